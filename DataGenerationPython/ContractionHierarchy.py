@@ -0,0 +1,251 @@
+"""
+module: ContractionHierarchy
+-------------------------
+
+Contraction hierarchy of a street network for fast shortest path and distance
+queries. The nodes are contracted one by one, least important first (fewest
+shortcuts added for the edges removed), and a shortcut u -> w replaces the path
+u -> v -> w through a contracted node v unless a witness search finds another path
+at most as long. A query then runs a bidirectional Dijkstra search that only climbs
+to more important nodes and settles a few hundred nodes on city size networks,
+whatever the length of the route. Shortcuts are unpacked into the original nodes.
+
+The hierarchy is built once per graph from its CompactGraph and stored in the stage
+cache next to it. It answers the first search of YenKShortestPaths and
+DisjointPaths and the lower bounds that let YenKShortestPaths skip spur searches
+that cannot produce one of the k routes requested. The routes have the costs of
+those found without the hierarchy, but of several routes of the same cost it can
+find another one first.
+"""
+
+import heapq
+
+from perturbation_routes import CompactGraph
+
+#Settled nodes after which a witness search gives up (a shortcut is then added)
+WITNESS_SETTLE_LIMIT = 60
+
+
+class ContractionHierarchy(object):
+    """
+    Shortest path index of a street network, the length of an edge being the one of
+    its key 0 as in YenKShortestPaths.
+    """
+    def __init__(self, graph, weight='length'):
+        """
+        Constructor, contracts all the nodes of the NetworkX *graph*.
+        """
+        compact = CompactGraph(graph, weight)
+        self.nodes = compact.nodes
+        self.index = compact.index
+        self.numShortcuts = 0
+        n = len(self.nodes)
+        outEdges = [dict() for _ in range(n)]   # node -> {head: (length, middle node or None)}
+        inEdges = [dict() for _ in range(n)]
+        for edge in range(len(compact.targets)):
+            u, v, length = compact.tails[edge], compact.targets[edge], compact.lengths[edge]
+            if u != v and (v not in outEdges[u] or length < outEdges[u][v][0]):
+                outEdges[u][v] = (length, None)
+                inEdges[v][u] = (length, None)
+        self.rank = [0] * n
+        self.up = [None] * n        # node -> [(head, length)] to more important nodes
+        self.down = [None] * n      # node -> [(tail, length)] from more important nodes
+        self.middle = {}            # (tail, head) -> contracted middle node of a shortcut
+        contracted = [False] * n
+        deleted = [0] * n           # contracted neighbours, spreads the contraction evenly
+        level = [0] * n             # depth of the shortcuts below a node, keeps the hierarchy shallow
+
+        heap = [(self._priority(v, outEdges, inEdges, deleted, level), v) for v in range(n)]
+        heapq.heapify(heap)
+        order = 0
+        while heap:
+            priority, v = heapq.heappop(heap)
+            if contracted[v]:
+                continue
+            # lazy update: contract v only if it is still the least important node
+            current = self._priority(v, outEdges, inEdges, deleted, level)
+            if heap and current > heap[0][0]:
+                heapq.heappush(heap, (current, v))
+                continue
+            for u, w, length in self._shortcuts(v, outEdges, inEdges):
+                if w not in outEdges[u] or length < outEdges[u][w][0]:
+                    outEdges[u][w] = (length, v)
+                    inEdges[w][u] = (length, v)
+                    self.numShortcuts += 1
+            contracted[v] = True
+            self.rank[v] = order
+            order += 1
+            self.up[v] = [(w, length) for w, (length, _) in outEdges[v].items()]
+            self.down[v] = [(u, length) for u, (length, _) in inEdges[v].items()]
+            for w, (length, mid) in outEdges[v].items():
+                if mid is not None:
+                    self.middle[(v, w)] = mid
+                del inEdges[w][v]
+                deleted[w] += 1
+                level[w] = max(level[w], level[v] + 1)
+            for u, (length, mid) in inEdges[v].items():
+                if mid is not None:
+                    self.middle[(u, v)] = mid
+                del outEdges[u][v]
+                deleted[u] += 1
+                level[u] = max(level[u], level[v] + 1)
+            outEdges[v] = None
+            inEdges[v] = None
+
+    def __contains__(self, node):
+        return node in self.index
+
+    def distance(self, source, dest):
+        """
+        Length of the shortest path between two nodes (osmids), infinity when there is none.
+        """
+        return self._query(self.index[source], self.index[dest])[0]
+
+    def shortestPath(self, source, dest):
+        """
+        Shortest path between two nodes as a list of osmids, None when there is none.
+        """
+        length, meet, forward, backward = self._query(self.index[source], self.index[dest])
+        if meet is None:
+            return None
+        path = [meet]
+        node = meet
+        while forward[node] is not None:
+            path[:0] = self._unpack(forward[node], node)[:-1]
+            node = forward[node]
+        node = meet
+        while backward[node] is not None:
+            path.extend(self._unpack(node, backward[node])[1:])
+            node = backward[node]
+        return [self.nodes[i] for i in path]
+
+    def distanceTable(self, sources, targets):
+        """
+        Shortest path lengths from every source to every target (osmids), as a dict
+        of dicts, with one upward search per source and per target.
+        """
+        buckets = {}
+        for target in targets:
+            for node, length in self._upwardSearch(self.index[target], self.down).items():
+                buckets.setdefault(node, []).append((target, length))
+        table = {}
+        for source in sources:
+            row = dict((target, float('inf')) for target in targets)
+            for node, length in self._upwardSearch(self.index[source], self.up).items():
+                for target, remaining in buckets.get(node, ()):
+                    if length + remaining < row[target]:
+                        row[target] = length + remaining
+            table[source] = row
+        return table
+
+    def _priority(self, v, outEdges, inEdges, deleted, level):
+        """
+        Edge difference of contracting v plus its contracted neighbours and its level.
+        """
+        edgeDifference = len(self._shortcuts(v, outEdges, inEdges)) - len(outEdges[v]) - len(inEdges[v])
+        return edgeDifference + deleted[v] + level[v]
+
+    def _shortcuts(self, v, outEdges, inEdges):
+        """
+        Shortcuts (tail, head, length) needed to contract v.
+        """
+        shortcuts = []
+        heads = outEdges[v]
+        if not heads:
+            return shortcuts
+        maxOut = max(length for length, _ in heads.values())
+        for u, (inLength, _) in inEdges[v].items():
+            witness = self._witnessSearch(u, v, inLength + maxOut, heads, outEdges)
+            for w, (outLength, _) in heads.items():
+                if w == u:
+                    continue
+                length = inLength + outLength
+                if witness.get(w, float('inf')) > length:
+                    shortcuts.append((u, w, length))
+        return shortcuts
+
+    def _witnessSearch(self, source, avoid, limit, targets, outEdges):
+        """
+        Distances from source without going through *avoid*, searched up to *limit*
+        and WITNESS_SETTLE_LIMIT settled nodes.
+        """
+        dist = {source: 0.0}
+        heap = [(0.0, source)]
+        settled = 0
+        remaining = set(targets)
+        while heap and remaining and settled < WITNESS_SETTLE_LIMIT:
+            d, node = heapq.heappop(heap)
+            if d > dist[node]:
+                continue
+            if d > limit:
+                break
+            settled += 1
+            remaining.discard(node)
+            for head, (length, _) in outEdges[node].items():
+                if head == avoid:
+                    continue
+                newDist = d + length
+                if newDist < dist.get(head, float('inf')):
+                    dist[head] = newDist
+                    heapq.heappush(heap, (newDist, head))
+        return dist
+
+    def _query(self, source, dest):
+        """
+        Bidirectional upward search, returns the length, the meeting node and the
+        predecessors of both searches.
+        """
+        inf = float('inf')
+        if source == dest:
+            return 0.0, source, {source: None}, {dest: None}
+        dist = ({source: 0.0}, {dest: 0.0})
+        pred = ({source: None}, {dest: None})
+        heaps = ([(0.0, source)], [(0.0, dest)])
+        edges = (self.up, self.down)
+        best, meet = inf, None
+        side = 0
+        while heaps[0] or heaps[1]:
+            if not heaps[side] or (heaps[1 - side] and heaps[1 - side][0][0] < heaps[side][0][0]):
+                side = 1 - side
+            d, node = heapq.heappop(heaps[side])
+            if d >= best:
+                # the other search cannot improve the meeting point once both exceed it
+                heaps[side][:] = []
+                continue
+            if d > dist[side][node]:
+                continue
+            other = dist[1 - side].get(node)
+            if other is not None and d + other < best:
+                best, meet = d + other, node
+            for head, length in edges[side][node]:
+                newDist = d + length
+                if newDist < dist[side].get(head, inf):
+                    dist[side][head] = newDist
+                    pred[side][head] = node
+                    heapq.heappush(heaps[side], (newDist, head))
+        return best, meet, pred[0], pred[1]
+
+    def _upwardSearch(self, source, edges):
+        """
+        Distances of all the nodes reached by an upward search from source.
+        """
+        dist = {source: 0.0}
+        heap = [(0.0, source)]
+        while heap:
+            d, node = heapq.heappop(heap)
+            if d > dist[node]:
+                continue
+            for head, length in edges[node]:
+                if d + length < dist.get(head, float('inf')):
+                    dist[head] = d + length
+                    heapq.heappush(heap, (d + length, head))
+        return dist
+
+    def _unpack(self, tail, head):
+        """
+        The original nodes of the edge tail -> head, a shortcut or not.
+        """
+        mid = self.middle.get((tail, head))
+        if mid is None:
+            return [tail, head]
+        return self._unpack(tail, mid)[:-1] + self._unpack(mid, head)
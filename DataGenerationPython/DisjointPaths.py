@@ -0,0 +1,156 @@
+"""
+module: DisjointPaths
+-------------------------
+
+Classes for computing k edge-disjoint or node-disjoint paths of minimum total
+length via Bhandari's method ("Survivable Networks", Ramesh Bhandari). Every
+additional path costs a single shortest path search on a transformed graph in
+which the edges of the paths found so far are reversed with negative lengths,
+which is what the modified Dijkstra algorithm is designed for. Edges used in
+opposite directions by two searches cancel out, and the remaining edges are
+split again into paths.
+
+Streets are walkable both ways, so two paths are edge-disjoint when they share no
+street in either direction, and node-disjoint when they share no node apart from
+the source and the destination.
+"""
+
+from ModifiedDijkstra import ModifiedDijkstra
+from YenKShortestPaths import WeightedPath
+
+
+class DisjointPaths(object):
+    """
+    Up to k disjoint paths between two nodes, returned in order of increasing cost
+    by next() like YenKShortestPaths, so both can be used by the route generation.
+    All the paths are computed by the first call. Fewer than k paths are returned
+    when the network does not have k disjoint paths between the two nodes.
+    """
+
+    def __init__(self, graph, source, dest, weight="weight", k=2, nodeDisjoint=False, stats=None, hierarchy=None):
+        """
+        Constructor
+
+                @param graph         NetworkX MultiDiGraph, the length of an edge is the one
+                                     of its key 0 as in YenKShortestPaths.
+                @param k             Number of disjoint paths.
+                @param nodeDisjoint  Whether the paths must not share nodes, otherwise they
+                                     only must not share edges.
+                @param stats         Optional SearchStats accumulating the counters of the
+                                     searches.
+                @param hierarchy     Optional ContractionHierarchy of *graph*, it then finds
+                                     the first path.
+        """
+        self.g = graph
+        self.source = source
+        self.dest = dest
+        self.wt = weight
+        self.k = k
+        self.nodeDisjoint = nodeDisjoint
+        self.stats = stats
+        self.hierarchy = hierarchy
+        self.pathList = None
+        self._next = 0
+
+    def __iter__(self):
+        """Returns itself as an iterator object"""
+        return self
+
+    def next(self):
+        """
+        Returns the next path of the disjoint set, by increasing cost.
+        """
+        if self.pathList is None:
+            self.pathList = sorted(self.getPaths(), key=lambda path: path.cost)
+        if self._next >= len(self.pathList):
+            raise StopIteration
+        self._next += 1
+        return self.pathList[self._next - 1]
+
+    __next__ = next
+
+    def getPaths(self):
+        """
+        Computes the disjoint paths, as a list of WeightedPath objects in no
+        particular order.
+        """
+        if self.source == self.dest or self.source not in self.g or self.dest not in self.g:
+            return []
+        lengths = {}
+        for u, v in self.g.edges():
+            if (u, v) not in lengths:
+                lengths[(u, v)] = self.g[u][v][0][self.wt]
+        used = set()    # directed edges of the current paths
+        count = 0
+        while count < self.k:
+            if count == 0 and self.hierarchy is not None:
+                # nothing is reversed yet, the first path is the shortest one
+                nodeList = self.hierarchy.shortestPath(self.source, self.dest)
+                if self.stats is not None:
+                    self.stats.hierarchyQueries += 1
+            else:
+                nodeList = self._search(lengths, used)
+            if nodeList is None:
+                break
+            for u, v in zip(nodeList[:-1], nodeList[1:]):
+                if (v, u) in used:
+                    # interlacing edge, the two paths exchange their tails
+                    used.remove((v, u))
+                else:
+                    used.add((u, v))
+            count += 1
+        return [WeightedPath(nodeList, set(), self.g, wt=self.wt) for nodeList in self._splitPaths(used, count)]
+
+    def _search(self, lengths, used):
+        """
+        Shortest path on the graph transformed for the current paths, as a list of
+        nodes of the original graph, or None when there is none.
+        """
+        import networkx as nx
+        split = set()
+        if self.nodeDisjoint:
+            split = set(u for u, v in used if u != self.source)
+        outNode = lambda node: (node, 'out') if node in split else node
+        tempG = nx.MultiDiGraph()
+        tempG.add_nodes_from(self.g.nodes())
+        for (u, v), length in lengths.items():
+            if (u, v) not in used and (v, u) not in used:
+                tempG.add_edge(outNode(u), v, 0, **{self.wt: length})
+        for u, v in used:
+            # the edge can only be walked backwards, cancelling its length
+            tempG.add_edge(v, outNode(u), 0, **{self.wt: -lengths[(u, v)]})
+        for node in split:
+            # a node of a path can only be entered to leave it backwards along the path
+            tempG.add_edge((node, 'out'), node, 0, **{self.wt: 0.0})
+        if self.stats is not None:
+            self.stats.graphCopies += 1
+        alg = ModifiedDijkstra(tempG, self.wt, stats=self.stats)
+        nodeList = alg.getPath(self.source, self.dest, as_nodes=True)
+        if nodeList is None:
+            return None
+        path = []
+        for node in nodeList:
+            node = node[0] if isinstance(node, tuple) else node
+            if len(path) == 0 or path[-1] != node:
+                path.append(node)
+        return path
+
+    def _splitPaths(self, used, count):
+        """
+        Decomposes the edges of the disjoint paths into *count* source to destination
+        node lists, cutting the loops a zero length cycle could leave.
+        """
+        outEdges = {}
+        for u, v in used:
+            outEdges.setdefault(u, []).append(v)
+        paths = []
+        for i in range(count):
+            nodeList = [self.source]
+            while nodeList[-1] != self.dest and outEdges.get(nodeList[-1]):
+                node = outEdges[nodeList[-1]].pop()
+                if node in nodeList:
+                    nodeList = nodeList[:nodeList.index(node)]
+                nodeList.append(node)
+            if nodeList[-1] == self.dest:
+                paths.append(nodeList)
+        return paths
@@ -8,6 +8,39 @@ Modified: Shubhankar Mathur
 """
 
 
+class SearchStats(object):
+    """
+    Counters of the work done by shortest path searches. A single instance can be
+    shared by many searches (e.g. all the k-shortest path computations of an OD run)
+    to aggregate their counters.
+    """
+    FIELDS = ('searches', 'nodesSettled', 'edgesRelaxed', 'frontierPushes', 'nodeScans',
+              'spurSearches', 'candidatesGenerated', 'candidatesDiscarded', 'graphCopies',
+              'hierarchyQueries', 'spursPruned')
+
+    def __init__(self):
+        for field in self.FIELDS:
+            setattr(self, field, 0)
+        self.spurTime = 0.0
+
+    def add(self, other):
+        """
+        Adds the counters of *other* to this instance and returns it.
+        """
+        for field in self.FIELDS:
+            setattr(self, field, getattr(self, field) + getattr(other, field))
+        self.spurTime += other.spurTime
+        return self
+
+    def toDict(self):
+        counters = dict((field, getattr(self, field)) for field in self.FIELDS)
+        counters['spurTime'] = self.spurTime
+        return counters
+
+    def __str__(self):
+        return ", ".join("{}: {}".format(key, value) for key, value in self.toDict().items())
+
+
 class ModifiedDijkstra(object):
     """
     The Modified Dijkstra algorithm from "Survivable Networks" by Ramesh Bhandari.
@@ -18,16 +51,19 @@ class ModifiedDijkstra(object):
     Works with graphs, *g*, in NetworkX format. Specifically Graph and
     DiGraph classes.
     """
-    def __init__(self, g, wt="weight"):
+    def __init__(self, g, wt="weight", stats=None):
         """
         Constructor. Parameter *g* is a NetworkX Graph or DiGraph instance.
         The *wt* keyword argument sets the link attribute to be used in computing
-        the path length.
+        the path length. The optional *stats* (a SearchStats instance) receives the
+        counters of every search.
         """
         self.dist = {}  # A map from nodes to their labels (float)
         self.predecessor = {}  # A map from a node to a node
         self.g = g
         self.wt = wt
+        self.stats = stats
+        self._scans = 0
         edges = g.edges()
         # Set the value for infinite distance in the graph
         self.inf = 0.0
@@ -39,7 +75,8 @@ class ModifiedDijkstra(object):
         """
         Computes the shortest path in the graph between the given *source* and *dest*
         node (strings).  Returns the path as a list of links (default) or as a list of
-        nodes by setting the *as_nodes* keyword argument to *True*.
+        nodes by setting the *as_nodes* keyword argument to *True*, or None when *dest*
+        cannot be reached.
         """
         self.dist = {}  # A map from nodes to their labels (float)
         self.predecessor = {}  # A map from a node to a node
@@ -60,28 +97,42 @@ class ModifiedDijkstra(object):
         for edge in outEdges:
             self.dist[edge[1]] = self.g[edge[0]][edge[1]][0][self.wt]
         
+        # Counters are kept in locals and only handed to the stats at the end
+        settled = 1
+        relaxed = len(outEdges)
+        pushes = 0
+        self._scans = 0
         s = set(vertices)
         s.remove(source)
         currentMin = self._findMinNode(s)
         if currentMin is None:
+            self._recordStats(settled, relaxed, pushes)
             return None
         s.remove(currentMin)
         while currentMin != dest and (len(s) != 0) and currentMin is not None:
+            settled += 1
             if self.g.is_directed():
                 outEdges = self.g.out_edges([currentMin])
             else:
                 outEdges = self.g.edges([currentMin])
             for edge in outEdges:
+                relaxed += 1
                 opposite = edge[1]
                 if self.dist[currentMin] + self.g[edge[0]][edge[1]][0][self.wt] < self.dist[opposite]:
                     self.dist[opposite] = self.dist[currentMin] + self.g[edge[0]][edge[1]][0][self.wt]
                     self.predecessor[opposite] = currentMin
                     s.add(opposite)
+                    pushes += 1
                 
             currentMin = self._findMinNode(s)
             if currentMin is None:
+                self._recordStats(settled, relaxed, pushes)
                 return None
             s.remove(currentMin)
+        self._recordStats(settled + 1, relaxed, pushes)
+        if self.dist[dest] == self.inf:
+            # every reachable node was settled without reaching the destination
+            return None
         
         # Compute the path as a list of edges
         currentNode = dest
@@ -109,8 +160,21 @@ class ModifiedDijkstra(object):
         """
         minNode = None
         minVal = self.inf
+        self._scans += len(s)
         for vertex in s:
             if self.dist[vertex] < minVal:
                 minVal = self.dist[vertex]
                 minNode = vertex
         return minNode
+
+    def _recordStats(self, settled, relaxed, pushes):
+        """
+        Adds the counters of the last search to the stats, if any.
+        """
+        if self.stats is None:
+            return
+        self.stats.searches += 1
+        self.stats.nodesSettled += settled
+        self.stats.edgesRelaxed += relaxed
+        self.stats.frontierPushes += pushes
+        self.stats.nodeScans += self._scans
@@ -10,9 +10,9 @@ Author: *Greg Bernstein*
 Modified: Shubhankar Mathur
 """
 
-import networkx as nx
 import heapq
-from ModifiedDijkstra import ModifiedDijkstra
+import time
+from ModifiedDijkstra import ModifiedDijkstra, SearchStats
 from copy import deepcopy
 
 
@@ -24,12 +24,25 @@ class YenKShortestPaths(object):
      undirected and directed  graphs. However it has only been tested so far against undirected graphs.
     """
 
-    def __init__(self, graph, source, dest, weight="weight", cap="capacity"):
+    def __init__(self, graph, source, dest, weight="weight", cap="capacity", stats=None, onSpur=None,
+                 hierarchy=None, k=None):
         """
         Constructor
 
                 @param source    The beginning node of the path.
                 @param dest      The termination node of the path.
+                @param stats     Optional SearchStats accumulating the counters of all the
+                                 searches, it can be shared to aggregate a whole OD run.
+                                 Each returned path then carries the counters of the work
+                                 done to find it in its *stats* attribute.
+                @param onSpur    Optional callback onSpur(spurNode, seconds, candidate)
+                                 called after every spur search, candidate is None when
+                                 the spur search found no path.
+                @param hierarchy Optional ContractionHierarchy of *graph*, it then finds
+                                 the first path.
+                @param k         Optional number of paths that will be requested. With a
+                                 hierarchy, the spur searches whose lower bound exceeds the
+                                 k-th best candidate are skipped.
         """
         self.wt = weight
         self.cap = cap
@@ -39,9 +52,17 @@ class YenKShortestPaths(object):
         self.deletedEdges = set()
         self.deletedNodes = set()
         self.kPath = None
-        # Make a copy of the graph tempG that we can manipulate
-        if isinstance(graph, nx.Graph):
+        self.stats = stats
+        self.onSpur = onSpur
+        self.hierarchy = hierarchy
+        self.k = k
+        self._callStats = None if stats is None else SearchStats()
+        # Make a copy of the graph tempG that we can manipulate (any NetworkX style graph,
+        # checked by duck typing so that importing this module does not import networkx)
+        if hasattr(graph, 'copy') and hasattr(graph, 'remove_edge'):
             self.tempG = graph.copy()
+            if self._callStats is not None:
+                self._callStats.graphCopies += 1
         else:
             self.tempG = None
         self.kPath = None
@@ -65,36 +86,116 @@ class YenKShortestPaths(object):
         how you want to think about things).
         """
         if self.kPath is None:
-            alg = ModifiedDijkstra(self.g, self.wt)
-            nodeList = alg.getPath(self.source, self.dest, as_nodes=True)
-            if len(nodeList) == 0:
+            if self.hierarchy is not None:
+                nodeList = self.hierarchy.shortestPath(self.source, self.dest)
+                if self._callStats is not None:
+                    self._callStats.hierarchyQueries += 1
+                if nodeList is None:
+                    raise StopIteration
+            else:
+                alg = ModifiedDijkstra(self.g, self.wt, stats=self._callStats)
+                nodeList = alg.getPath(self.source, self.dest, as_nodes=True)
+            if not nodeList:
                 raise StopIteration
             deletedLinks = set()
             self.kPath = WeightedPath(nodeList, deletedLinks, self.g, wt=self.wt, cap=self.cap)
             self.kPath.dNode = self.source
             self.pathList.append(self.kPath)
-            return self.kPath
+            return self._recordPath(self.kPath)
         # Iterate over all the nodes in kPath from dNode to the node before the destination
         # and add candidate paths to the path heap.
         kNodes = self.kPath.nodeList
         index = kNodes.index(self.kPath.dNode)
         curNode = kNodes[index]
+        callStats = self._callStats
+        prefixCost = sum(self.g[kNodes[i]][kNodes[i + 1]][0][self.wt] for i in range(index))
         while curNode != self.dest:
+            if self._canSkipSpur(index, prefixCost):
+                if callStats is not None:
+                    callStats.spursPruned += 1
+                prefixCost += self.g[curNode][kNodes[index + 1]][0][self.wt]
+                index += 1
+                curNode = kNodes[index]
+                continue
+            if self.onSpur is not None:
+                spurStart = time.perf_counter()
             self._removeEdgesNodes(curNode)
             candidate = self._computeCandidatePath(curNode)
             self._restoreGraph()
+            if callStats is not None:
+                callStats.spurSearches += 1
+                if candidate is not None:
+                    callStats.candidatesGenerated += 1
+                else:
+                    callStats.candidatesDiscarded += 1
+            if self.onSpur is not None:
+                spurTime = time.perf_counter() - spurStart
+                if callStats is not None:
+                    callStats.spurTime += spurTime
+                self.onSpur(curNode, spurTime, candidate)
             if candidate is not None:
                 heapq.heappush(self.pathHeap, candidate)
+            prefixCost += self.g[curNode][kNodes[index + 1]][0][self.wt]
             index += 1
             curNode = kNodes[index]
             
         if len(self.pathHeap) == 0:
+            self._recordPath(None)
             raise StopIteration
 
         p = heapq.heappop(self.pathHeap)  # after iterations contains next shortest path
         self.pathList.append(p)
         self.kPath = p  # updates the kth path
-        return p
+        return self._recordPath(p)
+
+    __next__ = next
+
+    def _canSkipSpur(self, index, prefixCost):
+        """
+        Whether the heap already holds enough distinct candidates shorter than any
+        path the spur search from the node at *index* in kPath could produce to
+        return the k paths. The spur path leaves the spur node by an edge that is not
+        deleted towards a node outside the root path, so the unmasked distances of
+        the hierarchy from the heads of these edges give its lower bound.
+        """
+        if self.hierarchy is None or self.k is None:
+            return False
+        needed = self.k - len(self.pathList)
+        if needed <= 0 or len(self.pathHeap) < needed:
+            return False
+        costs = sorted(dict((tuple(path.nodeList), path.cost) for path in self.pathHeap).values())
+        if len(costs) < needed:
+            return False
+        kNodes = self.kPath.nodeList
+        curNode = kNodes[index]
+        root = set(kNodes[:index + 1])
+        deleted = set(self.kPath.deletedEdges)
+        deleted.add((curNode, kNodes[index + 1]))
+        if self.g.is_directed():
+            outEdges = self.g.out_edges(curNode)
+        else:
+            outEdges = self.g.edges(curNode)
+        spurBound = float('inf')
+        for e in set(outEdges):
+            if e[1] in root or e in deleted:
+                continue
+            if self._callStats is not None:
+                self._callStats.hierarchyQueries += 1
+            spurBound = min(spurBound, self.g[e[0]][e[1]][0][self.wt] + self.hierarchy.distance(e[1], self.dest))
+        # the margin keeps the candidates of equal cost summed in another order
+        return costs[needed - 1] * (1 + 1e-9) < prefixCost + spurBound
+
+    def _recordPath(self, path):
+        """
+        Hands the counters of the last call to *path* and to the shared stats.
+        """
+        if self._callStats is None:
+            return path
+        if path is not None:
+            path.stats = self._callStats
+        self.stats.add(self._callStats)
+        self._callStats = SearchStats()
+        return path
 
     def __lt__(self, other):
         return self.cost < other.cost
@@ -153,7 +254,7 @@ class YenKShortestPaths(object):
         combines with the portion of kPath from the source up through
         the deviation node
         """
-        alg = ModifiedDijkstra(self.tempG, self.wt)
+        alg = ModifiedDijkstra(self.tempG, self.wt, stats=self._callStats)
         nodeList = alg.getPath(curNode, self.dest, as_nodes=True)
         # Trying this out...
         if nodeList is None:
@@ -176,6 +277,8 @@ class YenKShortestPaths(object):
         restores the temp graph to match the graph g.
         """
         self.tempG = self.g.copy()
+        if self._callStats is not None:
+            self._callStats.graphCopies += 1
         self.deletedEdges = []
         self.deletedNodes = []
     
@@ -193,6 +296,7 @@ class WeightedPath(object):
         self.g = g
         self.wt = wt
         self.dNode = None   # The deflection node
+        self.stats = None   # SearchStats of the work done to find the path, if requested
         self.cost = 0.0
         self.capacity = float("inf")
         for i in range(len(pathNodeList)-1):
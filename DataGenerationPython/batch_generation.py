@@ -0,0 +1,272 @@
+"""
+module: batch_generation
+-------------------------
+
+Generation of the input files of many study areas in one batch. Every job (a centre,
+a radius, an OD matrix and an output directory) is described by a JobContext and run
+in a pool of worker processes, so that the batch scales with the number of cores. A
+job keeps all its generation state in its own mapGeoToCells.GenerationContext, so
+jobs can also share one process (`--threads`), e.g. when they mostly wait on
+OpenStreetMap downloads.
+Jobs whose areas overlap share one base graph covering all of them: it is fetched
+once, stored in the stage cache and truncated to the network distance of every job
+inside the workers, which therefore never import osmnx.
+
+The job file is a comma separated text file with the columns
+
+    # name, lat, long, radius, odFile, outputDir[, maxRoutes]
+
+e.g. `python batch_generation.py precincts.txt --workers 8 --cache-dir cache`.
+"""
+
+import argparse
+import csv
+import json
+import os
+import sys
+import tempfile
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+from stage_cache import StageCache
+from synthetic_network import greatCircleDistance
+
+#Base graphs already loaded by the current worker process, by cache key
+_baseGraphs = {}
+
+
+class JobContext(object):
+    """
+    Everything a job needs and produces: its area, OD matrix, output directory,
+    extra mapGeoToCells parameters and, once run, its outputs or error.
+    """
+    def __init__(self, name, centre, radius, od_path, output_dir, params=None):
+        self.name = name
+        self.centre = (float(centre[0]), float(centre[1]))
+        self.radius = float(radius)
+        self.od_path = od_path
+        self.output_dir = output_dir
+        self.params = dict(params or {})
+        self.baseKey = None
+        self.outputs = None
+        self.error = None
+        self.wallTime = None
+
+    def parameters(self):
+        """ The mapGeoToCells parameters of the job."""
+        params = dict(self.params)
+        params.update({'START_POINT': self.centre, 'DISTANCE_RANGE': self.radius,
+                       'odMatrixFileNamePath': self.od_path, 'RUN_REPORT_FILE_NAME': 'new_run_report'})
+        return params
+
+    def toDict(self):
+        return {'name': self.name, 'centre': self.centre, 'radius': self.radius, 'odFile': self.od_path,
+                'outputDir': self.output_dir, 'params': self.params, 'outputs': self.outputs,
+                'error': self.error, 'wallTime': self.wallTime}
+
+
+def readJobs(file_path):
+    """ Reads a job file, see the module documentation for its columns.
+
+        Relative OD and output paths are taken relative to the job file.
+    """
+    jobs = []
+    base = os.path.dirname(os.path.abspath(file_path))
+    with open(file_path, encoding="utf8") as jobFile:
+        for row in csv.reader(jobFile, delimiter=','):
+            row = [value.strip() for value in row]
+            if len(row) == 0 or row[0] == '' or row[0].startswith('#'):
+                continue
+            if len(row) < 6:
+                raise ValueError("Job '{}' needs name, lat, long, radius, odFile and outputDir".format(row[0]))
+            params = {'MAX_ROUTES': int(row[6])} if len(row) > 6 and row[6] else {}
+            jobs.append(JobContext(row[0], (row[1], row[2]), row[3], os.path.join(base, row[4]),
+                                   os.path.join(base, row[5]), params))
+    return jobs
+
+
+def distance(point_a, point_b):
+    """ Great-circle distance in metres between two (lat, long) points."""
+    return float(greatCircleDistance(point_a[0], point_a[1], point_b[0], point_b[1]))
+
+
+def groupOverlappingJobs(jobs):
+    """ Partitions the jobs into groups of transitively overlapping areas.
+
+        Returns
+        -------
+        groups : list
+            lists of jobs, every job appearing in exactly one group.
+    """
+    parent = list(range(len(jobs)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for i in range(len(jobs)):
+        for j in range(i + 1, len(jobs)):
+            if distance(jobs[i].centre, jobs[j].centre) < jobs[i].radius + jobs[j].radius:
+                parent[find(i)] = find(j)
+    groups = {}
+    for i, job in enumerate(jobs):
+        groups.setdefault(find(i), []).append(job)
+    return list(groups.values())
+
+
+def enclosingCircle(jobs):
+    """ A (centre, radius) circle containing the areas of all the jobs.
+
+        The centre is the mean of the job centres, which is not the smallest circle
+        but is close to it for the compact clusters of overlapping areas.
+    """
+    centre = (sum(job.centre[0] for job in jobs) / len(jobs), sum(job.centre[1] for job in jobs) / len(jobs))
+    radius = max(distance(centre, job.centre) + job.radius for job in jobs)
+    return centre, radius
+
+
+def baseGraphKey(cache, centre, radius, synthetic=None):
+    """ Cache key of the base graph of a group of jobs."""
+    if synthetic is not None:
+        return cache.key('base graph', list(synthetic), centre, radius)
+    return cache.key('base graph', centre, radius, 'bbox', 'walk')
+
+
+def loadBaseGraph(centre, radius, synthetic=None):
+    """ Fetches the street network around a group of jobs.
+
+        A node within network distance r of a job centre lies within r of it as the
+        crow flies, and so does every node of its shortest path, so truncating the
+        bounding box network by network distance gives the network of every job.
+    """
+    if synthetic is not None:
+        from synthetic_network import generateNetwork
+        seed = synthetic[2] if len(synthetic) > 2 else None
+        return generateNetwork(synthetic[0], synthetic[1], center=centre, seed=seed)
+    import osmnx as ox
+    return ox.graph_from_point(centre, distance=radius, distance_type='bbox', network_type='walk')
+
+
+def truncateGraph(g, centre, radius):
+    """ The part of `g` within `radius` metres of network distance from the node nearest to `centre`."""
+    import networkx as nx
+    from synthetic_network import nearestNode
+    source = nearestNode(g, centre)
+    reached = nx.single_source_dijkstra_path_length(g, source, cutoff=radius, weight='length')
+    truncated = g.subgraph(reached).copy()
+    truncated.graph.pop('_nearestNodeCache', None)
+    return truncated
+
+
+def prepareBaseGraphs(jobs, cache, synthetic=None, log=None):
+    """ Groups the jobs, fetches the missing base graphs into the cache and sets the baseKey of the jobs."""
+    groups = groupOverlappingJobs(jobs)
+    for group in groups:
+        centre, radius = enclosingCircle(group)
+        key = baseGraphKey(cache, centre, radius, synthetic)
+        if not cache.contains('base graph', key):
+            if log is not None:
+                log("Fetching the base graph of {} job(s) ({:.0f} m around {})".format(len(group), radius, centre))
+            cache.store('base graph', key, loadBaseGraph(centre, radius, synthetic))
+        for job in group:
+            job.baseKey = key
+    return groups
+
+
+def runJob(job, cache_dir):
+    """ Runs one job in the current process and returns its context with the outputs or the error."""
+    import mapGeoToCells as gen
+    from run_report import RunReport
+    start = time.perf_counter()
+    try:
+        base = _baseGraphs.get(job.baseKey)
+        if base is None:
+            base = StageCache(cache_dir).load('base graph', job.baseKey)
+            _baseGraphs[job.baseKey] = base
+        graph = truncateGraph(base, job.centre, job.radius)
+        params = job.parameters()
+        params.setdefault('CACHE_DIRECTORY', cache_dir)
+        #the network, cells, routes and parameters of the job live in its own context
+        ctx = gen.GenerationContext(**params).setOutputDirectory(job.output_dir)
+        job.outputs = gen.generate(graph=graph, report=RunReport(job.name, verbose=False), context=ctx)
+    except Exception:
+        job.error = traceback.format_exc()
+    job.wallTime = time.perf_counter() - start
+    return job
+
+
+def runBatch(jobs, workers=None, cache_dir=None, synthetic=None, log=None, threads=False):
+    """ Runs all the jobs in parallel worker processes (or threads).
+
+        Parameters
+        ----------
+        jobs : list
+            JobContext instances.
+        workers : integer
+            (optional) number of worker processes or threads, the number of cores by default.
+        cache_dir : string
+            (optional) stage cache shared by the jobs, a temporary directory by default.
+        synthetic : tuple
+            (optional) (layout, nodes[, seed]) synthetic base networks instead of OpenStreetMap.
+        threads : boolean
+            (optional) run the jobs in threads of the current process instead of worker processes.
+
+        Returns
+        -------
+        jobs : list
+            the job contexts with their outputs or errors, in the order of the input.
+    """
+    temp_dir = None
+    if cache_dir is None:
+        temp_dir = tempfile.TemporaryDirectory(prefix='batch_cache_')
+        cache_dir = temp_dir.name
+    try:
+        prepareBaseGraphs(jobs, StageCache(cache_dir), synthetic, log)
+        done = {}
+        pool = ThreadPoolExecutor if threads else ProcessPoolExecutor
+        with pool(max_workers=workers) as executor:
+            futures = dict((executor.submit(runJob, job, cache_dir), i) for i, job in enumerate(jobs))
+            for future in as_completed(futures):
+                job = future.result()
+                done[futures[future]] = job
+                if log is not None:
+                    status = "failed" if job.error else "done"
+                    log("[{}/{}] {} {} in {:.1f}s".format(len(done), len(jobs), job.name, status, job.wallTime))
+        return [done[i] for i in range(len(jobs))]
+    finally:
+        if temp_dir is not None:
+            temp_dir.cleanup()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate the input files of many study areas in parallel.")
+    parser.add_argument('jobs', help="job file: name, lat, long, radius, odFile, outputDir[, maxRoutes]")
+    parser.add_argument('--workers', type=int, default=None, help="number of worker processes")
+    parser.add_argument('--threads', action='store_true', help="run the jobs in threads of this process")
+    parser.add_argument('--cache-dir', default=None, help="stage cache directory shared by the jobs and the runs")
+    parser.add_argument('--synthetic', nargs='+', metavar='LAYOUT NODES [SEED]',
+                        help="synthetic base networks instead of OpenStreetMap, e.g. --synthetic organic 2000 1")
+    parser.add_argument('--report', default=None, help="JSON file receiving the outcome of every job")
+    args = parser.parse_args(argv)
+
+    synthetic = None
+    if args.synthetic is not None:
+        synthetic = (args.synthetic[0],) + tuple(int(value) for value in args.synthetic[1:])
+    log = lambda message: print(message, file=sys.stderr, flush=True)
+    start = time.perf_counter()
+    jobs = runBatch(readJobs(args.jobs), args.workers, args.cache_dir, synthetic, log, args.threads)
+    failed = [job for job in jobs if job.error]
+    for job in failed:
+        log("Job {} failed:\n{}".format(job.name, job.error))
+    log("{} job(s) done, {} failed, in {:.1f}s".format(len(jobs) - len(failed), len(failed), time.perf_counter() - start))
+    if args.report is not None:
+        with open(args.report, 'w', encoding="utf8") as reportFile:
+            json.dump([job.toDict() for job in jobs], reportFile, indent=2)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
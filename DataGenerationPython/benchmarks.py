@@ -0,0 +1,320 @@
+"""
+module: benchmarks
+-------------------------
+
+Benchmark harness for the data generation pipeline. Every stage (shortest paths,
+k-shortest paths, cellization, the three link builders, zone sequences, flow
+decomposition and link utilization) is timed on the SYD350 network, downloaded from
+OpenStreetMap around the default START_POINT with a radius of 350 m, and on synthetic
+networks of increasing size. The results are stored as JSON and can be compared to a
+stored baseline, in which case the run fails when a stage got slower than the allowed
+threshold.
+
+Usage:
+    python benchmarks.py --sizes 1000 4000 --output bench_results.json
+    python benchmarks.py --baseline bench_baseline.json --threshold 0.25
+"""
+
+import argparse
+import datetime as dt
+import json
+import platform
+import sys
+import time
+from types import SimpleNamespace
+
+import numpy as np
+import networkx as nx
+
+from ModifiedDijkstra import ModifiedDijkstra
+from YenKShortestPaths import YenKShortestPaths
+
+BENCHMARK_SIZES = (250, 1000, 4000)
+BENCHMARK_LAYOUT = 'organic'
+NUM_OD_PAIRS = 10
+REPEAT = 3
+REGRESSION_THRESHOLD = 0.25
+
+#Stages whose cost grows faster than linearly are skipped above these network sizes (nodes)
+STAGE_MAX_NODES = {
+    'ModifiedDijkstra.getPath': 4000,
+    'YenKShortestPaths.k3': 1000,
+    'YenKShortestPaths.k10': 500,
+    'createCells': 1000,
+    'createLinksData': 1000,
+    'createRoadIntersections': 1000,
+    'createPathEnds': 1000,
+    'getZoneSequence': 1000,
+    'flowToPaths': None,
+    'link_util': 1000,
+}
+
+#Stages that need the cells of the network
+CELL_STAGES = ('createLinksData', 'createRoadIntersections', 'createPathEnds', 'getZoneSequence')
+
+
+def timeStage(function, repeat=REPEAT, setup=None):
+    """ Times `function` `repeat` times, calling `setup` before every run.
+
+        Returns
+        -------
+        timing : dictionary
+            the minimum, median and mean wall time in seconds.
+    """
+    times = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return {'min': min(times), 'median': float(np.median(times)), 'mean': float(np.mean(times)), 'repeat': repeat}
+
+
+def benchmarkNetwork(g, stages=None, num_od=NUM_OD_PAIRS, repeat=REPEAT, seed=0, log=print, max_nodes=None):
+    """ Runs the stage benchmarks on one street network.
+
+        Parameters
+        ----------
+        g : networkx.MultiDiGraph
+            street network in osmnx format.
+        stages : list
+            (optional) names of the stages to run, all of STAGE_MAX_NODES by default.
+        num_od : integer
+            (optional) number of OD pairs routed by the routing stages.
+        repeat : integer
+            (optional) number of timed runs per stage.
+        max_nodes : dictionary
+            (optional) stage size limits overriding STAGE_MAX_NODES.
+
+        Returns
+        -------
+        results : dictionary
+            timing of every stage, indexed by stage name. Skipped stages carry a
+            'skipped' entry with the reason.
+    """
+    import mapGeoToCells as gen
+    from flow_paths import flowToPaths
+    from utilities import link_util
+
+    stages = list(STAGE_MAX_NODES) if stages is None else stages
+    num_nodes = g.number_of_nodes()
+    rng = np.random.default_rng(seed)
+    results = {}
+    limits = dict(STAGE_MAX_NODES, **(max_nodes or {}))
+
+    def enabled(stage):
+        limit = limits.get(stage)
+        if stage not in stages:
+            return False
+        if limit is not None and num_nodes > limit:
+            results[stage] = {'skipped': 'network larger than {} nodes'.format(limit)}
+            return False
+        return True
+
+    def record(stage, function, items, setup=None):
+        timing = timeStage(function, repeat, setup)
+        timing['items'] = items
+        timing['perItem'] = timing['min'] / items if items else None
+        results[stage] = timing
+        log("  {:<26} {:>10.4f} s  ({} items)".format(stage, timing['min'], items))
+
+    ctx = gen.GenerationContext()
+    ctx.setNetwork(g)
+    od_pairs = _connectedPairs(g, num_od, rng)
+
+    if enabled('createCells'):
+        record('createCells', ctx.createCells, len(ctx.node_link_list))
+    cell_stages = [stage for stage in CELL_STAGES if enabled(stage)]
+    if cell_stages:
+        ctx.setCells(ctx.createCells())
+
+    if enabled('ModifiedDijkstra.getPath'):
+        record('ModifiedDijkstra.getPath',
+               lambda: [ModifiedDijkstra(g, 'length').getPath(o, d, as_nodes=True) for o, d in od_pairs],
+               len(od_pairs))
+
+    paths = {pair: _kShortest(g, pair, 3) for pair in od_pairs}
+    node_lists = [p for pair in od_pairs for p in paths[pair]]
+    for k in (3, 10):
+        if enabled('YenKShortestPaths.k{}'.format(k)):
+            record('YenKShortestPaths.k{}'.format(k), lambda k=k: [_kShortest(g, pair, k) for pair in od_pairs],
+                   len(od_pairs))
+
+    for stage in ('createLinksData', 'createRoadIntersections', 'createPathEnds'):
+        if stage in cell_stages:
+            builder = getattr(gen, stage)
+            record(stage, lambda builder=builder: [builder(ctx, node_list) for node_list in node_lists],
+                   len(node_lists), setup=ctx.resetRouteData)
+    ctx.resetRouteData()
+
+    if 'getZoneSequence' in cell_stages:
+        record('getZoneSequence', lambda: [gen.getZoneSequence(ctx, node_list) for node_list in node_lists],
+               len(node_lists))
+
+    if enabled('flowToPaths'):
+        side = max(int(np.sqrt(num_nodes)), 4)
+        flows = [_latticeFlow(side, 5, rng) for _ in range(num_od)]
+        record('flowToPaths', lambda: [flowToPaths(demand, flow) for demand, flow in flows], len(flows))
+
+    if enabled('link_util'):
+        simple_g = nx.DiGraph(g)
+        can_paths = {pair: paths[pair] for pair in od_pairs}
+        d_paths = {(pair, p): SimpleNamespace(varValue=float(rng.uniform(1, 10)))
+                   for pair in od_pairs for p in range(len(paths[pair]))}
+        record('link_util', lambda: link_util(simple_g, d_paths, can_paths), simple_g.number_of_edges())
+    return results
+
+
+def runBenchmarks(sizes=BENCHMARK_SIZES, layout=BENCHMARK_LAYOUT, include_syd350=True, stages=None,
+                  num_od=NUM_OD_PAIRS, repeat=REPEAT, seed=0, log=print, max_nodes=None):
+    """ Runs the benchmarks on the SYD350 network and on synthetic networks.
+
+        Returns
+        -------
+        report : dictionary
+            run metadata and the stage results indexed by network name.
+    """
+    from synthetic_network import generateNetwork
+
+    networks = []
+    if include_syd350:
+        networks.append(('SYD350', _loadSYD350))
+    for size in sizes:
+        networks.append(('{}-{}'.format(layout, size),
+                         lambda size=size: generateNetwork(layout, size, seed=seed)))
+
+    report = {'meta': {'timestamp': dt.datetime.now().isoformat(timespec='seconds'),
+                       'python': platform.python_version(), 'platform': platform.platform(),
+                       'repeat': repeat, 'numOD': num_od, 'seed': seed},
+              'results': {}}
+    for name, loader in networks:
+        try:
+            g = loader()
+        except Exception as error:
+            log("{}: skipped ({})".format(name, error))
+            report['results'][name] = {'skipped': str(error)}
+            continue
+        log("{}: {} nodes, {} edges".format(name, g.number_of_nodes(), g.number_of_edges()))
+        report['results'][name] = benchmarkNetwork(g, stages, num_od, repeat, seed, log, max_nodes)
+    return report
+
+
+def compareToBaseline(report, baseline, threshold=REGRESSION_THRESHOLD):
+    """ Compares the minimum stage times of a report with a baseline report.
+
+        Returns
+        -------
+        regressions : list
+            (network, stage, baseline time, current time, relative change) of every
+            stage slower than the baseline by more than `threshold`.
+    """
+    regressions = []
+    for network, stages in report['results'].items():
+        base_stages = baseline.get('results', {}).get(network, {})
+        for stage, timing in stages.items():
+            base = base_stages.get(stage) if isinstance(base_stages, dict) else None
+            if not isinstance(timing, dict) or 'min' not in timing or not base or 'min' not in base:
+                continue
+            change = (timing['min'] - base['min']) / base['min'] if base['min'] > 0 else 0.0
+            if change > threshold:
+                regressions.append((network, stage, base['min'], timing['min'], change))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the data generation pipeline")
+    parser.add_argument('--sizes', type=int, nargs='*', default=list(BENCHMARK_SIZES),
+                        help="node counts of the synthetic networks")
+    parser.add_argument('--layout', default=BENCHMARK_LAYOUT, help="synthetic layout: grid, radial or organic")
+    parser.add_argument('--no-syd350', action='store_true', help="skip the OpenStreetMap SYD350 network")
+    parser.add_argument('--stages', nargs='*', default=None, help="subset of stages to run")
+    parser.add_argument('--max-nodes', nargs='*', default=[], metavar='STAGE=NODES',
+                        help="override the network size above which a stage is skipped")
+    parser.add_argument('--od', type=int, default=NUM_OD_PAIRS, help="number of OD pairs routed")
+    parser.add_argument('--repeat', type=int, default=REPEAT, help="timed runs per stage")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='bench_results.json', help="JSON file receiving the results")
+    parser.add_argument('--baseline', default=None, help="JSON results to compare against")
+    parser.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD,
+                        help="allowed relative slow-down before a stage counts as regressed")
+    args = parser.parse_args(argv)
+
+    max_nodes = {stage: int(nodes) for stage, nodes in (item.split('=') for item in args.max_nodes)}
+    report = runBenchmarks(args.sizes, args.layout, not args.no_syd350, args.stages, args.od, args.repeat,
+                           args.seed, max_nodes=max_nodes)
+    with open(args.output, 'w', encoding="utf8") as outFile:
+        json.dump(report, outFile, indent=2)
+    print("Results written to {}".format(args.output))
+
+    if args.baseline is None:
+        return 0
+    with open(args.baseline, encoding="utf8") as baseFile:
+        baseline = json.load(baseFile)
+    regressions = compareToBaseline(report, baseline, args.threshold)
+    for network, stage, base_time, cur_time, change in regressions:
+        print("REGRESSION {} / {}: {:.4f} s -> {:.4f} s (+{:.0%})".format(network, stage, base_time, cur_time, change))
+    if regressions:
+        return 1
+    print("No stage regressed by more than {:.0%}".format(args.threshold))
+    return 0
+
+
+def _loadSYD350():
+    """
+    Street network of the SYD350 example: 350 m around the default START_POINT.
+    """
+    import mapGeoToCells as gen
+    import osmnx as ox
+    return ox.graph_from_point(gen.START_POINT, distance=350, distance_type='network', network_type='walk')
+
+
+def _connectedPairs(g, num_od, rng, max_tries=100):
+    """
+    Draws distinct OD pairs of nodes that are connected in `g`.
+    """
+    nodes = list(g.nodes())
+    pairs = []
+    for _ in range(num_od * max_tries):
+        if len(pairs) == num_od:
+            break
+        o, d = (nodes[i] for i in rng.choice(len(nodes), 2, replace=False))
+        if (o, d) not in pairs and nx.has_path(g, o, d):
+            pairs.append((o, d))
+    return pairs
+
+
+def _kShortest(g, pair, k):
+    """
+    Node lists of up to `k` shortest loopless paths of an OD pair.
+    """
+    paths = []
+    yen = YenKShortestPaths(g, pair[0], pair[1], 'length')
+    for _ in range(k):
+        try:
+            paths.append(list(yen.next().nodeList))
+        except StopIteration:
+            break
+    return paths
+
+
+def _latticeFlow(side, num_paths, rng):
+    """
+    Acyclic flow made of monotone lattice paths between two corners of a grid,
+    as accepted by flow_paths.flowToPaths.
+    """
+    flow = {}
+    for _ in range(num_paths):
+        moves = rng.permutation([0] * (side - 1) + [1] * (side - 1))
+        row, col = 0, 0
+        load = float(rng.integers(1, 10))
+        for move in moves:
+            nxt = (row + move, col + 1 - move)
+            link = ((row, col), nxt)
+            flow[link] = flow.get(link, 0.0) + load
+            row, col = nxt
+    return ((0, 0), (side - 1, side - 1)), list(flow.items())
+
+
+if __name__ == "__main__":
+    sys.exit(main())
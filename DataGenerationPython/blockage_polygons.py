@@ -0,0 +1,267 @@
+"""
+module: blockage_polygons
+-------------------------
+
+Blockage files of many closure scenarios from geographic polygons (roadworks, event
+areas, crowd barriers...) instead of hand-written cell rows. Every closure is a
+polygon with a time window and a blocked percentage; a cell gets the percentage of
+the closure times the fraction of its surface the polygon covers. The polygons of
+all the scenarios are intersected with the cells in one batch by the spatial index of
+cell_index.py, and every scenario gets a blockage file listing only its blocked
+cells, which the simulator reads as well as a full one.
+
+The closures are read from a GeoJSON FeatureCollection of Polygon or MultiPolygon
+features (longitude, latitude) whose properties give `scenario`, `startTime`,
+`endTime` and `percentage` (100 by default), or from a comma separated file:
+
+    # scenario, startTime, endTime, percentage, x1 y1 x2 y2 x3 y3 ...
+    roadworks, 0, 120, 100, 151.0621 -34.0171 151.0625 -34.0171 151.0625 -34.0175
+    market, 20, 60, 50, 151.0630 -34.0180 151.0634 -34.0180 151.0632 -34.0184
+
+The times are simulation intervals (the time steps Board.considerCellBlockage is
+called with), not seconds. A closure whose endTime is not after its startTime is
+left out, as in closure_scenarios: the simulator would never lift its blockage.
+
+The simulator keeps one blockage per cell: the closures of a scenario with the same
+time window add up on a cell, and the windows of a cell are then merged into the
+highest percentage over the window spanning all of them, as in closure_scenarios.
+The written percentages are capped at MAX_BLOCKAGE_PERCENTAGE (99.9), as the
+simulator cannot lift a 100% blockage again.
+
+e.g. `python blockage_polygons.py closures.geojson --cache-dir cache --output-dir output/closures`.
+"""
+
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from cell_index import MULT_FACTOR, CellIndex, geoToPlane, planeOrigin, readCells
+from closure_scenarios import MAX_BLOCKAGE_PERCENTAGE, Closure
+
+#Decimals of the blocked percentages written, smaller blockages are left out. The
+#percentages are capped at MAX_BLOCKAGE_PERCENTAGE of closure_scenarios, as the
+#simulator divides the cell area by 100 - percentage when a blockage ends
+PERCENTAGE_DECIMALS = 3
+
+#Name of the blockage file of every scenario when the cells are not those of a cached run
+BLOCKAGE_FILE = 'blockage.txt'
+
+
+class PolygonClosure(Closure):
+    """
+    Blockage of the cells covered by a polygon during [startTime, endTime], the
+    target being the name of the polygon.
+    """
+    def __init__(self, target, rings, start_time, end_time, percentage):
+        Closure.__init__(self, target, start_time, end_time, percentage)
+        self.rings = [np.asarray(ring, dtype=float).reshape(-1, 2) for ring in rings]
+        if not self.rings or len(self.rings[0]) < 3:
+            raise ValueError("Closure {} needs a polygon of at least 3 points".format(target))
+
+    def toDict(self):
+        closure = Closure.toDict(self)
+        closure['rings'] = [ring.tolist() for ring in self.rings]
+        return closure
+
+
+def readGeoJson(file_path):
+    """ Reads the closures of a GeoJSON FeatureCollection.
+
+        Returns
+        -------
+        scenarios : OrderedDict
+            lists of PolygonClosure instances by scenario name, a MultiPolygon giving
+            one closure per polygon. A feature without startTime or endTime is an error.
+    """
+    with open(file_path, encoding="utf8") as jsonFile:
+        collection = json.load(jsonFile)
+    scenarios = OrderedDict()
+    for i, feature in enumerate(collection.get('features', [])):
+        properties = feature.get('properties') or {}
+        geometry = feature.get('geometry') or {}
+        if geometry.get('type') == 'Polygon':
+            polygons = [geometry['coordinates']]
+        elif geometry.get('type') == 'MultiPolygon':
+            polygons = geometry['coordinates']
+        else:
+            raise ValueError("Feature {} of {} is not a Polygon or MultiPolygon".format(i, file_path))
+        for key in ('scenario', 'startTime', 'endTime'):
+            if key not in properties:
+                raise ValueError("Feature {} of {} has no {} property".format(i, file_path, key))
+        name = str(properties.get('name', feature.get('id', i)))
+        for polygon in polygons:
+            scenarios.setdefault(str(properties['scenario']), []).append(PolygonClosure(
+                name, [[point[:2] for point in ring] for ring in polygon], properties['startTime'],
+                properties['endTime'], properties.get('percentage', 100)))
+    return scenarios
+
+
+def readPolygonCsv(file_path):
+    """ Reads the closures of a comma separated file, see the module documentation.
+
+        Returns
+        -------
+        scenarios : OrderedDict
+            lists of PolygonClosure instances by scenario name, the closures being
+            named by their line number.
+    """
+    scenarios = OrderedDict()
+    with open(file_path, encoding="utf8") as closureFile:
+        for number, row in enumerate(csv.reader(closureFile, delimiter=','), 1):
+            row = [value.strip() for value in row]
+            if len(row) == 0 or row[0] == '' or row[0].startswith('#'):
+                continue
+            if len(row) < 5:
+                raise ValueError("Closure on line {} needs startTime, endTime, percentage and a polygon".format(number))
+            coordinates = [float(value) for value in " ".join(row[4:]).split()]
+            if len(coordinates) % 2:
+                raise ValueError("Polygon on line {} has an odd number of coordinates".format(number))
+            scenarios.setdefault(row[0], []).append(PolygonClosure("line {}".format(number), [coordinates],
+                                                                   row[1], row[2], row[3]))
+    return scenarios
+
+
+def readClosures(file_path):
+    """ Reads a GeoJSON (.geojson or .json) or comma separated closure file."""
+    if os.path.splitext(file_path)[1].lower() in ('.geojson', '.json'):
+        return readGeoJson(file_path)
+    return readPolygonCsv(file_path)
+
+
+def scenarioBlockages(scenarios, index, origin=None, mult_factor=MULT_FACTOR):
+    """ Blocked cells of every scenario, all the polygons being intersected at once.
+
+        The closures with an empty time window (endTime <= startTime) are left out.
+
+        Parameters
+        ----------
+        scenarios : dictionary
+            lists of PolygonClosure instances by scenario name.
+        index : CellIndex
+            the cells.
+        origin : tuple
+            (optional) origin of the cell plane, see cell_index.planeOrigin. Without
+            it the polygons are already in the cell plane.
+        mult_factor : float
+            (optional) MULT_FACTOR of the generated cells.
+
+        Returns
+        -------
+        blockages : OrderedDict
+            by scenario name, (startTime, endTime, percentage) by cell index.
+    """
+    names = list(scenarios)
+    closures = [(s, closure) for s, name in enumerate(names) for closure in scenarios[name]
+                if closure.overlaps(None)]
+    polygons = []
+    for _, closure in closures:
+        rings = closure.rings
+        if origin is not None:
+            rings = [geoToPlane(ring[:, 0], ring[:, 1], origin, mult_factor) for ring in rings]
+        polygons.append(rings)
+    scenario = np.array([s for s, _ in closures], dtype=np.int64)
+    startTime = np.array([closure.startTime for _, closure in closures], dtype=np.int64)
+    endTime = np.array([closure.endTime for _, closure in closures], dtype=np.int64)
+    percentage = np.array([closure.percentage for _, closure in closures])
+    polygonIds, cells, _, fractions = index.overlaps(polygons)
+    blocked = percentage[polygonIds] * fractions
+
+    # closures of a scenario with the same window add up on a cell
+    windows = np.stack([scenario[polygonIds], cells, startTime[polygonIds], endTime[polygonIds]])
+    windows, inverse = np.unique(windows, axis=1, return_inverse=True)
+    blocked = np.minimum(np.bincount(inverse.ravel(), weights=blocked, minlength=windows.shape[1]),
+                         MAX_BLOCKAGE_PERCENTAGE)
+    blocked = np.round(blocked, PERCENTAGE_DECIMALS)
+    windows, blocked = windows[:, blocked > 0], blocked[blocked > 0]
+
+    # the windows of a cell merged into one blockage
+    keys, first, inverse = np.unique(windows[0] * len(index) + windows[1], return_index=True, return_inverse=True)
+    inverse = inverse.ravel()
+    start, end, merged = windows[2][first].copy(), windows[3][first].copy(), np.zeros(len(keys))
+    np.minimum.at(start, inverse, windows[2])
+    np.maximum.at(end, inverse, windows[3])
+    np.maximum.at(merged, inverse, blocked)
+    blockages = OrderedDict((name, OrderedDict()) for name in names)
+    for key, s, e, value in zip(keys, start, end, merged):
+        value = float(value)
+        blockages[names[key // len(index)]][int(key % len(index))] = (
+            int(s), int(e), int(value) if value == int(value) else value)
+    return blockages
+
+
+def writeBlockages(blockages, index, file_path):
+    """ Writes the blockage file of one scenario, with the blocked cells only."""
+    directory = os.path.dirname(file_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(file_path, 'w', encoding="utf8") as blockageFile:
+        blockageFile.write("cellName,startTime,endTime,percentage\n")
+        for cell in sorted(blockages):
+            start, end, percentage = blockages[cell]
+            blockageFile.write("{},{},{},{}\n".format(index.names[cell], start, end, percentage))
+
+
+def loadCachedCells(cache_dir, output_dir=None):
+    """ The cells, plane origin, MULT_FACTOR and blockage file name of a cached run."""
+    import mapGeoToCells as gen
+    from stage_cache import StageCache
+    ctx = gen.GenerationContext()
+    if output_dir is not None:
+        ctx.setOutputDirectory(output_dir)
+    _, graph, cached_cells = gen.loadCachedRun(ctx, StageCache(cache_dir))
+    xs = [data['x'] for _, data in graph.nodes(data=True)]
+    ys = [data['y'] for _, data in graph.nodes(data=True)]
+    return cached_cells['cells'], planeOrigin(xs, ys), gen.MULT_FACTOR, ctx.BLOCKAGE_FILE_NAME + gen.FILE_FORMAT
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Write the blockage files of closure scenarios given as polygons.")
+    parser.add_argument('closures', help="GeoJSON or comma separated file of the closure polygons")
+    parser.add_argument('--output-dir', required=True, help="directory receiving one sub-directory per scenario")
+    parser.add_argument('--cache-dir', default=None, help="stage cache of the run the cells were generated by")
+    parser.add_argument('--run-output-dir', default=None, help="output directory of the cached run")
+    parser.add_argument('--cells', default=None, help="cell file, instead of the cells of a cached run")
+    parser.add_argument('--origin', nargs=2, type=float, metavar=('X', 'Y'), default=None,
+                        help="node x and y (longitude, latitude) of the origin of the cell plane, with --cells")
+    parser.add_argument('--plane', action='store_true', help="the polygons are given in the cell plane")
+    parser.add_argument('--report', default=None, help="JSON file receiving the blocked cells of every scenario")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    if args.cache_dir is not None:
+        cells, origin, multFactor, fileName = loadCachedCells(args.cache_dir, args.run_output_dir)
+    elif args.cells is not None:
+        if args.origin is None and not args.plane:
+            parser.error("give the --origin of the cell plane or --plane polygons with --cells")
+        cells, origin, multFactor, fileName = readCells(args.cells), args.origin, MULT_FACTOR, BLOCKAGE_FILE
+    else:
+        parser.error("give the cells with --cache-dir or --cells")
+    if args.plane:
+        origin = None
+    index = CellIndex(cells)
+    scenarios = readClosures(args.closures)
+    blockages = scenarioBlockages(scenarios, index, origin, multFactor)
+    report = OrderedDict()
+    for name, scenario in blockages.items():
+        path = os.path.join(args.output_dir, name, fileName)
+        writeBlockages(scenario, index, path)
+        report[name] = {'blockage': path, 'closures': [closure.toDict() for closure in scenarios[name]],
+                        'blockedCells': len(scenario)}
+    print("{} scenario(s), {} closure(s), {} blocked cell(s) of {} written in {:.2f}s".format(
+        len(blockages), sum(len(closures) for closures in scenarios.values()),
+        sum(len(scenario) for scenario in blockages.values()), len(index), time.perf_counter() - start),
+        file=sys.stderr)
+    if args.report is not None:
+        with open(args.report, 'w', encoding="utf8") as reportFile:
+            json.dump(report, reportFile, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,434 @@
+"""
+module: calibration
+-------------------------
+
+Calibration of the parameters of a fundamental diagram (free speed, shape parameters
+and mu) against observed travel times, over the bounds of a parameter search range
+file (examples/parameters/*ParamSearchSpace.txt). The Java Calibration class runs
+one BOBYQA search, one simulation after the other; here every round draws a Latin
+hypercube sample of the search box and evaluates its points in a pool of worker
+processes, so that the wall time of a calibration goes down with the number of
+cores. Every round after the first samples a box shrunk around the best point found
+so far.
+
+The points are scored by an Objective, the log-likelihood of the mean travel times
+of Board.getLogLikelihood ("meantraveltime" mode) with the people grouped by route
+and departure time: ScenarioObjective writes a parameter file and a scenario per
+point and runs it with an executor of scenario_sweep (the Java simulator or the NumPy
+network loading), NetworkLoadingObjective simulates the points in the worker process
+itself without writing any file. The observations are a travelTimeMean.txt file, e.g.
+from a run of the simulator with reference parameters.
+
+The score of every evaluated point is stored in a stage cache under the key of the
+point and of the objective (scenario, input files, observations and simulator), so a
+calibration that is interrupted, extended by more rounds or run again with the same
+seed only evaluates the points that are new.
+
+e.g. `python calibration.py scenario.txt --observed travelTimeMean.txt --output-dir calib --workers 8`.
+"""
+
+import argparse
+import csv
+import json
+import math
+import os
+import sys
+import time
+import traceback
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from fundamental_diagrams import SHAPE_PARAMETERS, readSearchSpace
+from network_loading import NetworkLoading, readScenario
+from scenario_sweep import (EXECUTORS, RUN_ENTRIES, JavaExecutor, LocalExecutor, outputDirectoryEntry,
+                            scenarioInputs, writeScenario)
+from stage_cache import StageCache, fileFingerprint
+
+#Stage of the stage cache storing the scores of the evaluated points
+POINTS_STAGE = 'calibration point'
+
+#Files written in the output directory: every evaluated point, and the best parameters
+POINTS_FILE = 'calibrationPoints.txt'
+BEST_PARAMETERS_FILE = 'calibratedParam.txt'
+
+#Modules of the NumPy network loading, part of the key of its scores
+NETWORK_LOADING_MODULES = ('network_loading.py', 'fundamental_diagrams.py')
+
+
+def latinHypercube(count, low, high, rng):
+    """ Latin hypercube sample of a box: every parameter range is cut into `count`
+        strata holding exactly one point each, at a random position.
+
+        Returns
+        -------
+        points : numpy array
+            (count, parameters) array.
+    """
+    low, high = np.asarray(low, dtype=float), np.asarray(high, dtype=float)
+    strata = np.argsort(rng.random((count, len(low))), axis=0)
+    return low + (strata + rng.random((count, len(low)))) / count * (high - low)
+
+
+def readObservations(file_path):
+    """ Number of people and mean travel time of every route and departure time of a
+        travelTimeMean.txt file, the groups of a demand row being merged.
+
+        Returns
+        -------
+        observations : OrderedDict
+            (size, meanTravelTime) by (routeName, depTime).
+    """
+    rows = []
+    with open(file_path, encoding="utf8") as meanFile:
+        for row in csv.reader(meanFile, delimiter=','):
+            if len(row) < 5 or row[0].lstrip().startswith('#'):
+                continue
+            rows.append((row[1].strip(), int(row[3]), float(row[2]), float(row[4])))
+    return groupTravelTimes(rows)
+
+
+def groupTravelTimes(rows):
+    """ Merges (routeName, depTime, size, meanTravelTime) rows by route and departure
+        time, as readObservations(). Empty groups are left out.
+    """
+    totals = OrderedDict()
+    for route, depTime, size, travelTime in rows:
+        if size <= 0:
+            continue
+        people, weighted = totals.get((route, depTime), (0.0, 0.0))
+        totals[(route, depTime)] = (people + size, weighted + size * travelTime)
+    return OrderedDict((key, (people, weighted / people)) for key, (people, weighted) in totals.items())
+
+
+def logLikelihood(observed, simulated):
+    """ Log-likelihood of the observed mean travel times (Board.getLogLikelihood in
+        "meantraveltime" mode), -inf when a group observed is not simulated or never
+        arrives, as the Java calibration scores a NaN.
+    """
+    numPeople = squaredErr = 0.0
+    for key, (size, travelTime) in observed.items():
+        if travelTime != travelTime:
+            continue
+        simTravelTime = simulated.get(key, (0.0, float('nan')))[1]
+        if simTravelTime != simTravelTime:
+            return float('-inf')
+        numPeople += size
+        squaredErr += size * (travelTime - simTravelTime) ** 2
+    if numPeople == 0:
+        raise ValueError("No observed travel time")
+    if squaredErr == 0:
+        return float('inf')
+    return -numPeople / 2.0 * (1.0 + math.log(2.0 * math.pi / numPeople * squaredErr))
+
+
+def diagramParameters(fun_diag, parameters):
+    """ The 'vf', 'shape' and 'mu' dictionary of readParameters from the values of a
+        point, by parameter name in the order of the search range file.
+    """
+    values = list(parameters.values())
+    return {'vf': values[0], 'shape': values[1:1 + len(SHAPE_PARAMETERS[fun_diag])], 'mu': values[-1]}
+
+
+def writeParameterFile(file_path, fun_diag, parameters):
+    """ Writes a parameter file of the simulator (see examples/parameters)."""
+    with open(file_path, 'w', encoding="utf8") as paramFile:
+        paramFile.write("#FunDiag: {}\n".format(fun_diag))
+        paramFile.write("\n".join("{}, {!r}".format(name, float(value)) for name, value in parameters.items()))
+
+
+class Objective(object):
+    """
+    Scores a parameter set, the higher the better. Subclasses implement evaluate()
+    and fingerprint(). Objectives are sent to the worker processes, so they must be
+    picklable.
+    """
+    name = None
+
+    def __init__(self, scenario_path, observed_path, root=None):
+        self.scenario_path = scenario_path
+        self.observed_path = observed_path
+        self.root = root
+        self.scenario = readScenario(scenario_path, root)
+        self.funDiag = self.scenario['funDiag']
+
+    def fingerprint(self):
+        """ JSON serialisable description of everything the scores depend on besides
+            the parameters, part of the key of the points.
+        """
+        # the parameter file of the scenario is replaced by those of the points
+        ignored = (self.scenario['parameters'], self.scenario['searchSpace'])
+        inputs = [(path, fileFingerprint(path) if os.path.isfile(path) else None)
+                  for path in scenarioInputs(self.scenario_path, self.root) if path not in ignored]
+        return [self.name, self.funDiag, fileFingerprint(self.scenario_path), inputs,
+                fileFingerprint(self.observed_path)]
+
+    def evaluate(self, parameters, work_dir):
+        """ Simulates the scenario with the parameters and scores its travel times.
+
+            Parameters
+            ----------
+            parameters : OrderedDict
+                value of every parameter, by name in the order of the search range file.
+            work_dir : string
+                directory of the point, for the files of its simulation.
+
+            Returns
+            -------
+            score : float
+                the log-likelihood of the observations.
+        """
+        raise NotImplementedError
+
+
+class ScenarioObjective(Objective):
+    """
+    Writes the parameter file and a copy of the scenario into the directory of the
+    point and runs it with an executor of scenario_sweep, e.g. the Java simulator.
+    """
+    name = 'scenario'
+
+    def __init__(self, scenario_path, observed_path, executor, root=None):
+        Objective.__init__(self, scenario_path, observed_path, root)
+        self.executor = executor
+
+    def fingerprint(self):
+        return Objective.fingerprint(self) + [self.executor.fingerprint()]
+
+    def evaluate(self, parameters, work_dir):
+        os.makedirs(work_dir, exist_ok=True)
+        paramPath = os.path.join(work_dir, 'param.txt')
+        writeParameterFile(paramPath, self.funDiag, parameters)
+        scenarioPath = os.path.join(work_dir, 'scenario.txt')
+        entries = OrderedDict(RUN_ENTRIES)
+        # the simulator reads the parameter file relative to the input directory
+        entries['parameter file name'] = os.path.relpath(paramPath, self.scenario['inputDirectory'] or os.curdir
+                                                         ).replace(os.sep, '/')
+        entries['output directory'] = outputDirectoryEntry(work_dir, self.root)
+        writeScenario(self.scenario_path, scenarioPath, entries)
+        meanPath = os.path.join(work_dir, 'travelTimeMean.txt')
+        if os.path.exists(meanPath):
+            os.remove(meanPath)
+        self.executor.run(scenarioPath, work_dir, self.root)
+        return logLikelihood(readObservations(self.observed_path), readObservations(meanPath))
+
+
+class NetworkLoadingObjective(Objective):
+    """
+    Simulates the points with the NumPy network loading of network_loading.py in the
+    worker process, without writing any file: the quickest stand-in for the simulator.
+    """
+    name = 'network loading'
+
+    def __init__(self, scenario_path, observed_path, root=None, max_time=None):
+        Objective.__init__(self, scenario_path, observed_path, root)
+        self.max_time = max_time
+
+    def fingerprint(self):
+        directory = os.path.dirname(os.path.abspath(__file__))
+        return Objective.fingerprint(self) + [self.max_time, fileFingerprint(
+            *[os.path.join(directory, module) for module in NETWORK_LOADING_MODULES])]
+
+    def evaluate(self, parameters, work_dir):
+        scenario = self.scenario
+        network = NetworkLoading(scenario['cells'], scenario['links'], scenario['routes'], scenario['demand'],
+                                 scenario['blockages'], self.funDiag, diagramParameters(self.funDiag, parameters),
+                                 scenario['cfl'], scenario['alpha'], scenario['beta'])
+        result = network.run(self.max_time, record_cells=False)
+        mean, _, _ = result.travelTimeStats()
+        simulated = groupTravelTimes(
+            (network.routeNames[network.groupRoute[group]], network.groupDepTime[group],
+             result.groupSize[group], mean[group]) for group in range(len(network.groupIds)))
+        return logLikelihood(readObservations(self.observed_path), simulated)
+
+
+class PointContext(object):
+    """
+    One parameter set of the calibration: its round, values and key and, once
+    evaluated, its score or error.
+    """
+    def __init__(self, round_number, parameters, key):
+        self.round = round_number
+        self.parameters = OrderedDict(parameters)
+        self.key = key
+        self.score = None
+        self.error = None
+        self.wallTime = None
+        self.cached = False
+
+    def toDict(self):
+        return {'round': self.round, 'parameters': self.parameters, 'key': self.key, 'score': self.score,
+                'error': self.error, 'wallTime': self.wallTime, 'cached': self.cached}
+
+
+def evaluatePoint(point, objective, work_dir):
+    """ Scores one point in the current process, returning its context with the score
+        or the error.
+    """
+    start = time.perf_counter()
+    try:
+        point.score = float(objective.evaluate(point.parameters, work_dir))
+        if point.score != point.score:
+            point.score = float('-inf')
+    except Exception:
+        point.error = traceback.format_exc()
+    point.wallTime = time.perf_counter() - start
+    return point
+
+
+def refinedBounds(bounds, best, round_number, shrink):
+    """ The box sampled by a round after the first: the search box scaled by
+        shrink ** round_number and centred on the best point, moved back inside the
+        search box where it sticks out.
+    """
+    low = np.array([bound[0] for bound in bounds.values()])
+    high = np.array([bound[1] for bound in bounds.values()])
+    halfWidth = 0.5 * (high - low) * shrink ** round_number
+    centre = np.clip(np.array(list(best.values())), low + halfWidth, high - halfWidth)
+    return centre - halfWidth, centre + halfWidth
+
+
+def calibrate(objective, bounds, output_dir, samples=32, rounds=3, shrink=0.5, seed=None, workers=None,
+              cache=None, log=None):
+    """ Latin hypercube search of the parameters maximising the objective.
+
+        Parameters
+        ----------
+        objective : Objective
+            scores the parameter sets.
+        bounds : OrderedDict
+            (low, high) of every parameter, see fundamental_diagrams.readSearchSpace.
+        output_dir : string
+            directory of the calibration, the points get their sub-directories in
+            output_dir/points.
+        samples : integer
+            (optional) points per round.
+        rounds : integer
+            (optional) number of rounds, the first one sampling the whole search box.
+        shrink : float
+            (optional) factor of the size of the box sampled from one round to the next.
+        seed : integer
+            (optional) seed of the samples.
+        workers : integer
+            (optional) number of worker processes, the number of cores by default.
+        cache : StageCache
+            (optional) stores the scores of the points, output_dir/cache by default.
+
+        Returns
+        -------
+        points : list
+            PointContext instances of every round, best score first.
+    """
+    if cache is None:
+        cache = StageCache(os.path.join(output_dir, 'cache'))
+    fingerprint = objective.fingerprint()
+    rng = np.random.default_rng(seed)
+    low = np.array([bound[0] for bound in bounds.values()])
+    high = np.array([bound[1] for bound in bounds.values()])
+    points = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for roundNumber in range(rounds):
+            scored = [point for point in points if point.score is not None]
+            if roundNumber > 0 and scored:
+                best = max(scored, key=lambda point: point.score)
+                low, high = refinedBounds(bounds, best.parameters, roundNumber, shrink)
+            roundPoints, pending = [], []
+            for values in latinHypercube(samples, low, high, rng):
+                parameters = OrderedDict(zip(bounds, (float(value) for value in values)))
+                point = PointContext(roundNumber, parameters, cache.key(POINTS_STAGE, fingerprint,
+                                                                          list(parameters.values())))
+                record = cache.load(POINTS_STAGE, point.key)
+                if record is not None:
+                    point.score, point.wallTime, point.cached = record['score'], record['wallTime'], True
+                else:
+                    pending.append(len(roundPoints))
+                roundPoints.append(point)
+            futures = dict((pool.submit(evaluatePoint, roundPoints[i], objective,
+                                        os.path.join(output_dir, 'points', roundPoints[i].key)), i) for i in pending)
+            for future in as_completed(futures):
+                point = roundPoints[futures[future]] = future.result()
+                if point.error is None:
+                    cache.store(POINTS_STAGE, point.key, {'parameters': point.parameters, 'score': point.score,
+                                                          'wallTime': point.wallTime})
+            points.extend(roundPoints)
+            failed = sum(roundPoints[i].error is not None for i in pending)
+            if log is not None:
+                scores = [point.score for point in points if point.score is not None]
+                log("Round {}: {} point(s) evaluated, {} cached, {} failed, best log-likelihood {}".format(
+                    roundNumber + 1, len(pending) - failed, samples - len(pending), failed,
+                    max(scores) if scores else None))
+    return sorted(points, key=lambda point: -point.score if point.score is not None else float('inf'))
+
+
+def writePoints(points, file_path):
+    """ Writes one line per point, best first: its score, round, status and values."""
+    names = list(points[0].parameters) if points else []
+    with open(file_path, 'w', encoding="utf8") as pointFile:
+        pointFile.write("# logLikelihood, round, status, wallTime, {} \n".format(", ".join(names)))
+        for point in points:
+            status = "failed" if point.error else ("cached" if point.cached else "done")
+            values = [point.score if point.score is not None else '', point.round + 1, status,
+                      "{:.3f}".format(point.wallTime or 0.0)] + [repr(value) for value in point.parameters.values()]
+            pointFile.write(", ".join(str(value) for value in values) + "\n")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Calibrate the fundamental diagram of a scenario in parallel.")
+    parser.add_argument('scenario', help="scenario file, see examples/scenarios")
+    parser.add_argument('--observed', required=True, help="travelTimeMean.txt file of the observed travel times")
+    parser.add_argument('--output-dir', required=True, help="directory of the calibration")
+    parser.add_argument('--search-space', default=None,
+                        help="parameter search range file, the one of the scenario by default")
+    parser.add_argument('--root', default=None, help="directory the input directory of the scenario is relative to")
+    parser.add_argument('--objective', choices=['network-loading'] + sorted(EXECUTORS), default='java',
+                        help="simulator scoring the points: the Java simulator, the NumPy network loading run on "
+                             "scenario files (local) or in process (network-loading)")
+    parser.add_argument('--classpath', default=None, help="classpath of the Java simulator")
+    parser.add_argument('--timeout', type=float, default=None, help="seconds after which a Java run is stopped")
+    parser.add_argument('--samples', type=int, default=32, help="points per round")
+    parser.add_argument('--rounds', type=int, default=3, help="number of rounds")
+    parser.add_argument('--shrink', type=float, default=0.5, help="factor of the sampled box from round to round")
+    parser.add_argument('--seed', type=int, default=None, help="seed of the samples")
+    parser.add_argument('--workers', type=int, default=None, help="number of worker processes")
+    parser.add_argument('--cache-dir', default=None, help="directory of the scores, output-dir/cache by default")
+    parser.add_argument('--report', default=None, help="JSON file receiving every point")
+    args = parser.parse_args(argv)
+
+    if not 0.0 < args.shrink <= 1.0:
+        parser.error("--shrink must be between 0 and 1")
+    if args.objective == 'network-loading':
+        objective = NetworkLoadingObjective(args.scenario, args.observed, args.root)
+    else:
+        executor = JavaExecutor(args.classpath, timeout=args.timeout) if args.objective == 'java' else LocalExecutor()
+        objective = ScenarioObjective(args.scenario, args.observed, executor, args.root)
+    searchSpace = args.search_space or objective.scenario['searchSpace']
+    if searchSpace is None:
+        parser.error("the scenario has no parameter search range file, give --search-space")
+    bounds = readSearchSpace(searchSpace, objective.funDiag)
+    log = lambda message: print(message, file=sys.stderr, flush=True)
+    start = time.perf_counter()
+    os.makedirs(args.output_dir, exist_ok=True)
+    cache = StageCache(args.cache_dir or os.path.join(args.output_dir, 'cache'))
+    points = calibrate(objective, bounds, args.output_dir, args.samples, args.rounds, args.shrink, args.seed,
+                       args.workers, cache, log)
+    writePoints(points, os.path.join(args.output_dir, POINTS_FILE))
+    failed = [point for point in points if point.error]
+    for point in failed[:3]:
+        log("Point {} failed:\n{}".format(point.key, point.error))
+    if args.report is not None:
+        with open(args.report, 'w', encoding="utf8") as reportFile:
+            json.dump([point.toDict() for point in points], reportFile, indent=2)
+    if not points or points[0].score is None:
+        log("No point could be evaluated, in {:.1f}s".format(time.perf_counter() - start))
+        return 1
+    best = points[0]
+    writeParameterFile(os.path.join(args.output_dir, BEST_PARAMETERS_FILE), objective.funDiag, best.parameters)
+    log("{} point(s), {} failed, in {:.1f}s; best log-likelihood {} with {}".format(
+        len(points), len(failed), time.perf_counter() - start, best.score,
+        ", ".join("{} {:.6g}".format(name, value) for name, value in best.parameters.items())))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
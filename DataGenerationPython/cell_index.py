@@ -0,0 +1,380 @@
+"""
+module: cell_index
+-------------------------
+
+Spatial index of the cells written by mapGeoToCells (createCells or a *_cells.txt
+file), which are quadrilaterals given as coordinate strings. The bounding boxes of
+the cells are hashed into a uniform grid whose sorted keys are searched with
+np.searchsorted, so the grid needs no memory for its empty squares and a query only
+tests the few cells registered in the squares it touches.
+
+All the queries are batched: point location (which cell contains every point, e.g.
+OD points or sensors), nearest cells within a distance (snapping points off the
+street cells) and polygon overlaps (which cells a closure or event polygon covers
+and what fraction of them), the exact overlap areas being computed by clipping
+every polygon against all its candidate cells at once (Sutherland-Hodgman).
+
+The cells live in the plane of the cell coordinates: the node coordinates of the
+street network shifted to the origin of the network and scaled by MULT_FACTOR, as
+getNormalizedCoordinates and getCoordinates do. geoToPlane() converts geographic
+coordinates (the x and y of the graph nodes, i.e. longitude and latitude) to it.
+
+e.g. `python cell_index.py ../examples/networks/SYD350_cells.txt --points points.txt`.
+"""
+
+import argparse
+import csv
+import sys
+
+import numpy as np
+
+#Scaling of the node coordinates in mapGeoToCells (MULT_FACTOR and the MULTIPLI of getCoordinates)
+MULT_FACTOR = 10000000
+PLANE_SCALE = 0.001
+
+#Shift of the cell coordinates avoiding negative values (padding of getCoordinates)
+PLANE_PADDING = 2.0
+
+#Side of the grid squares, in median cell extents
+GRID_FACTOR = 2.0
+
+#Absolute tolerance of the point in cell tests, points on a shared side go to the first cell
+PLANE_TOLERANCE = 1e-9
+
+#Largest number of polygon vertices x candidate cells clipped at once
+MAX_CLIP_SIZE = 1 << 22
+
+
+def parseCoordinates(coordinates):
+    """ Corners of cells from their coordinate strings, "(x1|y1) (x2|y2) (x3|y3) (x4|y4)".
+
+        Returns
+        -------
+        quads : numpy array
+            (cells, 4, 2) array, NaN for the cells without coordinates.
+    """
+    values = []
+    for coordinate in coordinates:
+        numbers = (coordinate or '').replace('(', ' ').replace(')', ' ').replace('|', ' ').split()
+        values.extend(numbers if len(numbers) == 8 else ['nan'] * 8)
+    return np.array(values, dtype=float).reshape(len(coordinates), 4, 2)
+
+
+def readCells(cells_path):
+    """ Reads a cell file of the generator into the dictionary of lists of createCells."""
+    cells = {'cellName': [], 'zone': [], 'surfaceSize': [], 'coordinate': []}
+    with open(cells_path, encoding="utf8") as cellFile:
+        for row in csv.DictReader(cellFile):
+            cells['cellName'].append(row['cellName'])
+            cells['zone'].append(row['zone'])
+            cells['surfaceSize'].append(float(row['surfaceSize']))
+            cells['coordinate'].append(row['coordinate'])
+    return cells
+
+
+def planeOrigin(xs, ys):
+    """ Origin of the cell plane of a network from the x and y of its nodes, as
+        getNormalizeParameter: the smallest absolute values.
+    """
+    xs, ys = np.asarray(xs, dtype=float), np.asarray(ys, dtype=float)
+    return (xs.min() if xs[0] > 0 else xs.max()), (ys.min() if ys[0] > 0 else ys.max())
+
+
+def geoToPlane(x, y, origin, mult_factor=MULT_FACTOR):
+    """ Cell plane coordinates of geographic points (node x and y, i.e. longitude and
+        latitude), see planeOrigin(). Returns an (..., 2) array.
+    """
+    scale = mult_factor * PLANE_SCALE
+    planeX = (np.abs(np.asarray(x, dtype=float)) - abs(origin[0])) * scale + PLANE_PADDING
+    planeY = (np.abs(np.asarray(y, dtype=float)) - abs(origin[1])) * scale + PLANE_PADDING
+    return np.stack([planeX, planeY], axis=-1)
+
+
+def _cross(origin, a, b):
+    """ z component of (a - origin) x (b - origin), over the last axis."""
+    return (a[..., 0] - origin[..., 0]) * (b[..., 1] - origin[..., 1]) - \
+           (a[..., 1] - origin[..., 1]) * (b[..., 0] - origin[..., 0])
+
+
+def polygonAreas(vertices, counts=None):
+    """ Signed areas (counter-clockwise positive) of polygons given as an (n, V, 2)
+        array, the first counts[i] vertices of polygon i being used.
+    """
+    vertices = np.asarray(vertices, dtype=float)
+    numVertices = vertices.shape[1]
+    if counts is None:
+        counts = np.full(len(vertices), numVertices)
+    position = np.arange(numVertices)[None, :]
+    following = np.where(position + 1 < counts[:, None], position + 1, 0)
+    nextVertices = np.take_along_axis(vertices, following[:, :, None], axis=1)
+    terms = vertices[..., 0] * nextVertices[..., 1] - nextVertices[..., 0] * vertices[..., 1]
+    return 0.5 * np.where(position < counts[:, None], terms, 0.0).sum(axis=1)
+
+
+def clipPolygons(vertices, counts, quads):
+    """ Clips polygons by convex counter-clockwise quadrilaterals, pair by pair
+        (Sutherland-Hodgman), all the pairs advancing together.
+
+        Parameters
+        ----------
+        vertices : numpy array
+            (pairs, V, 2) vertices of the polygons, padded.
+        counts : numpy array
+            number of vertices of every polygon.
+        quads : numpy array
+            (pairs, 4, 2) corners of the clipping quadrilaterals.
+
+        Returns
+        -------
+        vertices, counts : numpy arrays
+            the clipped polygons, in the same layout.
+    """
+    for side in range(4):
+        start, end = quads[:, side], quads[:, (side + 1) % 4]
+        numVertices = vertices.shape[1]
+        position = np.arange(numVertices)[None, :]
+        valid = position < counts[:, None]
+        previous = np.take_along_axis(vertices, np.where(position > 0, position - 1,
+                                                         counts[:, None] - 1)[:, :, None], axis=1)
+        currentSide = _cross(start[:, None], end[:, None], vertices)
+        previousSide = _cross(start[:, None], end[:, None], previous)
+        currentIn, previousIn = currentSide >= 0, previousSide >= 0
+        change = previousSide - currentSide
+        share = previousSide / np.where(change != 0, change, 1.0)
+        crossing = previous + share[:, :, None] * (vertices - previous)
+        # every vertex emits the crossing of the side on its way in, then itself when inside
+        emitted = np.stack([crossing, vertices], axis=2).reshape(len(vertices), 2 * numVertices, 2)
+        keep = np.stack([valid & (currentIn != previousIn), valid & currentIn], axis=2).reshape(len(vertices), -1)
+        counts = keep.sum(axis=1)
+        order = np.argsort(~keep, axis=1, kind='stable')[:, :max(int(counts.max(initial=0)), 1)]
+        vertices = np.take_along_axis(emitted, order[:, :, None], axis=1)
+    return vertices, counts
+
+
+def _expandRanges(starts, counts):
+    """ The owner and position of every element of consecutive ranges."""
+    owners = np.repeat(np.arange(len(counts)), counts)
+    offsets = np.cumsum(counts) - counts
+    return owners, np.repeat(starts - offsets, counts) + np.arange(owners.size)
+
+
+class CellIndex(object):
+    """
+    Uniform grid over the bounding boxes of the cells, with the cells as convex
+    counter-clockwise quadrilaterals.
+    """
+    def __init__(self, cells, grid_size=None):
+        """
+        Constructor
+
+                @param cells       Dictionary of lists of createCells (cellName, zone
+                                   and coordinate), see readCells.
+                @param grid_size   Side of the grid squares, GRID_FACTOR median cell
+                                   extents by default.
+        """
+        self.names = np.array(cells['cellName'], dtype=str)
+        self.zones = np.array(cells['zone'], dtype=str)
+        quads = parseCoordinates(cells['coordinate'])
+        # the corners go either way round depending on the side of the edge, orient them all alike
+        clockwise = polygonAreas(np.nan_to_num(quads)) < 0
+        quads[clockwise] = quads[clockwise, ::-1]
+        self.quads = quads
+        self.area = np.abs(polygonAreas(np.nan_to_num(quads)))
+        self.valid = ~np.isnan(quads).any(axis=(1, 2))
+        filled = np.where(self.valid[:, None, None], quads, 0.0)
+        self.low, self.high = filled.min(axis=1), filled.max(axis=1)
+        self._buildGrid(grid_size)
+
+    @classmethod
+    def fromFile(cls, cells_path, grid_size=None):
+        """ Index of the cells of a *_cells.txt file."""
+        return cls(readCells(cells_path), grid_size)
+
+    def __len__(self):
+        return len(self.names)
+
+    def _buildGrid(self, grid_size):
+        cells = np.flatnonzero(self.valid)
+        extent = (self.high - self.low)[cells].max(axis=1) if len(cells) else np.ones(1)
+        self.gridSize = float(grid_size or GRID_FACTOR * max(np.median(extent), PLANE_TOLERANCE))
+        self.gridOrigin = self.low[cells].min(axis=0) if len(cells) else np.zeros(2)
+        lowSquare = self._square(self.low[cells])
+        highSquare = self._square(self.high[cells])
+        self.gridShape = highSquare.max(axis=0) + 1 if len(cells) else np.ones(2, dtype=np.int64)
+        owners, keys = self._squareKeys(lowSquare, highSquare)
+        order = np.argsort(keys, kind='stable')
+        self.gridKeys, self.gridStarts, gridCounts = np.unique(keys[order], return_index=True, return_counts=True)
+        self.gridEnds = self.gridStarts + gridCounts
+        self.gridCells = cells[owners[order]]
+
+    def _square(self, points):
+        return np.floor((points - self.gridOrigin) / self.gridSize).astype(np.int64)
+
+    def _squareKeys(self, low_square, high_square):
+        """ The owner and key of every grid square of boxes given by their corner squares."""
+        low_square = np.maximum(low_square, 0)
+        high_square = np.minimum(high_square, self.gridShape - 1)
+        width = np.maximum(high_square - low_square + 1, 0)
+        owners, position = _expandRanges(np.zeros(len(width), dtype=np.int64), width[:, 0] * width[:, 1])
+        squareX = low_square[owners, 0] + position // np.maximum(width[owners, 1], 1)
+        squareY = low_square[owners, 1] + position % np.maximum(width[owners, 1], 1)
+        return owners, squareX * self.gridShape[1] + squareY
+
+    def candidates(self, low, high):
+        """ (query, cell) pairs of the cells whose bounding box meets the query boxes.
+
+            Parameters
+            ----------
+            low, high : numpy arrays
+                (queries, 2) lower and upper corners of the boxes.
+        """
+        low, high = np.atleast_2d(low), np.atleast_2d(high)
+        owners, keys = self._squareKeys(self._square(low), self._square(high))
+        slot = np.minimum(np.searchsorted(self.gridKeys, keys), max(len(self.gridKeys) - 1, 0))
+        found = (self.gridKeys[slot] == keys) if len(self.gridKeys) else np.zeros(len(keys), dtype=bool)
+        owners, slot = owners[found], slot[found]
+        starts, ends = self.gridStarts[slot], self.gridEnds[slot]
+        pairOwners, position = _expandRanges(starts, ends - starts)
+        queries, cells = owners[pairOwners], self.gridCells[position]
+        # a cell is registered in every square its box touches
+        pairs = np.unique(queries * len(self) + cells)
+        queries, cells = pairs // len(self), pairs % len(self)
+        meets = np.all((self.low[cells] <= high[queries]) & (low[queries] <= self.high[cells]), axis=1)
+        return queries[meets], cells[meets]
+
+    def _inside(self, points, cells):
+        quads = self.quads[cells]
+        sides = _cross(quads, np.roll(quads, -1, axis=1), points[:, None, :])
+        return np.all(sides >= -PLANE_TOLERANCE, axis=1)
+
+    def locate(self, points):
+        """ Index of the cell containing every point, -1 outside all the cells.
+
+            Parameters
+            ----------
+            points : numpy array
+                (points, 2) coordinates in the cell plane.
+        """
+        points = np.atleast_2d(np.asarray(points, dtype=float))
+        queries, cells = self.candidates(points, points)
+        inside = self._inside(points[queries], cells)
+        queries, cells = queries[inside], cells[inside]
+        located = np.full(len(points), -1, dtype=np.int64)
+        # candidates come sorted by query then cell, the first cell of a query wins
+        first = np.flatnonzero(np.r_[True, queries[1:] != queries[:-1]]) if len(queries) else queries
+        located[queries[first]] = cells[first]
+        return located
+
+    def distances(self, points, cells):
+        """ Distance of every point to its cell, 0 inside it."""
+        quads = self.quads[cells]
+        ends = np.roll(quads, -1, axis=1)
+        sides = ends - quads
+        with np.errstate(divide='ignore', invalid='ignore'):
+            share = np.clip(((points[:, None, :] - quads) * sides).sum(axis=2) / (sides ** 2).sum(axis=2), 0.0, 1.0)
+        closest = quads + np.nan_to_num(share)[:, :, None] * sides
+        distance = np.sqrt(((points[:, None, :] - closest) ** 2).sum(axis=2)).min(axis=1)
+        return np.where(self._inside(points, cells), 0.0, distance)
+
+    def nearest(self, points, max_distance):
+        """ Nearest cell of every point within max_distance, and its distance.
+
+            Returns
+            -------
+            cells, distances : numpy arrays
+                the index of the nearest cell (-1 when none is within max_distance)
+                and the distance to it (inf then), 0 for a point inside a cell.
+        """
+        points = np.atleast_2d(np.asarray(points, dtype=float))
+        queries, cells = self.candidates(points - max_distance, points + max_distance)
+        distance = self.distances(points[queries], cells)
+        close = distance <= max_distance
+        queries, cells, distance = queries[close], cells[close], distance[close]
+        order = np.lexsort((cells, distance, queries))
+        queries, cells, distance = queries[order], cells[order], distance[order]
+        first = np.flatnonzero(np.r_[True, queries[1:] != queries[:-1]]) if len(queries) else queries
+        nearest = np.full(len(points), -1, dtype=np.int64)
+        best = np.full(len(points), np.inf)
+        nearest[queries[first]], best[queries[first]] = cells[first], distance[first]
+        return nearest, best
+
+    def overlaps(self, polygons):
+        """ Areas of the cells covered by polygons.
+
+            Parameters
+            ----------
+            polygons : list
+                polygons in the cell plane, each an (V, 2) array of its vertices or a
+                list of rings, the first one the outline and the others its holes.
+
+            Returns
+            -------
+            polygonIds, cells, areas, fractions : numpy arrays
+                one entry per (polygon, cell) pair with a positive overlap: the
+                covered area and the covered fraction of the cell.
+        """
+        rings, owners, signs = [], [], []
+        for i, polygon in enumerate(polygons):
+            polygonRings = [polygon] if np.ndim(polygon[0]) == 1 else polygon
+            for j, ring in enumerate(polygonRings):
+                rings.append(np.asarray(ring, dtype=float).reshape(-1, 2))
+                owners.append(i)
+                signs.append(-1.0 if j else 1.0)
+        if not rings:
+            return (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0), np.zeros(0))
+        # closed rings repeat their first vertex, which clipping does not need
+        rings = [ring[:-1] if len(ring) > 1 and np.array_equal(ring[0], ring[-1]) else ring for ring in rings]
+        counts = np.array([len(ring) for ring in rings])
+        vertices = np.zeros((len(rings), counts.max(), 2))
+        for i, ring in enumerate(rings):
+            vertices[i, :len(ring)] = ring
+            vertices[i, len(ring):] = ring[-1]
+        low = np.array([ring.min(axis=0) for ring in rings])
+        high = np.array([ring.max(axis=0) for ring in rings])
+        queries, cells = self.candidates(low, high)
+        # exact areas, on chunks of pairs bounding the size of the clipped arrays
+        areas = np.zeros(len(queries))
+        chunk = max(1, MAX_CLIP_SIZE // (8 * vertices.shape[1]))
+        for start in range(0, len(queries), chunk):
+            ring = queries[start:start + chunk]
+            clipped, clippedCounts = clipPolygons(vertices[ring], counts[ring], self.quads[cells[start:start + chunk]])
+            areas[start:start + chunk] = np.abs(polygonAreas(clipped, clippedCounts))
+        signs, owners = np.array(signs), np.array(owners)
+        pairs, inverse = np.unique(owners[queries] * len(self) + cells, return_inverse=True)
+        covered = np.bincount(inverse, weights=signs[queries] * areas, minlength=len(pairs))
+        positive = covered > PLANE_TOLERANCE
+        polygonIds, cells, covered = pairs[positive] // len(self), pairs[positive] % len(self), covered[positive]
+        return polygonIds, cells, covered, np.minimum(covered / self.area[cells], 1.0)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Locate points in the cells of a cell file.")
+    parser.add_argument('cells', help="cell file of the generator (*_cells.txt)")
+    parser.add_argument('--points', required=True,
+                        help="comma separated file of x, y points in the cell plane (one header line)")
+    parser.add_argument('--max-distance', type=float, default=None,
+                        help="snap the points outside the cells to the nearest cell within this distance")
+    parser.add_argument('--output', default=None, help="file receiving the cell of every point, stdout by default")
+    args = parser.parse_args(argv)
+
+    index = CellIndex.fromFile(args.cells)
+    points = np.loadtxt(args.points, delimiter=',', skiprows=1, usecols=(0, 1), ndmin=2)
+    cells = index.locate(points)
+    distance = np.zeros(len(points))
+    if args.max_distance is not None:
+        cells, distance = index.nearest(points, args.max_distance)
+    output = open(args.output, 'w', encoding="utf8") if args.output else sys.stdout
+    try:
+        output.write("x,y,cellName,zone,distance\n")
+        for (x, y), cell, gap in zip(points, cells, distance):
+            output.write("{!r},{!r},{},{},{}\n".format(float(x), float(y), index.names[cell] if cell >= 0 else '',
+                                                       index.zones[cell] if cell >= 0 else '',
+                                                       repr(float(gap)) if cell >= 0 else ''))
+    finally:
+        if output is not sys.stdout:
+            output.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
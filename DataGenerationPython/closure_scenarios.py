@@ -0,0 +1,366 @@
+"""
+module: closure_scenarios
+-------------------------
+
+Closure scenarios (roadworks, events, incidents) on top of a cached run. Every
+scenario blocks a percentage of some cells or street edges during a time window and
+gets its own route, demand, link and blockage files, in one sub-directory of the
+output directory per scenario.
+
+Closures only make walking more expensive: a fully blocked edge is removed from the
+network and a partially blocked edge is lengthened in proportion of the blocked
+area. A k-shortest route set that avoids every blocked edge therefore stays optimal,
+so the k-shortest paths are only computed again for the OD pairs with a cached route
+through a blocked edge; the routes of all other OD pairs and the links of every known
+route are taken from the stage cache of the base run.
+
+Scenario file, one closure per line:
+
+    # scenario, target, startTime, endTime, percentage
+    roadworks, C516684370251668474900, 0, 3600, 100
+    roadworks, 5166843702-5166847490, 600, 1800, 50
+
+A target is a cell name or an edge given as `u-v` osmids, which blocks all its cells.
+A full closure removes the edge from the routing network but is written to the
+blockage file as MAX_BLOCKAGE_PERCENTAGE, which the simulator can lift again.
+"""
+
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+from collections import OrderedDict
+
+from stage_cache import StageCache
+from graph_update import routeTouches, _orientations
+
+#Blockage percentage from which an edge is removed from the routing network
+FULL_CLOSURE = 100.0
+
+#Highest percentage written to a blockage file: the simulator divides the cell area by
+#100 - percentage when a blockage ends, so a 100% row would leave the cell area NaN
+MAX_BLOCKAGE_PERCENTAGE = 99.9
+
+
+class Closure(object):
+    """
+    Blockage of a cell or of all the cells of an edge during [startTime, endTime].
+    """
+    def __init__(self, target, start_time, end_time, percentage):
+        self.target = target
+        self.startTime = int(start_time)
+        self.endTime = int(end_time)
+        self.percentage = float(percentage)
+        if not 0 <= self.percentage <= 100:
+            raise ValueError("Blockage percentage of {} must be between 0 and 100".format(target))
+
+    def overlaps(self, window):
+        """ Whether the closure is active during a (start, end) window, any non-empty closure when None."""
+        if self.endTime <= self.startTime:
+            return False
+        return window is None or (self.startTime < window[1] and window[0] < self.endTime)
+
+    def toDict(self):
+        return {'target': self.target, 'startTime': self.startTime, 'endTime': self.endTime,
+                'percentage': self.percentage}
+
+
+def readScenarios(file_path):
+    """ Reads a scenario file, see the module documentation for its format.
+
+        Returns
+        -------
+        scenarios : OrderedDict
+            lists of Closure instances by scenario name, in the order of the file.
+    """
+    scenarios = OrderedDict()
+    with open(file_path, encoding="utf8") as scenarioFile:
+        for row in csv.reader(scenarioFile, delimiter=','):
+            row = [value.strip() for value in row]
+            if len(row) == 0 or row[0] == '' or row[0].startswith('#'):
+                continue
+            if len(row) < 5:
+                raise ValueError("Closure of scenario '{}' needs target, startTime, endTime and percentage".format(row[0]))
+            scenarios.setdefault(row[0], []).append(Closure(row[1], row[2], row[3], row[4]))
+    return scenarios
+
+
+def cellEdgeIndex(cached_cells):
+    """ Maps the cells of a cells artifact to their edge and back.
+
+        Returns
+        -------
+        cell_edges : dictionary
+            the node pair (frozenset) of the edge of every cell name.
+        edge_cells : dictionary
+            the cell names of every node pair.
+    """
+    names = cached_cells['cells']['cellName']
+    cell_edges = {}
+    edge_cells = {}
+    start = 0
+    for u, v, count in cached_cells['edgeCells']:
+        pair = frozenset((u, v))
+        for name in names[start:start + count]:
+            cell_edges[name] = pair
+            edge_cells.setdefault(pair, []).append(name)
+        start += count
+    return cell_edges, edge_cells
+
+
+def resolveTarget(target, cell_edges, edge_cells):
+    """ The cell names blocked by a closure target, a cell name or a `u-v` edge."""
+    if target in cell_edges:
+        return [target]
+    nodes = target.split('-')
+    if len(nodes) == 2 and nodes[0].isdigit() and nodes[1].isdigit():
+        pair = frozenset((int(nodes[0]), int(nodes[1])))
+        if pair in edge_cells:
+            return edge_cells[pair]
+    raise ValueError("Closure target '{}' is neither a cell nor an edge of the network".format(target))
+
+
+def scenarioBlockages(closures, cell_edges, edge_cells):
+    """ Blockage rows of the cells closed by a scenario.
+
+        The simulator keeps one blockage per cell, so the closures of a cell are merged
+        into the highest percentage over the window spanning all of them, capped at
+        MAX_BLOCKAGE_PERCENTAGE.
+
+        Returns
+        -------
+        blockages : dictionary
+            (startTime, endTime, percentage) by cell name.
+    """
+    blockages = {}
+    for closure in closures:
+        for name in resolveTarget(closure.target, cell_edges, edge_cells):
+            if name in blockages:
+                start, end, percentage = blockages[name]
+                blockages[name] = (min(start, closure.startTime), max(end, closure.endTime),
+                                   max(percentage, closure.percentage))
+            else:
+                blockages[name] = (closure.startTime, closure.endTime, closure.percentage)
+    blockages = dict((name, (start, end, min(percentage, MAX_BLOCKAGE_PERCENTAGE)))
+                     for name, (start, end, percentage) in blockages.items())
+    return dict((name, (start, end, int(percentage) if percentage == int(percentage) else percentage))
+                for name, (start, end, percentage) in blockages.items())
+
+
+def edgeBlockages(closures, cell_edges, edge_cells, window=None):
+    """ Highest blocked percentage of every edge with a closure active during `window`."""
+    blocked = {}
+    for closure in closures:
+        if not closure.overlaps(window) or closure.percentage <= 0:
+            continue
+        for name in resolveTarget(closure.target, cell_edges, edge_cells):
+            pair = cell_edges[name]
+            blocked[pair] = max(blocked.get(pair, 0.0), closure.percentage)
+    return blocked
+
+
+def scenarioGraph(g, blocked):
+    """ A copy of `g` without the fully blocked edges and with the partially blocked ones lengthened.
+
+        Walking an edge whose area is reduced by p percent is taken to cost as much
+        as walking 1 / (1 - p / 100) times its length.
+    """
+    g_scenario = g.copy()
+    for pair, percentage in blocked.items():
+        for u, v in _orientations(pair):
+            if not g_scenario.has_edge(u, v):
+                continue
+            if percentage >= FULL_CLOSURE:
+                while g_scenario.has_edge(u, v):
+                    g_scenario.remove_edge(u, v)
+            else:
+                for data in g_scenario[u][v].values():
+                    data['length'] = data['length'] * 100.0 / (100.0 - percentage)
+    return g_scenario
+
+
+def routeLength(g, node_list):
+    """ Walking distance of a route on the unblocked network, measured as YenKShortestPaths does."""
+    return sum(g[u][v][0]['length'] for u, v in zip(node_list[:-1], node_list[1:]))
+
+
+def incompleteFilteredRoutes(ctx, routes_dict):
+    """ Whether overlap filtering left an OD pair with fewer than MAX_ROUTES routes.
+
+        A closure of a rejected candidate can then let another candidate in, so such
+        pairs are routed again even when their routes avoid the closures.
+    """
+    return ctx.MAX_ROUTE_OVERLAP is not None and len(routes_dict['nodeList']) < ctx.MAX_ROUTES
+
+
+def scenarioRoutesKey(ctx, cache, cells_key, blocked):
+    """ Cache key of the routes of a scenario, which only depend on the blocked percentages."""
+    import mapGeoToCells as gen
+    closed = sorted([sorted(str(node) for node in pair), percentage] for pair, percentage in blocked.items())
+    return cache.key('scenario routes', cells_key, ctx.MAX_ROUTES, gen.routeMethodKey(ctx), closed)
+
+
+def runScenario(name, closures, base, output_dir, window=None):
+    """ Writes the route, demand, link and blockage files of one scenario.
+
+        Parameters
+        ----------
+        name : string
+            the scenario name, also the name of its output sub-directory.
+        closures : list
+            the Closure instances of the scenario.
+        base : dictionary
+            the cached run, as loaded by runScenarios.
+        output_dir : string
+            the directory receiving the sub-directory of the scenario.
+        window : tuple
+            (optional) (start, end) time window, only the closures active during it
+            change the routes. All the closures are written to the blockage file.
+
+        Returns
+        -------
+        summary : dictionary
+            the output paths and the counters of the scenario.
+    """
+    import mapGeoToCells as gen
+    from ModifiedDijkstra import SearchStats
+    cache = base['cache']
+    ctx = base['context']
+    start = time.perf_counter()
+    blockages = scenarioBlockages(closures, base['cellEdges'], base['edgeCells'])
+    blocked = edgeBlockages(closures, base['cellEdges'], base['edgeCells'], window)
+
+    routes_key = scenarioRoutesKey(ctx, cache, base['cellsKey'], blocked)
+    scenario_routes = cache.load('scenario routes', routes_key)
+    rerouted = 0
+    stats = SearchStats()
+    if scenario_routes is None:
+        scenario_routes = {}
+        g_scenario = scenarioGraph(base['graph'], blocked)
+        for serial_num, od_pair in enumerate(base['odPairs']):
+            cached = base['routes'].get(od_pair)
+            if cached is not None and not any(routeTouches(node_list, blocked) for node_list in cached['nodeList']) \
+                    and not incompleteFilteredRoutes(ctx, cached):
+                continue
+            routes_dict = gen.getRouteData(ctx, od_pair[0], od_pair[1], serial_num, stats, graph=g_scenario)
+            #the routes are ranked by their lengthened cost but the simulator gets their walking distance
+            routes_dict['distance'] = [routeLength(base['graph'], node_list) for node_list in routes_dict['nodeList']]
+            scenario_routes[od_pair] = routes_dict
+            rerouted += 1
+        cache.store('scenario routes', routes_key, scenario_routes)
+
+    ctx.resetRouteData()
+    od_routes = {}
+    route_node_lists = []
+    for serial_num, od_pair in enumerate(base['odPairs']):
+        routes_dict = scenario_routes.get(od_pair, base['routes'].get(od_pair))
+        routes_dict = gen.nameRoutes(ctx, dict(routes_dict), serial_num)
+        gen.mergeRouteDataDict(ctx.routes_data_dict, routes_dict)
+        od_routes[od_pair] = routes_dict['routeName']
+        route_node_lists.extend(routes_dict['nodeList'])
+
+    links = base['links']
+    new_links = 0
+    for route_nodes in route_node_lists:
+        route_key = tuple(route_nodes)
+        if route_key in links:
+            gen.addLinkRows(ctx, links[route_key])
+        else:
+            links[route_key] = gen.createRouteLinkRows(ctx, route_nodes)
+            new_links += 1
+    base['newLinks'] += new_links
+    gen.createDemandData(ctx, base['demandGroups'], od_routes)
+
+    scenario_dir = os.path.join(output_dir, name)
+    ctx.setOutputDirectory(scenario_dir)
+    gen.writeRouteFiles(ctx)
+    gen.writeBlockageFile(ctx, blockages)
+    return {'outputs': {'blockage': os.path.join(scenario_dir, ctx.BLOCKAGE_FILE_NAME + gen.FILE_FORMAT),
+                        'demand': os.path.join(scenario_dir, ctx.DEMAND_FILE_NAME + gen.FILE_FORMAT),
+                        'route': os.path.join(scenario_dir, ctx.ROUTE_FILE_NAME + gen.FILE_FORMAT),
+                        'links': os.path.join(scenario_dir, ctx.LINKS_FILE_NAME + gen.FILE_FORMAT)},
+            'closures': [closure.toDict() for closure in closures],
+            'blockedCells': len(blockages),
+            'closedEdges': sum(1 for percentage in blocked.values() if percentage >= FULL_CLOSURE),
+            'slowedEdges': sum(1 for percentage in blocked.values() if percentage < FULL_CLOSURE),
+            'reroutedODPairs': rerouted,
+            'unroutedODPairs': sum(1 for names in od_routes.values() if not names),
+            'newRouteLinks': new_links,
+            'searches': stats.toDict(),
+            'wallTime': time.perf_counter() - start}
+
+
+def runScenarios(scenarios, cache_dir, output_dir=None, window=None, log=None):
+    """ Writes the files of every closure scenario of a cached run.
+
+        Parameters
+        ----------
+        scenarios : dictionary
+            lists of Closure instances by scenario name, as read by readScenarios.
+        cache_dir : string
+            the stage cache the base run was generated with.
+        output_dir : string
+            (optional) the output directory of the base run, by default the one set at
+            the top of mapGeoToCells. The scenarios are written to its sub-directories.
+        window : tuple
+            (optional) (start, end) time window of the closures that change the routes.
+
+        Returns
+        -------
+        summaries : OrderedDict
+            the summary of every scenario, as returned by runScenario.
+    """
+    import mapGeoToCells as gen
+    cache = StageCache(cache_dir)
+    ctx = gen.GenerationContext()
+    if output_dir is not None:
+        ctx.setOutputDirectory(output_dir)
+    output_dir = ctx.FILE_CREATION_PATH_CELLS
+    state, graph, cached_cells = gen.loadCachedRun(ctx, cache)
+    ctx.setNetwork(graph)
+    ctx.setCells(cached_cells['cells'])
+    cells_key = gen.cellsCacheKey(cache, state['graphKey'])
+    links_key = gen.linksCacheKey(cache, cells_key)
+    cell_edges, edge_cells = cellEdgeIndex(cached_cells)
+    base = {'cache': cache, 'context': ctx, 'graph': graph, 'cellsKey': cells_key, 'cellEdges': cell_edges,
+            'edgeCells': edge_cells, 'odPairs': state['odPairs'], 'demandGroups': state['demandGroups'],
+            'routes': cache.load('routes', gen.routesCacheKey(ctx, cache, cells_key), {}),
+            'links': cache.load('links', links_key, {}), 'newLinks': 0}
+
+    summaries = OrderedDict()
+    for name, closures in scenarios.items():
+        summaries[name] = runScenario(name, closures, base, output_dir, window)
+        if log is not None:
+            summary = summaries[name]
+            log("Scenario {}: {} blocked cells, {} closed and {} slowed edges, {} of {} OD pairs rerouted in {:.1f}s".format(
+                name, summary['blockedCells'], summary['closedEdges'], summary['slowedEdges'],
+                summary['reroutedODPairs'], len(state['odPairs']), summary['wallTime']))
+    if base['newLinks']:
+        cache.store('links', links_key, base['links'])
+    return summaries
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Write the route and blockage files of closure scenarios "
+                                                 "of a cached run.")
+    parser.add_argument('scenarios', help="scenario file: scenario, target, startTime, endTime, percentage")
+    parser.add_argument('--cache-dir', required=True, help="stage cache of the base run")
+    parser.add_argument('--output-dir', default=None, help="output directory of the base run")
+    parser.add_argument('--routing-window', nargs=2, type=int, metavar=('START', 'END'), default=None,
+                        help="only the closures active during this window change the routes")
+    parser.add_argument('--report', default=None, help="JSON file receiving the summary of every scenario")
+    args = parser.parse_args(argv)
+
+    log = lambda message: print(message, file=sys.stderr, flush=True)
+    summaries = runScenarios(readScenarios(args.scenarios), args.cache_dir, args.output_dir,
+                             args.routing_window, log)
+    if args.report is not None:
+        with open(args.report, 'w', encoding="utf8") as reportFile:
+            json.dump(summaries, reportFile, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,176 @@
+"""
+module: demand_bins
+-------------------------
+
+Compaction of the OD demand before it is written to the demand file. Every row of the
+demand file becomes one group in the simulator (Input.loadAggDemand), so fine grained
+OD data directly inflates the simulation cost. The functions in this module aggregate
+the OD records of each snapped origin/destination pair into departure-time bins and
+report how far the binning moved the departure-time distribution, which lets the user
+trade accuracy against speed through the width of the bins.
+"""
+
+import numpy as np
+import pandas as pd
+
+#Position of the aggregated departure time inside its bin
+BIN_ANCHORS = ('start', 'centre', 'mean')
+
+
+def binDepartureTimes(dep_time, bin_size, origin=0):
+    """ Computes the bin index of each departure time.
+
+        Parameters
+        ----------
+        dep_time : array_like
+            departure times in seconds.
+        bin_size : integer
+            width of a departure-time bin in seconds. Values smaller than one
+            keep every distinct departure time in its own bin.
+        origin : integer
+            (optional) start of the first bin in seconds.
+
+        Returns
+        -------
+        bins : numpy.ndarray
+            the integer bin index of every departure time.
+    """
+    bin_size = max(int(bin_size), 1)
+    dep_time = np.asarray(dep_time, dtype=np.int64)
+    return (dep_time - origin) // bin_size
+
+
+def aggregateDemand(od_data, bin_size, anchor='start'):
+    """ Aggregates the OD records of every OD pair into departure-time bins.
+
+        Parameters
+        ----------
+        od_data : pandas.DataFrame
+            one row per OD record with the columns origNode, destNode, depTime
+            (seconds) and numPpl.
+        bin_size : integer
+            width of a departure-time bin in seconds. A bin size smaller than one
+            only merges records with identical departure times.
+        anchor : string
+            (optional) departure time given to an aggregated group, either the
+            'start' or the 'centre' of its bin or the 'mean' departure time of the
+            people it contains.
+
+        Returns
+        -------
+        groups : pandas.DataFrame
+            one row per (origNode, destNode, bin) with the columns origNode, destNode,
+            depTime and numPpl, sorted by departure time.
+        report : dictionary
+            statistics on the size reduction and on the shift of the departure-time
+            distribution, see `binShiftReport`.
+    """
+    if anchor not in BIN_ANCHORS:
+        raise ValueError("Unknown bin anchor '{}', expected one of {}".format(anchor, BIN_ANCHORS))
+    bin_size = max(int(bin_size), 1)
+    records = od_data[['origNode', 'destNode', 'depTime', 'numPpl']].copy()
+    records['depTime'] = records['depTime'].astype(np.int64)
+    records['numPpl'] = records['numPpl'].astype(np.float64)
+    origin = int(records['depTime'].min()) if len(records) else 0
+    records['bin'] = binDepartureTimes(records['depTime'].values, bin_size, origin)
+    records['weightedTime'] = records['depTime'] * records['numPpl']
+
+    grouped = records.groupby(['origNode', 'destNode', 'bin'], sort=False)
+    groups = grouped.agg(numPpl=('numPpl', 'sum'), weightedTime=('weightedTime', 'sum'),
+                         minTime=('depTime', 'min')).reset_index()
+    if anchor == 'start':
+        groups['depTime'] = origin + groups['bin'] * bin_size
+    elif anchor == 'centre':
+        groups['depTime'] = origin + groups['bin'] * bin_size + bin_size // 2
+    else:
+        #groups without people keep their earliest departure time
+        mean_time = groups['weightedTime'] / groups['numPpl'].where(groups['numPpl'] > 0)
+        groups['depTime'] = mean_time.fillna(groups['minTime']).round()
+    groups['depTime'] = groups['depTime'].astype(np.int64)
+
+    #departure time assigned to every original record, used to measure the shift
+    binned_time = records[['origNode', 'destNode', 'bin']].merge(
+        groups[['origNode', 'destNode', 'bin', 'depTime']], how='left',
+        on=['origNode', 'destNode', 'bin'])['depTime'].values
+    report = binShiftReport(records['depTime'].values, binned_time, records['numPpl'].values)
+    report['binSize'] = bin_size
+    report['anchor'] = anchor
+    report['numRecords'] = len(records)
+    report['numGroups'] = len(groups)
+    report['compressionRatio'] = len(records) / len(groups) if len(groups) else 1.0
+
+    groups = groups.sort_values(['depTime', 'origNode', 'destNode'], kind='mergesort')
+    groups = groups[['origNode', 'destNode', 'depTime', 'numPpl']].reset_index(drop=True)
+    return groups, report
+
+
+def binShiftReport(dep_time, binned_time, num_ppl):
+    """ Measures how much the binning moved the departure times of the people.
+
+        Parameters
+        ----------
+        dep_time : array_like
+            original departure time of every OD record.
+        binned_time : array_like
+            departure time of the group every OD record was aggregated into.
+        num_ppl : array_like
+            number of people of every OD record, used as weights.
+
+        Returns
+        -------
+        report : dictionary
+            the people weighted mean absolute shift, the mean signed shift (bias), the
+            largest absolute shift and the Wasserstein-1 distance between the original
+            and the binned departure-time distributions, all in seconds.
+    """
+    dep_time = np.asarray(dep_time, dtype=np.float64)
+    binned_time = np.asarray(binned_time, dtype=np.float64)
+    weights = np.asarray(num_ppl, dtype=np.float64)
+    total = weights.sum()
+    if len(dep_time) == 0 or total <= 0:
+        return {'meanAbsShift': 0.0, 'meanShift': 0.0, 'maxAbsShift': 0.0, 'wasserstein': 0.0}
+    shift = binned_time - dep_time
+    return {'meanAbsShift': float(np.dot(np.abs(shift), weights) / total),
+            'meanShift': float(np.dot(shift, weights) / total),
+            'maxAbsShift': float(np.abs(shift).max()),
+            'wasserstein': _wassersteinDistance(dep_time, binned_time, weights)}
+
+
+def binSizeForGroupCap(od_data, max_groups, bin_sizes=(60, 120, 300, 600, 900, 1800, 3600)):
+    """ Finds the smallest bin size whose aggregation does not exceed a number of groups.
+
+        Parameters
+        ----------
+        od_data : pandas.DataFrame
+            OD records as accepted by `aggregateDemand`.
+        max_groups : integer
+            largest acceptable number of demand groups.
+        bin_sizes : tuple
+            (optional) candidate bin sizes in seconds, in increasing order.
+
+        Returns
+        -------
+        bin_size : integer
+            the first candidate meeting the cap, or the largest candidate when none does.
+    """
+    pairs = od_data[['origNode', 'destNode']]
+    for bin_size in bin_sizes:
+        bins = binDepartureTimes(od_data['depTime'].values, bin_size, int(od_data['depTime'].min()))
+        num_groups = len(pd.DataFrame({'o': pairs['origNode'].values, 'd': pairs['destNode'].values,
+                                       'b': bins}).drop_duplicates())
+        if num_groups <= max_groups:
+            return bin_size
+    return bin_sizes[-1]
+
+
+def _wassersteinDistance(values_a, values_b, weights):
+    """
+    Wasserstein-1 distance between two weighted empirical distributions that share
+    their weights, i.e. the area between their cumulative distribution functions.
+    """
+    values = np.concatenate((values_a, values_b))
+    signed = np.concatenate((weights, -weights)) / weights.sum()
+    order = np.argsort(values, kind='mergesort')
+    values = values[order]
+    cdf_diff = np.cumsum(signed[order])
+    return float(np.sum(np.abs(cdf_diff[:-1]) * np.diff(values)))
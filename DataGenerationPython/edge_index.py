@@ -0,0 +1,359 @@
+"""
+module: edge_index
+-------------------------
+
+Index joining the cells and zones of a generated network back to the OpenStreetMap
+edges they were cut from, so that results keyed by cell (densities, occupancies,
+blockages...) can be reported per street segment without parsing the names. The
+cells of an edge are consecutive rows of the cell file (createCells walks the edges
+one after the other), so the index only stores, for every edge (u, v, key), its first
+cell and number of cells, its first zone and number of zones and its bearing. The
+reverse lookups (edge of every cell or zone) are rebuilt from these ranges.
+
+The cells of an edge go from node u to node v, the cells 2j and 2j + 1 being the two
+halves of the j-th cross-section, and every NUM_CELLS_PER_ZONE cells form a zone (the
+generator gives its value, which the index file keeps in every row). The
+bearing is the compass bearing of the edge from u to v, in degrees clockwise from the
+north, an edge looked up as (v, u) being the same edge walked the other way.
+
+mapGeoToCells.generate writes the index next to the cell file (new_edge_index.txt):
+
+    u,v,key,firstCell,cellCount,firstZone,zoneCount,bearing,cellsPerZone
+    5166840518,5166841063,0,0,4,0,1,330.7,4
+
+e.g. `python edge_index.py new_edge_index.txt --values densities.csv --output edge_densities.csv`.
+"""
+
+import argparse
+import csv
+import sys
+from math import atan2, cos, degrees, radians
+
+import numpy as np
+
+#Decimals of the bearings written
+BEARING_DECIMALS = 1
+
+#Reductions of the cell values of an edge or zone
+REDUCTIONS = {'sum': np.add, 'mean': np.add, 'max': np.maximum, 'min': np.minimum}
+
+#Columns of the index file
+COLUMNS = ('u', 'v', 'key', 'firstCell', 'cellCount', 'firstZone', 'zoneCount', 'bearing', 'cellsPerZone')
+
+
+def edgeBearing(x1, y1, x2, y2):
+    """ Compass bearing in degrees from (x1, y1) to (x2, y2), x being the longitude and
+        y the latitude, on the local flat approximation of the earth.
+    """
+    if x1 == x2 and y1 == y2:
+        return 0.0
+    return degrees(atan2((x2 - x1) * cos(radians((y1 + y2) / 2)), y2 - y1)) % 360
+
+
+def edgeKeys(edge_cells, graph):
+    """ Key of every edge of an edgeCells list in the graph, the parallel edges of a node
+        pair taking its keys in order.
+    """
+    keys = []
+    seen = {}
+    for u, v, _ in edge_cells:
+        pair = frozenset((u, v))
+        serial = seen.get(pair, 0)
+        seen[pair] = serial + 1
+        pairKeys = set()
+        if graph.is_multigraph():
+            for a, b in ((u, v), (v, u)):
+                if graph.has_edge(a, b):
+                    pairKeys.update(graph[a][b])
+        pairKeys = sorted(pairKeys)
+        keys.append(pairKeys[serial] if serial < len(pairKeys) else serial)
+    return keys
+
+
+def reduceRanges(values, starts, counts, reduce='mean', axis=-1):
+    """ Reduces consecutive ranges of values along an axis, in one pass.
+
+        Parameters
+        ----------
+        values : numpy array
+            the values, the ranges covering the whole axis in order.
+        starts : numpy array
+            first position of every range.
+        counts : numpy array
+            length of every range.
+        reduce : string
+            (optional) 'sum', 'mean', 'max' or 'min'.
+        axis : integer
+            (optional) axis of the values the ranges are taken along.
+
+        Returns
+        -------
+        reduced : numpy array
+            the values with the axis replaced by the ranges, NaN for the empty ranges
+            (0 for a sum).
+    """
+    if reduce not in REDUCTIONS:
+        raise ValueError("Unknown reduction {}, expected one of {}".format(reduce, sorted(REDUCTIONS)))
+    values = np.moveaxis(np.asarray(values), axis, -1)
+    if values.shape[-1] != counts.sum():
+        raise ValueError("Expected {} values along the axis, got {}".format(counts.sum(), values.shape[-1]))
+    reduced = np.full(values.shape[:-1] + (len(counts),), 0.0 if reduce == 'sum' else np.nan)
+    filled = counts > 0
+    if filled.any():
+        # the filled ranges tile the axis, so reduceat stops every range at the start of the next
+        result = REDUCTIONS[reduce].reduceat(values, starts[filled], axis=-1)
+        reduced[..., filled] = result / counts[filled] if reduce == 'mean' else result
+    return np.moveaxis(reduced, -1, axis)
+
+
+class EdgeIndex(object):
+    """
+    Cell and zone ranges of the edges of a generated network, in the order of the
+    cell file.
+    """
+    def __init__(self, u, v, key, cell_counts, cells_per_zone, bearing=None):
+        """
+        Constructor
+
+                @param u               OSM id of the first node of every edge.
+                @param v               OSM id of the second node of every edge, the
+                                       cells going from u to v.
+                @param key             Key of every edge between its nodes.
+                @param cell_counts     Number of cells of every edge.
+                @param cells_per_zone  Cells of a zone, NUM_CELLS_PER_ZONE of the generator.
+                @param bearing         Compass bearing of every edge from u to v.
+        """
+        self.u = np.asarray(u, dtype=np.int64)
+        self.v = np.asarray(v, dtype=np.int64)
+        self.key = np.asarray(key, dtype=np.int64)
+        self.cellCount = np.asarray(cell_counts, dtype=np.int64)
+        self.cellsPerZone = int(cells_per_zone)
+        self.bearing = np.zeros(len(self.u)) if bearing is None else np.asarray(bearing, dtype=float)
+        self.firstCell = np.cumsum(self.cellCount) - self.cellCount
+        self.zoneCount = -(-self.cellCount // self.cellsPerZone)
+        self.firstZone = np.cumsum(self.zoneCount) - self.zoneCount
+        self.numCells = int(self.cellCount.sum())
+        self.numZones = int(self.zoneCount.sum())
+        # the reverse lookups, edge of every cell and zone and the cells of every zone
+        self.cellEdges = np.repeat(np.arange(len(self.u)), self.cellCount)
+        self.zoneEdges = np.repeat(np.arange(len(self.u)), self.zoneCount)
+        zoneSerial = np.arange(self.numZones) - np.repeat(self.firstZone, self.zoneCount)
+        self.zoneFirstCell = np.repeat(self.firstCell, self.zoneCount) + zoneSerial * self.cellsPerZone
+        self.zoneCellCount = np.minimum(np.repeat(self.firstCell + self.cellCount, self.zoneCount)
+                                        - self.zoneFirstCell, self.cellsPerZone)
+        self._lookup = None
+        self._names = None
+
+    @classmethod
+    def fromEdgeCells(cls, edge_cells, graph, cells_per_zone):
+        """ Index of the edgeCells list of createCells ((u, v, cell count) in the order
+            of the cells) of a network, the bearings and keys being taken from the graph
+            and the zone size from the generator (NUM_CELLS_PER_ZONE).
+        """
+        nodes = graph.nodes
+        bearing = [edgeBearing(nodes[u]['x'], nodes[u]['y'], nodes[v]['x'], nodes[v]['y'])
+                   for u, v, _ in edge_cells]
+        return cls([u for u, _, _ in edge_cells], [v for _, v, _ in edge_cells], edgeKeys(edge_cells, graph),
+                   [count for _, _, count in edge_cells], cells_per_zone, bearing)
+
+    @classmethod
+    def fromFile(cls, index_path):
+        """ Reads an index file written by toFile. The zone size of a file written
+            without the cellsPerZone column is the smallest one its zone counts allow.
+        """
+        with open(index_path, encoding="utf8") as indexFile:
+            columns = [column.strip() for column in indexFile.readline().split(',')]
+        table = np.loadtxt(index_path, delimiter=',', skiprows=1, ndmin=1,
+                           dtype=np.dtype([(name, float if name == 'bearing' else np.int64) for name in columns]))
+        if 'cellsPerZone' in columns:
+            cellsPerZone = int(table['cellsPerZone'][0]) if len(table) else 1
+        else:
+            zoned = table['zoneCount'] > 0
+            cellsPerZone = int((-(-table['cellCount'][zoned] // table['zoneCount'][zoned])).max(initial=1))
+        index = cls(table['u'], table['v'], table['key'], table['cellCount'], cellsPerZone, table['bearing'])
+        if not np.array_equal(index.zoneCount, table['zoneCount']):
+            raise ValueError("The zone counts of {} do not match {} cells per zone".format(index_path, cellsPerZone))
+        return index
+
+    def __len__(self):
+        return len(self.u)
+
+    def toFile(self, index_path):
+        """ Writes the index, one line per edge. Returns the number of edges."""
+        with open(index_path, 'w', encoding="utf8", newline='') as indexFile:
+            writer = csv.writer(indexFile)
+            writer.writerow(COLUMNS)
+            for row in zip(self.u.tolist(), self.v.tolist(), self.key.tolist(), self.firstCell.tolist(),
+                           self.cellCount.tolist(), self.firstZone.tolist(), self.zoneCount.tolist(),
+                           np.round(self.bearing, BEARING_DECIMALS).tolist()):
+                writer.writerow(row + (self.cellsPerZone,))
+        return len(self)
+
+    def lookup(self, u, v, key=0):
+        """ Edges of node pairs, in either direction.
+
+            Parameters
+            ----------
+            u, v : array_like
+                OSM ids of the nodes of the edges, e.g. the u and v columns of the edges
+                of the osmnx graph.
+            key : array_like
+                (optional) key of the edges between their nodes.
+
+            Returns
+            -------
+            edges : numpy array
+                the edge of every pair, -1 for the pairs not in the index.
+            directions : numpy array
+                1 if the cells of the edge go from u to v, -1 if they go from v to u.
+        """
+        u, v, key = np.broadcast_arrays(np.asarray(u, dtype=np.int64), np.asarray(v, dtype=np.int64),
+                                        np.asarray(key, dtype=np.int64))
+        if len(self) == 0:
+            return np.full(u.shape, -1), np.zeros(u.shape, dtype=int)
+        if self._lookup is None:
+            nodes = np.unique(np.concatenate([self.u, self.v]))
+            a, b = np.searchsorted(nodes, self.u), np.searchsorted(nodes, self.v)
+            packed = np.concatenate([self._pack(a, b, self.key, len(nodes)), self._pack(b, a, self.key, len(nodes))])
+            order = np.argsort(packed, kind='stable')
+            edges = np.tile(np.arange(len(self)), 2)[order]
+            directions = np.repeat([1, -1], len(self))[order]
+            self._lookup = (nodes, packed[order], edges, directions)
+        nodes, packed, edges, directions = self._lookup
+        a = np.minimum(np.searchsorted(nodes, u), len(nodes) - 1)
+        b = np.minimum(np.searchsorted(nodes, v), len(nodes) - 1)
+        query = self._pack(a, b, key, len(nodes))
+        position = np.minimum(np.searchsorted(packed, query), len(packed) - 1)
+        found = (nodes[a] == u) & (nodes[b] == v) & (key >= 0) & (packed[position] == query)
+        return np.where(found, edges[position], -1), np.where(found, directions[position], 0)
+
+    @staticmethod
+    def _pack(a, b, key, num_nodes):
+        return (a.astype(np.int64) * num_nodes + b) * (1 << 16) + np.minimum(key, (1 << 16) - 1)
+
+    def edgeCells(self, u, v, key=0):
+        """ Cells of an edge in the order of the walk from u to v."""
+        edges, directions = self.lookup(u, v, key)
+        if edges[()] < 0:
+            raise KeyError("No edge ({}, {}, {}) in the index".format(u, v, key))
+        cells = np.arange(self.firstCell[edges[()]], self.firstCell[edges[()]] + self.cellCount[edges[()]])
+        # a walk from v to u meets the cross-sections the other way round, the sides swapped
+        return cells if directions[()] > 0 else cells[::-1]
+
+    def cellNames(self):
+        """ Names of all the cells (C<u><v><serial>), rebuilt from the edges."""
+        return self._cellNames()[0]
+
+    def zoneNames(self):
+        """ Names of all the zones (Z<u><v><serial>), rebuilt from the edges."""
+        return self._cellNames()[1]
+
+    def _cellNames(self):
+        if self._names is None:
+            pairs = np.char.add(self.u.astype(str), self.v.astype(str))
+            cellSerial = np.arange(self.numCells) - np.repeat(self.firstCell, self.cellCount)
+            zoneSerial = np.arange(self.numZones) - np.repeat(self.firstZone, self.zoneCount)
+            self._names = (np.char.add(np.char.add('C', pairs[self.cellEdges]), cellSerial.astype(str)),
+                           np.char.add(np.char.add('Z', pairs[self.zoneEdges]), zoneSerial.astype(str)))
+        return self._names
+
+    def cellIds(self, names):
+        """ Position of cells in the cell file from their names, -1 for unknown names.
+            Parallel edges share their cell names, which go to the first edge.
+        """
+        names = np.asarray(names, dtype=str)
+        if self.numCells == 0:
+            return np.full(names.shape, -1)
+        allNames = self.cellNames()
+        order = np.argsort(allNames, kind='stable')
+        position = np.minimum(np.searchsorted(allNames[order], names), len(order) - 1)
+        found = allNames[order][position] == names
+        return np.where(found, order[position], -1)
+
+    def cellArray(self, values_by_name, fill=0.0):
+        """ Array of cell values (cells along the last axis) from values by cell name, e.g.
+            the densities of SystemState.cellDensities. Missing cells get `fill`.
+        """
+        names = list(values_by_name)
+        cells = self.cellIds(names)
+        values = [np.asarray(values_by_name[name], dtype=float) for name in names]
+        shape = values[0].shape if values else ()
+        array = np.full(shape + (self.numCells,), fill, dtype=float)
+        known = cells >= 0
+        if known.any():
+            array[..., cells[known]] = np.stack([value for value, ok in zip(values, known) if ok], axis=-1)
+        return array
+
+    def toEdges(self, values, reduce='mean', axis=-1):
+        """ Reduces per-cell values (the cells along `axis`, in the order of the cell file)
+            to per-edge values, see reduceRanges.
+        """
+        return reduceRanges(values, self.firstCell, self.cellCount, reduce, axis)
+
+    def toZones(self, values, reduce='mean', axis=-1):
+        """ Reduces per-cell values to per-zone values, see toEdges."""
+        return reduceRanges(values, self.zoneFirstCell, self.zoneCellCount, reduce, axis)
+
+    def zonesToEdges(self, values, reduce='mean', axis=-1):
+        """ Reduces per-zone values (in the order of their first cell) to per-edge values."""
+        return reduceRanges(values, self.firstZone, self.zoneCount, reduce, axis)
+
+
+def loadCachedIndex(cache_dir, output_dir=None):
+    """ Index of the cells of a cached run, e.g. one generated before the index was written."""
+    import mapGeoToCells as gen
+    from stage_cache import StageCache
+    ctx = gen.GenerationContext()
+    if output_dir is not None:
+        ctx.setOutputDirectory(output_dir)
+    _, graph, cached_cells = gen.loadCachedRun(ctx, StageCache(cache_dir))
+    return EdgeIndex.fromEdgeCells(cached_cells['edgeCells'], graph, gen.NUM_CELLS_PER_ZONE)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Join cell results to the OpenStreetMap edges of a generated network.")
+    parser.add_argument('index', help="edge index file of the generator (new_edge_index.txt)")
+    parser.add_argument('--cache-dir', default=None,
+                        help="write the index of the run cached in this stage cache instead of reading it")
+    parser.add_argument('--run-output-dir', default=None, help="output directory of the cached run")
+    parser.add_argument('--values', default=None,
+                        help="comma separated file of a cellName column and value columns (one header line)")
+    parser.add_argument('--reduce', choices=sorted(REDUCTIONS), default='mean', help="reduction of the cells of an edge")
+    parser.add_argument('--output', default=None, help="file receiving the values of every edge, stdout by default")
+    args = parser.parse_args(argv)
+
+    if args.cache_dir is not None:
+        index = loadCachedIndex(args.cache_dir, args.run_output_dir)
+        index.toFile(args.index)
+        print("{} edges and {} cells indexed in {}".format(len(index), index.numCells, args.index), file=sys.stderr)
+    else:
+        index = EdgeIndex.fromFile(args.index)
+    if args.values is None:
+        return 0
+
+    with open(args.values, encoding="utf8") as valueFile:
+        header = [column.strip() for column in next(csv.reader(valueFile))]
+    rows = np.loadtxt(args.values, delimiter=',', skiprows=1, ndmin=2, dtype=str)
+    cells = index.cellIds(np.char.strip(rows[:, 0]))
+    if (cells < 0).any():
+        print("{} row(s) of unknown cells ignored".format(int((cells < 0).sum())), file=sys.stderr)
+    # the cells missing from the file count as 0
+    values = np.zeros((len(header) - 1, index.numCells))
+    values[:, cells[cells >= 0]] = rows[cells >= 0, 1:].astype(float).T
+    edges = index.toEdges(values, args.reduce)
+    output = open(args.output, 'w', encoding="utf8", newline='') if args.output else sys.stdout
+    try:
+        writer = csv.writer(output)
+        writer.writerow(['u', 'v', 'key', 'bearing'] + header[1:])
+        for edge in range(len(index)):
+            writer.writerow([int(index.u[edge]), int(index.v[edge]), int(index.key[edge]),
+                             round(float(index.bearing[edge]), BEARING_DECIMALS)]
+                            + [repr(float(value)) for value in edges[:, edge]])
+    finally:
+        if output is not sys.stdout:
+            output.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
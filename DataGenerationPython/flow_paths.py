@@ -56,7 +56,7 @@ def getAllPathsInfo(demands, d_links, g, wt="weight"):
     path_list : list
         A list of path dictionaries with node-list, cost, and capacity information.
     """
-    print d_links
+    print(d_links)
     all_paths = []
     for d in demands.keys():
         d_paths = flowToPaths(d, d_links[d])
@@ -0,0 +1,340 @@
+"""
+module: fundamental_diagrams
+-------------------------
+
+The fundamental diagrams of the simulator (FunDiagWeidmann, FunDiagDrake, FunDiagSbFD
+and FunDiagZero) evaluated on NumPy arrays, to inspect and tune the curves on large
+grids of densities and parameter sets. A FundamentalDiagram holds arrays of
+parameters and evaluates every quantity for all the parameter sets times all the
+densities at once: parameters of shape P and densities of shape D give results of
+shape P + D.
+
+Besides the curves drawn by the visualization (FunDiag.critValues), the stream-wise
+quantities of the simulator are available: the speed, critical accumulation and
+critical speed of every stream (link orientation) of a cell from the accumulations of
+all its streams, as setLinkVel and setCritLinkAccVel compute them. The critical
+accumulation of a Weidmann stream has no closed form, FunDiagWeidmann finds it by a
+commons-math bisection per link and per time step; here all the bisections advance
+together, with the same steps so that the roots match the Java ones.
+
+The parameter files (examples/parameters/*Param*.txt) are read by readParameters()
+and the parameter search range files by readSearchSpace().
+"""
+
+from collections import OrderedDict
+
+import numpy as np
+
+#Absolute accuracy of the bisections of the Weidmann diagram (Parameter.Tolerance)
+BISECTION_TOLERANCE = 1e-6
+
+#Bracket of the critical accumulation of a Weidmann stream (FunDiagWeidmann.computeCritAcc)
+WEIDMANN_CRITICAL_BRACKET = (1.0, 100.0)
+
+#Angles of the link orientations in degrees (Parameter.linkAngles)
+LINK_ANGLES = {"N->E": 315, "N->S": 270, "N->W": 225,
+               "E->N": 135, "E->W": 180, "E->S": 225,
+               "S->E": 45, "S->N": 90, "S->W": 135,
+               "W->S": 315, "W->E": 0, "W->N": 45}
+
+#Shape parameters of the fundamental diagrams, in the order of the parameter files
+SHAPE_PARAMETERS = {'Weidmann': ('gamma[1/m^2]', 'kj[1/m^2]'),
+                    'Drake': ('thetaDrake[m^4]',),
+                    'SbFD': ('theta[m^4]', 'beta[m^2]'),
+                    'Zero': ()}
+
+
+def bisection(function, low, high, tolerance=BISECTION_TOLERANCE):
+    """
+    Element-wise bisection with the steps of commons-math BisectionSolver, on arrays
+    of intervals, so that the roots match those of the Java diagrams. The value at
+    the lower bound is carried over from the previous step instead of evaluated again.
+    """
+    low, high = np.broadcast_arrays(np.asarray(low, dtype=float), np.asarray(high, dtype=float))
+    low, high = low.copy(), high.copy()
+    lowValue = function(low)
+    while True:
+        mid = 0.5 * (low + high)
+        midValue = function(mid)
+        rightHalf = midValue * lowValue > 0
+        low = np.where(rightHalf, mid, low)
+        lowValue = np.where(rightHalf, midValue, lowValue)
+        high = np.where(rightHalf, high, mid)
+        if np.all(np.abs(high - low) <= tolerance):
+            return 0.5 * (low + high)
+
+
+def readParameterFile(file_path):
+    """ The values of every parameter of a parameter or parameter search range file, as
+        a dictionary of lists (one value, or the bounds of the search range).
+
+        Like Input.getFileLines, all the white space is removed and the first line,
+        the name of the diagram, is skipped.
+    """
+    values = OrderedDict()
+    with open(file_path, encoding="utf8") as paramFile:
+        next(paramFile, None)
+        for line in paramFile:
+            row = "".join(line.split()).split(",")
+            if row[0]:
+                values[row[0]] = [float(value) for value in row[1:]]
+    return values
+
+
+def readDiagramName(file_path):
+    """ The diagram named by the `#FunDiag: name` first line of a parameter file, None without it."""
+    with open(file_path, encoding="utf8") as paramFile:
+        line = "".join(paramFile.readline().split())
+    if line.startswith("#FunDiag:"):
+        return line.split(":", 1)[1]
+    return None
+
+
+def _diagramOf(file_path, fun_diag):
+    fun_diag = fun_diag or readDiagramName(file_path)
+    if fun_diag not in SHAPE_PARAMETERS:
+        raise ValueError("Unknown fundamental diagram {} in {}".format(fun_diag, file_path))
+    return fun_diag
+
+
+def readParameters(file_path, fun_diag=None):
+    """ Reads the free speed, the shape parameters and mu of a parameter file.
+
+        Parameters
+        ----------
+        file_path : string
+            the parameter file, see examples/parameters.
+        fun_diag : string
+            (optional) the diagram, the one named by the first line by default.
+
+        Returns
+        -------
+        params : dictionary
+            'vf', 'shape' (list in the order of SHAPE_PARAMETERS) and 'mu'.
+    """
+    fun_diag = _diagramOf(file_path, fun_diag)
+    values = readParameterFile(file_path)
+    names = ('vf[m/s]',) + SHAPE_PARAMETERS[fun_diag] + ('mu[-]',)
+    missing = [name for name in names if name not in values]
+    if missing:
+        raise ValueError("{} is missing the {} parameters {}".format(file_path, fun_diag, ", ".join(missing)))
+    return {'vf': values['vf[m/s]'][0], 'shape': [values[name][0] for name in SHAPE_PARAMETERS[fun_diag]],
+            'mu': values['mu[-]'][0]}
+
+
+def readSearchSpace(file_path, fun_diag=None):
+    """ Reads the bounds of the parameters of a parameter search range file.
+
+        Returns
+        -------
+        bounds : OrderedDict
+            (low, high) of vf, of the shape parameters in the order of SHAPE_PARAMETERS
+            and of mu, by parameter name.
+    """
+    fun_diag = _diagramOf(file_path, fun_diag)
+    values = readParameterFile(file_path)
+    bounds = OrderedDict()
+    for name in ('vf[m/s]',) + SHAPE_PARAMETERS[fun_diag] + ('mu[-]',):
+        if len(values.get(name, ())) < 2:
+            raise ValueError("{} needs the bounds of the {} parameter {}".format(file_path, fun_diag, name))
+        bounds[name] = (values[name][0], values[name][1])
+    return bounds
+
+
+class FundamentalDiagram(object):
+    """
+    A fundamental diagram of the simulator for arrays of parameter sets. The shape
+    parameters and the free speed are broadcast together into the parameter sets,
+    whose shape leads the shape of every result.
+
+    e.g. FundamentalDiagram('SbFD', (np.linspace(0.1, 0.3, 50), 0.3)).speed(density)
+    gives the (50,) + density.shape speeds of 50 values of theta.
+    """
+    def __init__(self, name, shape=(), vf=1.0):
+        """
+        Parameters
+        ----------
+        name : string
+            Weidmann, Drake, SbFD or Zero.
+        shape : sequence
+            shape parameters in the order of SHAPE_PARAMETERS, scalars or arrays.
+        vf : float or numpy.ndarray
+            (optional) free speed [m/s], for the dimensional quantities.
+        """
+        if name not in SHAPE_PARAMETERS:
+            raise ValueError("Unknown fundamental diagram " + str(name))
+        if len(shape) != len(SHAPE_PARAMETERS[name]):
+            raise ValueError("The {} diagram has the shape parameters {}".format(name, ", ".join(SHAPE_PARAMETERS[name])))
+        arrays = np.broadcast_arrays(*[np.asarray(value, dtype=float) for value in list(shape) + [vf]])
+        self.name = name
+        self.shape = list(arrays[:-1])
+        self.vf = arrays[-1]
+        self.paramShape = self.vf.shape
+
+    @classmethod
+    def fromParameterFile(cls, file_path, fun_diag=None):
+        """ The diagram of a parameter file, see readParameters()."""
+        fun_diag = _diagramOf(file_path, fun_diag)
+        params = readParameters(file_path, fun_diag)
+        return cls(fun_diag, params['shape'], params['vf'])
+
+    def _expand(self, ndim):
+        """ The shape parameters and the free speed with ndim trailing axes."""
+        return [value.reshape(value.shape + (1,) * ndim) for value in self.shape + [self.vf]]
+
+    def speed(self, density):
+        """ Non-dimensional speed at a density [1/m^2] of people walking in one direction.
+
+            The curve of FunDiag.critValues, which for Weidmann tends to 1 at zero
+            density where the stream-wise speed is infinite.
+        """
+        density = np.asarray(density, dtype=float)
+        params = self._expand(density.ndim)
+        with np.errstate(divide='ignore', over='ignore', invalid='ignore'):
+            if self.name == 'Weidmann':
+                gamma, kj = params[:2]
+                speed = np.where(density < kj, 1.0 - np.exp(-gamma * (1.0 / density - 1.0 / kj)), 0.0)
+            elif self.name in ('Drake', 'SbFD'):
+                speed = np.exp(-params[0] * density ** 2)
+            else:
+                speed = np.ones(self.paramShape + density.shape)
+        return speed
+
+    def velocity(self, density):
+        """ Speed [m/s] at a density [1/m^2]."""
+        density = np.asarray(density, dtype=float)
+        return self._expand(density.ndim)[-1] * self.speed(density)
+
+    def flow(self, density):
+        """ Specific flow [1/(m s)] at a density [1/m^2]."""
+        density = np.asarray(density, dtype=float)
+        return density * self.velocity(density)
+
+    def criticalDensity(self):
+        """ Density [1/m^2] of the maximum flow of every parameter set (FunDiag.critValues)."""
+        with np.errstate(divide='ignore', over='ignore', invalid='ignore'):
+            if self.name == 'Weidmann':
+                gamma, kj = self.shape
+                xj = gamma / kj
+                x = bisection(lambda x: 1.0 - (1.0 + x) * np.exp(xj - x), np.zeros(self.paramShape), kj)
+                return gamma / x
+            if self.name in ('Drake', 'SbFD'):
+                theta = self.shape[0]
+                return np.where(theta != 0.0, np.sqrt(1.0 / (2.0 * theta)), np.inf)
+        return np.full(self.paramShape, np.inf)
+
+    def criticalSpeed(self):
+        """ Non-dimensional speed at the critical density (FunDiag.critValues)."""
+        if self.name == 'Weidmann':
+            gamma, kj = self.shape
+            k = self.criticalDensity()
+            with np.errstate(over='ignore'):
+                return np.where(k < kj, 1.0 - np.exp(-gamma * (1.0 / k - 1.0 / kj)), 0.0)
+        if self.name in ('Drake', 'SbFD'):
+            return np.full(self.paramShape, np.exp(-0.5))
+        return np.ones(self.paramShape)
+
+    def capacity(self):
+        """ Maximum specific flow [1/(m s)] of every parameter set."""
+        with np.errstate(invalid='ignore'):
+            return self.criticalDensity() * self.vf * self.criticalSpeed()
+
+    def streamQuantities(self, acc, total, area, crossing=None):
+        """ Stream-wise speed, critical accumulation and critical speed (FunDiag.setLinkVel
+            and setCritLinkAccVel), element-wise.
+
+            Parameters
+            ----------
+            acc : numpy.ndarray
+                accumulation of the streams.
+            total : numpy.ndarray
+                accumulation of all the streams of their cells.
+            area : numpy.ndarray
+                area [m^2] of their cells, infinite for the source and sink cells.
+            crossing : numpy.ndarray
+                (optional) for SbFD, sum over the other streams of the cell of
+                (1 - cos of the intersection angle) x accumulation / area.
+
+            Returns
+            -------
+            vel, critAcc, critVel : numpy.ndarray
+                non-dimensional speed, critical accumulation and critical speed, of shape
+                P + the broadcast shape of the arguments.
+        """
+        arrays = [acc, total, area] + ([crossing] if crossing is not None else [])
+        ndim = np.broadcast(*arrays).ndim
+        full = self.paramShape + np.broadcast(*arrays).shape
+        params = self._expand(ndim)
+        others = total - acc
+        infinite = np.isinf(area)
+        with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            density = np.where(total > 0, total / area, 0.0)
+            if self.name == 'Weidmann':
+                gamma, kj = params[:2]
+                weidmann = lambda acc: np.where(acc == 0, np.inf, np.where(
+                    acc / area > kj, 0.0, 1.0 - np.exp(-gamma * (area / acc - 1.0 / kj))))
+                vel = weidmann(total)
+
+                def root(x):
+                    acc = others + x
+                    return 1.0 - (1.0 + x * gamma * (area / acc ** 2)) * np.exp(-gamma * (area / acc - 1.0 / kj))
+                low, high = WEIDMANN_CRITICAL_BRACKET
+                critAcc = np.minimum(bisection(root, np.full(full, low), np.full(full, high)), kj * area)
+                critVel = weidmann(critAcc + others)
+            elif self.name == 'Drake':
+                theta = params[0]
+                # FunDiagDrake.computeVelNd ignores its argument, the critical speed is the current one
+                vel = np.exp(-theta * density ** 2)
+                critAcc = np.where(theta != 0.0, -others / 2.0 + np.sqrt((others / 2.0) ** 2 + area ** 2 / (2.0 * theta)),
+                                   np.inf)
+                critVel = vel
+            elif self.name == 'SbFD':
+                theta, beta = params[:2]
+                penalty = np.exp(-beta * crossing) if crossing is not None else np.ones(full)
+                vel = penalty * np.exp(-theta * density ** 2)
+                critAcc = np.where(theta != 0.0, -others / 2.0 + np.sqrt((others / 2.0) ** 2 + area ** 2 / (2.0 * theta)),
+                                   np.inf)
+                critVel = penalty * np.exp(-theta * ((critAcc + others) / area) ** 2)
+            else:
+                vel = np.ones(full)
+                critAcc = np.full(full, np.inf)
+                critVel = np.ones(full)
+        if self.name != 'Zero':
+            vel = np.where(infinite, np.where(total == 0, vel, 1.0), vel)
+            critAcc = np.where(infinite, np.inf, critAcc)
+            critVel = np.where(infinite, 1.0, critVel)
+        return tuple(np.broadcast_to(value, full).copy() if value.shape != full else value
+                     for value in (vel, critAcc, critVel))
+
+    def streams(self, acc, area, angles=None):
+        """ Stream-wise quantities of cells from the accumulations of all their streams.
+
+            Parameters
+            ----------
+            acc : numpy.ndarray
+                (..., streams) accumulations of the streams of every cell.
+            area : numpy.ndarray
+                area [m^2] of every cell, broadcast against acc[..., 0].
+            angles : sequence
+                angles in degrees or orientations (e.g. 'N->E') of the streams, needed
+                by SbFD.
+
+            Returns
+            -------
+            vel, critAcc, critVel : numpy.ndarray
+                see streamQuantities().
+        """
+        acc = np.asarray(acc, dtype=float)
+        area = np.asarray(area, dtype=float)[..., None]
+        total = acc.sum(axis=-1, keepdims=True)
+        crossing = None
+        if self.name == 'SbFD':
+            if angles is None:
+                raise ValueError("The SbFD diagram needs the angles of the streams")
+            angles = np.array([LINK_ANGLES[angle] if isinstance(angle, str) else angle for angle in angles],
+                              dtype=float)
+            # FunDiagSbFD.interAngle, zero on the diagonal
+            weight = 1.0 - np.cos(np.radians(np.abs(angles[:, None] - angles[None, :]) % 360))
+            with np.errstate(divide='ignore', invalid='ignore'):
+                crossing = np.matmul(acc, weight) / area
+        return self.streamQuantities(acc, total, area, crossing)
@@ -0,0 +1,429 @@
+"""
+module: graph_update
+-------------------------
+
+Incremental update of generated files after a change of the street network (a new
+crossing, a closed footpath). The change is read from an OSM change file (.osc) or
+from an edge list and applied to the graph of a previous run found in the stage
+cache. Only what the change invalidates is recomputed:
+
+- the cells of the edges that were added, removed or modified, or whose node moved
+  (all the cells only when the nodes move the bounding box the coordinates are
+  normalised with),
+- the routes of the OD pairs whose cached routes use a changed edge, or that a new
+  edge could shorten: a new edge (a, b) can only enter the routes of the pair (o, d)
+  when the great-circle lower bound d(o, a) + length(a, b) + d(b, d) does not exceed
+  the cost of the longest route kept for the pair (of the whole route set for
+  disjoint routes, whose total length is minimised, and the cost ratio times the
+  shortest route for perturbation routes, whose other routes are kept as sampled),
+- the links of the new routes.
+
+Everything else is carried over into the cache entries of the updated graph, after
+which mapGeoToCells.generate rewrites the output files from the cache. The files are
+rewritten whole, not patched: fingerprinting the updated graph, converting it to the
+node and edge tables, and writing the cell, blockage, edge index, demand, route and
+link files all still take time linear in the size of the network and of the run,
+only the cellization, routing and link building are limited to the change. The cells
+are assembled in the edge order of the updated network, so every file is the same,
+line for line, as the one a full regeneration of the updated network writes (the
+cells of a changed edge, or of an edge the updated network lists the other way
+round, are created again).
+
+Edge list format, one change per line (a node already in the network is moved):
+
+    # action, osmid or u, lat or v, long or length[, oneway]
+    node, 5166843702, -34.0171, 151.0629
+    add, 5166843702, 5166847490, 52.3
+    remove, 5166843705, 5166843710
+"""
+
+import argparse
+import csv
+import sys
+import xml.etree.ElementTree as ET
+
+from stage_cache import StageCache, graphFingerprint
+
+#Great-circle lower bounds are scaled down to tolerate edge lengths measured on a plane
+LOWER_BOUND_SLACK = 0.99
+
+
+class GraphChange(object):
+    """
+    Nodes and edges added to or removed from a street network. Edges are directed
+    (u, v) pairs, ways are OSM way identifiers whose edges are removed.
+    """
+    def __init__(self):
+        self.addedNodes = {}     # osmid -> (lat, long)
+        self.removedNodes = set()
+        self.addedEdges = []     # (u, v, length, oneway, wayId), length None to measure it
+        self.removedEdges = set()
+        self.removedWays = set()
+
+    def __len__(self):
+        return (len(self.addedNodes) + len(self.removedNodes) + len(self.addedEdges) +
+                len(self.removedEdges) + len(self.removedWays))
+
+    def toDict(self):
+        return {'addedNodes': len(self.addedNodes), 'removedNodes': len(self.removedNodes),
+                'addedEdges': len(self.addedEdges), 'removedEdges': len(self.removedEdges),
+                'removedWays': len(self.removedWays)}
+
+
+def readEdgeList(file_path):
+    """ Reads an edge list change file, see the module documentation for its format."""
+    change = GraphChange()
+    with open(file_path, encoding="utf8") as changeFile:
+        for row in csv.reader(changeFile, delimiter=','):
+            row = [value.strip() for value in row]
+            if len(row) == 0 or row[0] == '' or row[0].startswith('#'):
+                continue
+            action = row[0].lower()
+            if action == 'node':
+                change.addedNodes[int(row[1])] = (float(row[2]), float(row[3]))
+            elif action == 'add':
+                length = float(row[3]) if len(row) > 3 and row[3] else None
+                oneway = len(row) > 4 and row[4].lower() in ('true', 'yes', '1')
+                change.addedEdges.append((int(row[1]), int(row[2]), length, oneway, None))
+            elif action == 'remove':
+                change.removedEdges.add((int(row[1]), int(row[2])))
+                change.removedEdges.add((int(row[2]), int(row[1])))
+            else:
+                raise ValueError("Unknown change '{}', expected node, add or remove".format(row[0]))
+    return change
+
+
+def readOsmChange(file_path):
+    """ Reads the walkable ways of an osmChange file.
+
+        Created and modified nodes give coordinates, deleted nodes are removed with
+        their edges. Deleted and modified ways have their edges removed, created and
+        modified ways tagged as highway add an edge in both directions between
+        consecutive nodes (all the streets are walkable both ways, as in the walk
+        networks of osmnx).
+    """
+    change = GraphChange()
+    root = ET.parse(file_path).getroot()
+    for block in root:
+        action = block.tag
+        for element in block:
+            osmid = int(element.get('id'))
+            if element.tag == 'node':
+                if action == 'delete':
+                    change.removedNodes.add(osmid)
+                else:
+                    change.addedNodes[osmid] = (float(element.get('lat')), float(element.get('lon')))
+            elif element.tag == 'way':
+                if action in ('modify', 'delete'):
+                    change.removedWays.add(osmid)
+                tags = dict((tag.get('k'), tag.get('v')) for tag in element.findall('tag'))
+                if action in ('create', 'modify') and 'highway' in tags:
+                    refs = [int(nd.get('ref')) for nd in element.findall('nd')]
+                    for u, v in zip(refs[:-1], refs[1:]):
+                        change.addedEdges.append((u, v, None, False, osmid))
+    return change
+
+
+def readChange(file_path):
+    """ Reads an osmChange (.osc, .xml) or edge list change file."""
+    if file_path.lower().endswith(('.osc', '.xml')):
+        return readOsmChange(file_path)
+    return readEdgeList(file_path)
+
+
+def applyChange(g, change):
+    """ Applies a change to a copy of a street network.
+
+        Returns
+        -------
+        g_new : networkx.MultiDiGraph
+            the updated network.
+        changed_pairs : set
+            frozensets of the node pairs whose edges were added, removed or modified,
+            the edges of a moved node included (their length is measured again).
+    """
+    from synthetic_network import greatCircleDistance
+    g_new = g.copy()
+    g_new.graph.pop('_nearestNodeCache', None)
+    changed_pairs = set()
+    removed = set(change.removedEdges)
+    for node in change.removedNodes:
+        if node in g_new:
+            removed.update(g_new.in_edges(node))
+            removed.update(g_new.out_edges(node))
+    if change.removedWays:
+        for u, v, data in g_new.edges(data=True):
+            way = data.get('osmid')
+            ways = way if isinstance(way, list) else [way]
+            if any(way_id in change.removedWays for way_id in ways):
+                removed.add((u, v))
+    for u, v in removed:
+        while g_new.has_edge(u, v):
+            g_new.remove_edge(u, v)
+        changed_pairs.add(frozenset((u, v)))
+    g_new.remove_nodes_from([node for node in change.removedNodes if node in g_new])
+
+    for osmid, (lat, lon) in change.addedNodes.items():
+        if osmid not in g_new:
+            g_new.add_node(osmid, osmid=osmid, y=lat, x=lon)
+        elif (g_new.nodes[osmid]['y'], g_new.nodes[osmid]['x']) != (lat, lon):
+            #a moved node changes the cells and the length of all its edges
+            g_new.nodes[osmid].update(y=lat, x=lon)
+            for u, v, data in list(g_new.in_edges(osmid, data=True)) + list(g_new.out_edges(osmid, data=True)):
+                data['length'] = round(float(greatCircleDistance(g_new.nodes[u]['y'], g_new.nodes[u]['x'],
+                                                                 g_new.nodes[v]['y'], g_new.nodes[v]['x'])), 3)
+                changed_pairs.add(frozenset((u, v)))
+    for u, v, length, oneway, way in change.addedEdges:
+        if u not in g_new or v not in g_new:
+            raise ValueError("Edge ({}, {}) uses a node that is neither in the graph nor added".format(u, v))
+        if length is None:
+            length = round(float(greatCircleDistance(g_new.nodes[u]['y'], g_new.nodes[u]['x'],
+                                                     g_new.nodes[v]['y'], g_new.nodes[v]['x'])), 3)
+        data = {'osmid': way, 'length': length, 'oneway': oneway, 'highway': 'footway'}
+        for a, b in ((u, v),) if oneway else ((u, v), (v, u)):
+            while g_new.has_edge(a, b):
+                g_new.remove_edge(a, b)
+            g_new.add_edge(a, b, 0, **dict(data))
+        changed_pairs.add(frozenset((u, v)))
+    return g_new, changed_pairs
+
+
+def updateCells(ctx, cached_cells, g_old, g_new, changed_pairs):
+    """ Carries over the cells of the unchanged edges and creates those of the changed ones.
+
+        The network of `ctx` (a mapGeoToCells.GenerationContext) must already be set to `g_new`.
+
+        Returns
+        -------
+        cells : dictionary
+            the cells artifact of the updated network ({'cells', 'edgeCells'}).
+        recomputed : integer
+            number of edges whose cells were created.
+    """
+    import mapGeoToCells as gen
+    old_lat = [data['x'] for _, data in g_old.nodes(data=True)]
+    old_lon = [data['y'] for _, data in g_old.nodes(data=True)]
+    if gen.getNormalizeParameter(old_lat, old_lon) != gen.getNormalizeParameter(ctx.lat_list, ctx.lon_list):
+        #the origin of the cell coordinates moved, every cell has to be placed again
+        edge_cells = []
+        cells = ctx.createCells(edge_cells=edge_cells)
+        return {'cells': cells, 'edgeCells': edge_cells}, len(edge_cells)
+
+    #slices of the cached cells by edge, in the orientation they were created in
+    old = cached_cells['cells']
+    old_slices = {}
+    start = 0
+    for u, v, count in cached_cells['edgeCells']:
+        old_slices.setdefault((u, v), []).append((start, count))
+        start += count
+    #the changed edges, and those the updated network now lists the other way round
+    new_edges = [(u, v) for u, v in ctx.node_link_list
+                 if frozenset((u, v)) in changed_pairs or (u, v) not in old_slices]
+    new_edge_cells = []
+    new_cells = ctx.createCells(new_edges, new_edge_cells)
+    new_slices = {}
+    start = 0
+    for u, v, count in new_edge_cells:
+        new_slices.setdefault((u, v), []).append((start, count))
+        start += count
+
+    #in the edge order of the updated network, as a full regeneration writes them
+    cells = dict((key, []) for key in old)
+    edge_cells = []
+    for u, v in ctx.node_link_list:
+        if frozenset((u, v)) in changed_pairs or (u, v) not in old_slices:
+            source, slices = new_cells, new_slices
+        else:
+            source, slices = old, old_slices
+        start, count = slices[(u, v)].pop(0)
+        for key in cells:
+            cells[key].extend(source[key][start:start + count])
+        edge_cells.append((u, v, count))
+    return {'cells': cells, 'edgeCells': edge_cells}, len(new_edges)
+
+
+def routeTouches(node_list, changed_pairs):
+    """ Whether a route uses an edge of `changed_pairs`."""
+    return any(frozenset((a, b)) in changed_pairs for a, b in zip(node_list[:-1], node_list[1:]))
+
+
+def affectedODPairs(routes, g_new, changed_pairs, max_routes, route_method='yen', cost_ratio=None,
+                    overlap_filtered=False):
+    """ OD pairs whose cached routes a change may invalidate.
+
+        Parameters
+        ----------
+        routes : dictionary
+            cached routes by OD pair, as stored by mapGeoToCells.
+        g_new : networkx.MultiDiGraph
+            the updated network.
+        changed_pairs : set
+            node pairs whose edges changed.
+        max_routes : integer
+            number of routes computed per OD pair.
+        route_method : string
+            (optional) the ROUTE_METHOD of mapGeoToCells the routes were computed with.
+        cost_ratio : float
+            (optional) the PERTURBATION_COST_RATIO of perturbation routes.
+        overlap_filtered : boolean
+            (optional) whether near-duplicate routes were filtered out, the pairs left
+            with fewer than max_routes routes are then routed again, as a change of a
+            rejected candidate can let another one in.
+
+        Returns
+        -------
+        affected : set
+            the OD pairs to route again.
+    """
+    import numpy as np
+    from synthetic_network import greatCircleDistance
+    affected = set()
+    candidates = []
+    for od_pair, routes_dict in routes.items():
+        if any(node not in g_new for node in od_pair) or \
+                any(routeTouches(node_list, changed_pairs) for node_list in routes_dict['nodeList']) or \
+                (overlap_filtered and len(routes_dict['nodeList']) < max_routes):
+            affected.add(od_pair)
+        else:
+            candidates.append(od_pair)
+
+    #directed edges of the changed pairs that exist in the updated network
+    added = [(a, b, min(data['length'] for data in g_new[a][b].values()))
+             for pair in changed_pairs for a, b in _orientations(pair) if g_new.has_edge(a, b)]
+    if not added or not candidates:
+        return affected
+    lat = lambda nodes: np.array([g_new.nodes[node]['y'] for node in nodes], dtype=np.float64)
+    lon = lambda nodes: np.array([g_new.nodes[node]['x'] for node in nodes], dtype=np.float64)
+    origins = [od_pair[0] for od_pair in candidates]
+    dests = [od_pair[1] for od_pair in candidates]
+    threshold = np.array([_routeBound(routes[od_pair]['distance'], max_routes, route_method, cost_ratio)
+                          for od_pair in candidates])
+    o_lat, o_lon, d_lat, d_lon = lat(origins), lon(origins), lat(dests), lon(dests)
+    possible = np.zeros(len(candidates), dtype=bool)
+    for a, b, length in added:
+        to_a = greatCircleDistance(g_new.nodes[a]['y'], g_new.nodes[a]['x'], o_lat, o_lon)
+        from_b = greatCircleDistance(g_new.nodes[b]['y'], g_new.nodes[b]['x'], d_lat, d_lon)
+        possible |= LOWER_BOUND_SLACK * (to_a + from_b) + length <= threshold
+    affected.update(od_pair for od_pair, flag in zip(candidates, possible.tolist()) if flag)
+    return affected
+
+
+def updateSnapping(snapped, g_old, g_new, change):
+    """ Re-snaps the OD coordinates that a removed, a moved or a closer added node affects."""
+    import numpy as np
+    from synthetic_network import greatCircleDistance, nearestNode
+    moved = set(node for node in change.addedNodes if node in g_old and node in g_new and
+                (g_old.nodes[node]['y'], g_old.nodes[node]['x']) != (g_new.nodes[node]['y'], g_new.nodes[node]['x']))
+    candidates = [node for node in change.addedNodes if node not in g_old or node in moved]
+    cand_lat = np.array([g_new.nodes[node]['y'] for node in candidates if node in g_new], dtype=np.float64)
+    cand_lon = np.array([g_new.nodes[node]['x'] for node in candidates if node in g_new], dtype=np.float64)
+    updated = {}
+    for cord, node in snapped.items():
+        point = (float(cord.split('|')[0]), float(cord.split('|')[1]))
+        if node not in g_new or node in moved:
+            node = nearestNode(g_new, point)
+        elif len(cand_lat):
+            best = float(greatCircleDistance(point[0], point[1], g_new.nodes[node]['y'], g_new.nodes[node]['x']))
+            if (greatCircleDistance(point[0], point[1], cand_lat, cand_lon) <= best).any():
+                #a new or moved node is at least as close, the ties go as in a full snapping
+                node = nearestNode(g_new, point)
+        updated[cord] = node
+    return updated
+
+
+def updateRun(change, cache_dir, output_dir=None, report=None):
+    """ Updates the outputs of a cached run after a change of its street network.
+
+        Parameters
+        ----------
+        change : GraphChange
+            the change of the network.
+        cache_dir : string
+            the stage cache the run was generated with.
+        output_dir : string
+            (optional) the output directory of the run, by default the one set at the top of mapGeoToCells.
+
+        Returns
+        -------
+        outputs : dictionary
+            the paths of the rewritten files, as returned by mapGeoToCells.generate.
+    """
+    import mapGeoToCells as gen
+    from run_report import RunReport
+    cache = StageCache(cache_dir)
+    ctx = gen.GenerationContext()
+    if output_dir is not None:
+        ctx.setOutputDirectory(output_dir)
+    state, g_old, cached_cells = gen.loadCachedRun(ctx, cache)
+    old_graph_key = state['graphKey']
+    old_cells_key = gen.cellsCacheKey(cache, old_graph_key)
+    report = RunReport('graph update') if report is None else report
+
+    with report.stage('apply change', unit='changes') as stage:
+        g_new, changed_pairs = applyChange(g_old, change)
+        stage.items = len(change)
+        stage.count('changedEdges', len(changed_pairs))
+    new_graph_key = cache.key('graph', graphFingerprint(g_new))
+    cache.store('graph', new_graph_key, g_new)
+
+    with report.stage('cells update', unit='edges') as stage:
+        ctx.setNetwork(g_new)
+        cells, stage.items = updateCells(ctx, cached_cells, g_old, g_new, changed_pairs)
+        new_cells_key = gen.cellsCacheKey(cache, new_graph_key)
+        cache.store('cells', new_cells_key, cells)
+        stage.count('cells', len(cells['cells']['cellName']))
+
+    with report.stage('route invalidation', unit='OD pairs') as stage:
+        routes = cache.load('routes', gen.routesCacheKey(ctx, cache, old_cells_key), {})
+        affected = affectedODPairs(routes, g_new, changed_pairs, ctx.MAX_ROUTES, ctx.ROUTE_METHOD,
+                                   ctx.PERTURBATION_COST_RATIO, ctx.MAX_ROUTE_OVERLAP is not None)
+        kept = dict((od_pair, routes_dict) for od_pair, routes_dict in routes.items() if od_pair not in affected)
+        cache.store('routes', gen.routesCacheKey(ctx, cache, new_cells_key), kept)
+        links = cache.load('links', gen.linksCacheKey(cache, old_cells_key), {})
+        kept_links = dict((route, rows) for route, rows in links.items() if not routeTouches(route, changed_pairs))
+        cache.store('links', gen.linksCacheKey(cache, new_cells_key), kept_links)
+        stage.items = len(routes)
+        stage.count('rerouted', len(affected))
+
+    snapped = cache.load('snapping', gen.snappingCacheKey(cache, old_graph_key), {})
+    cache.store('snapping', gen.snappingCacheKey(cache, new_graph_key), updateSnapping(snapped, g_old, g_new, change))
+
+    report.info['graphUpdate'] = dict(change.toDict(), changedEdges=len(changed_pairs),
+                                      cellEdgesRecomputed=report.stages[-2].items, reroutedODPairs=len(affected))
+    return gen.generate(graph=g_new, report=report, context=ctx)
+
+
+def _routeBound(distances, max_routes, route_method, cost_ratio):
+    """
+    Longest route a change can add to a route set of the given distances.
+    """
+    if route_method == 'perturbation':
+        return cost_ratio * min(distances) if distances else float('inf')
+    if len(distances) < max_routes:
+        return float('inf')
+    #a route of a better disjoint set is at most as long as the total of the current set
+    return max(distances) if route_method == 'yen' else sum(distances)
+
+
+def _orientations(pair):
+    """
+    Both directions of an undirected node pair.
+    """
+    nodes = tuple(pair)
+    if len(nodes) == 1:
+        return [(nodes[0], nodes[0])]
+    return [(nodes[0], nodes[1]), (nodes[1], nodes[0])]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Update generated files after a change of the street network.")
+    parser.add_argument('change', help="osmChange file (.osc) or edge list (node/add/remove lines)")
+    parser.add_argument('--cache-dir', required=True, help="stage cache of the run to update")
+    parser.add_argument('--output-dir', default=None, help="output directory of the run to update")
+    args = parser.parse_args(argv)
+    updateRun(readChange(args.change), args.cache_dir, args.output_dir)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -11,26 +11,56 @@ cell segregations which represents various blocks of space on the street connect
 with each other to form a street network. This street the network is used by 
 StochasticAnisoPedCTM to simulate the pedestrian movement pattern.
 
+The module can be imported as a library: nothing runs at import time and the heavy
+dependencies (osmnx, networkx, pandas, numpy) are only imported by the stages that
+need them, so worker processes using the cell, link and route functions never pay
+the osmnx import. `generate` runs the whole pipeline and `main` is the command line
+entry point (`python mapGeoToCells.py --help`).
+
 Author: Shubhankar Mathur
 """
 
-import pandas as pd
-import numpy as np
-from math import ceil, sqrt
+from math import ceil, isinf, sqrt
+import argparse
 import os
 import csv
 import datetime as dt
-from copy import deepcopy
-import random as rd
 
-import osmnx as ox
-import networkx as nx
 from YenKShortestPaths import YenKShortestPaths
+from DisjointPaths import DisjointPaths
+from route_overlap import OverlapStats, RouteOverlapFilter
+from ModifiedDijkstra import SearchStats
+from run_report import RunReport
+from stage_cache import StageCache, fileFingerprint, graphFingerprint
 
 #Parameters impacting the radius of input data
 DISTANCE_RANGE = 350                #radius of input area in meters
 START_POINT = (-34.01746,151.06285) #lat,long
 MAX_ROUTES = 3                      #NUmber of route options
+ROUTE_METHOD = 'yen'                #'yen' (k shortest routes), 'edge-disjoint' or 'node-disjoint' (k disjoint routes of least total length) or 'perturbation'
+ROUTING_WORKERS = 1                 #worker processes of the 'perturbation' routes, None for one per core
+USE_CONTRACTION_HIERARCHY = False   #index the network (cached with it) for the first route and to skip useless spur searches
+
+#Choice sets of ROUTE_METHOD 'perturbation', the shortest routes found on randomly perturbed edge lengths
+PERTURBATION_SAMPLES = 50           #shortest path searches per origin, the first one on the true lengths
+PERTURBATION_SPREAD = 0.3           #edge lengths are multiplied by factors drawn in [1 - spread, 1 + spread]
+PERTURBATION_COST_RATIO = 1.5       #routes longer than this ratio times the shortest route are discarded
+PERTURBATION_SEED = 0               #seed of the perturbations, the routes are reproducible for a given seed
+
+#Filtering of near-duplicate routes, the overlap of a route is the fraction of its length shared with a shorter route
+MAX_ROUTE_OVERLAP = None            #routes overlapping a kept route of their OD pair by more than this are dropped, None keeps all
+MAX_CANDIDATE_ROUTES = 20           #candidate routes drawn from the route generator per OD pair when filtering
+
+#Offline synthetic network used instead of OpenStreetMap, e.g. ('grid', 10000) or ('organic', 10000, seed)
+SYNTHETIC_NETWORK = None            #layout ('grid', 'radial' or 'organic'), number of nodes and optional seed
+
+#Demand compaction (one demand group is simulated per OD pair and departure-time bin)
+DEMAND_TIME_BIN = 0                 #width of departure-time bins in seconds, 0 only merges identical departures
+MAX_DEMAND_GROUPS = None            #if set, the smallest bin width giving at most this many groups is used
+DEMAND_BIN_ANCHOR = 'start'         #departure time of a group: 'start', 'centre' or 'mean' of its bin
+
+#Stage cache (graph, cells, snapped OD, routes and links are reused by reruns whose inputs did not change)
+CACHE_DIRECTORY = None              #directory of the stage cache, e.g. "cache", None disables caching
 
 #File Input Directory
 odMatrixFileNamePath = "ODMatrix.txt"
@@ -41,6 +71,9 @@ BLOCKAGE_FILE_NAME = "new_blockage"
 DEMAND_FILE_NAME = "new_demand"
 ROUTE_FILE_NAME = "new_route"
 LINKS_FILE_NAME = "new_links"
+RUN_REPORT_FILE_NAME = "new_run_report"    #JSON timing and memory report, written next to the cell file
+EDGE_INDEX_FILE_NAME = "new_edge_index"    #cell and zone ranges of every OSM edge, written next to the cell file
+SLOWEST_OD_PAIRS = 10                      #number of most expensive OD pairs listed with their search counters in the report
 
 #File Output Directory             
 FILE_CREATION_PATH_CELLS = ""           #Current (root) directory by default
@@ -49,6 +82,17 @@ FILE_CREATION_PATH_DEMAND = ""
 FILE_CREATION_PATH_ROUTE = ""
 FILE_CREATION_PATH_LINKS = ""
 
+#Parameters that can be set through configure, generate and the command line
+PARAMETERS = ('DISTANCE_RANGE', 'START_POINT', 'MAX_ROUTES', 'ROUTE_METHOD', 'ROUTING_WORKERS',
+              'PERTURBATION_SAMPLES', 'PERTURBATION_SPREAD', 'PERTURBATION_COST_RATIO', 'PERTURBATION_SEED',
+              'MAX_ROUTE_OVERLAP', 'MAX_CANDIDATE_ROUTES', 'USE_CONTRACTION_HIERARCHY',
+              'SYNTHETIC_NETWORK', 'DEMAND_TIME_BIN', 'MAX_DEMAND_GROUPS', 'DEMAND_BIN_ANCHOR', 'CACHE_DIRECTORY', 'odMatrixFileNamePath', 'CELL_FILE_NAME',
+              'BLOCKAGE_FILE_NAME', 'DEMAND_FILE_NAME', 'ROUTE_FILE_NAME', 'LINKS_FILE_NAME',
+              'RUN_REPORT_FILE_NAME', 'EDGE_INDEX_FILE_NAME', 'SLOWEST_OD_PAIRS', 'FILE_CREATION_PATH_CELLS',
+              'FILE_CREATION_PATH_BLOCKAGE', 'FILE_CREATION_PATH_DEMAND', 'FILE_CREATION_PATH_ROUTE',
+              'FILE_CREATION_PATH_LINKS')
+_DEFAULT_PARAMETERS = dict((name, globals()[name]) for name in PARAMETERS)
+
 #DO NOT CHANGE VALUE OF ANY VARIABLE BEYOND THIS POINT UNLESS MODIFYING THE CODE
 #constant values
 FILE_FORMAT = ".txt"
@@ -69,22 +113,22 @@ BI_DIRECTION = 'true'
 NEW_MAX_CORD = 50
 NEW_MIN_CORD = 0
 
-print("Generate Data.....Do not close the window")
-
 #Function will create the dictionary which will store all the data related to cells
-def createCells(node_list, lat_List, lon_list, node_length, node_link_list, node_coordinates):
+def createCells(node_list, lat_List, lon_list, node_length, node_link_list, node_coordinates, edge_cells=None):
     global NUM_CELLS_PER_ZONE
     cells_dict = {'cellName':[], 'zone':[], 'surfaceSize':[], 'coordinate':[]}
     node_serial = 1
     zone_serial = 1
-    lat_min_par, long_min_par, lat_max_par, long_max_par = getNormalizeParameter(lat_list, lon_list)
+    lat_min_par, long_min_par, lat_max_par, long_max_par = getNormalizeParameter(lat_List, lon_list)
     for node in node_link_list:
-        tot_count = int(getCellCount(node))
+        tot_count = int(getCellCount(node, node_length))
         display_tot_count = round(tot_count/20)
         if display_tot_count%2 == 1:
             display_tot_count = display_tot_count + 1
         if display_tot_count == 0:
             display_tot_count = 2
+        if edge_cells is not None:  #number of cells of every edge, in the order of cells_dict
+            edge_cells.append((node[0], node[1], display_tot_count))
         for i in range(display_tot_count):    #for 150 - 4 and 0.005
             cell_Name = getCellName(str(node[0]) + str(node[1]) ,i)
             cells_dict['cellName'].append(cell_Name)
@@ -94,17 +138,17 @@ def createCells(node_list, lat_List, lon_list, node_length, node_link_list, node
     return cells_dict
 
 #Function to translate the geo-pane distance to coordinate pane length
-def translateLength(node):
+def translateLength(node, node_length):
     length = list(node_length[(node_length['u'] == node[0]) & (node_length['v'] == node[1])]["length"])[0]
     global CELL_EDGE_LENGTH
     translatedLength = (length // CELL_EDGE_LENGTH) * CELL_EDGE_LENGTH
     return translatedLength
 
 #Get the number of cells for each path between 2 nodes
-def getCellCount(node):
+def getCellCount(node, node_length):
     global CELL_EDGE_LENGTH
     global NUM_CELLS_PER_WIDTH
-    count = ((translateLength(node))//CELL_EDGE_LENGTH) * NUM_CELLS_PER_WIDTH
+    count = ((translateLength(node, node_length))//CELL_EDGE_LENGTH) * NUM_CELLS_PER_WIDTH
     return count
 
 #Get the cell name
@@ -130,7 +174,6 @@ def getCoordinates(lat_min, long_min, node, node_coordinates, serial_num, tot_co
     lon1 = list(node_coordinates[node_coordinates['osmid']==node[0]]['y'])[0]
     lat2 = list(node_coordinates[node_coordinates['osmid']==node[1]]['x'])[0]
     lon2 = list(node_coordinates[node_coordinates['osmid']==node[1]]['y'])[0]
-    length = list(node_length[(node_length['u'] == node[0]) & (node_length['v'] == node[1])]["length"])[0]
     nor_lat1, nor_lon1 = getNormalizedCoordinates(lat_min, long_min, lat1, lon1)
     nor_lat2, nor_lon2 = getNormalizedCoordinates(lat_min, long_min, lat2, lon2)
     distance = getDistance(nor_lat1, nor_lon1, nor_lat2, nor_lon2)
@@ -163,9 +206,13 @@ def getDistance(x1, y1, x2, y2):
     distance = sqrt((x2 - x1)**2 + (y2 - y1)**2)
     return distance
 
-#Slope between 2 points in cartesian plane
+#Slope of the perpendicular to the line joining 2 points in cartesian plane, infinite for a horizontal line
 def getSlope(x1, y1, x2, y2):
+    if x2 == x1:
+        return 0.0
     slope = (y2 - y1)/(x2 - x1)
+    if slope == 0:
+        return float('inf')
     perpendicularSlope = (1/slope)*(-1)
     return perpendicularSlope
 
@@ -175,13 +222,13 @@ def getNormalizeParameter(lat_List, lon_List):
     long_min = 0
     lat_max = 0
     long_max = 0
-    if lat_list[0] > 0 :
+    if lat_List[0] > 0 :
         lat_min = min(lat_List)
         lat_max = max(lat_List)
     else:
         lat_min = max(lat_List)
         lat_max = min(lat_List)
-    if lon_list[0] > 0:
+    if lon_List[0] > 0:
         long_min = min(lon_List)
         long_max = max(lon_List)
     else:
@@ -191,6 +238,11 @@ def getNormalizeParameter(lat_List, lon_List):
 
 #Get the edge coordinates of the cells perpendicular  to central line joining the 2 nodes
 def getPerprndicularCoordinates(x1, y1, slope, serial_num):
+    #vertical and horizontal lines (grid streets), the sides follow the limits of the general case
+    if slope == 0:
+        return (x1 + CELL_EDGE_LENGTH, y1) if serial_num%2 == 0 else (x1 - CELL_EDGE_LENGTH, y1)
+    if isinf(slope):
+        return (x1, y1 + CELL_EDGE_LENGTH) if serial_num%2 == 0 else (x1, y1 - CELL_EDGE_LENGTH)
     a = slope**2 + 1
     b = (slope**2 + 1)*y1*(-2)
     c = ((slope**2 + 1)*(y1**2)) - ((slope**2)*(CELL_EDGE_LENGTH**2))
@@ -208,61 +260,104 @@ def getDivisionPoint(part, x1, y1, x2, y2, tot_count):
     dy = ((part*y2) + ((tot_count - part)*y1))/tot_count
     return dx, dy
 
-#Get the street data from the Open Street Map library
-G4 = ox.graph_from_point(START_POINT,distance=DISTANCE_RANGE, distance_type='network', network_type='walk')
-graph = deepcopy(G4)
+#Parameters and state of one generation, e.g. GenerationContext(START_POINT=(-33.87, 151.21), MAX_ROUTES=5)
+class GenerationContext(object):
+    """
+    The parameters of a generation (PARAMETERS, the values set at the top of this
+    file by default), its street network and cells and the link, route and demand
+    rows collected for its files. Every function using them takes the context, so
+    several generations can run at once in one process.
+    """
+    def __init__(self, **params):
+        self.__dict__.update(_DEFAULT_PARAMETERS)
+        self.configure(**params)
+        #street network and its node and edge tables, set by setNetwork
+        self.G4 = None
+        self.node_coordinates = None
+        self.node_length = None
+        self.lat_list = []
+        self.lon_list = []
+        self.node_list = []
+        self.node_link_list = []
+        self.route_hierarchy = None
+        #cells, set by setCells
+        self.cells_dict = None
+        self.cell_data = None
+        #rows of the link, route and demand files
+        self.links_dict = {'cellName':[], 'origCellName':[], 'destCellName':[], 'length':[], 'streamOrig':[], 'streamDest':[], 'boolean bi-directional':[]}
+        self.routes_data_dict = {'routeName':[],'zoneSequence':[], 'distance':[]}
+        self.demand_dict = {'routeName':[], 'depTime':[], 'numPpl':[], 'travelTime':[], 'routeName2':[],'routeName3':[]}
 
-#Convert data into graphs
-data = ox.save_load.graph_to_gdfs(G4, nodes=True, edges=True, node_geometry=False, fill_edge_geometry=False)
+    #Set parameters of the generation, e.g. configure(START_POINT=(-33.87, 151.21), MAX_ROUTES=5)
+    def configure(self, **params):
+        unknown = [name for name in params if name not in PARAMETERS]
+        if unknown:
+            raise ValueError("Unknown parameters {}, expected some of {}".format(unknown, PARAMETERS))
+        self.__dict__.update(params)
+        return self
 
-node_coordinates = data[0][["osmid","x","y"]]       #output is pandas framework, x is lat, y is long 
-node_length = data[1][["u","v","length","oneway"]]  #output is pandas framework u and v are osmids for the nodes
+    #Values of all the parameters
+    def parameters(self):
+        return dict((name, getattr(self, name)) for name in PARAMETERS)
 
-lat_list = []
-lon_list = []
-node_list = []
+    #Set the same output directory for all the generated files
+    def setOutputDirectory(self, path):
+        self.configure(FILE_CREATION_PATH_CELLS=path, FILE_CREATION_PATH_BLOCKAGE=path, FILE_CREATION_PATH_DEMAND=path,
+                       FILE_CREATION_PATH_ROUTE=path, FILE_CREATION_PATH_LINKS=path)
+        if path:
+            os.makedirs(path, exist_ok=True)
+        return self
 
-node_link_list = list((G4.to_undirected()).edges())
+    #Set the street network used by the cell, link and route functions
+    def setNetwork(self, G):
+        from synthetic_network import graphFrames
+        self.G4 = G
+        self.route_hierarchy = None
+        #Convert data into graphs
+        self.node_coordinates, self.node_length = graphFrames(G)  #output is pandas framework, x is lat, y is long, u and v are osmids for the nodes
+        self.lat_list = list(self.node_coordinates['x'])
+        self.lon_list = list(self.node_coordinates['y'])
+        self.node_list = [int(osmid) for osmid in self.node_coordinates['osmid']]
+        self.node_link_list = list((G.to_undirected()).edges())
 
-for index, rows in node_coordinates.iterrows():
-    lat_list.append(rows.x)
-    lon_list.append(rows.y)
-    node_list.append(int(rows.osmid))
+    #Create the cells of the edges of the network (all of them by default)
+    def createCells(self, node_link_list=None, edge_cells=None):
+        node_link_list = self.node_link_list if node_link_list is None else node_link_list
+        return createCells(self.node_list, self.lat_list, self.lon_list, self.node_length, node_link_list,
+                           self.node_coordinates, edge_cells)
 
-cells_dict = createCells(node_list, lat_list, lon_list, node_length, node_link_list, node_coordinates)
+    #Set the cells used by the link and route functions
+    def setCells(self, cells):
+        import pandas as pd
+        self.cells_dict = cells
+        self.cell_data = pd.DataFrame.from_dict(cells)
 
-cell_data = pd.DataFrame.from_dict(cells_dict)
+    #Empty the link and route data collected from previous routes
+    def resetRouteData(self):
+        for data_dict in (self.links_dict, self.routes_data_dict, self.demand_dict):
+            for key in data_dict:
+                data_dict[key].clear()
 
-#Generate the cell Data
-cell_data.to_csv(os.path.join(FILE_CREATION_PATH_CELLS, CELL_FILE_NAME + FILE_FORMAT), index=False)
-
-# ------------------------------------ Blockage File ------------------------------------------------------#
-
-blockage_dict = {'cellName':[], 'startTime':[], 'endTime':[], 'percentage':[]}
-
-#Defalt is set to 0% blockage and 0 as start and end time in seconds
-blockage_dict['cellName'] = cells_dict['cellName']
-blockage_dict['startTime'] = [0 for _ in range(len(blockage_dict['cellName']))]
-blockage_dict['endTime'] = [0 for _ in range(len(blockage_dict['cellName']))]
-blockage_dict['percentage'] = [0 for _ in range(len(blockage_dict['cellName']))]
-
-blockage_data = pd.DataFrame.from_dict(blockage_dict)
-
-#Generate the cell blockage list file
-blockage_data.to_csv(os.path.join(FILE_CREATION_PATH_BLOCKAGE, BLOCKAGE_FILE_NAME  + FILE_FORMAT), index=False)
+#Get the street data from the Open Street Map library or generate a synthetic network around START_POINT
+def loadGraph(ctx):
+    if ctx.SYNTHETIC_NETWORK is None:
+        import osmnx as ox
+        return ox.graph_from_point(ctx.START_POINT,distance=ctx.DISTANCE_RANGE, distance_type='network', network_type='walk')
+    from synthetic_network import generateNetwork
+    seed = ctx.SYNTHETIC_NETWORK[2] if len(ctx.SYNTHETIC_NETWORK) > 2 else None
+    return generateNetwork(ctx.SYNTHETIC_NETWORK[0], ctx.SYNTHETIC_NETWORK[1], center=ctx.START_POINT, seed=seed)
 
 # -------------------------- Code for generating the links -------------------------------------------------#
 
-links_dict = {'cellName':[], 'origCellName':[], 'destCellName':[], 'length':[], 'streamOrig':[], 'streamDest':[], 'boolean bi-directional':[]}
-
 #Check if a particular cell exists in the system
-def isCellExists(cellName):
-    if cellName in cells_dict['cellName']:
+def isCellExists(ctx, cellName):
+    if cellName in ctx.cells_dict['cellName']:
         return True
     return False
 
 #Generate the data related to links connecting the cells in a path
-def createLinksData(node_list):
+def createLinksData(ctx, node_list):
+    links_dict, cell_data = ctx.links_dict, ctx.cell_data
     temp_list = []
     for i in range(len(node_list) -1):
         tmp1 = str(node_list[i]) + str(node_list[i+1])
@@ -274,7 +369,7 @@ def createLinksData(node_list):
             tmp = tmp2
         # for staright line path x-x-x 
         for j in range(count):                           # ending with -2 to keep the dest within the limit of count
-            if (isCellExists('C'+tmp+str(j+2)) and isCellExists('C'+tmp+str(j)) and isCellExists('C'+tmp+str(j+4))):
+            if (isCellExists(ctx, 'C'+tmp+str(j+2)) and isCellExists(ctx, 'C'+tmp+str(j)) and isCellExists(ctx, 'C'+tmp+str(j+4))):
                 links_dict['cellName'].append('C'+tmp+str(j+2))
                 links_dict['origCellName'].append('C'+tmp+str(j))
                 links_dict['destCellName'].append('C'+tmp+str(j+4))
@@ -286,7 +381,7 @@ def createLinksData(node_list):
         #                         |
         #                         x
         for j in range(1, count, 2):                           # starting with 1 since the origin is not in -ve, for odd j
-            if (isCellExists('C'+tmp+str(j+2)) and isCellExists('C'+tmp+str(j)) and isCellExists('C'+tmp+str(j+1))):
+            if (isCellExists(ctx, 'C'+tmp+str(j+2)) and isCellExists(ctx, 'C'+tmp+str(j)) and isCellExists(ctx, 'C'+tmp+str(j+1))):
                 links_dict['cellName'].append('C'+tmp+str(j+2))
                 links_dict['origCellName'].append('C'+tmp+str(j))
                 links_dict['destCellName'].append('C'+tmp+str(j+1))
@@ -298,7 +393,7 @@ def createLinksData(node_list):
         #                       |
         # for curving up path x-x
         for j in range(0, count, 2):                           # for even j
-            if (isCellExists('C'+tmp+str(j+2)) and isCellExists('C'+tmp+str(j)) and isCellExists('C'+tmp+str(j+3))):
+            if (isCellExists(ctx, 'C'+tmp+str(j+2)) and isCellExists(ctx, 'C'+tmp+str(j)) and isCellExists(ctx, 'C'+tmp+str(j+3))):
                 links_dict['cellName'].append('C'+tmp+str(j+2))
                 links_dict['origCellName'].append('C'+tmp+str(j))
                 links_dict['destCellName'].append('C'+tmp+str(j+3))
@@ -310,7 +405,7 @@ def createLinksData(node_list):
         #                     |
         # for curving up path x-x
         for j in range(1, count, 2):                           # starting with 1 since the origin is not in -ve, for odd j
-            if (isCellExists('C'+tmp+str(j-1)) and isCellExists('C'+tmp+str(j)) and isCellExists('C'+tmp+str(j+1))):
+            if (isCellExists(ctx, 'C'+tmp+str(j-1)) and isCellExists(ctx, 'C'+tmp+str(j)) and isCellExists(ctx, 'C'+tmp+str(j+1))):
                 links_dict['cellName'].append('C'+tmp+str(j-1))
                 links_dict['origCellName'].append('C'+tmp+str(j))
                 links_dict['destCellName'].append('C'+tmp+str(j+1))
@@ -322,7 +417,7 @@ def createLinksData(node_list):
         #                       |
         #                       x
         for j in range(0, count, 2):                           # for even j
-            if (isCellExists('C'+tmp+str(j+1)) and isCellExists('C'+tmp+str(j)) and isCellExists('C'+tmp+str(j+3))):
+            if (isCellExists(ctx, 'C'+tmp+str(j+1)) and isCellExists(ctx, 'C'+tmp+str(j)) and isCellExists(ctx, 'C'+tmp+str(j+3))):
                 links_dict['cellName'].append('C'+tmp+str(j+1))
                 links_dict['origCellName'].append('C'+tmp+str(j))
                 links_dict['destCellName'].append('C'+tmp+str(j+3))
@@ -332,7 +427,8 @@ def createLinksData(node_list):
                 links_dict['boolean bi-directional'].append(BI_DIRECTION)
 
 #Generate the data related to links connecting the cells of 2 different path in a route
-def createRoadIntersections(node_list):
+def createRoadIntersections(ctx, node_list):
+    links_dict, cell_data = ctx.links_dict, ctx.cell_data
     temp_list = []
     for i in range(len(node_list) -2):
         isReverse1 = 0
@@ -355,7 +451,7 @@ def createRoadIntersections(node_list):
             isReverse2 = 1
         if isReverse1 == 0 and isReverse2 == 0:
             #case1-a
-            if (isCellExists('C'+tmp_1+str(count_1-1)) and isCellExists('C'+tmp_1+str(count_1-3)) and isCellExists('C'+tmp_2+str(1))):
+            if (isCellExists(ctx, 'C'+tmp_1+str(count_1-1)) and isCellExists(ctx, 'C'+tmp_1+str(count_1-3)) and isCellExists(ctx, 'C'+tmp_2+str(1))):
                 links_dict['cellName'].append('C'+tmp_1+str(count_1-1))
                 links_dict['origCellName'].append('C'+tmp_1+str(count_1-3))
                 links_dict['destCellName'].append('C'+tmp_2+str(1))
@@ -364,7 +460,7 @@ def createRoadIntersections(node_list):
                 links_dict['streamDest'].append('E')
                 links_dict['boolean bi-directional'].append(BI_DIRECTION)
             #case1-b
-            if (isCellExists('C'+tmp_1+str(count_1-2)) and isCellExists('C'+tmp_1+str(count_1-4)) and isCellExists('C'+tmp_2+str(0))):
+            if (isCellExists(ctx, 'C'+tmp_1+str(count_1-2)) and isCellExists(ctx, 'C'+tmp_1+str(count_1-4)) and isCellExists(ctx, 'C'+tmp_2+str(0))):
                 links_dict['cellName'].append('C'+tmp_1+str(count_1-2))
                 links_dict['origCellName'].append('C'+tmp_1+str(count_1-4))
                 links_dict['destCellName'].append('C'+tmp_2+str(0))
@@ -373,7 +469,7 @@ def createRoadIntersections(node_list):
                 links_dict['streamDest'].append('E')
                 links_dict['boolean bi-directional'].append(BI_DIRECTION)
             #case2
-            if (isCellExists('C'+tmp_2+str(0)) and isCellExists('C'+tmp_1+str(count_1-2)) and isCellExists('C'+tmp_2+str(1))):
+            if (isCellExists(ctx, 'C'+tmp_2+str(0)) and isCellExists(ctx, 'C'+tmp_1+str(count_1-2)) and isCellExists(ctx, 'C'+tmp_2+str(1))):
                 links_dict['cellName'].append('C'+tmp_2+str(0))
                 links_dict['origCellName'].append('C'+tmp_1+str(count_1-2))
                 links_dict['destCellName'].append('C'+tmp_2+str(1))
@@ -382,7 +478,7 @@ def createRoadIntersections(node_list):
                 links_dict['streamDest'].append('N')
                 links_dict['boolean bi-directional'].append(BI_DIRECTION)
             #case3
-            if (isCellExists('C'+tmp_2+str(1)) and isCellExists('C'+tmp_1+str(count_1-1)) and isCellExists('C'+tmp_2+str(0))):
+            if (isCellExists(ctx, 'C'+tmp_2+str(1)) and isCellExists(ctx, 'C'+tmp_1+str(count_1-1)) and isCellExists(ctx, 'C'+tmp_2+str(0))):
                 links_dict['cellName'].append('C'+tmp_2+str(1))
                 links_dict['origCellName'].append('C'+tmp_1+str(count_1-1))
                 links_dict['destCellName'].append('C'+tmp_2+str(0))
@@ -391,7 +487,7 @@ def createRoadIntersections(node_list):
                 links_dict['streamDest'].append('S')
                 links_dict['boolean bi-directional'].append(BI_DIRECTION)
             #case4
-            if (isCellExists('C'+tmp_1+str(count_1-2)) and isCellExists('C'+tmp_1+str(count_1-1)) and isCellExists('C'+tmp_2+str(0))):
+            if (isCellExists(ctx, 'C'+tmp_1+str(count_1-2)) and isCellExists(ctx, 'C'+tmp_1+str(count_1-1)) and isCellExists(ctx, 'C'+tmp_2+str(0))):
                 links_dict['cellName'].append('C'+tmp_1+str(count_1-2))
                 links_dict['origCellName'].append('C'+tmp_1+str(count_1-1))
                 links_dict['destCellName'].append('C'+tmp_2+str(0))
@@ -400,7 +496,7 @@ def createRoadIntersections(node_list):
                 links_dict['streamDest'].append('E')
                 links_dict['boolean bi-directional'].append(BI_DIRECTION)
             #case5
-            if (isCellExists('C'+tmp_1+str(count_1-1)) and isCellExists('C'+tmp_1+str(count_1-2)) and isCellExists('C'+tmp_2+str(1))):
+            if (isCellExists(ctx, 'C'+tmp_1+str(count_1-1)) and isCellExists(ctx, 'C'+tmp_1+str(count_1-2)) and isCellExists(ctx, 'C'+tmp_2+str(1))):
                 links_dict['cellName'].append('C'+tmp_1+str(count_1-1))
                 links_dict['origCellName'].append('C'+tmp_1+str(count_1-2))
                 links_dict['destCellName'].append('C'+tmp_2+str(1))
@@ -410,7 +506,7 @@ def createRoadIntersections(node_list):
                 links_dict['boolean bi-directional'].append(BI_DIRECTION)
         if isReverse1 == 1 and isReverse2 == 0:
             #case1-a
-            if (isCellExists('C'+tmp_1+str(1)) and isCellExists('C'+tmp_1+str(3)) and isCellExists('C'+tmp_2+str(1))):
+            if (isCellExists(ctx, 'C'+tmp_1+str(1)) and isCellExists(ctx, 'C'+tmp_1+str(3)) and isCellExists(ctx, 'C'+tmp_2+str(1))):
                 links_dict['cellName'].append('C'+tmp_1+str(1))
                 links_dict['origCellName'].append('C'+tmp_1+str(3))
                 links_dict['destCellName'].append('C'+tmp_2+str(1))
@@ -419,7 +515,7 @@ def createRoadIntersections(node_list):
                 links_dict['streamDest'].append('E')
                 links_dict['boolean bi-directional'].append(BI_DIRECTION)
             #case1-b
-            if (isCellExists('C'+tmp_1+str(0)) and isCellExists('C'+tmp_1+str(2)) and isCellExists('C'+tmp_2+str(0))):
+            if (isCellExists(ctx, 'C'+tmp_1+str(0)) and isCellExists(ctx, 'C'+tmp_1+str(2)) and isCellExists(ctx, 'C'+tmp_2+str(0))):
                 links_dict['cellName'].append('C'+tmp_1+str(0))
                 links_dict['origCellName'].append('C'+tmp_1+str(2))
                 links_dict['destCellName'].append('C'+tmp_2+str(0))
@@ -428,7 +524,7 @@ def createRoadIntersections(node_list):
                 links_dict['streamDest'].append('E')
                 links_dict['boolean bi-directional'].append(BI_DIRECTION)
             #case2
-            if (isCellExists('C'+tmp_2+str(0)) and isCellExists('C'+tmp_1+str(0)) and isCellExists('C'+tmp_2+str(1))):
+            if (isCellExists(ctx, 'C'+tmp_2+str(0)) and isCellExists(ctx, 'C'+tmp_1+str(0)) and isCellExists(ctx, 'C'+tmp_2+str(1))):
                 links_dict['cellName'].append('C'+tmp_2+str(0))
                 links_dict['origCellName'].append('C'+tmp_1+str(0))
                 links_dict['destCellName'].append('C'+tmp_2+str(1))
@@ -437,7 +533,7 @@ def createRoadIntersections(node_list):
                 links_dict['streamDest'].append('N')
                 links_dict['boolean bi-directional'].append(BI_DIRECTION)
             #case3
-            if (isCellExists('C'+tmp_2+str(1)) and isCellExists('C'+tmp_1+str(1)) and isCellExists('C'+tmp_2+str(0))):
+            if (isCellExists(ctx, 'C'+tmp_2+str(1)) and isCellExists(ctx, 'C'+tmp_1+str(1)) and isCellExists(ctx, 'C'+tmp_2+str(0))):
                 links_dict['cellName'].append('C'+tmp_2+str(1))
                 links_dict['origCellName'].append('C'+tmp_1+str(1))
                 links_dict['destCellName'].append('C'+tmp_2+str(0))
@@ -446,7 +542,7 @@ def createRoadIntersections(node_list):
                 links_dict['streamDest'].append('S')
                 links_dict['boolean bi-directional'].append(BI_DIRECTION)
             #case4
-            if (isCellExists('C'+tmp_1+str(0)) and isCellExists('C'+tmp_1+str(1)) and isCellExists('C'+tmp_2+str(0))):
+            if (isCellExists(ctx, 'C'+tmp_1+str(0)) and isCellExists(ctx, 'C'+tmp_1+str(1)) and isCellExists(ctx, 'C'+tmp_2+str(0))):
                 links_dict['cellName'].append('C'+tmp_1+str(0))
                 links_dict['origCellName'].append('C'+tmp_1+str(1))
                 links_dict['destCellName'].append('C'+tmp_2+str(0))
@@ -455,7 +551,7 @@ def createRoadIntersections(node_list):
                 links_dict['streamDest'].append('E')
                 links_dict['boolean bi-directional'].append(BI_DIRECTION)
             #case5
-            if (isCellExists('C'+tmp_1+str(0)) and isCellExists('C'+tmp_1+str(1)) and isCellExists('C'+tmp_2+str(1))):
+            if (isCellExists(ctx, 'C'+tmp_1+str(0)) and isCellExists(ctx, 'C'+tmp_1+str(1)) and isCellExists(ctx, 'C'+tmp_2+str(1))):
                 links_dict['cellName'].append('C'+tmp_1+str(1))
                 links_dict['origCellName'].append('C'+tmp_1+str(0))
                 links_dict['destCellName'].append('C'+tmp_2+str(1))
@@ -465,7 +561,7 @@ def createRoadIntersections(node_list):
                 links_dict['boolean bi-directional'].append(BI_DIRECTION)
         if isReverse1 == 0 and isReverse2 == 1:
             #case1-a
-            if (isCellExists('C'+tmp_1+str(count_1-1)) and isCellExists('C'+tmp_1+str(count_1-3)) and isCellExists('C'+tmp_2+str(count_2-1))):
+            if (isCellExists(ctx, 'C'+tmp_1+str(count_1-1)) and isCellExists(ctx, 'C'+tmp_1+str(count_1-3)) and isCellExists(ctx, 'C'+tmp_2+str(count_2-1))):
                 links_dict['cellName'].append('C'+tmp_1+str(count_1-1))
                 links_dict['origCellName'].append('C'+tmp_1+str(count_1-3))
                 links_dict['destCellName'].append('C'+tmp_2+str(count_2-1))
@@ -474,7 +570,7 @@ def createRoadIntersections(node_list):
                 links_dict['streamDest'].append('E')
                 links_dict['boolean bi-directional'].append(BI_DIRECTION)
             #case1-b
-            if (isCellExists('C'+tmp_1+str(count_1-2)) and isCellExists('C'+tmp_1+str(count_1-4)) and isCellExists('C'+tmp_2+str(count_2-2))):
+            if (isCellExists(ctx, 'C'+tmp_1+str(count_1-2)) and isCellExists(ctx, 'C'+tmp_1+str(count_1-4)) and isCellExists(ctx, 'C'+tmp_2+str(count_2-2))):
                 links_dict['cellName'].append('C'+tmp_1+str(count_1-2))
                 links_dict['origCellName'].append('C'+tmp_1+str(count_1-4))
                 links_dict['destCellName'].append('C'+tmp_2+str(count_2-2))
@@ -483,7 +579,7 @@ def createRoadIntersections(node_list):
                 links_dict['streamDest'].append('E')
                 links_dict['boolean bi-directional'].append(BI_DIRECTION)
             #case2
-            if (isCellExists('C'+tmp_2+str(count_2-2)) and isCellExists('C'+tmp_1+str(count_1-2)) and isCellExists('C'+tmp_2+str(count_2-1))):
+            if (isCellExists(ctx, 'C'+tmp_2+str(count_2-2)) and isCellExists(ctx, 'C'+tmp_1+str(count_1-2)) and isCellExists(ctx, 'C'+tmp_2+str(count_2-1))):
                 links_dict['cellName'].append('C'+tmp_2+str(count_2-2))
                 links_dict['origCellName'].append('C'+tmp_1+str(count_1-2))
                 links_dict['destCellName'].append('C'+tmp_2+str(count_2-1))
@@ -492,7 +588,7 @@ def createRoadIntersections(node_list):
                 links_dict['streamDest'].append('N')
                 links_dict['boolean bi-directional'].append(BI_DIRECTION)
             #case3
-            if (isCellExists('C'+tmp_2+str(count_2-1)) and isCellExists('C'+tmp_1+str(count_1-1)) and isCellExists('C'+tmp_2+str(count_2-2))):
+            if (isCellExists(ctx, 'C'+tmp_2+str(count_2-1)) and isCellExists(ctx, 'C'+tmp_1+str(count_1-1)) and isCellExists(ctx, 'C'+tmp_2+str(count_2-2))):
                 links_dict['cellName'].append('C'+tmp_2+str(count_2-1))
                 links_dict['origCellName'].append('C'+tmp_1+str(count_1-1))
                 links_dict['destCellName'].append('C'+tmp_2+str(count_2-2))
@@ -501,7 +597,7 @@ def createRoadIntersections(node_list):
                 links_dict['streamDest'].append('S')
                 links_dict['boolean bi-directional'].append(BI_DIRECTION)
             #case4
-            if (isCellExists('C'+tmp_1+str(count_1-1)) and isCellExists('C'+tmp_1+str(count_1-2)) and isCellExists('C'+tmp_2+str(count_2-2))):
+            if (isCellExists(ctx, 'C'+tmp_1+str(count_1-1)) and isCellExists(ctx, 'C'+tmp_1+str(count_1-2)) and isCellExists(ctx, 'C'+tmp_2+str(count_2-2))):
                 links_dict['cellName'].append('C'+tmp_1+str(count_1-1))
                 links_dict['origCellName'].append('C'+tmp_1+str(count_1-2))
                 links_dict['destCellName'].append('C'+tmp_2+str(count_2-2))
@@ -510,7 +606,7 @@ def createRoadIntersections(node_list):
                 links_dict['streamDest'].append('E')
                 links_dict['boolean bi-directional'].append(BI_DIRECTION)
             #case5
-            if (isCellExists('C'+tmp_1+str(count_1-1)) and isCellExists('C'+tmp_1+str(count_1-2)) and isCellExists('C'+tmp_2+str(count_2-2))):
+            if (isCellExists(ctx, 'C'+tmp_1+str(count_1-1)) and isCellExists(ctx, 'C'+tmp_1+str(count_1-2)) and isCellExists(ctx, 'C'+tmp_2+str(count_2-2))):
                 links_dict['cellName'].append('C'+tmp_1+str(count_1-1))
                 links_dict['origCellName'].append('C'+tmp_1+str(count_1-2))
                 links_dict['destCellName'].append('C'+tmp_2+str(count_2-2))
@@ -520,7 +616,7 @@ def createRoadIntersections(node_list):
                 links_dict['boolean bi-directional'].append(BI_DIRECTION)
         if isReverse1 == 1 and isReverse2 == 1:
             #case1-a
-            if (isCellExists('C'+tmp_1+str(1)) and isCellExists('C'+tmp_1+str(3)) and isCellExists('C'+tmp_2+str(count_2-1))):
+            if (isCellExists(ctx, 'C'+tmp_1+str(1)) and isCellExists(ctx, 'C'+tmp_1+str(3)) and isCellExists(ctx, 'C'+tmp_2+str(count_2-1))):
                 links_dict['cellName'].append('C'+tmp_1+str(1))
                 links_dict['origCellName'].append('C'+tmp_1+str(3))
                 links_dict['destCellName'].append('C'+tmp_2+str(count_2-1))
@@ -529,7 +625,7 @@ def createRoadIntersections(node_list):
                 links_dict['streamDest'].append('E')
                 links_dict['boolean bi-directional'].append(BI_DIRECTION)
             #case1-b
-            if (isCellExists('C'+tmp_1+str(0)) and isCellExists('C'+tmp_1+str(2)) and isCellExists('C'+tmp_2+str(count_2-2))):
+            if (isCellExists(ctx, 'C'+tmp_1+str(0)) and isCellExists(ctx, 'C'+tmp_1+str(2)) and isCellExists(ctx, 'C'+tmp_2+str(count_2-2))):
                 links_dict['cellName'].append('C'+tmp_1+str(0))
                 links_dict['origCellName'].append('C'+tmp_1+str(2))
                 links_dict['destCellName'].append('C'+tmp_2+str(count_2-2))
@@ -538,7 +634,7 @@ def createRoadIntersections(node_list):
                 links_dict['streamDest'].append('E')
                 links_dict['boolean bi-directional'].append(BI_DIRECTION)
             #case2
-            if (isCellExists('C'+tmp_2+str(count_2-2)) and isCellExists('C'+tmp_1+str(0)) and isCellExists('C'+tmp_2+str(count_2-1))):
+            if (isCellExists(ctx, 'C'+tmp_2+str(count_2-2)) and isCellExists(ctx, 'C'+tmp_1+str(0)) and isCellExists(ctx, 'C'+tmp_2+str(count_2-1))):
                 links_dict['cellName'].append('C'+tmp_2+str(count_2-2))
                 links_dict['origCellName'].append('C'+tmp_1+str(0))
                 links_dict['destCellName'].append('C'+tmp_2+str(count_2-1))
@@ -547,7 +643,7 @@ def createRoadIntersections(node_list):
                 links_dict['streamDest'].append('N')
                 links_dict['boolean bi-directional'].append(BI_DIRECTION)
             #case3
-            if (isCellExists('C'+tmp_2+str(count_2-1)) and isCellExists('C'+tmp_1+str(1)) and isCellExists('C'+tmp_2+str(count_2-2))):
+            if (isCellExists(ctx, 'C'+tmp_2+str(count_2-1)) and isCellExists(ctx, 'C'+tmp_1+str(1)) and isCellExists(ctx, 'C'+tmp_2+str(count_2-2))):
                 links_dict['cellName'].append('C'+tmp_2+str(count_2-1))
                 links_dict['origCellName'].append('C'+tmp_1+str(1))
                 links_dict['destCellName'].append('C'+tmp_2+str(count_2-2))
@@ -556,7 +652,7 @@ def createRoadIntersections(node_list):
                 links_dict['streamDest'].append('S')
                 links_dict['boolean bi-directional'].append(BI_DIRECTION)
             #case4
-            if (isCellExists('C'+tmp_1+str(0)) and isCellExists('C'+tmp_1+str(1)) and isCellExists('C'+tmp_2+str(count_2-2))):
+            if (isCellExists(ctx, 'C'+tmp_1+str(0)) and isCellExists(ctx, 'C'+tmp_1+str(1)) and isCellExists(ctx, 'C'+tmp_2+str(count_2-2))):
                 links_dict['cellName'].append('C'+tmp_1+str(0))
                 links_dict['origCellName'].append('C'+tmp_1+str(1))
                 links_dict['destCellName'].append('C'+tmp_2+str(count_2-2))
@@ -565,7 +661,7 @@ def createRoadIntersections(node_list):
                 links_dict['streamDest'].append('E')
                 links_dict['boolean bi-directional'].append(BI_DIRECTION)
             #case5
-            if (isCellExists('C'+tmp_1+str(1)) and isCellExists('C'+tmp_1+str(0)) and isCellExists('C'+tmp_2+str(count_2-1))):
+            if (isCellExists(ctx, 'C'+tmp_1+str(1)) and isCellExists(ctx, 'C'+tmp_1+str(0)) and isCellExists(ctx, 'C'+tmp_2+str(count_2-1))):
                 links_dict['cellName'].append('C'+tmp_1+str(1))
                 links_dict['origCellName'].append('C'+tmp_1+str(0))
                 links_dict['destCellName'].append('C'+tmp_2+str(count_2-1))
@@ -575,7 +671,8 @@ def createRoadIntersections(node_list):
                 links_dict['boolean bi-directional'].append(BI_DIRECTION)
 
 #Generate the data related to links connecting the origin and destination cells
-def createPathEnds(node_list):
+def createPathEnds(ctx, node_list):
+    links_dict, cell_data = ctx.links_dict, ctx.cell_data
     #origin cells
     tmp1 = str(node_list[0]) + str(node_list[1])
     tmp2 = str(node_list[1]) + str(node_list[0])
@@ -587,7 +684,7 @@ def createPathEnds(node_list):
         tmp_1 = tmp2
         isReverse = 1
     if isReverse == 0:
-        if (isCellExists('C'+tmp_1+str(0)) and isCellExists('C'+tmp_1+str(2))):
+        if (isCellExists(ctx, 'C'+tmp_1+str(0)) and isCellExists(ctx, 'C'+tmp_1+str(2))):
             links_dict['cellName'].append('C'+tmp_1+str(0))
             links_dict['origCellName'].append('none')
             links_dict['destCellName'].append('C'+tmp_1+str(2))
@@ -595,7 +692,7 @@ def createPathEnds(node_list):
             links_dict['streamOrig'].append('W')
             links_dict['streamDest'].append('E')
             links_dict['boolean bi-directional'].append(BI_DIRECTION)
-        if (isCellExists('C'+tmp_1+str(1)) and isCellExists('C'+tmp_1+str(3))):
+        if (isCellExists(ctx, 'C'+tmp_1+str(1)) and isCellExists(ctx, 'C'+tmp_1+str(3))):
             links_dict['cellName'].append('C'+tmp_1+str(1))
             links_dict['origCellName'].append('none')
             links_dict['destCellName'].append('C'+tmp_1+str(3))
@@ -604,7 +701,7 @@ def createPathEnds(node_list):
             links_dict['streamDest'].append('E')
             links_dict['boolean bi-directional'].append(BI_DIRECTION)
     else:
-        if (isCellExists('C'+tmp_1+str(count_1 - 1)) and isCellExists('C'+tmp_1+str(count_1 - 3))):
+        if (isCellExists(ctx, 'C'+tmp_1+str(count_1 - 1)) and isCellExists(ctx, 'C'+tmp_1+str(count_1 - 3))):
             links_dict['cellName'].append('C'+tmp_1+str(count_1 - 1))
             links_dict['origCellName'].append('none')
             links_dict['destCellName'].append('C'+tmp_1+str(count_1 - 3))
@@ -612,7 +709,7 @@ def createPathEnds(node_list):
             links_dict['streamOrig'].append('W')
             links_dict['streamDest'].append('E')
             links_dict['boolean bi-directional'].append(BI_DIRECTION)
-        if (isCellExists('C'+tmp_1+str(count_1 - 2)) and isCellExists('C'+tmp_1+str(count_1 - 4))):
+        if (isCellExists(ctx, 'C'+tmp_1+str(count_1 - 2)) and isCellExists(ctx, 'C'+tmp_1+str(count_1 - 4))):
             links_dict['cellName'].append('C'+tmp_1+str(count_1 - 2))
             links_dict['origCellName'].append('none')
             links_dict['destCellName'].append('C'+tmp_1+str(count_1 - 4))
@@ -631,7 +728,7 @@ def createPathEnds(node_list):
         tmp_1 = tmp2
         isReverse = 1
     if isReverse == 0:
-        if (isCellExists('C'+tmp_1+str(0)) and isCellExists('C'+tmp_1+str(2))):
+        if (isCellExists(ctx, 'C'+tmp_1+str(0)) and isCellExists(ctx, 'C'+tmp_1+str(2))):
             links_dict['cellName'].append('C'+tmp_1+str(count_1 - 1))
             links_dict['origCellName'].append('C'+tmp_1+str(count_1 - 3))
             links_dict['destCellName'].append('none')
@@ -639,7 +736,7 @@ def createPathEnds(node_list):
             links_dict['streamOrig'].append('W')
             links_dict['streamDest'].append('E')
             links_dict['boolean bi-directional'].append(BI_DIRECTION)
-        if (isCellExists('C'+tmp_1+str(1)) and isCellExists('C'+tmp_1+str(3))):
+        if (isCellExists(ctx, 'C'+tmp_1+str(1)) and isCellExists(ctx, 'C'+tmp_1+str(3))):
             links_dict['cellName'].append('C'+tmp_1+str(count_1 - 2))
             links_dict['origCellName'].append('C'+tmp_1+str(count_1 - 4))
             links_dict['destCellName'].append('none')
@@ -648,7 +745,7 @@ def createPathEnds(node_list):
             links_dict['streamDest'].append('E')
             links_dict['boolean bi-directional'].append(BI_DIRECTION)
     else:
-        if (isCellExists('C'+tmp_1+str(0)) and isCellExists('C'+tmp_1+str(2))):
+        if (isCellExists(ctx, 'C'+tmp_1+str(0)) and isCellExists(ctx, 'C'+tmp_1+str(2))):
             links_dict['cellName'].append('C'+tmp_1+str(0))
             links_dict['origCellName'].append('C'+tmp_1+str(2))
             links_dict['destCellName'].append('none')
@@ -656,7 +753,7 @@ def createPathEnds(node_list):
             links_dict['streamOrig'].append('W')
             links_dict['streamDest'].append('E')
             links_dict['boolean bi-directional'].append(BI_DIRECTION)
-        if (isCellExists('C'+tmp_1+str(1)) and isCellExists('C'+tmp_1+str(3))):
+        if (isCellExists(ctx, 'C'+tmp_1+str(1)) and isCellExists(ctx, 'C'+tmp_1+str(3))):
             links_dict['cellName'].append('C'+tmp_1+str(1))
             links_dict['origCellName'].append('C'+tmp_1+str(3))
             links_dict['destCellName'].append('none')
@@ -667,10 +764,9 @@ def createPathEnds(node_list):
 
 # -------------------------- Code for finding the routes -------------------------------------------------#
 
-routes_data_dict = {'routeName':[],'zoneSequence':[], 'distance':[]}
-
 # Get the list of zones which are part of the route
-def getZoneSequence(node_list):
+def getZoneSequence(ctx, node_list):
+    cell_data = ctx.cell_data
     temp_list = []
     for i in range(len(node_list) -1):
         flagRev = 0
@@ -690,27 +786,185 @@ def getZoneSequence(node_list):
                 temp_list.append('Z'+tmp+str(j))
     return '-'.join(str(val) for val in temp_list)
 
+#Get the graph node nearest to a "lat|long" coordinate of the OD Matrix (same great-circle rule as osmnx)
+def getNearestNode(ctx, cord):
+    from synthetic_network import nearestNode
+    point = (float(cord.split('|')[0]), float(cord.split('|')[1]))
+    return nearestNode(ctx.G4, point)
+
+#Get the route generator of ROUTE_METHOD between source and destination nodes
+#k is the number of routes that will be drawn, the contraction hierarchy is only used on the network it indexes
+def getRouteGenerator(ctx, graph, orig_node, dest_node, stats=None, k=None):
+    hierarchy = ctx.route_hierarchy if graph is ctx.G4 else None
+    if ctx.ROUTE_METHOD == 'yen':
+        return YenKShortestPaths(graph, orig_node, dest_node, 'length', stats=stats, hierarchy=hierarchy, k=k)
+    if ctx.ROUTE_METHOD in ('edge-disjoint', 'node-disjoint'):
+        return DisjointPaths(graph, orig_node, dest_node, 'length', ctx.MAX_ROUTES,
+                             nodeDisjoint=ctx.ROUTE_METHOD == 'node-disjoint', stats=stats, hierarchy=hierarchy)
+    raise ValueError("Unknown ROUTE_METHOD '{}', expected 'yen', 'edge-disjoint', 'node-disjoint' "
+                     "or 'perturbation'".format(ctx.ROUTE_METHOD))
+
 #Get the data related to routes between source and destination nodes 
-def getRouteData(orig_cord, dest_cord, serial_num):
-    orig_node = ox.get_nearest_node(G4, (float(orig_cord.split('|')[0]), float(orig_cord.split('|')[1])))
-    dest_node = ox.get_nearest_node(G4, (float(dest_cord.split('|')[0]), float(dest_cord.split('|')[1])))
-    routes_dict = {'routeName':[],'zoneSequence':[], 'distance':[]}
-    kShortestPaths = YenKShortestPaths(G4, orig_node, dest_node, 'length')
-    for i in range(MAX_ROUTES):
+def getRouteData(ctx, orig_node, dest_node, serial_num, stats=None, graph=None, overlap_stats=None):
+    routes_dict = {'routeName':[],'zoneSequence':[], 'distance':[], 'nodeList':[], 'routeIndex':[]}
+    if orig_node == dest_node:
+        #both ends snapped to the same node, there is no street to walk
+        return routes_dict
+    if ctx.ROUTE_METHOD == 'perturbation':
+        return getPerturbedRouteData(ctx, [(orig_node, dest_node)], [serial_num], stats, graph,
+                                     overlap_stats=overlap_stats)[(orig_node, dest_node)]
+    graph = ctx.G4 if graph is None else graph
+    overlap_filter = getOverlapFilter(ctx, graph, overlap_stats)
+    num_candidates = ctx.MAX_ROUTES if overlap_filter is None else max(ctx.MAX_ROUTES, ctx.MAX_CANDIDATE_ROUTES)
+    kShortestPaths = getRouteGenerator(ctx, graph, orig_node, dest_node, stats, num_candidates)
+    for candidate in range(num_candidates):
+        if len(routes_dict['nodeList']) >= ctx.MAX_ROUTES:
+            break
         try:
-            #get the cell names while finding the routes
-            kShortestPathsObject = deepcopy(kShortestPaths.next())
-            node_list = kShortestPathsObject.nodeList
-            routes_dict['zoneSequence'].append(getZoneSequence(node_list))
-            routes_dict['routeName'].append(ROUTE_CONV_NAME+str(serial_num)+str(i))
-            routes_dict['distance'].append(kShortestPathsObject.cost)
-            createLinksData(node_list)
-            createRoadIntersections(node_list)
-            createPathEnds(node_list)
-        except:
-            pass
+            #get the cell names while finding the routes, the path is only read so it is not copied
+            kShortestPathsObject = kShortestPaths.next()
+        except StopIteration:
+            break
+        node_list = kShortestPathsObject.nodeList
+        if overlap_filter is None or overlap_filter.offer(node_list):
+            appendRoute(ctx, routes_dict, serial_num, node_list, kShortestPathsObject.cost)
     return routes_dict
 
+#Add a route to the routes of an OD pair
+def appendRoute(ctx, routes_dict, serial_num, node_list, distance):
+    i = len(routes_dict['nodeList'])
+    routes_dict['zoneSequence'].append(getZoneSequence(ctx, node_list))
+    routes_dict['routeName'].append(getRouteName(ctx, serial_num, i))
+    routes_dict['distance'].append(distance)
+    routes_dict['nodeList'].append(node_list)
+    routes_dict['routeIndex'].append(i)
+
+#Name of the i-th route of an OD pair, the route number is padded so that names stay unique beyond 10 routes
+def getRouteName(ctx, serial_num, i):
+    return ROUTE_CONV_NAME+str(serial_num)+str(i).zfill(len(str(ctx.MAX_ROUTES - 1)))
+
+#Get the filter of near-duplicate routes of an OD pair, None when MAX_ROUTE_OVERLAP is not set
+def getOverlapFilter(ctx, graph, overlap_stats=None):
+    if ctx.MAX_ROUTE_OVERLAP is None:
+        return None
+    return RouteOverlapFilter(graph, ctx.MAX_ROUTE_OVERLAP, 'length', stats=overlap_stats)
+
+#Get the route data of many OD pairs from the choice sets of perturbed shortest paths, in ROUTING_WORKERS processes
+def getPerturbedRouteData(ctx, od_pairs, serial_nums, stats=None, graph=None, workers=1, overlap_stats=None):
+    from perturbation_routes import perturbedChoiceSets
+    graph = ctx.G4 if graph is None else graph
+    num_candidates = ctx.MAX_ROUTES if ctx.MAX_ROUTE_OVERLAP is None else max(ctx.MAX_ROUTES, ctx.MAX_CANDIDATE_ROUTES)
+    choice_sets, search_stats = perturbedChoiceSets(graph, od_pairs, num_candidates,
+                                                    ctx.PERTURBATION_SAMPLES, ctx.PERTURBATION_SPREAD,
+                                                    ctx.PERTURBATION_COST_RATIO, ctx.PERTURBATION_SEED, workers)
+    if stats is not None:
+        stats.add(search_stats)
+    od_routes_data = {}
+    for od_pair, serial_num in zip(od_pairs, serial_nums):
+        routes_dict = {'routeName':[],'zoneSequence':[], 'distance':[], 'nodeList':[], 'routeIndex':[]}
+        overlap_filter = getOverlapFilter(ctx, graph, overlap_stats)
+        for node_list, distance in choice_sets[od_pair]:
+            if len(routes_dict['nodeList']) >= ctx.MAX_ROUTES or len(node_list) < 2:
+                break
+            if overlap_filter is None or overlap_filter.offer(node_list):
+                appendRoute(ctx, routes_dict, serial_num, node_list, distance)
+        od_routes_data[od_pair] = routes_dict
+    return od_routes_data
+
+#Rename the routes of an OD pair computed (or cached) under another serial number
+def nameRoutes(ctx, routes_dict, serial_num):
+    routes_dict['routeName'] = [getRouteName(ctx, serial_num, i) for i in routes_dict['routeIndex']]
+    return routes_dict
+
+#Generate the links connecting the cells along a route
+def createRouteLinks(ctx, node_list):
+    createLinksData(ctx, node_list)
+    createRoadIntersections(ctx, node_list)
+    createPathEnds(ctx, node_list)
+
+#Generate the links of a route and return the rows added to links_dict
+def createRouteLinkRows(ctx, node_list):
+    start = len(ctx.links_dict['cellName'])
+    createRouteLinks(ctx, node_list)
+    return dict((key, values[start:]) for key, values in ctx.links_dict.items())
+
+#Add previously generated link rows to links_dict
+def addLinkRows(ctx, rows):
+    for key, values in rows.items():
+        ctx.links_dict[key].extend(values)
+
+#Key of the street network in the stage cache
+def graphCacheKey(ctx, cache, graph):
+    if graph is not None:
+        return cache.key('graph', graphFingerprint(graph))
+    if ctx.SYNTHETIC_NETWORK is not None:
+        import synthetic_network
+        return cache.key('graph', list(ctx.SYNTHETIC_NETWORK), ctx.START_POINT, fileFingerprint(synthetic_network.__file__))
+    return cache.key('graph', ctx.START_POINT, ctx.DISTANCE_RANGE, 'network', 'walk')
+
+#Load the state, graph and cells of the cached run writing to the output files of the context and apply its parameters
+def loadCachedRun(ctx, cache):
+    state = cache.load('run', runCacheKey(ctx, cache))
+    if state is None:
+        raise ValueError("No cached run writes to these outputs, generate them with a cache directory first")
+    ctx.configure(**state['params'])
+    graph = cache.load('graph', state['graphKey'])
+    cells = cache.load('cells', cellsCacheKey(cache, state['graphKey']))
+    if graph is None or cells is None:
+        raise ValueError("The graph or the cells of the cached run are missing from the cache")
+    return state, graph, cells
+
+#Set the contraction hierarchy of the network of the context, from the cache or built and cached
+def setRouteHierarchy(ctx, cache, graph_key):
+    from ContractionHierarchy import ContractionHierarchy
+    import ContractionHierarchy as hierarchy_module
+    import perturbation_routes
+    key = cache.key('hierarchy', graph_key, fileFingerprint(hierarchy_module.__file__, perturbation_routes.__file__))
+    ctx.route_hierarchy = cache.load('hierarchy', key)
+    if ctx.route_hierarchy is None:
+        ctx.route_hierarchy = ContractionHierarchy(ctx.G4, 'length')
+        cache.store('hierarchy', key, ctx.route_hierarchy)
+    return ctx.route_hierarchy
+
+#Fingerprint of the code computing the cells, routes and links
+def codeFingerprint():
+    import YenKShortestPaths as yen
+    import ModifiedDijkstra as dijkstra
+    import DisjointPaths as disjoint
+    import perturbation_routes as perturbation
+    return fileFingerprint(__file__, yen.__file__, dijkstra.__file__, disjoint.__file__, perturbation.__file__)
+
+#Keys of the cells, routes, links and snapped coordinates computed from a graph or from its cells
+def cellsCacheKey(cache, graph_key):
+    code_key = codeFingerprint() if cache.enabled else None
+    return cache.key('cells', graph_key, code_key, CELL_EDGE_LENGTH, NUM_CELLS_PER_WIDTH,
+                     NUM_CELLS_PER_ZONE, SURFACE_AREA_CELL, MULT_FACTOR)
+
+def routesCacheKey(ctx, cache, cells_key):
+    return cache.key('routes', cells_key, ctx.MAX_ROUTES, routeMethodKey(ctx))
+
+#Route method and the parameters its routes depend on, including the overlap filtering
+#and the contraction hierarchy, whose shortest paths can break cost ties differently
+def routeMethodKey(ctx):
+    if ctx.ROUTE_METHOD == 'perturbation':
+        method = [ctx.ROUTE_METHOD, ctx.PERTURBATION_SAMPLES, ctx.PERTURBATION_SPREAD, ctx.PERTURBATION_COST_RATIO,
+                  ctx.PERTURBATION_SEED]
+    else:
+        method = [ctx.ROUTE_METHOD, bool(ctx.USE_CONTRACTION_HIERARCHY)]
+    if ctx.MAX_ROUTE_OVERLAP is not None:
+        method += [ctx.MAX_ROUTE_OVERLAP, ctx.MAX_CANDIDATE_ROUTES]
+    return method
+
+def linksCacheKey(cache, cells_key):
+    return cache.key('links', cells_key)
+
+def snappingCacheKey(cache, graph_key):
+    return cache.key('snapping', graph_key)
+
+#Key of the state of the last run writing to the output files of the context
+def runCacheKey(ctx, cache):
+    return cache.key('run', os.path.abspath(os.path.join(ctx.FILE_CREATION_PATH_CELLS, ctx.CELL_FILE_NAME + FILE_FORMAT)))
+
 #Merge the dictionaries of all the routes
 def mergeRouteDataDict(routes_data_dict, routes_dict):
     for i in range(len(routes_dict['zoneSequence'])):
@@ -720,9 +974,6 @@ def mergeRouteDataDict(routes_data_dict, routes_dict):
     return routes_data_dict
 
 # -------------------------- Code for generating the Demand File -------------------------------------------------#
-ODMatrixList = []
-
-demand_dict = {'routeName':[], 'depTime':[], 'numPpl':[], 'travelTime':[], 'routeName2':[],'routeName3':[]}
 
 #Normalize time from time format to interger
 def getNormalizedTime(min_time, curr_time):
@@ -730,6 +981,68 @@ def getNormalizedTime(min_time, curr_time):
     nor_time  = (temp_time - min_time).seconds
     return nor_time
 
+#Fill demand_dict with one row per demand group, offering the routes of its OD pair
+def createDemandData(ctx, demand_groups, od_routes):
+    demand_dict = ctx.demand_dict
+    for group in demand_groups.itertuples(index=False):
+        route_names = od_routes[(group.origNode, group.destNode)]
+        num_routes = len(route_names)
+        if num_routes >= 1:
+            demand_dict['routeName'].append(route_names[0])
+        else:
+            demand_dict['routeName'].append('NA')
+        if num_routes >= 2:
+            demand_dict['routeName2'].append(route_names[1])           #changes made here for testing
+        else:
+            demand_dict['routeName2'].append('NA')
+        if num_routes >= 3:
+            demand_dict['routeName3'].append(route_names[2])
+        else:
+            demand_dict['routeName3'].append('NA')
+        demand_dict['numPpl'].append(str(int(group.numPpl)))
+        demand_dict['depTime'].append(str(group.depTime))
+        demand_dict['travelTime'].append(str(TRAVEL_TIME))
+
+#Write the demand, route and link files from demand_dict, routes_data_dict and links_dict
+def writeRouteFiles(ctx):
+    import pandas as pd
+    #Generate the demand file
+    demand_data = pd.DataFrame.from_dict(ctx.demand_dict)
+    demand_data.to_csv(os.path.join(ctx.FILE_CREATION_PATH_DEMAND, ctx.DEMAND_FILE_NAME + FILE_FORMAT), index=False)
+
+    #Generate the route file
+    route_data = pd.DataFrame.from_dict(ctx.routes_data_dict)
+    route_data.to_csv(os.path.join(ctx.FILE_CREATION_PATH_ROUTE, ctx.ROUTE_FILE_NAME + FILE_FORMAT), index=False)
+
+    #Generate the link file
+    links_data = pd.DataFrame.from_dict(ctx.links_dict)
+    links_data = links_data.drop_duplicates()
+    links_data.to_csv(os.path.join(ctx.FILE_CREATION_PATH_LINKS, ctx.LINKS_FILE_NAME + FILE_FORMAT), index=False)
+    return len(demand_data) + len(route_data) + len(links_data)
+
+# ------------------------------------ Blockage File ------------------------------------------------------#
+
+#Write the blockage file, blockages maps cell names to (startTime, endTime, percentage)
+def writeBlockageFile(ctx, blockages=None):
+    import pandas as pd
+    cells_dict = ctx.cells_dict
+    blockages = {} if blockages is None else blockages
+    blockage_dict = {'cellName':[], 'startTime':[], 'endTime':[], 'percentage':[]}
+
+    #Defalt is set to 0% blockage and 0 as start and end time in seconds
+    blockage_dict['cellName'] = cells_dict['cellName']
+    for cellName in cells_dict['cellName']:
+        startTime, endTime, percentage = blockages.get(cellName, (0, 0, 0))
+        blockage_dict['startTime'].append(startTime)
+        blockage_dict['endTime'].append(endTime)
+        blockage_dict['percentage'].append(percentage)
+
+    blockage_data = pd.DataFrame.from_dict(blockage_dict)
+
+    #Generate the cell blockage list file
+    blockage_data.to_csv(os.path.join(ctx.FILE_CREATION_PATH_BLOCKAGE, ctx.BLOCKAGE_FILE_NAME  + FILE_FORMAT), index=False)
+    return len(blockage_data)
+
 def getMinTime(ODMatrixList):
     min_time = dt.datetime.strptime('23:59:59', '%H:%M:%S') #highest possible time
     for row in ODMatrixList:
@@ -738,51 +1051,242 @@ def getMinTime(ODMatrixList):
             min_time = temp_time
     return min_time
 
-#Read the OD Matrix data
-with open(odMatrixFileNamePath, encoding="utf8") as dataFile:
-    data = csv.reader(dataFile, delimiter=',')
-    for row in data:
-        if '#' not in row[0]:
-            ODMatrixList.append(row)
-
-min_time = getMinTime(ODMatrixList)
-
-#Generate the Demand file data
-serial_num = 0
-for row in ODMatrixList:
-    start_time = getNormalizedTime(min_time, row[2])
-    demand = int(row[3])
-    routes_dict = getRouteData(row[0], row[1], serial_num)
-    routes_data_dict = mergeRouteDataDict(routes_data_dict, routes_dict)
-    num_routes = len(routes_dict['routeName'])
-    if num_routes >= 1:
-        demand_dict['routeName'].append(routes_dict['routeName'][0])
-    else:
-        demand_dict['routeName'].append('NA')
-    if num_routes >= 2:
-        demand_dict['routeName2'].append(routes_dict['routeName'][1])           #changes made here for testing
-    else:
-        demand_dict['routeName2'].append('NA')
-    if num_routes >= 3:
-        demand_dict['routeName3'].append(routes_dict['routeName'][2])
-    else:
-        demand_dict['routeName3'].append('NA')
-    demand_dict['numPpl'].append(str(demand))
-    demand_dict['depTime'].append(str(start_time))
-    demand_dict['travelTime'].append(str(TRAVEL_TIME))
-    serial_num = serial_num + 1
-
-#Generate the demand file
-demand_data = pd.DataFrame.from_dict(demand_dict)
-demand_data.to_csv(os.path.join(FILE_CREATION_PATH_DEMAND, DEMAND_FILE_NAME + FILE_FORMAT), index=False)
-
-#Generate the route file
-route_data = pd.DataFrame.from_dict(routes_data_dict)
-route_data.to_csv(os.path.join(FILE_CREATION_PATH_ROUTE, ROUTE_FILE_NAME + FILE_FORMAT), index=False)
-
-#Generate the link file
-links_data = pd.DataFrame.from_dict(links_dict)
-links_data = links_data.drop_duplicates()
-links_data.to_csv(os.path.join(FILE_CREATION_PATH_LINKS, LINKS_FILE_NAME + FILE_FORMAT), index=False)
-
-print("All files generated")
\ No newline at end of file
+#Run the whole generation in a context (a new one by default), on the given graph if any, and return the paths
+#of the generated files, e.g. generate(START_POINT=(-33.87, 151.21), MAX_ROUTES=5)
+def generate(graph=None, report=None, context=None, **params):
+    import pandas as pd
+    from demand_bins import aggregateDemand, binSizeForGroupCap
+    from edge_index import EdgeIndex
+    ctx = GenerationContext() if context is None else context
+    ctx.configure(**params)
+    print("Generate Data.....Do not close the window")
+    report = RunReport('mapGeoToCells') if report is None else report
+    report.info.update({'startPoint': ctx.START_POINT, 'distanceRange': ctx.DISTANCE_RANGE, 'maxRoutes': ctx.MAX_ROUTES,
+                        'routeMethod': routeMethodKey(ctx),
+                        'syntheticNetwork': ctx.SYNTHETIC_NETWORK, 'demandTimeBin': ctx.DEMAND_TIME_BIN})
+    cache = StageCache(ctx.CACHE_DIRECTORY)
+    with report.stage('graph load', unit='nodes') as stage:
+        graph_key = graphCacheKey(ctx, cache, graph)
+        G = graph
+        if G is not None and cache.enabled and not cache.contains('graph', graph_key):
+            cache.store('graph', graph_key, G)
+        if G is None:
+            G = cache.load('graph', graph_key)
+            if G is None:
+                G = loadGraph(ctx)
+                cache.store('graph', graph_key, G)
+        stage.items = G.number_of_nodes()
+        stage.count('edges', G.number_of_edges())
+    with report.stage('gdf conversion', unit='edges') as stage:
+        ctx.setNetwork(G)
+        stage.items = len(ctx.node_length)
+    if ctx.USE_CONTRACTION_HIERARCHY and ctx.ROUTE_METHOD != 'perturbation':
+        with report.stage('contraction hierarchy', unit='nodes') as stage:
+            hierarchy = setRouteHierarchy(ctx, cache, graph_key)
+            stage.items = len(hierarchy.nodes)
+            stage.count('shortcuts', hierarchy.numShortcuts)
+    ctx.resetRouteData()
+
+    with report.stage('cellization', unit='cells') as stage:
+        cells_key = cellsCacheKey(cache, graph_key)
+        cached_cells = cache.load('cells', cells_key)
+        if cached_cells is None:
+            edge_cells = []
+            cells = ctx.createCells(edge_cells=edge_cells)
+            cache.store('cells', cells_key, {'cells': cells, 'edgeCells': edge_cells})
+        else:
+            cells, edge_cells = cached_cells['cells'], cached_cells['edgeCells']
+        ctx.setCells(cells)
+        stage.items = len(ctx.cells_dict['cellName'])
+
+    with report.stage('writing cells', unit='rows') as stage:
+        #Generate the cell Data
+        ctx.cell_data.to_csv(os.path.join(ctx.FILE_CREATION_PATH_CELLS, ctx.CELL_FILE_NAME + FILE_FORMAT), index=False)
+        stage.items = len(ctx.cell_data)
+
+    with report.stage('edge index', unit='edges') as stage:
+        #Generate the index joining the cells and zones back to the OSM edges
+        stage.items = EdgeIndex.fromEdgeCells(edge_cells, G, NUM_CELLS_PER_ZONE).toFile(
+            os.path.join(ctx.FILE_CREATION_PATH_CELLS, ctx.EDGE_INDEX_FILE_NAME + FILE_FORMAT))
+
+    # ------------------------------------ Blockage File ------------------------------------------------------#
+
+    with report.stage('blockage', unit='cells') as stage:
+        stage.items = writeBlockageFile(ctx)
+
+    # -------------------------- Code for generating the Demand File -------------------------------------------------#
+
+    with report.stage('OD snapping', unit='records') as stage:
+        #Read the OD Matrix data
+        ODMatrixList = []
+        with open(ctx.odMatrixFileNamePath, encoding="utf8") as dataFile:
+            data = csv.reader(dataFile, delimiter=',')
+            for row in data:
+                if '#' not in row[0]:
+                    ODMatrixList.append(row)
+
+        min_time = getMinTime(ODMatrixList)
+
+        #Snap the OD Matrix records to the graph, reusing the coordinates snapped by previous runs
+        snap_key = snappingCacheKey(cache, graph_key)
+        snapped = cache.load('snapping', snap_key, {})
+        num_snapped = len(snapped)
+        od_dict = {'origNode':[], 'destNode':[], 'depTime':[], 'numPpl':[]}
+        for row in report.progress(ODMatrixList, label='OD records', record=stage):
+            for cord, column in ((row[0], 'origNode'), (row[1], 'destNode')):
+                if cord not in snapped:
+                    snapped[cord] = getNearestNode(ctx, cord)
+                od_dict[column].append(snapped[cord])
+            od_dict['depTime'].append(getNormalizedTime(min_time, row[2]))
+            od_dict['numPpl'].append(int(row[3]))
+        od_data = pd.DataFrame.from_dict(od_dict)
+        if len(snapped) > num_snapped:
+            cache.store('snapping', snap_key, snapped)
+        stage.count('snappedPoints', len(snapped) - num_snapped)
+
+    with report.stage('demand binning', unit='records') as stage:
+        #Aggregate the OD records of each OD pair into departure-time bins
+        time_bin = ctx.DEMAND_TIME_BIN
+        if ctx.MAX_DEMAND_GROUPS is not None and len(od_data) > 0:
+            time_bin = max(time_bin, binSizeForGroupCap(od_data, ctx.MAX_DEMAND_GROUPS))
+        demand_groups, bin_report = aggregateDemand(od_data, time_bin, anchor=ctx.DEMAND_BIN_ANCHOR)
+        stage.items = len(od_data)
+        report.info['demandBinning'] = bin_report
+    print("Demand groups: {} OD records aggregated into {} groups (bin {}s, mean shift {:.1f}s, max shift {:.0f}s)".format(
+        bin_report['numRecords'], bin_report['numGroups'], bin_report['binSize'],
+        bin_report['meanAbsShift'], bin_report['maxAbsShift']))
+
+    #Compute the routes once per OD pair
+    od_pairs = list(dict.fromkeys(zip(demand_groups['origNode'], demand_groups['destNode'])))
+    od_routes = {}
+    route_node_lists = []
+    route_stats = SearchStats()
+    overlap_stats = OverlapStats()
+    od_pair_costs = []
+    with report.stage('routing', unit='OD pairs') as stage:
+        #the routes of an OD pair only depend on the cells and on MAX_ROUTES
+        routes_key = routesCacheKey(ctx, cache, cells_key)
+        cached_routes = cache.load('routes', routes_key, {})
+        num_cached = len(cached_routes)
+        batch_routes = {}
+        if ctx.ROUTE_METHOD == 'perturbation':
+            #the choice sets are computed in one batch, spread over the worker processes by origin
+            missing = [(serial_num, od_pair) for serial_num, od_pair in enumerate(od_pairs) if od_pair not in cached_routes]
+            batch_routes = getPerturbedRouteData(ctx, [od_pair for _, od_pair in missing],
+                                                 [serial_num for serial_num, _ in missing], route_stats,
+                                                 workers=ctx.ROUTING_WORKERS, overlap_stats=overlap_stats)
+        for serial_num, od_pair in enumerate(report.progress(od_pairs, label='OD pairs', record=stage)):
+            if od_pair in cached_routes:
+                routes_dict = nameRoutes(ctx, dict(cached_routes[od_pair]), serial_num)
+                stage.count('cachedODPairs')
+            elif od_pair in batch_routes:
+                routes_dict = batch_routes[od_pair]
+                cached_routes[od_pair] = routes_dict
+            else:
+                pair_stats = SearchStats()
+                pair_start = dt.datetime.now()
+                routes_dict = getRouteData(ctx, od_pair[0], od_pair[1], serial_num, pair_stats, overlap_stats=overlap_stats)
+                od_pair_costs.append(((dt.datetime.now() - pair_start).total_seconds(), od_pair, pair_stats))
+                route_stats.add(pair_stats)
+                cached_routes[od_pair] = routes_dict
+            mergeRouteDataDict(ctx.routes_data_dict, routes_dict)
+            od_routes[od_pair] = routes_dict['routeName']
+            route_node_lists.extend(routes_dict['nodeList'])
+        if len(cached_routes) > num_cached:
+            cache.store('routes', routes_key, cached_routes)
+        stage.count('routes', len(route_node_lists))
+        for key, value in route_stats.toDict().items():
+            stage.count(key, value)
+    if ctx.MAX_ROUTE_OVERLAP is not None:
+        report.info['routeOverlap'] = dict(overlap_stats.toDict(), maxRouteOverlap=ctx.MAX_ROUTE_OVERLAP)
+        print("Route overlap: {} of {} candidate routes rejected, mean overlap of the kept routes {:.2f}".format(
+            overlap_stats.rejected, overlap_stats.candidates, report.info['routeOverlap']['meanOverlap']))
+    #the most expensive OD pairs point at pathological parts of the network
+    od_pair_costs.sort(key=lambda cost: cost[0], reverse=True)
+    report.info['slowestODPairs'] = [dict(origNode=str(od_pair[0]), destNode=str(od_pair[1]), wallTime=seconds,
+                                          **pair_stats.toDict())
+                                     for seconds, od_pair, pair_stats in od_pair_costs[:ctx.SLOWEST_OD_PAIRS]]
+
+    with report.stage('link building', unit='routes') as stage:
+        #the links of a route only depend on the cells and on its nodes
+        links_key = linksCacheKey(cache, cells_key)
+        cached_links = cache.load('links', links_key, {})
+        num_cached = len(cached_links)
+        for route_nodes in report.progress(route_node_lists, label='routes', record=stage):
+            route_key = tuple(route_nodes)
+            if route_key in cached_links:
+                addLinkRows(ctx, cached_links[route_key])
+                stage.count('cachedRoutes')
+            elif cache.enabled:
+                cached_links[route_key] = createRouteLinkRows(ctx, route_nodes)
+            else:
+                createRouteLinks(ctx, route_nodes)
+        if len(cached_links) > num_cached:
+            cache.store('links', links_key, cached_links)
+        stage.count('links', len(ctx.links_dict['cellName']))
+    if cache.enabled:
+        report.info['stageCache'] = dict(cache.summary(), directory=ctx.CACHE_DIRECTORY)
+        #what an incremental update of these outputs needs to find the artifacts of this run
+        cache.store('run', runCacheKey(ctx, cache), {'graphKey': graph_key, 'odPairs': od_pairs,
+                                                     'demandGroups': demand_groups, 'params': ctx.parameters()})
+
+    #Generate the Demand file data
+    createDemandData(ctx, demand_groups, od_routes)
+
+    with report.stage('writing', unit='rows') as stage:
+        stage.items = writeRouteFiles(ctx)
+
+    report_path = report.write(os.path.join(ctx.FILE_CREATION_PATH_CELLS, ctx.RUN_REPORT_FILE_NAME + '.json'))
+    print("All files generated")
+    return {'cells': os.path.join(ctx.FILE_CREATION_PATH_CELLS, ctx.CELL_FILE_NAME + FILE_FORMAT),
+            'blockage': os.path.join(ctx.FILE_CREATION_PATH_BLOCKAGE, ctx.BLOCKAGE_FILE_NAME + FILE_FORMAT),
+            'demand': os.path.join(ctx.FILE_CREATION_PATH_DEMAND, ctx.DEMAND_FILE_NAME + FILE_FORMAT),
+            'route': os.path.join(ctx.FILE_CREATION_PATH_ROUTE, ctx.ROUTE_FILE_NAME + FILE_FORMAT),
+            'links': os.path.join(ctx.FILE_CREATION_PATH_LINKS, ctx.LINKS_FILE_NAME + FILE_FORMAT),
+            'edgeIndex': os.path.join(ctx.FILE_CREATION_PATH_CELLS, ctx.EDGE_INDEX_FILE_NAME + FILE_FORMAT),
+            'report': report_path}
+
+#Command line entry point, the parameters not given keep the values set at the top of this file
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate the cell, link, route, demand and blockage files "
+                                                 "of StochasticAnisoPedCTM from OpenStreetMap and an OD matrix.")
+    parser.add_argument('--od', dest='odMatrixFileNamePath', help="OD matrix file")
+    parser.add_argument('--start-point', nargs=2, type=float, metavar=('LAT', 'LONG'), help="centre of the area")
+    parser.add_argument('--distance', dest='DISTANCE_RANGE', type=float, help="radius of the area in metres")
+    parser.add_argument('--max-routes', dest='MAX_ROUTES', type=int, help="number of route options per OD pair")
+    parser.add_argument('--route-method', dest='ROUTE_METHOD',
+                        choices=('yen', 'edge-disjoint', 'node-disjoint', 'perturbation'),
+                        help="k shortest routes (yen), k disjoint routes of least total length or the routes "
+                             "found on randomly perturbed edge lengths")
+    parser.add_argument('--routing-workers', dest='ROUTING_WORKERS', type=int,
+                        help="worker processes of the perturbation routes")
+    parser.add_argument('--perturbation-samples', dest='PERTURBATION_SAMPLES', type=int,
+                        help="shortest path searches per origin of the perturbation routes")
+    parser.add_argument('--perturbation-seed', dest='PERTURBATION_SEED', type=int, help="seed of the perturbations")
+    parser.add_argument('--hierarchy', dest='USE_CONTRACTION_HIERARCHY', action='store_true', default=None,
+                        help="index the network with a contraction hierarchy to speed up the routing")
+    parser.add_argument('--max-overlap', dest='MAX_ROUTE_OVERLAP', type=float,
+                        help="drop the routes sharing more than this fraction of their length with a shorter route")
+    parser.add_argument('--synthetic', nargs='+', metavar='LAYOUT NODES [SEED]',
+                        help="use a synthetic network instead of OpenStreetMap, e.g. --synthetic organic 1000 1")
+    parser.add_argument('--time-bin', dest='DEMAND_TIME_BIN', type=int, help="departure-time bin width in seconds")
+    parser.add_argument('--max-groups', dest='MAX_DEMAND_GROUPS', type=int, help="largest number of demand groups")
+    parser.add_argument('--bin-anchor', dest='DEMAND_BIN_ANCHOR', choices=('start', 'centre', 'mean'))
+    parser.add_argument('--output-dir', help="directory receiving all the generated files")
+    parser.add_argument('--cache-dir', dest='CACHE_DIRECTORY', help="stage cache directory, reruns reuse its artifacts")
+    args = parser.parse_args(argv)
+
+    params = dict((name, value) for name, value in vars(args).items() if name in PARAMETERS and value is not None)
+    if args.start_point is not None:
+        params['START_POINT'] = tuple(args.start_point)
+    if args.synthetic is not None:
+        params['SYNTHETIC_NETWORK'] = (args.synthetic[0],) + tuple(int(value) for value in args.synthetic[1:])
+    ctx = GenerationContext(**params)
+    if args.output_dir is not None:
+        ctx.setOutputDirectory(args.output_dir)
+    generate(context=ctx)
+    return 0
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,1206 @@
+"""
+module: network_loading
+-------------------------
+
+NumPy implementation of the network loading of the simulator (Board.iterate), which
+runs directly on the cell, link, route, demand and blockage files written by
+mapGeoToCells, for quick what-if checks without a round trip through the JVM.
+
+The state is a dense array of the number of people of every group on every link.
+Every time interval advances all the links at once, in the order of Board.iterate:
+blockages, departures (split over the route options of every demand row by the
+stochastic route choice of Group.performStochasticRoute), link accumulations and
+speeds from the fundamental diagram of every cell, node potentials of every route,
+sending capacities split by the logit route choice at the nodes, receiving
+capacities, propagation, and removal of the people reaching a sink link. As in the
+scenario files, the length of a time interval is CFL factor x shortest link / free
+speed and the capacities of a link are scaled by CFL factor / relative link length.
+
+The flows of one group on a link only depend on its route, so the route choice
+fractions are computed per route and target link, and the flows of all the groups
+follow from a few gathers and sums over the links grouped by node. The node
+potentials of all the routes are computed together by Bellman-Ford iterations over
+(route, link) pairs instead of one Dijkstra search per route. The groups are
+numbered by departure, and only those that have departed and still have people on
+the network are advanced.
+
+The replications of the stochastic route choice that drew the same splits so far
+follow the same flows, so they form one class that is advanced once; a class is only
+split when its replications draw different splits at a departure, and the potentials
+and route choice fractions are computed for all the classes together.
+
+Known differences with the Java simulator:
+ - the critical speed of a route at departure is averaged over the sides of the cells
+   given by the links, not over the layout computed by the visualization;
+ - the logit fractions are computed relative to the best target, so that they do not
+   underflow on long routes;
+ - the sub-groups of a demand row get the ids following the demand rows, by
+   departure, while the Java ids depend on the hash table order.
+"""
+
+import argparse
+import math
+import os
+import sys
+import time
+
+import numpy as np
+
+from fundamental_diagrams import LINK_ANGLES, SHAPE_PARAMETERS, FundamentalDiagram, readParameters
+
+#Numerical tolerance of the simulator (Parameter.absTol)
+ABS_TOL = 1e-6
+
+#The simulation stops at the latest MAX_TRAVEL_TIME intervals after the last departure
+MAX_TRAVEL_TIME = 1000
+
+#Route choice fractions below this value are set to zero (Node.getRouteChoiceFrac)
+MIN_ROUTE_FRACTION = 1e-14
+
+#Potential of the source/sink nodes that are not the destination of a route
+SOURCE_SINK_POTENTIAL = 1e10
+
+#Travel time correction for the two gate cells of a route (Group.addTravelTime)
+GATE_INTERVALS = 2
+
+
+def readTable(file_path):
+    """ The rows of an input file of the simulator, without its header line.
+
+        Like Input.getFileLines, all the white space is removed before the lines are
+        split at the commas.
+    """
+    rows = []
+    with open(file_path, encoding="utf8") as inputFile:
+        next(inputFile, None)
+        for line in inputFile:
+            line = "".join(line.split())
+            if line:
+                rows.append(line.split(","))
+    return rows
+
+
+def readScenario(file_path, root=None):
+    """ Reads a scenario file of the simulator.
+
+        Parameters
+        ----------
+        file_path : string
+            the scenario file, see examples/scenarios.
+        root : string
+            (optional) directory the input directory of the scenario is relative to,
+            the current directory by default as for the Java entry point.
+
+        Returns
+        -------
+        scenario : dictionary
+            the paths of the input files (and of the parameter search range file,
+            None without it), the fundamental diagram, the CFL factor, the
+            aggregation period of the calibration and the alpha and beta parameters
+            of the stochastic route choice.
+    """
+    values = {}
+    with open(file_path, encoding="utf8") as scenarioFile:
+        for line in scenarioFile:
+            line = "".join(line.split())
+            if not line or line.startswith("#") or ":" not in line:
+                continue
+            key, value = line.split(":", 1)
+            values[key] = value
+    missing = [key for key in ('inputdirectory', 'parameterfilename', 'linkconfigurationfilename',
+                               'cellconfigurationfilename', 'routeconfigurationfilename', 'fundamentaldiagram',
+                               'demandfilename') if key not in values]
+    if missing:
+        raise ValueError("{} is missing the entries {}".format(file_path, ", ".join(missing)))
+    if values.get('demandformat', 'aggregate') != 'aggregate':
+        raise ValueError("Only the aggregate demand format is supported, not " + values['demandformat'])
+    if values['fundamentaldiagram'] not in SHAPE_PARAMETERS:
+        raise ValueError("Unknown fundamental diagram " + values['fundamentaldiagram'])
+    inputDir = values['inputdirectory']
+    if root is not None:
+        inputDir = os.path.join(root, inputDir)
+    path = lambda key: inputDir + values[key] if values.get(key) else None
+    return {'parameters': path('parameterfilename'), 'links': path('linkconfigurationfilename'),
+            'cells': path('cellconfigurationfilename'), 'routes': path('routeconfigurationfilename'),
+            'demand': path('demandfilename'), 'blockages': path('blockageconfigurationfilename'),
+            'searchSpace': path('parametersearchrangefile'),
+            'funDiag': values['fundamentaldiagram'], 'cfl': float(values.get('CFLfactor', 1.0)),
+            'alpha': float(values.get('alpha', 0.0)), 'beta': float(values.get('beta', 0.0)),
+            'aggregationPeriod': float(values['aggregationperiod(sec)']) if values.get('aggregationperiod(sec)') else None,
+            'inputDirectory': inputDir, 'outputDirectory': values.get('outputdirectory')}
+
+
+def readBlockages(file_path):
+    """ Blockages by cell name as (startTime, endTime, percentage), the last line of a
+        cell winning as in Input.loadBlockages.
+    """
+    blockages = {}
+    if file_path is None or not os.path.exists(file_path):
+        return blockages
+    for row in readTable(file_path):
+        start, end, percentage = int(row[1]), int(row[2]), float(row[3])
+        if start > end:
+            raise ValueError("For cell {} the startTime is after the endTime".format(row[0]))
+        if percentage > 100.0:
+            raise ValueError("Blockage percentage of cell {} is above 100".format(row[0]))
+        blockages[row[0]] = (start, end, percentage)
+    return blockages
+
+
+def weightedPercentiles(values, counts, percentiles):
+    """ Percentiles of the columns of an array whose rows are repeated.
+
+        Parameters
+        ----------
+        values : numpy.ndarray
+            (rows, columns) values.
+        counts : numpy.ndarray
+            number of times every row is repeated, at least once.
+        percentiles : sequence
+            percentiles between 0 and 100.
+
+        Returns
+        -------
+        result : numpy.ndarray
+            (percentiles, columns) percentiles of the columns of the repeated rows, with
+            the linear interpolation of numpy.percentile.
+    """
+    order = np.argsort(values, axis=0, kind='stable')
+    ordered = np.take_along_axis(values, order, axis=0)
+    # rank following the last repetition of every sorted row
+    ends = np.cumsum(counts[order], axis=0)
+    n = int(counts.sum())
+    virtual = (n - 1) * (np.asarray(percentiles, dtype=float) / 100)
+    lower = np.floor(virtual)
+    columns = np.arange(values.shape[1])
+    result = np.empty((len(virtual), values.shape[1]))
+    for i, (index, gamma) in enumerate(zip(lower.astype(np.int64), virtual - lower)):
+        a = ordered[(ends <= index).sum(axis=0), columns]
+        b = ordered[(ends <= min(index + 1, n - 1)).sum(axis=0), columns]
+        # the interpolation of numpy.percentile, from the closer bound
+        result[i] = a + (b - a) * gamma if gamma < 0.5 else b - (b - a) * (1 - gamma)
+    return result
+
+
+class NetworkLoading(object):
+    """
+    Network of cells and links loaded with the demand of a scenario. run() simulates
+    it and returns a LoadingResult, and can be called again on the same network.
+    """
+
+    def __init__(self, cells_path, links_path, routes_path, demand_path, blockage_path=None,
+                 fun_diag='SbFD', params=None, cfl=1.0, alpha=0.0, beta=0.0):
+        """
+        Constructor
+
+                @param params     Dictionary of 'vf', 'shape' and 'mu' as returned by
+                                  readParameters.
+                @param cfl        CFL factor of the scenario.
+                @param alpha      Weight of critical speed / distance in the route choice.
+                @param beta       Weight of the distance in the route choice.
+        """
+        if fun_diag not in SHAPE_PARAMETERS:
+            raise ValueError("Unknown fundamental diagram " + fun_diag)
+        if not 0.0 < cfl <= 1.0:
+            raise ValueError("Invalid CFL factor ({}), valid range between 0 and 1".format(cfl))
+        self.funDiag = fun_diag
+        self.vf = float(params['vf'])
+        self.shape = [float(value) for value in params['shape']]
+        self.mu = float(params['mu'])
+        self.cfl = float(cfl)
+        self.alpha = float(alpha)
+        self.beta = float(beta)
+        self.diagram = FundamentalDiagram(fun_diag, self.shape)
+        self._loadCells(cells_path)
+        self._loadLinks(links_path)
+        self._buildNodes()
+        self._loadRoutes(routes_path)
+        self._loadDemand(demand_path)
+        self._loadBlockages(readBlockages(blockage_path))
+        self._buildStreams()
+        self._buildRouteGraphs()
+        # critical speed of the diagram (FunDiag.critValues)
+        self.fdCritVel = float(self.diagram.criticalSpeed())
+
+    @classmethod
+    def fromScenario(cls, scenario_path, root=None):
+        """ Loads the network, the parameters and the demand of a scenario file."""
+        scenario = readScenario(scenario_path, root)
+        params = readParameters(scenario['parameters'], scenario['funDiag'])
+        return cls(scenario['cells'], scenario['links'], scenario['routes'], scenario['demand'],
+                   scenario['blockages'], scenario['funDiag'], params, scenario['cfl'],
+                   scenario['alpha'], scenario['beta'])
+
+    def _loadCells(self, cells_path):
+        self.cellNames = []
+        zones = []
+        areas = []
+        for row in readTable(cells_path):
+            self.cellNames.append(row[0])
+            zones.append(row[1])
+            areas.append(float('inf') if row[2] == 'INF' else float(row[2]))
+        self.cellIndex = dict((name, i) for i, name in enumerate(self.cellNames))
+        self.cellZones = zones
+        self.cellArea = np.array(areas, dtype=float)
+
+    def _loadLinks(self, links_path):
+        """
+        Links as in Input.loadLinks: the link of line i has the id 2i, its reverse 2i + 1.
+        """
+        ids, cells, origs, dests, lengths, orients = [], [], [], [], [], []
+        for i, row in enumerate(readTable(links_path)):
+            cell, orig, dest = row[0], row[1], row[2]
+            for name in (cell, orig, dest):
+                if name != 'none' and name not in self.cellIndex or name == 'none' and name == cell:
+                    raise ValueError("Invalid cell '{}' on line {} of {}".format(name, i + 1, links_path))
+            length = float('inf') if row[3] == 'MIN' else float(row[3])
+            directions = [(orig, dest, row[4][0], row[5][0], 2 * i)]
+            if row[6] == 'true':
+                directions.append((dest, orig, row[5][0], row[4][0], 2 * i + 1))
+            for origCell, destCell, origSide, destSide, linkID in directions:
+                orient = origSide + "->" + destSide
+                if orient not in LINK_ANGLES:
+                    raise ValueError("Invalid orientation {} on line {} of {}".format(orient, i + 1, links_path))
+                ids.append(linkID)
+                cells.append(self.cellIndex[cell])
+                origs.append(origCell)
+                dests.append(destCell)
+                lengths.append(length)
+                orients.append(orient)
+        if not ids:
+            raise ValueError("No link in " + links_path)
+        lengths = np.array(lengths, dtype=float)
+        self.minLinkLength = float(lengths.min())
+        lengths[np.isinf(lengths)] = self.minLinkLength
+        self.linkIds = np.array(ids, dtype=np.int64)
+        self.linkCell = np.array(cells, dtype=np.int64)
+        self.linkOrig = origs
+        self.linkDest = dests
+        self.linkOrient = orients
+        self.relLength = lengths / self.minLinkLength
+        self.deltaT = self.cfl * self.minLinkLength / self.vf
+        if not self.deltaT > 0.0:
+            raise ValueError("Invalid CFL factor or free speed, resulting in deltaT = {}".format(self.deltaT))
+        self.sinkLinks = np.array([i for i, dest in enumerate(dests) if dest == 'none'], dtype=np.int64)
+
+    def _buildNodes(self):
+        """
+        Nodes as in Input.buildNodes: a node is the boundary between two cells (or a
+        cell and 'none'), shared by all the links crossing it.
+        """
+        nodeIndex = {}
+        nodeZones = []
+        tails, heads = [], []
+        for i in range(len(self.linkIds)):
+            cell = self.cellNames[self.linkCell[i]]
+            for pair, ends in (((self.linkOrig[i], cell), tails), ((cell, self.linkDest[i]), heads)):
+                key = frozenset(pair)
+                if key not in nodeIndex:
+                    nodeIndex[key] = len(nodeZones)
+                    nodeZones.append(set(self.cellZones[self.cellIndex[name]] for name in pair if name != 'none'))
+                ends.append(nodeIndex[key])
+        self.numNodes = len(nodeZones)
+        self.nodeZones = nodeZones
+        self.linkTail = np.array(tails, dtype=np.int64)
+        self.linkHead = np.array(heads, dtype=np.int64)
+        self.sourceSinkNodes = np.unique(self.linkHead[self.sinkLinks])
+        # links of every head and tail node, for the sums over the links of a node
+        self._headSlots = self._slots(self.linkHead)
+        self._tailSlots = self._slots(self.linkTail)
+
+    @staticmethod
+    def _slots(keys):
+        """ The links of every node split in slots, slot j holding the (nodes, links) of the
+            j-th link of the nodes with more than j links, so that a sum over the links of
+            every node takes a few row gathers.
+        """
+        order = np.argsort(keys, kind='stable')
+        counts = np.bincount(keys)
+        rank = np.arange(len(keys)) - np.repeat(np.cumsum(counts) - counts, counts)
+        return [(keys[order][rank == j], order[rank == j]) for j in range(counts.max())]
+
+    @staticmethod
+    def _paddedSlots(keys):
+        """ The distinct sorted keys and a (keys, most pairs) array of the pairs of every key,
+            padded with len(keys), so that a minimum or a sum over the pairs of every key takes
+            one gather of the pair values followed by a row of padding values.
+        """
+        unique, starts, counts = np.unique(keys, return_index=True, return_counts=True)
+        slots = np.full((len(unique), counts.max() if len(counts) else 0), len(keys))
+        slots[np.repeat(np.arange(len(unique)), counts), np.arange(len(keys)) - np.repeat(starts, counts)] = \
+            np.arange(len(keys))
+        return unique, slots
+
+    def _loadRoutes(self, routes_path):
+        """
+        Routes as in Input.loadRoutes. The nodes of a route are those of the cells of its
+        zones, the source link is the first link of the origin zone coming from 'none',
+        and the destination node is the head of a link of the destination zone going to
+        'none'.
+        """
+        self.routes = {}
+        zoneNodes = {}
+        for node, zones in enumerate(self.nodeZones):
+            for zone in zones:
+                zoneNodes.setdefault(zone, set()).add(node)
+        linkZones = [self.cellZones[cell] for cell in self.linkCell]
+        for row in readTable(routes_path):
+            name, zoneSeq = row[0], row[1].split("-")
+            if name in self.routes:
+                raise ValueError("Two or more routes with identical name " + name)
+            for zone in zoneSeq:
+                if zone not in zoneNodes:
+                    raise ValueError("Invalid zone '{}' on route {}".format(zone, name))
+            sources = [i for i in range(len(self.linkIds)) if linkZones[i] == zoneSeq[0] and self.linkOrig[i] == 'none']
+            sinks = [i for i in range(len(self.linkIds)) if linkZones[i] == zoneSeq[-1] and self.linkDest[i] == 'none']
+            if not sources or not sinks:
+                raise ValueError("Route {} has no source or sink link".format(name))
+            nodes = set()
+            for zone in zoneSeq:
+                nodes |= zoneNodes[zone]
+            self.routes[name] = {'zones': zoneSeq, 'distance': float(row[2]), 'nodes': sorted(nodes),
+                                 'sourceLink': sources[0], 'destNode': int(self.linkHead[sinks[-1]])}
+
+    def _loadDemand(self, demand_path):
+        """
+        One group per route option of every demand row. The group of the first option
+        keeps the id of its row (Input.loadAggDemand), the others get the following ids.
+        The groups are ordered by departure.
+        """
+        rows = []
+        for row in readTable(demand_path):
+            options = [row[0]] + [name for name in row[4:6] if name != 'NA']
+            for name in options:
+                if name not in self.routes:
+                    raise ValueError("Invalid route {} in {}".format(name, demand_path))
+            rows.append((options, int(row[1]), float(row[2])))
+        self.demandRows = rows
+        self.routeNames = sorted(set(name for options, _, _ in rows for name in options))
+        routeIndex = dict((name, r) for r, name in enumerate(self.routeNames))
+        groups = []
+        for row, (options, depTime, _) in enumerate(rows):
+            for option, name in enumerate(options):
+                groups.append((depTime, row, option, routeIndex[name]))
+        groups.sort(key=lambda group: (group[0], group[1], group[2]))
+        self.groupDepTime = np.array([group[0] for group in groups], dtype=np.int64)
+        self.groupRow = np.array([group[1] for group in groups], dtype=np.int64)
+        self.groupOption = np.array([group[2] for group in groups], dtype=np.int64)
+        self.groupRoute = np.array([group[3] for group in groups], dtype=np.int64)
+        ids = np.where(self.groupOption == 0, self.groupRow, 0)
+        extra = np.flatnonzero(self.groupOption > 0)
+        ids[extra] = len(rows) + np.arange(len(extra))
+        self.groupIds = ids
+
+    def _loadBlockages(self, blockages):
+        self.blockages = [(self.cellIndex[cell], start, end, percentage)
+                          for cell, (start, end, percentage) in blockages.items()
+                          if cell in self.cellIndex and percentage > 0.0]
+
+    def _buildStreams(self):
+        """
+        Streams are the (cell, orientation) pairs, whose accumulations are the input of the
+        fundamental diagrams (FunDiag.linkAcc). For SbFD, the pairs of streams of a cell and
+        the 1 - cos of their intersection angle.
+        """
+        keys = {}
+        stream = []
+        for cell, orient in zip(self.linkCell, self.linkOrient):
+            stream.append(keys.setdefault((int(cell), orient), len(keys)))
+        self.linkStream = np.array(stream, dtype=np.int64)
+        self.streamCell = np.array([cell for cell, _ in keys], dtype=np.int64)
+        angles = np.array([LINK_ANGLES[orient] for _, orient in keys], dtype=float)
+        pairs = [(s, t) for s in range(len(keys)) for t in np.flatnonzero(self.streamCell == self.streamCell[s])
+                 if t != s] if self.funDiag == 'SbFD' else []
+        self._pairStream = np.array([s for s, _ in pairs], dtype=np.int64)
+        self._pairOther = np.array([t for _, t in pairs], dtype=np.int64)
+        phi = np.radians(np.abs(angles[self._pairStream] - angles[self._pairOther]) % 360)
+        self._pairWeight = 1.0 - np.cos(phi)
+        # cell sides reached by the links, for the critical speed of the routes
+        sides = {}
+        linkSide = []
+        for i, cell in enumerate(self.linkCell):
+            linkSide.append(sides.setdefault((int(cell), self.linkOrient[i][-1], self.linkDest[i]), len(sides)))
+        self.linkSide = np.array(linkSide, dtype=np.int64)
+        self.sideCell = np.array([cell for cell, _, _ in sides], dtype=np.int64)
+        self.sideNeighbour = np.array([self.cellIndex.get(dest, -1) for _, _, dest in sides], dtype=np.int64)
+
+    def _buildRouteGraphs(self):
+        """
+        Static structure of the potentials and route choice of every route used by the
+        demand, over flat (route, node) indices r * numNodes + node.
+        """
+        n = self.numNodes
+        numRoutes = len(self.routeNames)
+        sourceSink = np.zeros(n, dtype=bool)
+        sourceSink[self.sourceSinkNodes] = True
+        self._potInit = np.full(numRoutes * n, np.inf)
+        bfTails, bfHeads, bfLinks = [], [], []
+        qRoutes, qLinks = [], []
+        self.routeSides = []
+        for r, name in enumerate(self.routeNames):
+            route = self.routes[name]
+            inRoute = np.zeros(n, dtype=bool)
+            inRoute[route['nodes']] = True
+            fixed = sourceSink.copy()
+            fixed[route['destNode']] = False
+            hasPotential = inRoute | sourceSink
+            self._potInit[r * n + np.flatnonzero(fixed)] = SOURCE_SINK_POTENTIAL
+            self._potInit[r * n + route['destNode']] = 0.0
+            # Dijkstra of PotentialField: links between nodes of the route, fixed nodes keep their potential
+            relax = np.flatnonzero(inRoute[self.linkTail] & inRoute[self.linkHead] & ~fixed[self.linkHead]
+                                   & (self.linkHead != route['destNode']))
+            bfTails.append(r * n + self.linkTail[relax])
+            bfHeads.append(r * n + self.linkHead[relax])
+            bfLinks.append(relax)
+            # route choice at the nodes with a potential, towards the links leading to one
+            choice = np.flatnonzero(hasPotential[self.linkTail] & hasPotential[self.linkHead])
+            qRoutes.append(np.full(len(choice), r, dtype=np.int64))
+            qLinks.append(choice)
+            routeCells = np.unique(self.linkCell[inRoute[self.linkTail] | inRoute[self.linkHead]])
+            self.routeSides.append(np.flatnonzero(np.isin(self.sideCell, routeCells)))
+        # the relaxed pairs are sorted by head, so that a subset of them is grouped by head
+        bfTails, bfHeads, bfLinks = np.concatenate(bfTails), np.concatenate(bfHeads), np.concatenate(bfLinks)
+        order = np.argsort(bfHeads, kind='stable')
+        self._bfTails, self._bfLinks, self._bfPairHeads = bfTails[order], bfLinks[order], bfHeads[order]
+        qRoutes, qLinks = np.concatenate(qRoutes), np.concatenate(qLinks)
+        qTails = qRoutes * n + self.linkTail[qLinks]
+        order = np.argsort(qTails, kind='stable')
+        self._qRoutes, self._qLinks, self._qTails = qRoutes[order], qLinks[order], qTails[order]
+        self._qHeads = self._qRoutes * n + self.linkHead[self._qLinks]
+        self._routeStructures = {}
+
+    def _cellArea(self, t):
+        """
+        Cell areas at interval t. Board.considerCellBlockage reduces the area at the start
+        of a blockage and restores it at its end, so a blockage whose start and end are
+        equal is never lifted.
+        """
+        area = self.cellArea.copy()
+        for cell, start, end, percentage in self.blockages:
+            if start <= t and (t < end or start == end):
+                area[cell] *= (100.0 - percentage) / 100.0
+        return area
+
+    def _availableShare(self, t):
+        """ Share of the area of every cell left by the blockages active at t (Board.fillSources)."""
+        share = np.ones(len(self.cellNames))
+        for cell, start, end, percentage in self.blockages:
+            if start <= t <= end:
+                share[cell] = 1.0 - percentage / 100.0
+        return share
+
+    @staticmethod
+    def _sumBy(index, values, size):
+        """ Sums of the columns of a (replications, n) array by index, as (replications, size)."""
+        numReps = values.shape[0]
+        flat = (np.arange(numReps)[:, None] * size + index[None, :]).ravel()
+        return np.bincount(flat, weights=values.ravel(), minlength=numReps * size).reshape(numReps, size)
+
+    def streamSpeeds(self, streamAcc, area, streams=None):
+        """ Fundamental diagram of every stream.
+
+            Parameters
+            ----------
+            streamAcc : numpy.ndarray
+                accumulation of every stream, as a (streams,) or (replications, streams)
+                array.
+            area : numpy.ndarray
+                area of every cell.
+            streams : numpy.ndarray, optional
+                sorted streams the accumulations are given for, all the streams of their
+                cells. All the streams by default.
+
+            Returns
+            -------
+            vel, critAcc, critVel : numpy.ndarray
+                non-dimensional speed, critical accumulation and critical speed of every
+                stream, with the shape of streamAcc.
+        """
+        shape = np.shape(streamAcc)
+        streamAcc = np.atleast_2d(streamAcc)
+        if streams is None:
+            streamCell, pairStream, pairOther, pairWeight = (self.streamCell, self._pairStream,
+                                                             self._pairOther, self._pairWeight)
+        else:
+            streamCell = self.streamCell[streams]
+            local = np.full(len(self.streamCell), -1)
+            local[streams] = np.arange(len(streams))
+            pairs = np.flatnonzero(local[self._pairStream] >= 0)
+            pairStream, pairOther = local[self._pairStream[pairs]], local[self._pairOther[pairs]]
+            pairWeight = self._pairWeight[pairs]
+        total = self._sumBy(streamCell, streamAcc, len(area))[:, streamCell]
+        streamArea = area[streamCell]
+        crossing = None
+        if self.funDiag == 'SbFD':
+            with np.errstate(divide='ignore', invalid='ignore'):
+                crossing = self._sumBy(pairStream, pairWeight * streamAcc[:, pairOther] / streamArea[pairStream],
+                                       len(streamCell))
+        vel, critAcc, critVel = self.diagram.streamQuantities(streamAcc, total, streamArea, crossing)
+        return vel.reshape(shape), critAcc.reshape(shape), critVel.reshape(shape)
+
+    def routeCriticalSpeeds(self, streamAcc, vel, t):
+        """ Critical speed of every route at the departure of a group (Route.routeCricVelocity),
+            as a (replications, routes) array.
+
+            The mean over the sides of the cells of the route of the mean speed of the active
+            streams leaving through that side, scaled to m/s by the critical speed of the
+            diagram, or the free speed when no stream is active, times the share of the
+            neighbouring cell left by its blockage.
+        """
+        active = streamAcc[:, self.linkStream] > 0
+        linkVel = np.where(active, vel[:, self.linkStream], 0.0)
+        count = self._sumBy(self.linkSide, active, len(self.sideCell))
+        total = self._sumBy(self.linkSide, linkVel, len(self.sideCell))
+        sideVel = np.where(count > 0, total / np.maximum(count, 1), 0.0) * self.vf / self.fdCritVel
+        sideVel = np.where(sideVel > 0, sideVel, self.vf)
+        share = self._availableShare(t)
+        sideVel = sideVel * np.where(self.sideNeighbour >= 0, share[np.maximum(self.sideNeighbour, 0)], 1.0)
+        return np.stack([sideVel[:, sides].mean(axis=1) if len(sides) else np.zeros(len(sideVel))
+                         for sides in self.routeSides], axis=1)
+
+    def routeSplits(self, row, routeSpeed):
+        """ Shares of the route options of a demand row (Group.performStochasticRoute), as a
+            (replications, options) array.
+        """
+        options = self.demandRows[row][0]
+        routes = [self.routeNames.index(name) for name in options]
+        distance = np.array([self.routes[name]['distance'] for name in options])
+        utility = self.alpha * routeSpeed[:, routes] / distance + self.beta * distance
+        weights = np.exp(utility - utility.max(axis=1, keepdims=True))
+        return weights / weights.sum(axis=1, keepdims=True)
+
+    def _routeStructure(self, routes):
+        """ The (route, link) pairs of the potentials and of the route choice of some routes,
+            cached by set of routes since the routes with people on the network rarely change.
+            The route choice pairs index the routes by their position in *routes*.
+        """
+        key = tuple(routes)
+        if key not in self._routeStructures:
+            n = self.numNodes
+            # route * nodes + node indices are renumbered by position in *routes*
+            renumber = lambda index: np.searchsorted(routes, index // n) * n + index % n
+            pairs = np.flatnonzero(np.isin(self._bfPairHeads // n, routes))
+            potInit = self._potInit.reshape(-1, n)[routes].ravel()
+            heads, slots = self._paddedSlots(renumber(self._bfPairHeads[pairs]))
+            # the padding pair leaves from an extra node without potential
+            tails = np.append(renumber(self._bfTails[pairs]), len(potInit))
+            relaxation = (tails[slots], self._bfLinks[pairs], slots, heads, potInit)
+            pairs = np.flatnonzero(np.isin(self._qRoutes, routes))
+            tails, slots = self._paddedSlots(self._qTails[pairs])
+            numPairs = (slots < len(pairs)).sum(axis=1)
+            position = np.searchsorted(routes, self._qRoutes[pairs])
+            choice = (renumber(self._qHeads[pairs]), slots, np.repeat(np.arange(len(tails)), numPairs),
+                      position, self._qLinks[pairs], np.searchsorted(routes, tails // self.numNodes),
+                      tails % self.numNodes)
+            self._routeStructures[key] = (relaxation, choice)
+        return self._routeStructures[key]
+
+    def potentials(self, travelTime, routes=None):
+        """ Node potentials of every route (PotentialField).
+
+            Parameters
+            ----------
+            travelTime : numpy.ndarray
+                (replications, links) relative travel time of every link.
+            routes : numpy.ndarray
+                (optional) sorted indices of the routes to compute, all by default.
+
+            Returns
+            -------
+            pot : numpy.ndarray
+                (replications, len(routes), nodes) potentials.
+        """
+        if routes is None:
+            routes = np.arange(len(self.routeNames))
+        pot = self._potentials(np.ascontiguousarray(np.atleast_2d(travelTime).T), routes)
+        return pot.T.reshape(len(pot.T), len(routes), self.numNodes)
+
+    def _potentials(self, travelTime, routes):
+        """ Potentials of the routes as a (len(routes) * nodes, replications) array, from the
+            (links, replications) travel times, the gathers and minima taking whole rows.
+        """
+        slotTails, links, slots, heads, potInit = self._routeStructure(routes)[0]
+        # an extra row for the node of the padding pairs
+        pot = np.repeat(np.append(potInit, np.inf)[:, None], travelTime.shape[1], axis=1)
+        cost = np.concatenate((travelTime[links], np.zeros((1, travelTime.shape[1]))))
+        # only the nodes with a tail improved at the previous iteration are relaxed
+        frontier = np.append(np.isfinite(potInit), False)
+        while len(links):
+            rows = np.flatnonzero(frontier[slotTails].any(axis=1))
+            if not len(rows):
+                break
+            updated = heads[rows]
+            previous = pot[updated]
+            candidate = np.minimum(previous, (pot[slotTails[rows]] + cost[slots[rows]]).min(axis=1))
+            pot[updated] = candidate
+            frontier[:] = False
+            frontier[updated[(candidate < previous).any(axis=1)]] = True
+        return pot[:-1]
+
+    def routeFractions(self, pot, routes=None):
+        """ Logit route choice fractions (Node.getRouteChoiceFrac).
+
+            Parameters
+            ----------
+            pot : numpy.ndarray
+                (replications, len(routes), nodes) potentials of these routes.
+            routes : numpy.ndarray
+                (optional) sorted indices of the routes to compute, all by default.
+
+            Returns
+            -------
+            fractions : numpy.ndarray
+                (replications, len(routes), links) share of the people of a route at the
+                tail node of a link taking that link.
+            hasTarget : numpy.ndarray
+                (replications, len(routes), nodes) whether the people of a route at a node
+                have any target.
+        """
+        if routes is None:
+            routes = np.arange(len(self.routeNames))
+        numReps = len(pot)
+        fractions, hasTarget = self._routeChoice(np.ascontiguousarray(pot.reshape(numReps, -1).T), routes)
+        return fractions.transpose(1, 2, 0), hasTarget.transpose(1, 2, 0)
+
+    def _routeChoice(self, pot, routes, local=None):
+        """ Route choice fractions of the (len(routes) * nodes, replications) potentials, as a
+            (links, replications, len(routes)) array, and whether the people of a route at a
+            node have any target, as (nodes, replications, len(routes)). With the *local*
+            index of some links (-1 for the others), only the fractions of these links are
+            kept, by local index.
+        """
+        heads, slots, group, position, links, tailRoutes, tailNodes = self._routeStructure(routes)[1]
+        numReps = pot.shape[1]
+        numLinks = len(self.linkIds) if local is None else int(local.max()) + 1
+        fractions = np.zeros((numLinks, numReps, len(routes)))
+        hasTarget = np.zeros((self.numNodes, numReps, len(routes)), dtype=bool)
+        if not len(heads):
+            return fractions, hasTarget
+        headPot = pot[heads]
+        valid = headPot < SOURCE_SINK_POTENTIAL
+        # the padding pairs have no potential
+        padding = np.full((1, numReps), np.inf)
+        best = np.concatenate((np.where(valid, headPot, np.inf), padding))[slots].min(axis=1)
+        with np.errstate(invalid='ignore', over='ignore'):
+            weight = np.where(valid, np.exp(-self.mu * (headPot - best[group])), 0.0)
+        denominator = np.concatenate((weight, np.zeros((1, numReps))))[slots].sum(axis=1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            share = np.where(denominator[group] > 0, weight / denominator[group], 0.0)
+        share[share < MIN_ROUTE_FRACTION] = 0.0
+        if local is None:
+            fractions[links, :, position] = share
+        else:
+            kept = np.flatnonzero(local[links] >= 0)
+            fractions[local[links[kept]], :, position[kept]] = share[kept]
+        hasTarget[tailNodes, :, tailRoutes] = denominator > 0
+        return fractions, hasTarget
+
+    @staticmethod
+    def _localSlots(slots, local):
+        """ The slots of the links with a local index (-1 for the others), by local index."""
+        restricted = []
+        for nodes, links in slots:
+            inside = local[links] >= 0
+            restricted.append((nodes[inside], local[links[inside]]))
+        return restricted
+
+    def _nodeSum(self, values, slots):
+        """ Sums of a (links, ...) array over the links of every node, as (nodes, ...)."""
+        sums = np.zeros((self.numNodes,) + values.shape[1:], dtype=values.dtype)
+        for nodes, links in slots:
+            sums[nodes] += values[links]
+        return sums
+
+    def run(self, max_time=None, system_state=None, record_cells=True):
+        """ Simulates the scenario.
+
+            Parameters
+            ----------
+            max_time : integer
+                (optional) last time interval, the last departure plus MAX_TRAVEL_TIME by
+                default. The simulation stops earlier once the network is empty.
+            system_state : string
+                (optional) file receiving the state after every interval in the format of
+                Output.writeSystemState.
+            record_cells : boolean
+                (optional) whether the accumulation of every cell is kept for every interval.
+
+            Returns
+            -------
+            result : LoadingResult
+        """
+        split = lambda row, shares: shares * self.demandRows[row][2]
+        cells = (lambda acc, repClass: acc[0].astype(np.float32)) if record_cells else None
+        stateFile = open(system_state, 'w', encoding="utf8") if system_state is not None else None
+        try:
+            groupSize, arrivals, numIntervals, cellAcc = self._simulate(1, split, max_time, cells, stateFile)
+        finally:
+            if stateFile is not None:
+                stateFile.close()
+        _, arrivalGroups, arrivalTimes, arrivalSizes = arrivals
+        return LoadingResult(self, groupSize[0], arrivalGroups, arrivalTimes, arrivalSizes, numIntervals, cellAcc)
+
+    def runEnsemble(self, replications, seed=None, percentiles=(5, 50, 95), max_time=None):
+        """ Simulates many replications of the stochastic route choice at once.
+
+            In every replication the people of a demand row choose their route option
+            independently with the probabilities of Group.performStochasticRoute, so the
+            split of a row is a multinomial draw of its (rounded) number of people. The
+            replications advance together along an extra axis of all the arrays.
+
+            Parameters
+            ----------
+            replications : integer
+                number of replications.
+            seed : integer
+                (optional) seed of the random route choices.
+            percentiles : sequence
+                (optional) percentiles of the cell densities kept for every interval.
+            max_time : integer
+                (optional) last time interval, see run().
+
+            Returns
+            -------
+            result : EnsembleResult
+        """
+        rng = np.random.default_rng(seed)
+        split = lambda row, shares: rng.multinomial(int(round(self.demandRows[row][2])), shares).astype(float)
+        area = np.where(self.cellArea > 0, self.cellArea, np.inf)
+
+        def cells(acc, repClass):
+            # the percentiles of the cells nobody is in are zero
+            density = np.zeros((len(percentiles), len(area)), dtype=np.float32)
+            busy = np.flatnonzero(acc.any(axis=0))
+            density[:, busy] = weightedPercentiles(acc[:, busy] / area[busy], np.bincount(repClass, minlength=len(acc)),
+                                                   percentiles)
+            return density
+        groupSize, arrivals, numIntervals, density = self._simulate(replications, split, max_time, cells,
+                                                                    dtype=np.float32)
+        return EnsembleResult(self, groupSize, arrivals, numIntervals, percentiles, density)
+
+    def _simulate(self, numReps, split, max_time, cells=None, stateFile=None, dtype=np.float64):
+        """
+        Time loop shared by run() and runEnsemble(), on (links, classes, groups) arrays.
+        *split* gives the sizes of the groups of a demand row in every replication from the
+        shares of its route options, *cells* maps the (classes, cells) accumulations of an
+        interval and the class of every replication to the array kept for it. The people
+        on the links are stored as *dtype*, single precision halving the memory traffic of
+        the replications.
+
+        The loading is deterministic once the route options are drawn, so the replications
+        that drew the same sizes for all the groups departed so far are advanced once, as a
+        class. A class is split when its replications draw different sizes at a departure.
+        """
+        numLinks, numGroups = len(self.linkIds), len(self.groupIds)
+        lastDeparture = int(self.groupDepTime.max()) if numGroups else 0
+        maxTime = lastDeparture + MAX_TRAVEL_TIME if max_time is None else max_time
+        # class of every replication, all of them starting on the empty network
+        repClass = np.zeros(numReps, dtype=np.int64)
+        state = np.zeros((numLinks, 1, numGroups), dtype=dtype)
+        occupied = np.zeros(numLinks, dtype=bool)
+        groupSize = np.zeros((1, numGroups))
+        arrivals = []
+        cellRecords = []
+        streamAcc = np.zeros((1, len(self.streamCell)))
+        vel = np.ones((1, len(self.streamCell)))
+        travelTime = None
+        emptyArea = None
+        streams = cellLinks = np.zeros(0, dtype=np.int64)
+        first = departed = 0
+        if stateFile is not None:
+            stateFile.write("# timeInterval, linkID, cellName, groupID, groupSizeOnLink \n")
+        t = 0
+        while t <= maxTime:
+            area = self._cellArea(t)
+            if emptyArea is None or np.any(area != emptyArea):
+                # diagrams of the empty network, those of the streams without people
+                emptyArea, reset = area, True
+                emptyVel = self.streamSpeeds(np.zeros(len(self.streamCell)), area)[0]
+                with np.errstate(divide='ignore'):
+                    emptyTravelTime = self.relLength / emptyVel[self.linkStream]
+            # departures, split over the route options of their demand row
+            end = departed
+            while end < numGroups and self.groupDepTime[end] == t:
+                end += 1
+            if end > departed:
+                routeSpeed = self.routeCriticalSpeeds(streamAcc, vel, t)
+                for row in np.unique(self.groupRow[departed:end]):
+                    members = departed + np.flatnonzero(self.groupRow[departed:end] == row)
+                    members = members[np.argsort(self.groupOption[members])]
+                    sizes = split(row, self.routeSplits(row, routeSpeed)[repClass])
+                    # the replications of a class that drew the same sizes stay together
+                    _, index, inverse = np.unique(np.column_stack((repClass, sizes)), axis=0,
+                                                  return_index=True, return_inverse=True)
+                    if len(index) > len(groupSize):
+                        # the keys are sorted by class, so only a split renumbers the classes
+                        parent = repClass[index]
+                        state, groupSize = state[:, parent], groupSize[parent]
+                        streamAcc, vel, routeSpeed = streamAcc[parent], vel[parent], routeSpeed[parent]
+                        if travelTime is not None:
+                            travelTime = travelTime[:, parent]
+                    repClass = inverse.ravel()
+                    groupSize[:, members] = sizes[index]
+                    for group in members:
+                        source = self.routes[self.routeNames[self.groupRoute[group]]]['sourceLink']
+                        state[source, :, group] += groupSize[:, group]
+                        occupied[source] = True
+                departed = end
+            # only the links with people and the links they can reach are advanced
+            reached = np.zeros(self.numNodes, dtype=bool)
+            reached[self.linkHead[occupied]] = True
+            links = np.flatnonzero(occupied | reached[self.linkTail])
+            local = np.full(numLinks, -1)
+            local[links] = np.arange(len(links))
+            active = state[:, :, first:departed][links]
+            routes = self.groupRoute[first:departed]
+
+            # accumulations and fundamental diagrams of the cells of these links, per link
+            # as (links, classes)
+            linkAcc = active.sum(axis=2, dtype=np.float64)
+            streamAcc = self._sumBy(self.linkStream[links], linkAcc.T, len(self.streamCell))
+            touched = np.zeros(len(self.cellNames), dtype=bool)
+            touched[self.linkCell[links]] = True
+            if reset:
+                # the travel times are kept by link, as (links, classes)
+                vel = np.tile(emptyVel, (len(groupSize), 1))
+                travelTime = np.tile(emptyTravelTime[:, None], (1, len(groupSize)))
+                reset = False
+            else:
+                # the cells of the previous interval are emptied
+                vel[:, streams] = emptyVel[streams]
+                travelTime[cellLinks] = emptyTravelTime[cellLinks, None]
+            streams = np.flatnonzero(touched[self.streamCell])
+            cellLinks = np.flatnonzero(touched[self.linkCell])
+            speeds = self.streamSpeeds(streamAcc[:, streams], area, streams)
+            vel[:, streams] = speeds[0]
+            linkStream = np.searchsorted(streams, self.linkStream[links])
+            linkVel, linkCritAcc, linkCritVel = (values.T[linkStream] for values in speeds)
+            totalAcc = float(linkAcc.sum())
+            relLength = self.relLength[links, None]
+            with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+                travelTime[cellLinks] = self.relLength[cellLinks, None] / vel[:, self.linkStream[cellLinks]].T
+                hydroFlow = self.cfl / relLength * linkAcc * linkVel
+                critCap = self.cfl / relLength * linkCritAcc * linkCritVel
+                outCap = np.where(linkAcc <= linkCritAcc, hydroFlow, critCap)
+                recCap = np.where(linkAcc <= linkCritAcc, critCap, hydroFlow)
+                sendShare = np.where(linkAcc > 0, np.minimum(1.0, outCap / linkAcc), 0.0).astype(dtype)
+
+            if active.shape[2]:
+                # route choice of the routes with people on the network, indexed by position
+                activeRoutes, position = np.unique(routes, return_inverse=True)
+                fractions, hasTarget = self._routeChoice(self._potentials(travelTime, activeRoutes),
+                                                         activeRoutes, local)
+                fractions = fractions.astype(dtype, copy=False)
+                hasTarget = hasTarget[self.linkHead[links]]
+                headSlots, tailSlots = self._localSlots(self._headSlots, local), self._localSlots(self._tailSlots, local)
+                # sending and receiving capacities
+                sending = active * sendShare[:, :, None]
+                candidate = self._nodeSum(sending, headSlots)[self.linkTail[links]]
+                candidate *= fractions[:, :, position]
+                candInFlow = candidate.sum(axis=2)
+                with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+                    supply = np.where(candInFlow <= recCap, 1.0, recCap / candInFlow).astype(dtype)
+                # propagation, the sending array becomes the remaining people
+                leaving = self._nodeSum(fractions * supply[:, :, None], tailSlots)[self.linkHead[links]]
+                remaining = np.multiply(sending, leaving[:, :, position], out=sending)
+                np.subtract(active, remaining, out=remaining)
+                removed = remaining <= ABS_TOL
+                removed &= active > 0
+                removed &= hasTarget[:, :, position]
+                np.copyto(remaining, 0.0, where=removed)
+                candidate *= supply[:, :, None]
+                np.add(remaining, candidate, out=active)
+
+                # sinks
+                sinks = local[self.sinkLinks]
+                sinks = sinks[sinks >= 0]
+                arrived = active[sinks].sum(axis=0, dtype=np.float64)[repClass]
+                active[sinks] = 0.0
+                reps, groups = np.nonzero(arrived > 0)
+                travel = t - self.groupDepTime[first + groups] - GATE_INTERVALS
+                keep = (travel >= 0) & (t != 0)
+                if keep.any():
+                    arrivals.append((reps[keep], first + groups[keep], travel[keep], arrived[reps[keep], groups[keep]]))
+                state[links, :, first:departed] = active
+                occupied[links] = active.any(axis=(1, 2))
+
+            if stateFile is not None:
+                self._writeState(stateFile, t, state[:, 0, first:departed], first)
+            if cells is not None:
+                cellRecords.append(cells(self._sumBy(self.linkCell[links], active.sum(axis=2, dtype=np.float64).T,
+                                                     len(self.cellNames)), repClass))
+            # groups that left the network are no longer advanced, nor their last fragments
+            # (below ABS_TOL of the group) cycling between the links of its route
+            start = first
+            while first < departed and np.all(active[:, :, first - start].sum(axis=0) <= ABS_TOL * groupSize[:, first]):
+                state[links, :, first] = 0.0
+                first += 1
+            if first == departed:
+                occupied[:] = False
+            if totalAcc < ABS_TOL and t > lastDeparture:
+                break
+            if first == departed < numGroups:
+                # the network is empty, nothing happens until the next departure
+                idle = max(min(int(self.groupDepTime[departed]), maxTime + 1) - t - 1, 0)
+                if cells is not None:
+                    cellRecords.extend([np.zeros_like(cellRecords[-1])] * idle)
+                t += idle
+            t += 1
+        t = min(t, maxTime)
+        if arrivals:
+            arrivals = tuple(np.concatenate(parts) for parts in zip(*arrivals))
+        else:
+            arrivals = (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0))
+        return groupSize[repClass], arrivals, t + 1, np.array(cellRecords) if cells is not None else None
+
+    def _writeState(self, stateFile, t, active, first):
+        links, groups = np.nonzero(active)
+        order = np.lexsort((groups, links))
+        links, groups = links[order], groups[order]
+        stateFile.writelines("{}, {}, {}, {}, {}\n".format(t, linkID, self.cellNames[cell], groupID, repr(size))
+                             for linkID, cell, groupID, size in zip(
+                                 self.linkIds[links].tolist(), self.linkCell[links].tolist(),
+                                 self.groupIds[first + groups].tolist(), active[links, groups].tolist()))
+
+
+class LoadingResult(object):
+    """
+    Travel times and cell accumulations of a simulation.
+    """
+    def __init__(self, network, group_size, arrival_groups, arrival_times, arrival_sizes, num_intervals, cell_acc):
+        self.network = network
+        self.groupSize = group_size
+        self.arrivalGroups = arrival_groups     # group index (by departure) of every arrival
+        self.arrivalTimes = arrival_times       # travel time intervals
+        self.arrivalSizes = arrival_sizes
+        self.numIntervals = num_intervals
+        self.cellAccumulation = cell_acc        # (intervals, cells) or None
+
+    def travelTimeStats(self):
+        """ Mean and standard deviation of the travel time (seconds) and share of arrived
+            people of every group (Group.computeTravelTimeStats), by group index.
+        """
+        numGroups = len(self.groupSize)
+        seconds = self.arrivalTimes * self.network.deltaT
+        survived = np.bincount(self.arrivalGroups, weights=self.arrivalSizes, minlength=numGroups)
+        total = np.bincount(self.arrivalGroups, weights=self.arrivalSizes * seconds, minlength=numGroups)
+        squares = np.bincount(self.arrivalGroups, weights=self.arrivalSizes * seconds ** 2, minlength=numGroups)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mean = total / survived
+            std = np.sqrt(np.maximum(squares / survived - mean ** 2, 0.0))
+            relLoss = survived / self.groupSize
+        return mean, std, relLoss
+
+    def cellDensity(self):
+        """ Density of every cell at every interval, as an (intervals, cells) array."""
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return self.cellAccumulation / self.network.cellArea[None, :]
+
+    def writeTravelTimes(self, output_dir):
+        """ Writes travelTimeDist.txt and travelTimeMean.txt as Output.writeTravelTime."""
+        net = self.network
+        os.makedirs(output_dir, exist_ok=True)
+        names = [net.routeNames[r] for r in net.groupRoute]
+        order = np.lexsort((self.arrivalTimes, self.arrivalGroups))
+        with open(os.path.join(output_dir, "travelTimeDist.txt"), 'w', encoding="utf8") as distFile:
+            distFile.write("# groupID, routeName, groupSize, depTime, travelTime, fragSize \n")
+            for i in order:
+                group = self.arrivalGroups[i]
+                distFile.write("{}, {}, {}, {}, {}, {}\n".format(
+                    net.groupIds[group], names[group], repr(float(self.groupSize[group])), net.groupDepTime[group],
+                    repr(float(self.arrivalTimes[i] * net.deltaT)), repr(float(self.arrivalSizes[i]))))
+        mean, _, relLoss = self.travelTimeStats()
+        with open(os.path.join(output_dir, "travelTimeMean.txt"), 'w', encoding="utf8") as meanFile:
+            meanFile.write("# groupID, routeName, groupSize, depTime, weightedTravelTime, rel_loss \n")
+            for group in np.argsort(net.groupIds):
+                meanFile.write("{}, {}, {}, {}, {}, {}\n".format(
+                    net.groupIds[group], names[group], repr(float(self.groupSize[group])), net.groupDepTime[group],
+                    repr(float(mean[group])), repr(float(relLoss[group]))))
+
+    def summary(self):
+        """ Arrived share and mean travel time (seconds) of every route."""
+        net = self.network
+        mean, _, relLoss = self.travelTimeStats()
+        routes = {}
+        for r, name in enumerate(net.routeNames):
+            members = np.flatnonzero((net.groupRoute == r) & (self.groupSize > 0))
+            people = self.groupSize[members].sum()
+            arrived = (relLoss[members] * self.groupSize[members]).sum()
+            weights = relLoss[members] * self.groupSize[members]
+            routes[name] = {'people': float(people), 'arrived': float(arrived),
+                            'meanTravelTime': float(np.sum(np.nan_to_num(mean[members]) * weights) / arrived)
+                            if arrived > 0 else float('nan')}
+        return routes
+
+
+class EnsembleResult(object):
+    """
+    Travel times and cell density percentiles of the replications of runEnsemble().
+    The travel times are aggregated by demand row, whose people are split over
+    different route options in every replication.
+    """
+    def __init__(self, network, group_size, arrivals, num_intervals, percentiles, density):
+        self.network = network
+        self.groupSize = group_size             # (replications, groups)
+        self.arrivalReplications, self.arrivalGroups, self.arrivalTimes, self.arrivalSizes = arrivals
+        self.numIntervals = num_intervals
+        self.percentiles = tuple(percentiles)
+        self.densityPercentiles = density       # (intervals, percentiles, cells)
+
+    @property
+    def numReplications(self):
+        return self.groupSize.shape[0]
+
+    def meanTravelTimes(self):
+        """ Mean travel time (seconds) of every demand row in every replication, as a
+            (replications, rows) array, NaN where nobody arrived.
+        """
+        numRows = len(self.network.demandRows)
+        index = self.arrivalReplications * numRows + self.network.groupRow[self.arrivalGroups]
+        seconds = self.arrivalTimes * self.network.deltaT
+        size = self.numReplications * numRows
+        survived = np.bincount(index, weights=self.arrivalSizes, minlength=size)
+        total = np.bincount(index, weights=self.arrivalSizes * seconds, minlength=size)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return (total / survived).reshape(self.numReplications, numRows)
+
+    def meanTravelTimePercentiles(self, percentiles=None):
+        """ Percentiles over the replications of the mean travel time of every demand row,
+            as a (percentiles, rows) array.
+        """
+        percentiles = self.percentiles if percentiles is None else percentiles
+        means = self.meanTravelTimes()
+        result = np.full((len(percentiles), means.shape[1]), np.nan)
+        arrived = ~np.all(np.isnan(means), axis=0)
+        if arrived.any():
+            result[:, arrived] = np.nanpercentile(means[:, arrived], percentiles, axis=0)
+        return result
+
+    def travelTimePercentiles(self, percentiles=None):
+        """ Percentiles of the travel time (seconds) of the people of every demand row over
+            all the replications, as a (rows, percentiles) array, NaN where nobody arrived.
+        """
+        percentiles = np.asarray(self.percentiles if percentiles is None else percentiles, dtype=float)
+        numRows = len(self.network.demandRows)
+        rows = self.network.groupRow[self.arrivalGroups]
+        order = np.lexsort((self.arrivalTimes, rows))
+        rows, times, sizes = rows[order], self.arrivalTimes[order], self.arrivalSizes[order]
+        result = np.full((numRows, len(percentiles)), np.nan)
+        if not len(rows):
+            return result
+        # cumulative share of the people of its row at every arrival, the last one being 1
+        cumulative = np.cumsum(sizes)
+        rowTotal = np.bincount(rows, weights=sizes, minlength=numRows)
+        rowStart = np.concatenate(([0.0], np.cumsum(rowTotal)))[rows]
+        share = (cumulative - rowStart) / rowTotal[rows]
+        share[np.append(rows[1:] != rows[:-1], True)] = 1.0
+        present = np.unique(rows)
+        targets = present[:, None] + percentiles[None, :] / 100.0
+        positions = np.minimum(np.searchsorted(rows + share, targets.ravel()), len(rows) - 1)
+        result[present] = times[positions].reshape(targets.shape) * self.network.deltaT
+        return result
+
+    def writePercentiles(self, output_dir):
+        """ Writes travelTimePercentiles.txt, by demand row, and the cell density
+            percentiles of every interval to cellDensityPercentiles.npy.
+        """
+        net = self.network
+        os.makedirs(output_dir, exist_ok=True)
+        pooled = self.travelTimePercentiles()
+        means = self.meanTravelTimePercentiles()
+        labels = ["p{:g}".format(p) for p in self.percentiles]
+        with open(os.path.join(output_dir, "travelTimePercentiles.txt"), 'w', encoding="utf8") as outFile:
+            outFile.write("# demandRow, routeName, depTime, numPpl, {}, {} \n".format(
+                ", ".join(labels), ", ".join("mean_" + label for label in labels)))
+            for row, (options, depTime, numPpl) in enumerate(net.demandRows):
+                outFile.write("{}, {}, {}, {}, {}, {}\n".format(
+                    row, options[0], depTime, repr(numPpl), ", ".join(repr(float(v)) for v in pooled[row]),
+                    ", ".join(repr(float(v)) for v in means[:, row])))
+        if self.densityPercentiles is not None:
+            np.save(os.path.join(output_dir, "cellDensityPercentiles.npy"), self.densityPercentiles)
+
+
+def compareMeanTravelTimes(result, java_mean_path):
+    """ Compares the mean travel times with a travelTimeMean.txt of the Java simulator,
+        by route and departure time (the group ids of the two differ).
+
+        Returns
+        -------
+        rows : list
+            (routeName, depTime, python mean, java mean) tuples.
+    """
+    java = {}
+    with open(java_mean_path, encoding="utf8") as meanFile:
+        for line in meanFile:
+            if line.startswith("#") or not line.strip():
+                continue
+            fields = [field.strip() for field in line.split(",")]
+            size, mean = float(fields[2]), float(fields[4])
+            if size > 0 and not math.isnan(mean):
+                entry = java.setdefault((fields[1], int(fields[3])), [0.0, 0.0])
+                entry[0] += size * mean
+                entry[1] += size
+    net = result.network
+    mean, _, _ = result.travelTimeStats()
+    rows = []
+    for (route, depTime), (weighted, size) in sorted(java.items()):
+        members = np.flatnonzero((np.array(net.routeNames)[net.groupRoute] == route) & (net.groupDepTime == depTime)
+                                 & (result.groupSize > 0) & ~np.isnan(mean))
+        weights = result.groupSize[members]
+        python = float(np.sum(mean[members] * weights) / weights.sum()) if weights.sum() > 0 else float('nan')
+        rows.append((route, depTime, python, weighted / size))
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Simulate a scenario of the simulator with the NumPy network loading.")
+    parser.add_argument('scenario', help="scenario file, see examples/scenarios")
+    parser.add_argument('--root', default=None, help="directory the input directory of the scenario is relative to")
+    parser.add_argument('--output-dir', default=None, help="directory receiving the travel time files")
+    parser.add_argument('--system-state', action='store_true', help="also write systemState.txt")
+    parser.add_argument('--max-time', type=int, default=None, help="last time interval")
+    parser.add_argument('--compare', default=None, help="travelTimeMean.txt of the Java simulator to compare with")
+    parser.add_argument('--replications', type=int, default=None,
+                        help="simulate this many replications of the stochastic route choice at once")
+    parser.add_argument('--seed', type=int, default=None, help="seed of the replications")
+    parser.add_argument('--percentiles', default="5,50,95", help="comma separated percentiles of the replications")
+    args = parser.parse_args(argv)
+
+    if args.replications is not None:
+        startTime = time.time()
+        network = NetworkLoading.fromScenario(args.scenario, args.root)
+        percentiles = [float(value) for value in args.percentiles.split(",")]
+        ensemble = network.runEnsemble(args.replications, args.seed, percentiles, args.max_time)
+        if args.output_dir is not None:
+            ensemble.writePercentiles(args.output_dir)
+        print("{} replications of {} groups, {} intervals simulated in {:.2f} s".format(
+            args.replications, len(network.groupIds), ensemble.numIntervals, time.time() - startTime))
+        pooled = ensemble.travelTimePercentiles()
+        for row, (options, depTime, numPpl) in enumerate(network.demandRows):
+            print("{} departing at {}: travel time percentiles {} s".format(
+                "/".join(options), depTime, ", ".join("{:.1f}".format(value) for value in pooled[row])))
+        return 0
+
+    startTime = time.time()
+    network = NetworkLoading.fromScenario(args.scenario, args.root)
+    statePath = None
+    if args.output_dir is not None:
+        os.makedirs(args.output_dir, exist_ok=True)
+        if args.system_state:
+            statePath = os.path.join(args.output_dir, "systemState.txt")
+    result = network.run(args.max_time, statePath, record_cells=False)
+    if args.output_dir is not None:
+        result.writeTravelTimes(args.output_dir)
+    print("{} links, {} groups, {} intervals of {:.3f} s simulated in {:.2f} s".format(
+        len(network.linkIds), len(network.groupIds), result.numIntervals, network.deltaT, time.time() - startTime))
+    for name, route in result.summary().items():
+        print("{}: {:.2f} of {:.2f} people arrived, mean travel time {:.1f} s".format(
+            name, route['arrived'], route['people'], route['meanTravelTime']))
+    if args.compare is not None:
+        for route, depTime, python, java in compareMeanTravelTimes(result, args.compare):
+            print("{} departing at {}: {:.2f} s (Java {:.2f} s)".format(route, depTime, python, java))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
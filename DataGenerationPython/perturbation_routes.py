@@ -0,0 +1,262 @@
+"""
+module: perturbation_routes
+-------------------------
+
+Route choice sets obtained from shortest paths on randomly perturbed edge lengths.
+Every sample multiplies the length of every edge by a factor drawn uniformly in
+[1 - spread, 1 + spread] and one shortest path tree is grown from an origin until
+all its destinations are reached, so a sample serves all the OD pairs of an origin.
+The distinct paths whose (unperturbed) length is within a ratio of the shortest path
+form the choice set, the shortest path itself being always part of it.
+
+The random factor of an edge is a hash of the seed, the origin, the sample and the
+osmids of the nodes of the edge, so the choice sets are reproducible whatever the
+number of worker processes the origins are spread over, and adding or removing edges
+leaves the factors of all the other edges unchanged (the incremental updates of
+graph_update and closure_scenarios rely on it). The searches run on a CompactGraph
+(adjacency arrays with a binary heap) rather than on the NetworkX graph, whose per
+edge lookups would dominate the many searches of a sample.
+"""
+
+import heapq
+import numbers
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+
+from ModifiedDijkstra import SearchStats
+
+#Graph of the current worker process, set once by the pool initializer
+_workerGraph = None
+
+#Constants of the splitmix64 hash giving the random factors
+MIX_GAMMA = 0x9E3779B97F4A7C15
+MIX_MULTIPLIERS = (0xBF58476D1CE4E5B9, 0x94D049BB133111EB)
+
+
+class CompactGraph(object):
+    """
+    Street network as compressed sparse row adjacency arrays: the edges leaving the
+    node of index i are offsets[i] to offsets[i + 1] in tails, targets and lengths. The
+    length of an edge is the one of its key 0 as in YenKShortestPaths.
+    """
+    def __init__(self, g, weight='length'):
+        self.nodes = list(g.nodes())
+        self.index = dict((node, i) for i, node in enumerate(self.nodes))
+        adjacency = [[] for _ in self.nodes]
+        seen = set()
+        for u, v in g.edges():
+            if (u, v) not in seen:
+                seen.add((u, v))
+                adjacency[self.index[u]].append((self.index[v], g[u][v][0][weight]))
+        self.offsets = [0]
+        self.tails = []
+        self.targets = []
+        self.lengths = []
+        for node, edges in enumerate(adjacency):
+            for target, length in edges:
+                self.tails.append(node)
+                self.targets.append(target)
+                self.lengths.append(float(length))
+            self.offsets.append(len(self.targets))
+        self._edgeHashes = None
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def shortestPaths(self, source, targets, lengths=None, stats=None):
+        """ Shortest paths from the node index `source` to the node indices `targets`.
+
+            Parameters
+            ----------
+            lengths : list
+                (optional) edge lengths replacing those of the graph.
+            stats : SearchStats
+                (optional) receives the counters of the search.
+
+            Returns
+            -------
+            paths : dictionary
+                lists of edge indices from the source by reached target.
+        """
+        lengths = self.lengths if lengths is None else lengths
+        offsets, heads = self.offsets, self.targets
+        dist = {source: 0.0}
+        pred = {}
+        settled = set()
+        remaining = set(targets)
+        remaining.discard(source)
+        heap = [(0.0, source)]
+        relaxed = pushes = 0
+        while heap and remaining:
+            d, node = heapq.heappop(heap)
+            if node in settled:
+                continue
+            settled.add(node)
+            remaining.discard(node)
+            for edge in range(offsets[node], offsets[node + 1]):
+                relaxed += 1
+                head = heads[edge]
+                new_dist = d + lengths[edge]
+                if new_dist < dist.get(head, float('inf')):
+                    dist[head] = new_dist
+                    pred[head] = edge
+                    heapq.heappush(heap, (new_dist, head))
+                    pushes += 1
+        if stats is not None:
+            stats.searches += 1
+            stats.nodesSettled += len(settled)
+            stats.edgesRelaxed += relaxed
+            stats.frontierPushes += pushes
+        tails = self.tails
+        paths = {}
+        for target in targets:
+            if target == source or target not in settled:
+                continue
+            edges = []
+            node = target
+            while node != source:
+                edge = pred[node]
+                edges.append(edge)
+                node = tails[edge]
+            edges.reverse()
+            paths[target] = edges
+        return paths
+
+    def edgeHashes(self):
+        """ Hash of the osmids of the nodes of every edge, as a NumPy uint64 array."""
+        import numpy as np
+        if self._edgeHashes is None:
+            keys = np.array([nodeKey(node) for node in self.nodes], dtype=np.int64).view(np.uint64)
+            tails = keys[np.asarray(self.tails, dtype=np.int64)]
+            heads = keys[np.asarray(self.targets, dtype=np.int64)]
+            self._edgeHashes = mix64(mix64(tails) ^ heads)
+        return self._edgeHashes
+
+    def pathNodes(self, source, edges):
+        """ The osmids of a path given by its source index and edge indices."""
+        return [self.nodes[source]] + [self.nodes[self.targets[edge]] for edge in edges]
+
+    def pathLength(self, edges):
+        """ The unperturbed length of a path given by its edge indices."""
+        return sum(self.lengths[edge] for edge in edges)
+
+
+def nodeKey(node):
+    """ Integer of a node in the hashes, its osmid or a checksum of its name."""
+    return int(node) if isinstance(node, numbers.Integral) else zlib.crc32(str(node).encode('utf8'))
+
+
+def mix64(values):
+    """ splitmix64 hash of a NumPy uint64 array, wrapping around on overflow."""
+    import numpy as np
+    z = values + np.uint64(MIX_GAMMA)
+    z = (z ^ (z >> np.uint64(30))) * np.uint64(MIX_MULTIPLIERS[0])
+    z = (z ^ (z >> np.uint64(27))) * np.uint64(MIX_MULTIPLIERS[1])
+    return z ^ (z >> np.uint64(31))
+
+
+def edgeFactors(compact, seed, origin, sample, spread):
+    """ Factors in [1 - spread, 1 + spread] of the edge lengths of a sample of an origin,
+        the factor of an edge only depending on the seed, origin, sample and its nodes.
+    """
+    import numpy as np
+    salt = np.array([int(seed), nodeKey(origin), sample], dtype=np.int64).view(np.uint64)
+    salt = mix64(mix64(mix64(salt[:1]) ^ salt[1]) ^ salt[2])
+    uniform = (mix64(compact.edgeHashes() ^ salt) >> np.uint64(11)) * (1.0 / (1 << 53))
+    return 1.0 - spread + 2.0 * spread * uniform
+
+
+def originChoiceSets(compact, origin, dests, max_routes, samples, spread, cost_ratio, seed):
+    """ Choice sets of the OD pairs of one origin.
+
+        Returns
+        -------
+        choice_sets : dictionary
+            (nodeList, length) lists sorted by length, by destination osmid.
+        stats : SearchStats
+            counters of the searches.
+    """
+    import numpy as np
+    stats = SearchStats()
+    source = compact.index[origin]
+    targets = dict((compact.index[dest], dest) for dest in dests if dest in compact.index)
+    found = dict((target, set()) for target in targets)
+    base = np.asarray(compact.lengths, dtype=np.float64)
+    for sample in range(samples):
+        #the first sample is unperturbed and gives the shortest path
+        lengths = None if sample == 0 else (base * edgeFactors(compact, seed, origin, sample, spread)).tolist()
+        for target, edges in compact.shortestPaths(source, list(targets), lengths, stats).items():
+            found[target].add(tuple(edges))
+    choice_sets = dict((dest, []) for dest in dests)
+    for target, dest in targets.items():
+        candidates = sorted((compact.pathLength(edges), edges) for edges in found[target])
+        stats.candidatesGenerated += len(candidates)
+        if not candidates:
+            continue
+        limit = candidates[0][0] * cost_ratio
+        kept = [(compact.pathNodes(source, edges), length) for length, edges in candidates
+                if length <= limit][:max_routes]
+        stats.candidatesDiscarded += len(candidates) - len(kept)
+        choice_sets[dest] = kept
+    return choice_sets, stats
+
+
+def perturbedChoiceSets(g, od_pairs, max_routes, samples=50, spread=0.3, cost_ratio=1.5, seed=0,
+                        workers=1, weight='length'):
+    """ Choice sets of many OD pairs, the origins being spread over worker processes.
+
+        Parameters
+        ----------
+        g : networkx.MultiDiGraph
+            the street network.
+        od_pairs : list
+            (origin, destination) osmid pairs.
+        max_routes : integer
+            largest number of routes per OD pair.
+        samples : integer
+            number of shortest path searches per origin, the first one unperturbed.
+        spread : float
+            the edge lengths are multiplied by factors drawn in [1 - spread, 1 + spread].
+        cost_ratio : float
+            routes longer than cost_ratio times the shortest path are discarded.
+        seed : integer
+            seed of the random factors.
+        workers : integer
+            number of worker processes, the searches run in the current process when 1.
+
+        Returns
+        -------
+        choice_sets : dictionary
+            (nodeList, length) lists sorted by length, by OD pair.
+        stats : SearchStats
+            counters of all the searches.
+    """
+    compact = CompactGraph(g, weight)
+    by_origin = {}
+    for origin, dest in od_pairs:
+        by_origin.setdefault(origin, []).append(dest)
+    tasks = [(origin, dests, max_routes, samples, spread, cost_ratio, seed) for origin, dests in by_origin.items()]
+    stats = SearchStats()
+    choice_sets = {}
+    if workers is not None and workers <= 1 or len(tasks) <= 1:
+        results = [originChoiceSets(compact, *task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_initWorker, initargs=(compact,)) as executor:
+            results = list(executor.map(_runTask, tasks, chunksize=max(1, len(tasks) // (4 * (workers or 4)))))
+    for (origin, _, _, _, _, _, _), (origin_sets, origin_stats) in zip(tasks, results):
+        for dest, routes in origin_sets.items():
+            choice_sets[(origin, dest)] = routes
+        stats.add(origin_stats)
+    return dict((od_pair, choice_sets.get(od_pair, [])) for od_pair in od_pairs), stats
+
+
+def _initWorker(compact):
+    """
+    Keeps the graph in the worker process, so that it is pickled once per worker.
+    """
+    global _workerGraph
+    _workerGraph = compact
+
+
+def _runTask(task):
+    return originChoiceSets(_workerGraph, *task)
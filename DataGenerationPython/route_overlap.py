@@ -0,0 +1,87 @@
+"""
+module: route_overlap
+-------------------------
+
+Filtering of near-duplicate routes. The overlap of a candidate route with an
+accepted route of the same OD pair is the length of the streets they share divided
+by the length of the candidate, so 0 means disjoint and 1 means the candidate only
+uses streets of the accepted route. Candidates are offered as they come out of the
+route generator (by increasing length) and rejected when their overlap with an
+accepted route exceeds MAX_ROUTE_OVERLAP of mapGeoToCells.
+
+The streets of the accepted routes are kept in an index from street to routes, so
+the shared lengths of a candidate with all the accepted routes are accumulated in a
+single pass over its streets.
+"""
+
+#Bounds of the overlap histogram of the report
+OVERLAP_BINS = (0.0, 0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0)
+
+
+class OverlapStats(object):
+    """
+    Counters of the overlap filtering of many OD pairs, for the run report.
+    """
+    def __init__(self):
+        self.candidates = 0
+        self.rejected = 0
+        self.overlaps = []  # highest overlap of every accepted route but the first of its OD pair
+
+    def toDict(self):
+        counts = [0] * (len(OVERLAP_BINS) - 1)
+        for overlap in self.overlaps:
+            for i in range(len(counts)):
+                if overlap <= OVERLAP_BINS[i + 1] or i == len(counts) - 1:
+                    counts[i] += 1
+                    break
+        return {'candidates': self.candidates, 'rejected': self.rejected,
+                'meanOverlap': sum(self.overlaps) / len(self.overlaps) if self.overlaps else 0.0,
+                'maxOverlap': max(self.overlaps) if self.overlaps else 0.0,
+                'histogram': dict(("{:.1f}-{:.1f}".format(OVERLAP_BINS[i], OVERLAP_BINS[i + 1]), counts[i])
+                                  for i in range(len(counts)))}
+
+
+class RouteOverlapFilter(object):
+    """
+    Accepts the routes of one OD pair whose overlap with every route accepted before
+    does not exceed `max_overlap`.
+    """
+    def __init__(self, graph, max_overlap, weight='length', stats=None):
+        self.g = graph
+        self.maxOverlap = max_overlap
+        self.wt = weight
+        self.stats = stats
+        self.streetRoutes = {}   # street -> indices of the accepted routes using it
+        self.numAccepted = 0
+
+    def streets(self, node_list):
+        """ The lengths of the streets of a route, by unordered node pair."""
+        return dict((frozenset((u, v)), self.g[u][v][0][self.wt]) for u, v in zip(node_list[:-1], node_list[1:]))
+
+    def overlap(self, streets):
+        """ The highest overlap of a route, given by its streets, with the accepted routes."""
+        shared = [0.0] * self.numAccepted
+        for street, length in streets.items():
+            for route in self.streetRoutes.get(street, ()):
+                shared[route] += length
+        total = sum(streets.values())
+        if not shared or total <= 0:
+            return 0.0
+        return max(shared) / total
+
+    def offer(self, node_list):
+        """ Accepts or rejects the next candidate route, returns whether it was accepted."""
+        streets = self.streets(node_list)
+        overlap = self.overlap(streets)
+        if self.stats is not None:
+            self.stats.candidates += 1
+        if self.numAccepted > 0 and overlap > self.maxOverlap:
+            if self.stats is not None:
+                self.stats.rejected += 1
+            return False
+        for street in streets:
+            self.streetRoutes.setdefault(street, []).append(self.numAccepted)
+        if self.stats is not None and self.numAccepted > 0:
+            self.stats.overlaps.append(overlap)
+        self.numAccepted += 1
+        return True
@@ -0,0 +1,183 @@
+"""
+module: run_report
+-------------------------
+
+Instrumentation of the data generation stages. A RunReport records for every stage
+its wall time, CPU time, peak resident memory, item count and throughput, prints live
+progress with an estimated time to completion on stderr and writes everything as a
+machine-readable JSON report, so that the stage eating the budget of a long run can
+be identified.
+"""
+
+import json
+import os
+import platform
+import sys
+import time
+import datetime as dt
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+#Minimum number of seconds between two progress lines
+PROGRESS_INTERVAL = 1.0
+
+
+def peakRSS():
+    """ Peak resident set size of the process in MB, None when it cannot be measured."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    #ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    if sys.platform == 'darwin':
+        return peak / (1024.0 * 1024.0)
+    return peak / 1024.0
+
+
+class StageRecord(object):
+    """
+    Measurements of one stage of a run. The number of processed items can be set
+    (or incremented) while the stage runs.
+    """
+    def __init__(self, name, items=None, unit='items'):
+        self.name = name
+        self.items = items
+        self.unit = unit
+        self.counts = {}
+        self.wallTime = None
+        self.cpuTime = None
+        self.peakRSS = None
+        self._wallStart = time.perf_counter()
+        self._cpuStart = time.process_time()
+
+    def count(self, key, value=1):
+        """ Adds `value` to an additional counter of the stage."""
+        self.counts[key] = self.counts.get(key, 0) + value
+
+    def stop(self):
+        """ Freezes the wall and CPU time of the stage."""
+        self.wallTime = time.perf_counter() - self._wallStart
+        self.cpuTime = time.process_time() - self._cpuStart
+        self.peakRSS = peakRSS()
+
+    def toDict(self):
+        record = {'stage': self.name, 'wallTime': self.wallTime, 'cpuTime': self.cpuTime,
+                  'peakRSS_MB': self.peakRSS, 'items': self.items, 'unit': self.unit}
+        if self.items is not None and self.wallTime:
+            record['throughput'] = self.items / self.wallTime
+            record['throughputUnit'] = self.unit + '/s'
+        if self.counts:
+            record['counts'] = dict(self.counts)
+        return record
+
+
+class RunReport(object):
+    """
+    Collects the stage records of a run and reports progress on a stream (stderr
+    by default).
+    """
+    def __init__(self, name, stream=None, verbose=True):
+        self.name = name
+        self.stream = sys.stderr if stream is None else stream
+        self.verbose = verbose
+        self.stages = []
+        self.info = {}
+        self._start = time.perf_counter()
+        self._cpuStart = time.process_time()
+        self._startTime = dt.datetime.now()
+
+    @contextmanager
+    def stage(self, name, items=None, unit='items'):
+        """ Context manager measuring the enclosed block as one stage.
+
+            Yields the StageRecord, whose `items` can be updated inside the block.
+        """
+        record = StageRecord(name, items, unit)
+        self._log("[{}] {} ...".format(self.name, name))
+        try:
+            yield record
+        finally:
+            record.stop()
+            self.stages.append(record)
+            rate = ""
+            if record.items is not None and record.wallTime:
+                rate = ", {} {} ({:.1f} {}/s)".format(record.items, record.unit, record.items / record.wallTime, record.unit)
+            self._log("[{}] {} done in {:.2f}s (cpu {:.2f}s{}{})".format(
+                self.name, name, record.wallTime, record.cpuTime,
+                "" if record.peakRSS is None else ", peak {:.0f} MB".format(record.peakRSS), rate))
+
+    def progress(self, iterable, total=None, label='items', record=None):
+        """ Iterates over `iterable` printing the progress and the estimated time left.
+
+            Parameters
+            ----------
+            iterable : iterable
+                the items being processed.
+            total : integer
+                (optional) number of items, taken from len(iterable) when possible.
+            label : string
+                (optional) name of the items in the progress lines.
+            record : StageRecord
+                (optional) stage whose item count follows the iteration.
+        """
+        if total is None and hasattr(iterable, '__len__'):
+            total = len(iterable)
+        start = time.perf_counter()
+        last = start
+        done = 0
+        for item in iterable:
+            yield item
+            done += 1
+            if record is not None:
+                record.items = done
+            now = time.perf_counter()
+            if now - last >= PROGRESS_INTERVAL:
+                last = now
+                self._log(self._progressLine(label, done, total, now - start))
+        if done and time.perf_counter() - start >= PROGRESS_INTERVAL:
+            self._log(self._progressLine(label, done, total, time.perf_counter() - start))
+
+    def toDict(self):
+        return {'run': self.name,
+                'started': self._startTime.isoformat(timespec='seconds'),
+                'wallTime': time.perf_counter() - self._start,
+                'cpuTime': time.process_time() - self._cpuStart,
+                'peakRSS_MB': peakRSS(),
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'info': self.info,
+                'stages': [record.toDict() for record in self.stages]}
+
+    def write(self, file_path):
+        """ Writes the report as JSON and returns its path."""
+        directory = os.path.dirname(file_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(file_path, 'w', encoding="utf8") as reportFile:
+            json.dump(self.toDict(), reportFile, indent=2)
+        return file_path
+
+    def _progressLine(self, label, done, total, elapsed):
+        rate = done / elapsed if elapsed > 0 else 0.0
+        if total:
+            eta = (total - done) / rate if rate > 0 else float('inf')
+            return "[{}]   {}/{} {} ({:.0%}, {:.1f}/s, ETA {})".format(
+                self.name, done, total, label, done / total, rate, _formatDuration(eta))
+        return "[{}]   {} {} ({:.1f}/s)".format(self.name, done, label, rate)
+
+    def _log(self, message):
+        if self.verbose:
+            print(message, file=self.stream, flush=True)
+
+
+def _formatDuration(seconds):
+    """
+    Formats a duration as H:MM:SS.
+    """
+    if seconds == float('inf'):
+        return '?'
+    seconds = int(round(seconds))
+    return "{}:{:02d}:{:02d}".format(seconds // 3600, (seconds % 3600) // 60, seconds % 60)
@@ -0,0 +1,477 @@
+"""
+module: scenario_sweep
+-------------------------
+
+Sweeps over variants of a scenario of the simulator (fundamental diagram, blockage,
+demand, route choice parameters...). A grid file gives the values of some entries of
+a template scenario file, every combination of them is written as a scenario file in
+its own run directory, and the runs are executed in a pool of worker processes so
+that a sweep keeps all the cores busy.
+
+The runs are executed by an Executor: JavaExecutor launches the simulator in a
+subprocess, LocalExecutor simulates the scenario with the NumPy network loading of
+network_loading.py, which needs no JVM. A failed run is attempted again up to a given
+number of times. Every successful run leaves a record of the fingerprint of its
+inputs (scenario, input files and executor) in its directory, and a run whose inputs
+did not change since is skipped, so an interrupted or extended sweep only runs what
+is missing.
+
+Grid file, one entry per line followed by its values:
+
+    # entry, value1, value2, ...
+    fundamental diagram + parameter file name, SbFD + parameters/sbfdParamBER.txt, Weidmann + parameters/weidmannParamBER.txt
+    blockage configuration file name, networks/SYD350_00_blockage.txt, networks/SYD350_01_blockage.txt
+    alpha, -0.5, -1.0
+
+Entries joined by `+` vary together, their values being joined the same way. The
+entries are those of the template, whose lines are kept in order as the simulator
+reads them by position.
+
+e.g. `python scenario_sweep.py template.txt grid.txt --output-dir sweep --workers 8`.
+"""
+
+import argparse
+import csv
+import itertools
+import json
+import os
+import subprocess
+import sys
+import time
+import traceback
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from stage_cache import StageCache, fileFingerprint
+
+#Entries set in every run, so that the simulator writes its travel times and opens no window
+RUN_ENTRIES = OrderedDict([('text output', 'true'), ('visualization', 'false')])
+
+#Files a successful run leaves in its directory
+OUTPUT_FILES = ('travelTimeDist.txt', 'travelTimeMean.txt')
+
+#Record of a successful run, with the fingerprint of its inputs
+RUN_RECORD = 'sweepRun.json'
+
+#Repository root, where the simulator classes and libraries are
+REPOSITORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+#Libraries of the simulator, relative to the repository root
+JAVA_LIBRARIES = ('apache-commons/commons-math3-3.3.jar', 'processing/core/library/core.jar')
+
+#Lines of the simulator log kept in the error of a failed run
+LOG_TAIL = 20
+
+
+def entryKey(entry):
+    """ An entry name without white space, as Input.loadScenario compares them."""
+    return "".join(entry.split())
+
+
+def readGrid(file_path):
+    """ Reads a grid file, see the module documentation for its format.
+
+        Returns
+        -------
+        axes : list
+            (entries, values) pairs, entries a tuple of entry names and values a list of
+            tuples of as many values.
+    """
+    axes = []
+    with open(file_path, encoding="utf8") as gridFile:
+        for row in csv.reader(gridFile, delimiter=','):
+            row = [value.strip() for value in row]
+            if len(row) == 0 or row[0] == '' or row[0].startswith('#'):
+                continue
+            entries = tuple(entry.strip() for entry in row[0].split('+'))
+            values = []
+            for value in row[1:]:
+                parts = tuple(part.strip() for part in value.split('+'))
+                if len(parts) != len(entries):
+                    raise ValueError("Value '{}' of '{}' needs {} parts".format(value, row[0], len(entries)))
+                values.append(parts)
+            if not values:
+                raise ValueError("Entry '{}' has no value".format(row[0]))
+            axes.append((entries, values))
+    return axes
+
+
+def expandGrid(axes):
+    """ Every combination of the values of the axes, as OrderedDicts of entry values."""
+    variants = []
+    for combination in itertools.product(*[values for _, values in axes]):
+        variant = OrderedDict()
+        for (entries, _), values in zip(axes, combination):
+            variant.update(zip(entries, values))
+        variants.append(variant)
+    return variants
+
+
+def writeScenario(template_path, file_path, entries):
+    """ Writes a copy of the template scenario with the values of some entries replaced.
+
+        The lines keep their order since Input.loadScenario reads the entries by line
+        number, so every entry must already be in the template.
+    """
+    values = dict((entryKey(entry), value) for entry, value in entries.items())
+    found = set()
+    lines = []
+    with open(template_path, encoding="utf8") as templateFile:
+        for line in templateFile:
+            entry = line.split(':', 1)[0]
+            key = entryKey(entry)
+            if ':' in line and not line.lstrip().startswith('#') and key in values:
+                line = "{}: {}\n".format(entry.rstrip(), values[key])
+                found.add(key)
+            lines.append(line)
+    missing = [entry for entry in entries if entryKey(entry) not in found]
+    if missing:
+        raise ValueError("{} has no entries {}".format(template_path, ", ".join(missing)))
+    with open(file_path, 'w', encoding="utf8") as scenarioFile:
+        scenarioFile.writelines(lines)
+
+
+def scenarioInputs(scenario_path, root=None):
+    """ Paths of the input files of a scenario, those of its entries naming a file."""
+    values = OrderedDict()
+    with open(scenario_path, encoding="utf8") as scenarioFile:
+        for line in scenarioFile:
+            line = "".join(line.split())
+            if line and not line.startswith('#') and ':' in line:
+                key, value = line.split(':', 1)
+                values[key] = value
+    inputDir = os.path.join(root or '', values.get('inputdirectory', ''))
+    return [inputDir + value for key, value in values.items()
+            if value and (key.endswith('filename') or key.endswith('file'))]
+
+
+class Executor(object):
+    """
+    Runs one scenario file. Subclasses implement run() and extend fingerprint() with
+    whatever their results depend on besides the scenario and its input files.
+    Executors are sent to the worker processes, so they must be picklable.
+    """
+    name = None
+
+    def fingerprint(self):
+        """ JSON serialisable description of the executor, part of the key of the runs."""
+        return [self.name]
+
+    def run(self, scenario_path, output_dir, root):
+        """ Simulates the scenario, raising an exception when it fails.
+
+            Parameters
+            ----------
+            scenario_path : string
+                the scenario file of the run.
+            output_dir : string
+                directory of the run, the output directory of the scenario.
+            root : string
+                directory the input directory of the scenario is relative to.
+        """
+        raise NotImplementedError
+
+
+class JavaExecutor(Executor):
+    """
+    The simulator in a Java subprocess, `java -cp <classpath> anisopedctm.AnisoPedCTM
+    scenario.txt` started in the root directory, its output going to simulator.log.
+    The default classpath expects the classes compiled into src (see the README).
+    """
+    name = 'java'
+
+    def __init__(self, classpath=None, java='java', timeout=None, options=()):
+        if classpath is None:
+            classpath = os.pathsep.join([os.path.join(REPOSITORY, 'src')] +
+                                        [os.path.join(REPOSITORY, library) for library in JAVA_LIBRARIES])
+        self.classpath = classpath
+        self.java = java
+        self.timeout = timeout
+        self.options = list(options)
+
+    def fingerprint(self):
+        # the compiled classes and libraries, by size and modification time
+        stamps = []
+        for entry in self.classpath.split(os.pathsep):
+            paths = [entry]
+            if os.path.isdir(entry):
+                paths = [os.path.join(directory, name) for directory, _, names in os.walk(entry)
+                         for name in names if name.endswith('.class')]
+            for path in sorted(paths):
+                if os.path.exists(path):
+                    stat = os.stat(path)
+                    stamps.append((path, stat.st_size, int(stat.st_mtime)))
+        return [self.name, self.java, self.options, stamps]
+
+    def run(self, scenario_path, output_dir, root):
+        command = [self.java] + self.options + ['-cp', self.classpath, 'anisopedctm.AnisoPedCTM',
+                                                os.path.abspath(scenario_path)]
+        logPath = os.path.join(output_dir, 'simulator.log')
+        with open(logPath, 'w', encoding="utf8") as logFile:
+            code = subprocess.call(command, cwd=root, stdout=logFile, stderr=subprocess.STDOUT, timeout=self.timeout)
+        # Input.loadScenario prints its errors and carries on, so check the outputs too
+        missing = [name for name in OUTPUT_FILES if not os.path.exists(os.path.join(output_dir, name))]
+        if code != 0 or missing:
+            with open(logPath, encoding="utf8", errors='replace') as logFile:
+                tail = "".join(logFile.readlines()[-LOG_TAIL:])
+            raise RuntimeError("The simulator exited with code {}{}:\n{}".format(
+                code, ", without " + ", ".join(missing) if missing else "", tail))
+
+
+class LocalExecutor(Executor):
+    """
+    The NumPy network loading of network_loading.py, in the worker process itself.
+    A stand-in for the simulator when no JVM is available, e.g. to test a sweep.
+    """
+    name = 'local'
+
+    def __init__(self, max_time=None):
+        self.max_time = max_time
+
+    def fingerprint(self):
+        return [self.name, self.max_time, fileFingerprint(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                                       'network_loading.py'))]
+
+    def run(self, scenario_path, output_dir, root):
+        from network_loading import NetworkLoading
+        network = NetworkLoading.fromScenario(scenario_path, root)
+        network.run(self.max_time, record_cells=False).writeTravelTimes(output_dir)
+
+
+#Executors selectable on the command line
+EXECUTORS = {'java': JavaExecutor, 'local': LocalExecutor}
+
+
+class RunContext(object):
+    """
+    One variant of the sweep: its entries, scenario file and directory, the key of its
+    inputs and, once run, its outputs or error.
+    """
+    def __init__(self, name, entries, output_dir):
+        self.name = name
+        self.entries = OrderedDict(entries)
+        self.output_dir = output_dir
+        self.scenario_path = os.path.join(output_dir, 'scenario.txt')
+        self.key = None
+        self.outputs = None
+        self.error = None
+        self.wallTime = None
+        self.attempts = 0
+        self.skipped = False
+
+    def toDict(self):
+        return {'name': self.name, 'entries': self.entries, 'outputDir': self.output_dir,
+                'scenario': self.scenario_path, 'key': self.key, 'outputs': self.outputs, 'error': self.error,
+                'wallTime': self.wallTime, 'attempts': self.attempts, 'skipped': self.skipped}
+
+
+def runKey(run, executor, root=None):
+    """ Key of the inputs of a run: its scenario file, the input files it names and the executor."""
+    parts = [fileFingerprint(run.scenario_path)]
+    for path in scenarioInputs(run.scenario_path, root):
+        parts.append((path, fileFingerprint(path) if os.path.isfile(path) else None))
+    return StageCache().key('sweep run', parts, executor.fingerprint())
+
+
+def outputDirectoryEntry(output_dir, root=None):
+    """ The value of the output directory entry of a scenario writing into output_dir."""
+    outputDir = os.path.abspath(output_dir)
+    if ':' in outputDir:
+        # Input.loadScenario would split a Windows drive as an entry, relative to the root then
+        outputDir = os.path.relpath(outputDir, root or os.curdir)
+    return outputDir.replace(os.sep, '/') + '/'
+
+
+def prepareRuns(template_path, axes, output_dir, root=None, name=None):
+    """ Writes the scenario file of every variant of the grid in its run directory.
+
+        Parameters
+        ----------
+        template_path : string
+            the template scenario file.
+        axes : list
+            the axes of the grid, see readGrid().
+        output_dir : string
+            directory receiving one sub-directory per run.
+        root : string
+            (optional) directory the input directory of the scenario is relative to,
+            the current directory by default.
+        name : string
+            (optional) prefix of the run names, the name of the template by default.
+
+        Returns
+        -------
+        runs : list
+            RunContext instances, in the order of the grid.
+    """
+    if name is None:
+        name = os.path.splitext(os.path.basename(template_path))[0]
+    runs = []
+    for i, variant in enumerate(expandGrid(axes)):
+        run = RunContext("{}-{:03d}".format(name, i), variant, os.path.join(output_dir, "{}-{:03d}".format(name, i)))
+        os.makedirs(run.output_dir, exist_ok=True)
+        entries = OrderedDict(variant)
+        entries.update(RUN_ENTRIES)
+        entries['output directory'] = outputDirectoryEntry(run.output_dir, root)
+        writeScenario(template_path, run.scenario_path, entries)
+        runs.append(run)
+    return runs
+
+
+def readRecord(run):
+    """ The record left by the last successful run in its directory, None when there is none."""
+    path = os.path.join(run.output_dir, RUN_RECORD)
+    try:
+        with open(path, encoding="utf8") as recordFile:
+            return json.load(recordFile)
+    except (OSError, ValueError):
+        return None
+
+
+def summariseRun(output_dir):
+    """ Demand, arrived people and their mean travel time (seconds) from travelTimeMean.txt."""
+    demand = arrived = weighted = 0.0
+    with open(os.path.join(output_dir, 'travelTimeMean.txt'), encoding="utf8") as meanFile:
+        next(meanFile, None)
+        for row in csv.reader(meanFile, delimiter=','):
+            if len(row) < 6:
+                continue
+            size, travelTime, share = float(row[2]), float(row[4]), float(row[5])
+            demand += size
+            if share > 0 and travelTime == travelTime:
+                arrived += size * share
+                weighted += size * share * travelTime
+    return {'demand': demand, 'arrived': arrived, 'meanTravelTime': weighted / arrived if arrived > 0 else None}
+
+
+def executeRun(run, executor, root=None, retries=0):
+    """ Runs one scenario in the current process, attempting it again after a failure.
+
+        Returns its context with the outputs or the error of the last attempt.
+    """
+    start = time.perf_counter()
+    run.error = None
+    while run.attempts <= retries:
+        run.attempts += 1
+        try:
+            for name in OUTPUT_FILES + (RUN_RECORD,):
+                if os.path.exists(os.path.join(run.output_dir, name)):
+                    os.remove(os.path.join(run.output_dir, name))
+            executor.run(run.scenario_path, run.output_dir, root)
+            run.outputs = summariseRun(run.output_dir)
+            run.outputs['files'] = [os.path.join(run.output_dir, name) for name in OUTPUT_FILES]
+            run.error = None
+            break
+        except Exception:
+            run.error = traceback.format_exc()
+    run.wallTime = time.perf_counter() - start
+    if run.error is None:
+        with open(os.path.join(run.output_dir, RUN_RECORD), 'w', encoding="utf8") as recordFile:
+            json.dump({'key': run.key, 'entries': run.entries, 'outputs': run.outputs, 'wallTime': run.wallTime,
+                       'attempts': run.attempts}, recordFile, indent=2)
+    return run
+
+
+def runSweep(runs, executor, root=None, workers=None, retries=0, force=False, log=None):
+    """ Runs all the runs whose inputs changed in parallel worker processes.
+
+        Parameters
+        ----------
+        runs : list
+            RunContext instances, see prepareRuns().
+        executor : Executor
+            runs the scenarios.
+        root : string
+            (optional) directory the input directory of the scenarios is relative to.
+        workers : integer
+            (optional) number of worker processes, the number of cores by default.
+        retries : integer
+            (optional) further attempts of a failed run.
+        force : boolean
+            (optional) also run the runs whose inputs did not change.
+
+        Returns
+        -------
+        runs : list
+            the run contexts with their outputs or errors, in the order of the input.
+    """
+    pending = []
+    for run in runs:
+        run.key = runKey(run, executor, root)
+        record = readRecord(run)
+        if (not force and record is not None and record.get('key') == run.key
+                and all(os.path.exists(path) for path in record['outputs']['files'])):
+            run.outputs, run.wallTime, run.attempts = record['outputs'], record['wallTime'], record['attempts']
+            run.skipped = True
+        else:
+            pending.append(run)
+    if log is not None and len(pending) < len(runs):
+        log("{} of {} run(s) unchanged, skipped".format(len(runs) - len(pending), len(runs)))
+    done = dict((run.name, run) for run in runs if run.skipped)
+    if pending:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = dict((pool.submit(executeRun, run, executor, root, retries), run.name) for run in pending)
+            for future in as_completed(futures):
+                run = future.result()
+                done[futures[future]] = run
+                if log is not None:
+                    status = "failed" if run.error else "done"
+                    log("[{}/{}] {} {} in {:.1f}s ({} attempt(s))".format(
+                        len(done), len(runs), run.name, status, run.wallTime, run.attempts))
+    return [done[run.name] for run in runs]
+
+
+def writeResults(runs, file_path):
+    """ Writes one line per run: its status, timing, outcome and entries."""
+    entries = []
+    for run in runs:
+        entries.extend(entry for entry in run.entries if entry not in entries)
+    with open(file_path, 'w', encoding="utf8") as resultFile:
+        resultFile.write("# run, status, attempts, wallTime, demand, arrived, meanTravelTime, {} \n".format(
+            ", ".join(entries)))
+        for run in runs:
+            status = "failed" if run.error else ("skipped" if run.skipped else "done")
+            outputs = run.outputs or {}
+            values = [run.name, status, run.attempts, "{:.3f}".format(run.wallTime or 0.0),
+                      outputs.get('demand', ''), outputs.get('arrived', ''), outputs.get('meanTravelTime', '')]
+            resultFile.write(", ".join(str(value) if value is not None else '' for value in
+                                       values + [run.entries.get(entry, '') for entry in entries]) + "\n")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the variants of a scenario in parallel.")
+    parser.add_argument('template', help="template scenario file, see examples/scenarios")
+    parser.add_argument('grid', help="grid file: entry[ + entry], value[ + value], ...")
+    parser.add_argument('--output-dir', required=True, help="directory receiving one sub-directory per run")
+    parser.add_argument('--root', default=os.curdir, help="directory the input directory of the scenario is relative to")
+    parser.add_argument('--executor', choices=sorted(EXECUTORS), default='java', help="simulator running the scenarios")
+    parser.add_argument('--classpath', default=None, help="classpath of the Java simulator")
+    parser.add_argument('--timeout', type=float, default=None, help="seconds after which a Java run is stopped")
+    parser.add_argument('--workers', type=int, default=None, help="number of worker processes")
+    parser.add_argument('--retries', type=int, default=1, help="further attempts of a failed run")
+    parser.add_argument('--force', action='store_true', help="also run the runs whose inputs did not change")
+    parser.add_argument('--report', default=None, help="JSON file receiving the outcome of every run")
+    args = parser.parse_args(argv)
+
+    if args.executor == 'java':
+        executor = JavaExecutor(args.classpath, timeout=args.timeout)
+    else:
+        executor = LocalExecutor()
+    log = lambda message: print(message, file=sys.stderr, flush=True)
+    start = time.perf_counter()
+    runs = prepareRuns(args.template, readGrid(args.grid), args.output_dir, args.root)
+    runs = runSweep(runs, executor, args.root, args.workers, args.retries, args.force, log)
+    writeResults(runs, os.path.join(args.output_dir, 'sweepResults.txt'))
+    failed = [run for run in runs if run.error]
+    for run in failed:
+        log("Run {} failed:\n{}".format(run.name, run.error))
+    log("{} run(s) done, {} skipped, {} failed, in {:.1f}s".format(
+        len(runs) - len(failed), sum(run.skipped for run in runs), len(failed), time.perf_counter() - start))
+    if args.report is not None:
+        with open(args.report, 'w', encoding="utf8") as reportFile:
+            json.dump([run.toDict() for run in runs], reportFile, indent=2)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
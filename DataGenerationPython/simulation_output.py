@@ -0,0 +1,367 @@
+"""
+module: simulation_output
+-------------------------
+
+Columnar store of the text logs written by the simulator: the system state
+(Output.writeSystemState, one line per time interval, link, cell, group and
+fragment size) and the travel time distribution (Output.writeTravelTime). A log is
+converted once, in chunks, into one raw binary file per column (int32 ids, float32
+sizes, int32 codes of a name dictionary for the cell and route names) and a JSON
+description. The columns are then opened as NumPy memory maps, so a query only reads
+the pages of the rows it needs.
+
+Every indexed column (time, link, cell and group of the system state) gets a sorted
+index: the unique values, the offsets of their rows and, unless the log is already
+sorted on it, the permutation of the rows sorted by value. The rows of one cell, link
+or group are thus a slice of the permutation and remain in time order.
+"""
+
+import argparse
+import json
+import os
+import sys
+
+import numpy as np
+
+#Bump when the layout of the store changes
+STORE_VERSION = 1
+
+#Rows parsed per chunk when converting a log
+CHUNK_ROWS = 1000000
+
+#Columns of the logs, 'name' columns are stored as int32 codes of a name dictionary
+SYSTEM_STATE_COLUMNS = (('time', 'int32'), ('link', 'int32'), ('cell', 'name'), ('group', 'int32'),
+                        ('size', 'float32'))
+TRAVEL_TIME_COLUMNS = (('group', 'int32'), ('route', 'name'), ('groupSize', 'float32'), ('depTime', 'int32'),
+                       ('travelTime', 'float32'), ('fragSize', 'float32'))
+
+#Columns indexed for the queries
+SYSTEM_STATE_INDEXES = ('time', 'link', 'cell', 'group')
+TRAVEL_TIME_INDEXES = ('group',)
+
+
+def convertLog(log_path, directory, columns, indexes=(), chunk_rows=CHUNK_ROWS):
+    """ Converts a comma separated simulator log into a columnar store.
+
+        Parameters
+        ----------
+        log_path : string
+            the text log, lines starting with '#' being ignored.
+        directory : string
+            directory of the store, created if needed and overwritten.
+        columns : tuple
+            (name, type) of the columns of the log, type being a NumPy type or 'name'.
+        indexes : tuple
+            (optional) names of the columns to index.
+        chunk_rows : integer
+            (optional) number of rows parsed at once, bounds the memory used.
+
+        Returns
+        -------
+        meta : dictionary
+            the description of the store.
+    """
+    import pandas as pd
+    os.makedirs(directory, exist_ok=True)
+    names = [name for name, _ in columns]
+    codes = dict((name, {}) for name, kind in columns if kind == 'name')
+    dtypes = dict((name, str if kind == 'name' else kind) for name, kind in columns)
+    rows = 0
+    files = dict((name, open(_columnPath(directory, name), 'wb')) for name in names)
+    try:
+        reader = pd.read_csv(log_path, header=None, names=names, dtype=dtypes, comment='#',
+                             skipinitialspace=True, chunksize=chunk_rows)
+        for chunk in reader:
+            for name, kind in columns:
+                if kind == 'name':
+                    #codes of the chunk mapped onto the dictionary of the whole log
+                    local, uniques = pd.factorize(chunk[name].str.strip())
+                    dictionary = codes[name]
+                    mapping = np.array([dictionary.setdefault(value, len(dictionary)) for value in uniques],
+                                       dtype=np.int32)
+                    values = mapping[local] if len(mapping) else np.zeros(len(chunk), dtype=np.int32)
+                else:
+                    values = chunk[name].to_numpy(dtype=kind)
+                files[name].write(values.tobytes())
+            rows += len(chunk)
+    finally:
+        for columnFile in files.values():
+            columnFile.close()
+    meta = {'version': STORE_VERSION, 'source': os.path.abspath(log_path), 'rows': rows,
+            'columns': [[name, 'int32' if kind == 'name' else kind] for name, kind in columns],
+            'names': dict((name, sorted(dictionary, key=dictionary.get)) for name, dictionary in codes.items()),
+            'indexes': {}}
+    for name in indexes:
+        meta['indexes'][name] = buildIndex(directory, meta, name)
+    with open(os.path.join(directory, 'meta.json'), 'w', encoding="utf8") as metaFile:
+        json.dump(meta, metaFile)
+    return meta
+
+
+def buildIndex(directory, meta, name):
+    """ Writes the sorted index of a column, returns its description.
+
+        The permutation is only written when the rows are not already sorted on the
+        column, as the time of the system state log.
+    """
+    values = _openColumn(directory, meta, name)
+    if len(values) == 0 or bool(np.all(values[1:] >= values[:-1])):
+        order = None
+        sortedValues = values
+    else:
+        order = np.argsort(values, kind='stable')
+        sortedValues = values[order]
+        order.astype(np.int64).tofile(_columnPath(directory, name + '.order'))
+    keys, starts = np.unique(sortedValues, return_index=True)
+    np.save(os.path.join(directory, name + '.keys.npy'), keys)
+    np.save(os.path.join(directory, name + '.offsets.npy'), np.append(starts, len(values)).astype(np.int64))
+    return {'sorted': order is None, 'numKeys': int(len(keys))}
+
+
+def convertSystemState(log_path, directory, chunk_rows=CHUNK_ROWS):
+    """ Converts a system state log and opens the store."""
+    convertLog(log_path, directory, SYSTEM_STATE_COLUMNS, SYSTEM_STATE_INDEXES, chunk_rows)
+    return SystemState(directory)
+
+
+def convertTravelTimes(log_path, directory, chunk_rows=CHUNK_ROWS):
+    """ Converts a travel time distribution log and opens the store."""
+    convertLog(log_path, directory, TRAVEL_TIME_COLUMNS, TRAVEL_TIME_INDEXES, chunk_rows)
+    return TravelTimes(directory)
+
+
+def _columnPath(directory, name):
+    return os.path.join(directory, name + '.bin')
+
+
+def _openColumn(directory, meta, name):
+    dtype = dict(meta['columns'])[name]
+    if meta['rows'] == 0:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(_columnPath(directory, name), dtype=dtype, mode='r', shape=(meta['rows'],))
+
+
+class ColumnStore(object):
+    """
+    Memory-mapped columns of a converted log. The columns and indexes are opened on
+    first use and nothing is read before a query slices them.
+    """
+    def __init__(self, directory):
+        with open(os.path.join(directory, 'meta.json'), encoding="utf8") as metaFile:
+            self.meta = json.load(metaFile)
+        if self.meta.get('version') != STORE_VERSION:
+            raise ValueError("%s was written by another version of simulation_output, convert the log again"
+                             % directory)
+        self.directory = directory
+        self._columns = {}
+        self._indexes = {}
+        self._codes = dict((name, dict((value, code) for code, value in enumerate(values)))
+                           for name, values in self.meta['names'].items())
+
+    def __len__(self):
+        return self.meta['rows']
+
+    def column(self, name):
+        """ The memory map of a column."""
+        if name not in self._columns:
+            self._columns[name] = _openColumn(self.directory, self.meta, name)
+        return self._columns[name]
+
+    def names(self, name):
+        """ The name dictionary of a 'name' column, indexed by code."""
+        return self.meta['names'][name]
+
+    def code(self, name, value):
+        """ The code of a value of a 'name' column, None when it does not occur."""
+        return self._codes[name].get(value)
+
+    def keys(self, name):
+        """ The distinct values of an indexed column, sorted."""
+        return self._index(name)[0]
+
+    def rows(self, name, value):
+        """ Indices of the rows whose column `name` equals `value`, in log order."""
+        keys, offsets, order = self._index(name)
+        position = int(np.searchsorted(keys, value))
+        if position >= len(keys) or keys[position] != value:
+            return np.zeros(0, dtype=np.int64)
+        if order is None:
+            return np.arange(offsets[position], offsets[position + 1], dtype=np.int64)
+        return np.asarray(order[offsets[position]:offsets[position + 1]])
+
+    def rangeRows(self, name, start=None, end=None):
+        """ Indices of the rows whose column `name` lies in [start, end], in column order."""
+        keys, offsets, order = self._index(name)
+        first = 0 if start is None else int(np.searchsorted(keys, start, side='left'))
+        last = len(keys) if end is None else int(np.searchsorted(keys, end, side='right'))
+        if order is None:
+            return np.arange(offsets[first], offsets[last], dtype=np.int64)
+        return np.asarray(order[offsets[first]:offsets[last]])
+
+    def _index(self, name):
+        if name not in self._indexes:
+            if name not in self.meta['indexes']:
+                raise KeyError("column %s is not indexed" % name)
+            keys = np.load(os.path.join(self.directory, name + '.keys.npy'), mmap_mode='r')
+            offsets = np.load(os.path.join(self.directory, name + '.offsets.npy'), mmap_mode='r')
+            order = None
+            if not self.meta['indexes'][name]['sorted'] and len(self) > 0:
+                order = np.memmap(_columnPath(self.directory, name + '.order'), dtype=np.int64, mode='r',
+                                  shape=(len(self),))
+            self._indexes[name] = (keys, offsets, order)
+        return self._indexes[name]
+
+
+class SystemState(ColumnStore):
+    """
+    Converted system state log: the size of every group on every link at every time
+    interval.
+    """
+    def timeRange(self):
+        """ First and last time interval of the log."""
+        times = self.keys('time')
+        if len(times) == 0:
+            return None
+        return int(times[0]), int(times[-1])
+
+    def snapshot(self, time_interval):
+        """ The state at one time interval, as a dictionary of arrays (link, cell, group, size)."""
+        return self._select(self.rows('time', time_interval), ('link', 'cell', 'group', 'size'))
+
+    def cellOccupancy(self, cell_name, start=None, end=None):
+        """ Number of people in a cell at every time interval.
+
+            Parameters
+            ----------
+            cell_name : string
+                the name of the cell.
+            start, end : integer
+                (optional) time interval range, the whole log by default.
+
+            Returns
+            -------
+            times : numpy.ndarray
+                the time intervals from start to end.
+            people : numpy.ndarray
+                the summed group sizes of all the links of the cell.
+        """
+        code = self.code('cell', cell_name)
+        rows = np.zeros(0, dtype=np.int64) if code is None else self.rows('cell', code)
+        return self._timeSeries(rows, start, end)
+
+    def cellDensity(self, cell_name, area, start=None, end=None):
+        """ Density (people per square metre) of a cell of `area` square metres at every
+            time interval, see cellOccupancy.
+        """
+        times, people = self.cellOccupancy(cell_name, start, end)
+        return times, people / np.float32(area)
+
+    def cellDensities(self, cell_areas, start=None, end=None):
+        """ Density time series of many cells at once.
+
+            Parameters
+            ----------
+            cell_areas : dictionary
+                area in square metres by cell name, e.g. from readCellAreas.
+
+            Returns
+            -------
+            times : numpy.ndarray
+                the time intervals from start to end.
+            densities : dictionary
+                the density array of every cell.
+        """
+        start, end = self._window(start, end)
+        rows = self.rangeRows('time', start, end)
+        cells = self.column('cell')[rows]
+        codes = dict((self.code('cell', name), name) for name in cell_areas if self.code('cell', name) is not None)
+        wanted = np.isin(cells, np.fromiter(codes, dtype=np.int32, count=len(codes)))
+        rows, cells = rows[wanted], cells[wanted]
+        times = self.column('time')[rows].astype(np.int64) - start
+        sizes = self.column('size')[rows]
+        width = end - start + 1
+        densities = {}
+        #one bincount over (cell, time) for all the cells
+        position = dict((code, i) for i, code in enumerate(codes))
+        cellIndex = np.array([position[code] for code in cells.tolist()], dtype=np.int64)
+        people = np.bincount(cellIndex * width + times, weights=sizes,
+                             minlength=len(codes) * width).reshape(len(codes), width)
+        for i, (code, name) in enumerate(codes.items()):
+            densities[name] = (people[i] / cell_areas[name]).astype(np.float32)
+        for name in cell_areas:
+            densities.setdefault(name, np.zeros(width, dtype=np.float32))
+        return np.arange(start, end + 1), densities
+
+    def linkOccupancy(self, link_id, start=None, end=None):
+        """ Number of people on a link at every time interval, see cellOccupancy."""
+        return self._timeSeries(self.rows('link', link_id), start, end)
+
+    def groupTrajectory(self, group_id):
+        """ The fragments of a group in time order, as a dictionary of arrays (time, link,
+            cell, size). The cell entries are codes, see names('cell').
+        """
+        return self._select(self.rows('group', group_id), ('time', 'link', 'cell', 'size'))
+
+    def _select(self, rows, names):
+        return dict((name, np.asarray(self.column(name)[rows])) for name in names)
+
+    def _window(self, start, end):
+        timeRange = self.timeRange() or (0, -1)
+        return (timeRange[0] if start is None else start), (timeRange[1] if end is None else end)
+
+    def _timeSeries(self, rows, start, end):
+        start, end = self._window(start, end)
+        width = max(end - start + 1, 0)
+        times = self.column('time')[rows].astype(np.int64)
+        inside = (times >= start) & (times <= end)
+        values = np.bincount(times[inside] - start, weights=self.column('size')[rows[inside]], minlength=width)
+        return np.arange(start, end + 1), values.astype(np.float32)
+
+
+class TravelTimes(ColumnStore):
+    """
+    Converted travel time distribution: the travel time of every fragment of every
+    group.
+    """
+    def distribution(self, group_id):
+        """ Travel times and fragment sizes of a group, as a dictionary of arrays."""
+        rows = self.rows('group', group_id)
+        return dict((name, np.asarray(self.column(name)[rows])) for name in ('route', 'travelTime', 'fragSize'))
+
+    def meanTravelTimes(self):
+        """ Weighted mean travel time of every group, as (groups, means) arrays."""
+        groups = self.column('group')
+        weights = self.column('fragSize').astype(np.float64)
+        keys, inverse = np.unique(groups, return_inverse=True)
+        total = np.bincount(inverse, weights=weights)
+        weighted = np.bincount(inverse, weights=weights * self.column('travelTime'))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return keys, weighted / total
+
+
+def readCellAreas(cells_path):
+    """ Reads the surface of every cell from a cell file of the generator."""
+    import pandas as pd
+    cells = pd.read_csv(cells_path, usecols=['cellName', 'surfaceSize'])
+    return dict(zip(cells['cellName'].str.strip(), cells['surfaceSize'].astype(float)))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Convert a system state or travel time log of the simulator "
+                                                 "into a memory-mapped columnar store.")
+    parser.add_argument('log', help="systemState.txt or travel time distribution file")
+    parser.add_argument('store', help="directory of the store")
+    parser.add_argument('--travel-times', action='store_true', help="the log is a travel time distribution")
+    parser.add_argument('--chunk-rows', type=int, default=CHUNK_ROWS, help="rows parsed at once")
+    args = parser.parse_args(argv)
+
+    if args.travel_times:
+        store = convertTravelTimes(args.log, args.store, args.chunk_rows)
+    else:
+        store = convertSystemState(args.log, args.store, args.chunk_rows)
+    print("%d rows written to %s" % (len(store), args.store), file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
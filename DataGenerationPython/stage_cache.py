@@ -0,0 +1,118 @@
+"""
+module: stage_cache
+-------------------------
+
+Content-hashed cache of the stages of the data generation (graph, cells, snapped OD,
+routes and links). Every artifact is stored under a key derived from everything it
+depends on: the parameters of its stage, the key of the stage it was computed from and
+a fingerprint of the code computing it. A rerun therefore only recomputes the stages
+whose inputs changed, and the per OD pair stages only the pairs that are new.
+Artifacts are pickled in one sub-directory per stage and written atomically, so an
+interrupted run never leaves a corrupt entry behind.
+"""
+
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+
+#Bump to invalidate all the caches written by older versions of the artifacts
+CACHE_VERSION = 2
+
+
+class StageCache(object):
+    """
+    Persistent store of stage artifacts. A cache without directory is disabled:
+    nothing is loaded or stored, so the pipeline always recomputes.
+    """
+    def __init__(self, directory=None):
+        self.directory = directory
+        self.hits = {}
+        self.misses = {}
+
+    @property
+    def enabled(self):
+        return self.directory is not None
+
+    def key(self, stage, *parts):
+        """ Hashes the stage name and its inputs into a key.
+
+            The parts can be any JSON serialisable values (tuples are treated as
+            lists), other objects are represented by their repr.
+        """
+        text = json.dumps([CACHE_VERSION, stage] + list(parts), sort_keys=True, default=repr)
+        return hashlib.sha256(text.encode('utf8')).hexdigest()[:24]
+
+    def contains(self, stage, key):
+        """ Whether an artifact is stored for `key`, without loading it."""
+        path = self._path(stage, key)
+        return path is not None and os.path.exists(path)
+
+    def load(self, stage, key, default=None):
+        """ Returns the artifact stored for `key`, or `default` when there is none."""
+        path = self._path(stage, key)
+        if path is None or not os.path.exists(path):
+            self.misses[stage] = self.misses.get(stage, 0) + 1
+            return default
+        try:
+            with open(path, 'rb') as artifactFile:
+                value = pickle.load(artifactFile)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            #unreadable entries are treated as missing and get overwritten
+            self.misses[stage] = self.misses.get(stage, 0) + 1
+            return default
+        self.hits[stage] = self.hits.get(stage, 0) + 1
+        return value
+
+    def store(self, stage, key, value):
+        """ Persists the artifact of `key`, a no-op when the cache is disabled."""
+        path = self._path(stage, key)
+        if path is None:
+            return None
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        handle, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(handle, 'wb') as artifactFile:
+                pickle.dump(value, artifactFile, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_path, path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        return path
+
+    def summary(self):
+        """ Hits and misses per stage, for the run report."""
+        stages = sorted(set(self.hits) | set(self.misses))
+        return dict((stage, {'hits': self.hits.get(stage, 0), 'misses': self.misses.get(stage, 0)})
+                    for stage in stages)
+
+    def _path(self, stage, key):
+        if not self.enabled:
+            return None
+        return os.path.join(self.directory, stage, key + '.pkl')
+
+
+def graphFingerprint(g):
+    """ Content hash of a street network: node coordinates and edge lengths and directions."""
+    digest = hashlib.sha256()
+    for node, data in sorted(g.nodes(data=True), key=lambda item: str(item[0])):
+        digest.update("{}|{!r}|{!r};".format(node, data.get('x'), data.get('y')).encode('utf8'))
+    edges = sorted(((str(u), str(v), str(k), data.get('length'), data.get('oneway'))
+                    for u, v, k, data in g.edges(keys=True, data=True)), key=lambda edge: edge[:3])
+    for edge in edges:
+        digest.update("{}|{}|{}|{!r}|{!r};".format(*edge).encode('utf8'))
+    return digest.hexdigest()[:24]
+
+
+def fileFingerprint(*paths):
+    """ Content hash of files, e.g. an OD matrix or the modules computing a stage."""
+    digest = hashlib.sha256()
+    for path in paths:
+        with open(path, 'rb') as dataFile:
+            for block in iter(lambda: dataFile.read(1 << 20), b''):
+                digest.update(block)
+        digest.update(b'\0')
+    return digest.hexdigest()[:24]
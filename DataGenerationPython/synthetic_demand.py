@@ -0,0 +1,228 @@
+"""
+module: synthetic_demand
+-------------------------
+
+Reproducible generation of synthetic OD demand for load-testing the data generation
+and the simulator. Distinct OD pairs are drawn without replacement directly over the
+pair indices, so the cost does not depend on how close the requested number of pairs
+is to the number of possible pairs, and the result is written in the ODMatrix format
+read by mapGeoToCells (origin "lat|long", destination "lat|long", depTime "H:MM",
+demand).
+"""
+
+import numpy as np
+
+#Departure-time profiles as mixtures of (mean [min after midnight], st. dev. [min], weight)
+DEPARTURE_PROFILES = {
+    'uniform': [],
+    'am_peak': [(8 * 60, 45, 1.0)],
+    'pm_peak': [(17.5 * 60, 60, 1.0)],
+    'double_peak': [(8 * 60, 45, 0.5), (17.5 * 60, 60, 0.5)],
+}
+
+OD_MATRIX_HEADER = "#origin, destination, depTime, Demand"
+
+
+def numPairs(n_nodes, directed=True):
+    """ Number of distinct OD pairs (without self pairs) between `n_nodes` nodes."""
+    if directed:
+        return n_nodes * (n_nodes - 1)
+    return n_nodes * (n_nodes - 1) // 2
+
+
+def samplePairIndices(n_nodes, n_pairs, directed=True, rng=None):
+    """ Draws distinct pair indices without replacement.
+
+        Parameters
+        ----------
+        n_nodes : integer
+            number of nodes that can generate demands.
+        n_pairs : integer
+            number of pairs requested, capped at the number of possible pairs.
+        directed : boolean
+            (optional) whether (a, b) and (b, a) are different pairs.
+        rng : numpy.random.Generator
+            (optional) the random generator, a fresh unseeded one by default.
+
+        Returns
+        -------
+        indices : numpy.ndarray
+            sorted int64 pair indices, decoded with `pairIndexToNodes`.
+    """
+    rng = np.random.default_rng() if rng is None else rng
+    max_pair = numPairs(n_nodes, directed)
+    n_pairs = min(int(n_pairs), max_pair)
+    if n_pairs <= 0:
+        return np.empty(0, dtype=np.int64)
+    indices = rng.choice(max_pair, size=n_pairs, replace=False)
+    indices = np.sort(np.asarray(indices, dtype=np.int64))
+    return indices
+
+
+def pairIndexToNodes(indices, n_nodes, directed=True):
+    """ Decodes pair indices into (origin, destination) node positions.
+
+        Directed pairs are enumerated row by row skipping the diagonal, undirected
+        pairs row by row over the upper triangle (origin < destination).
+
+        Returns
+        -------
+        orig, dest : numpy.ndarray
+            the node positions of the origins and the destinations.
+    """
+    indices = np.asarray(indices, dtype=np.int64)
+    n = np.int64(n_nodes)
+    if directed:
+        orig = indices // (n - 1)
+        dest = indices % (n - 1)
+        dest = dest + (dest >= orig)
+        return orig, dest
+    #row i of the upper triangle starts at i*(2n-i-1)/2, invert it and fix rounding
+    estimate = np.floor(((2 * n - 1) - np.sqrt((2 * n - 1) ** 2 - 8.0 * indices)) / 2).astype(np.int64)
+    orig = np.clip(estimate, 0, n - 2)
+    for _ in range(2):
+        orig = np.where(_rowStart(orig, n) > indices, orig - 1, orig)
+        orig = np.where(_rowStart(orig + 1, n) <= indices, orig + 1, orig)
+    dest = indices - _rowStart(orig, n) + orig + 1
+    return orig, dest
+
+
+def sampleODPairs(node_list, n_pairs, directed=True, rng=None):
+    """ Samples distinct OD pairs between the given nodes.
+
+        Returns
+        -------
+        orig, dest : numpy.ndarray
+            arrays with the origin and destination nodes of every pair.
+    """
+    #object arrays keep the original node identifiers (strings, ints or tuples) intact
+    nodes = node_list if isinstance(node_list, np.ndarray) else _objectArray(node_list)
+    indices = samplePairIndices(len(nodes), n_pairs, directed, rng)
+    orig, dest = pairIndexToNodes(indices, len(nodes), directed)
+    return nodes[orig], nodes[dest]
+
+
+def sampleVolumes(n, low, high, distribution='uniform', rng=None):
+    """ Draws integer demand volumes in the range `low` to `high`.
+
+        The 'uniform' distribution gives every volume the same probability, the
+        'lognormal' one concentrates the volumes close to `low` with a long tail.
+    """
+    rng = np.random.default_rng() if rng is None else rng
+    if distribution == 'uniform':
+        return rng.integers(low, high, size=n, endpoint=True)
+    if distribution == 'lognormal':
+        scale = max(high - low, 1)
+        volumes = low + rng.lognormal(mean=0.0, sigma=1.0, size=n) * scale / np.e
+        return np.clip(np.rint(volumes), low, high).astype(np.int64)
+    raise ValueError("Unknown volume distribution '{}'".format(distribution))
+
+
+def sampleDepartureTimes(n, profile='uniform', window=(6 * 60, 22 * 60), rng=None):
+    """ Draws departure times following a time-of-day profile.
+
+        Parameters
+        ----------
+        n : integer
+            number of departure times.
+        profile : string or list
+            a key of DEPARTURE_PROFILES or a list of (mean, st. dev., weight) tuples
+            in minutes after midnight. An empty mixture is uniform over the window.
+        window : tuple
+            (optional) first and last minute of the day departures may fall in.
+
+        Returns
+        -------
+        minutes : numpy.ndarray
+            departure times as minutes after midnight.
+    """
+    rng = np.random.default_rng() if rng is None else rng
+    mixture = DEPARTURE_PROFILES[profile] if isinstance(profile, str) else profile
+    start, end = window
+    if len(mixture) == 0:
+        return rng.integers(start, end, size=n, endpoint=True)
+    means, stdevs, weights = (np.asarray(col, dtype=np.float64) for col in zip(*mixture))
+    component = rng.choice(len(means), size=n, p=weights / weights.sum())
+    minutes = rng.normal(means[component], stdevs[component])
+    return np.clip(np.rint(minutes), start, end).astype(np.int64)
+
+
+def genODMatrix(node_lat, node_lon, n_pairs, low=1, high=100, profile='uniform',
+                window=(6 * 60, 22 * 60), directed=True, volume_distribution='uniform', seed=None):
+    """ Generates a synthetic OD matrix between graph nodes.
+
+        Parameters
+        ----------
+        node_lat, node_lon : array_like
+            coordinates of the nodes that can generate demands.
+        n_pairs : integer
+            number of distinct OD pairs.
+        low, high : integer
+            (optional) range of the demand volumes.
+        profile : string or list
+            (optional) departure-time profile, see `sampleDepartureTimes`.
+        seed : integer
+            (optional) seed making the matrix reproducible.
+
+        Returns
+        -------
+        od_matrix : dictionary
+            arrays origLat, origLon, destLat, destLon, depTime (minutes after
+            midnight) and numPpl, one entry per OD pair.
+    """
+    rng = np.random.default_rng(seed)
+    node_lat = np.asarray(node_lat, dtype=np.float64)
+    node_lon = np.asarray(node_lon, dtype=np.float64)
+    indices = samplePairIndices(len(node_lat), n_pairs, directed, rng)
+    orig, dest = pairIndexToNodes(indices, len(node_lat), directed)
+    #pair indices are sorted, shuffle them so that the rows are not ordered by origin
+    order = rng.permutation(len(indices))
+    orig, dest = orig[order], dest[order]
+    return {'origLat': node_lat[orig], 'origLon': node_lon[orig],
+            'destLat': node_lat[dest], 'destLon': node_lon[dest],
+            'depTime': sampleDepartureTimes(len(orig), profile, window, rng),
+            'numPpl': sampleVolumes(len(orig), low, high, volume_distribution, rng)}
+
+
+def graphNodeCoordinates(g):
+    """ Returns the osmids, latitudes and longitudes of the nodes of an osmnx graph."""
+    osmids = np.fromiter(g.nodes(), dtype=np.int64, count=g.number_of_nodes())
+    lat = np.fromiter((data['y'] for _, data in g.nodes(data=True)), dtype=np.float64, count=len(osmids))
+    lon = np.fromiter((data['x'] for _, data in g.nodes(data=True)), dtype=np.float64, count=len(osmids))
+    return osmids, lat, lon
+
+
+def writeODMatrix(file_path, od_matrix, chunk_size=100000):
+    """ Writes an OD matrix generated by `genODMatrix` in the ODMatrix.txt format.
+
+        The rows are written in chunks so that millions of pairs do not have to be
+        formatted in memory at once.
+    """
+    dep_time = od_matrix['depTime']
+    num_rows = len(dep_time)
+    with open(file_path, 'w', encoding="utf8") as odFile:
+        odFile.write(OD_MATRIX_HEADER + "\n")
+        for start in range(0, num_rows, chunk_size):
+            stop = min(start + chunk_size, num_rows)
+            rows = zip(od_matrix['origLat'][start:stop].tolist(), od_matrix['origLon'][start:stop].tolist(),
+                       od_matrix['destLat'][start:stop].tolist(), od_matrix['destLon'][start:stop].tolist(),
+                       (dep_time[start:stop] // 60).tolist(), (dep_time[start:stop] % 60).tolist(),
+                       od_matrix['numPpl'][start:stop].tolist())
+            odFile.write("".join("{}|{},{}|{},{}:{:02d},{}\n".format(*row) for row in rows))
+    return num_rows
+
+
+def _objectArray(items):
+    """
+    Converts a list into a one dimensional object array without unpacking tuples.
+    """
+    array = np.empty(len(items), dtype=object)
+    array[:] = list(items)
+    return array
+
+
+def _rowStart(row, n):
+    """
+    Index of the first pair of row `row` in the upper-triangle enumeration.
+    """
+    return row * (2 * n - row - 1) // 2
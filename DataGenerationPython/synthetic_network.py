@@ -0,0 +1,237 @@
+"""
+module: synthetic_network
+-------------------------
+
+Generation of synthetic street networks in the format returned by osmnx, so that the
+cellization, link, route and demand generation of mapGeoToCells can be run and
+benchmarked offline on reproducible inputs of controlled size. Three layouts are
+available: a regular grid, a radial (ring and spoke) network and an organic network
+obtained by perturbing a grid and thinning out its streets. The graphs are NetworkX
+MultiDiGraphs whose nodes carry the osmid and the x (longitude) and y (latitude)
+attributes and whose edges carry the osmid, length and oneway attributes used by the
+generator. networkx is only imported when a network is built.
+"""
+
+from math import ceil, cos, pi, radians, sqrt
+
+import numpy as np
+
+LAYOUTS = ('grid', 'radial', 'organic')
+
+#Mean earth radius in metres, as used by osmnx for great-circle distances
+EARTH_RADIUS = 6371009
+
+#Metres per degree of latitude, used to place the synthetic network around a centre point
+METRES_PER_DEGREE = 111320.0
+
+#Ranges of realistic OpenStreetMap identifiers
+NODE_OSMID_RANGE = (1000000000, 7000000000)
+WAY_OSMID_RANGE = (20000000, 900000000)
+
+
+def generateNetwork(layout, num_nodes, center=(-34.01746, 151.06285), spacing=80.0,
+                    oneway_fraction=0.0, seed=None, **kwargs):
+    """ Generates a synthetic street network.
+
+        Parameters
+        ----------
+        layout : string
+            one of 'grid', 'radial' or 'organic'.
+        num_nodes : integer
+            approximate number of intersections, the layouts round it to fit their shape.
+        center : tuple
+            (optional) (lat, long) of the centre of the network.
+        spacing : float
+            (optional) typical distance between neighbouring intersections in metres.
+        oneway_fraction : float
+            (optional) share of the streets that can only be walked in one direction.
+        seed : integer
+            (optional) seed making the network reproducible.
+        kwargs :
+            layout specific options, see `gridLayout`, `radialLayout` and `organicLayout`.
+
+        Returns
+        -------
+        g : networkx.MultiDiGraph
+            the street network in osmnx format.
+    """
+    rng = np.random.default_rng(seed)
+    if layout == 'grid':
+        xy, streets = gridLayout(num_nodes, spacing)
+    elif layout == 'radial':
+        xy, streets = radialLayout(num_nodes, spacing, **kwargs)
+    elif layout == 'organic':
+        xy, streets = organicLayout(num_nodes, spacing, rng=rng, **kwargs)
+    else:
+        raise ValueError("Unknown layout '{}', expected one of {}".format(layout, LAYOUTS))
+    return _buildGraph(xy, streets, center, oneway_fraction, rng, name='synthetic_' + layout)
+
+
+def gridLayout(num_nodes, spacing=80.0):
+    """ Square grid of about `num_nodes` intersections.
+
+        Returns
+        -------
+        xy : numpy.ndarray
+            (n, 2) planar coordinates of the intersections in metres.
+        streets : numpy.ndarray
+            (m, 2) pairs of intersection positions joined by a street.
+    """
+    side = max(int(ceil(sqrt(num_nodes))), 2)
+    rows, cols = np.divmod(np.arange(side * side), side)
+    xy = np.column_stack((cols, rows)).astype(np.float64) * spacing
+    index = np.arange(side * side).reshape(side, side)
+    horizontal = np.column_stack((index[:, :-1].ravel(), index[:, 1:].ravel()))
+    vertical = np.column_stack((index[:-1, :].ravel(), index[1:, :].ravel()))
+    return xy, np.vstack((horizontal, vertical))
+
+
+def radialLayout(num_nodes, spacing=80.0, num_spokes=None):
+    """ Ring and spoke network of about `num_nodes` intersections around a central square.
+
+        The number of spokes defaults to a value keeping the arcs of the outer ring
+        close to `spacing`.
+    """
+    if num_spokes is None:
+        num_spokes = max(int(round(sqrt(2 * pi * num_nodes))), 4)
+    num_rings = max(int(ceil((num_nodes - 1) / num_spokes)), 1)
+    ring, spoke = np.divmod(np.arange(num_rings * num_spokes), num_spokes)
+    angle = 2 * pi * spoke / num_spokes
+    radius = (ring + 1) * spacing
+    xy = np.vstack(([0.0, 0.0], np.column_stack((radius * np.cos(angle), radius * np.sin(angle)))))
+    index = 1 + np.arange(num_rings * num_spokes).reshape(num_rings, num_spokes)
+    arcs = np.column_stack((index.ravel(), np.roll(index, -1, axis=1).ravel()))
+    radials = np.column_stack((index[:-1, :].ravel(), index[1:, :].ravel()))
+    centre = np.column_stack((np.zeros(num_spokes, dtype=np.int64), index[0, :]))
+    return xy, np.vstack((centre, radials, arcs))
+
+
+def organicLayout(num_nodes, spacing=80.0, jitter=0.25, drop_fraction=0.2, diagonal_fraction=0.05, rng=None):
+    """ Perturbed grid resembling an irregular street pattern.
+
+        The intersections of a grid are moved by `jitter` times the spacing, a share
+        `drop_fraction` of the streets that are not needed for connectivity is removed
+        and a share `diagonal_fraction` of the blocks gets a diagonal street.
+    """
+    rng = np.random.default_rng() if rng is None else rng
+    xy, streets = gridLayout(num_nodes, spacing)
+    xy = xy + rng.normal(0.0, jitter * spacing, size=xy.shape)
+    side = int(round(sqrt(len(xy))))
+    #a random spanning tree keeps the network connected whatever streets are dropped
+    order = rng.permutation(len(streets))
+    in_tree = _spanningTreeMask(streets[order], len(xy))
+    keep = in_tree | (rng.random(len(streets)) >= drop_fraction)
+    streets = streets[order][keep]
+    corner = np.arange(side * side).reshape(side, side)[:-1, :-1].ravel()
+    corner = corner[rng.random(len(corner)) < diagonal_fraction]
+    diagonals = np.column_stack((corner, corner + side + 1))
+    return xy, np.vstack((streets, diagonals))
+
+
+def graphFrames(g):
+    """ Node coordinates and edge lengths of a graph as pandas DataFrames.
+
+        Gives the same columns as the osmnx GeoDataFrames used by mapGeoToCells
+        (osmid, x, y for the nodes and u, v, length, oneway for the edges) without
+        building any geometry.
+    """
+    import pandas as pd
+    nodes = g.nodes(data=True)
+    node_coordinates = pd.DataFrame({'osmid': [data.get('osmid', node) for node, data in nodes],
+                                     'x': [data['x'] for _, data in nodes],
+                                     'y': [data['y'] for _, data in nodes]})
+    edges = g.edges(data=True)
+    node_length = pd.DataFrame({'u': [u for u, _, _ in edges], 'v': [v for _, v, _ in edges],
+                                'length': [data['length'] for _, _, data in edges],
+                                'oneway': [data.get('oneway', False) for _, _, data in edges]})
+    return node_coordinates, node_length
+
+
+def nearestNode(g, point, chunk_size=1000000):
+    """ Returns the node of `g` closest to a (lat, long) point.
+
+        Works on any graph in osmnx format and follows osmnx.get_nearest_node: the
+        haversine great-circle distance is used and ties go to the first node, so
+        the OD data can be snapped without importing osmnx.
+    """
+    cache = g.graph.get('_nearestNodeCache')
+    if cache is None or len(cache[0]) != g.number_of_nodes():
+        osmids = np.fromiter(g.nodes(), dtype=np.int64, count=g.number_of_nodes())
+        lat = np.fromiter((data['y'] for _, data in g.nodes(data=True)), dtype=np.float64, count=len(osmids))
+        lon = np.fromiter((data['x'] for _, data in g.nodes(data=True)), dtype=np.float64, count=len(osmids))
+        g.graph['_nearestNodeCache'] = (osmids, lat, lon)
+    osmids, lat, lon = g.graph['_nearestNodeCache']
+    best_node, best_dist = None, np.inf
+    for start in range(0, len(osmids), chunk_size):
+        dist = greatCircleDistance(point[0], point[1], lat[start:start + chunk_size], lon[start:start + chunk_size])
+        i = int(np.argmin(dist))
+        if dist[i] < best_dist:
+            best_node, best_dist = int(osmids[start + i]), dist[i]
+    return best_node
+
+
+def greatCircleDistance(lat1, lon1, lat2, lon2):
+    """ Haversine distance in metres between a (lat, long) point and arrays of points."""
+    phi1 = np.deg2rad(lat1)
+    phi2 = np.deg2rad(lat2)
+    d_phi = phi2 - phi1
+    d_theta = np.deg2rad(lon2) - np.deg2rad(lon1)
+    h = np.sin(d_phi / 2) ** 2 + np.cos(phi1) * np.cos(phi2) * np.sin(d_theta / 2) ** 2
+    h = np.minimum(1.0, h)
+    return 2 * np.arcsin(np.sqrt(h)) * EARTH_RADIUS
+
+
+def _buildGraph(xy, streets, center, oneway_fraction, rng, name):
+    """
+    Converts planar coordinates and street pairs into an osmnx style MultiDiGraph.
+    """
+    num_nodes = len(xy)
+    node_ids = _osmids(num_nodes, NODE_OSMID_RANGE, rng)
+    way_ids = _osmids(len(streets), WAY_OSMID_RANGE, rng)
+    lat0, lon0 = center
+    xy = xy - xy.mean(axis=0)
+    lat = lat0 + xy[:, 1] / METRES_PER_DEGREE
+    lon = lon0 + xy[:, 0] / (METRES_PER_DEGREE * cos(radians(lat0)))
+    length = np.round(np.hypot(*(xy[streets[:, 0]] - xy[streets[:, 1]]).T), 3)
+    oneway = rng.random(len(streets)) < oneway_fraction
+
+    import networkx as nx
+    g = nx.MultiDiGraph(name=name, crs={'init': 'epsg:4326'}, simplified=True)
+    g.add_nodes_from((osmid, {'osmid': osmid, 'x': x, 'y': y})
+                     for osmid, x, y in zip(node_ids.tolist(), lon.tolist(), lat.tolist()))
+    u, v = node_ids[streets[:, 0]].tolist(), node_ids[streets[:, 1]].tolist()
+    attributes = [{'osmid': way, 'length': l, 'oneway': bool(o), 'highway': 'footway'}
+                  for way, l, o in zip(way_ids.tolist(), length.tolist(), oneway.tolist())]
+    g.add_edges_from((a, b, 0, data) for a, b, data in zip(u, v, attributes))
+    g.add_edges_from((b, a, 0, dict(data)) for a, b, data in zip(u, v, attributes) if not data['oneway'])
+    return g
+
+
+def _osmids(n, id_range, rng):
+    """
+    Increasing identifiers with random gaps, starting at a random point of `id_range`.
+    """
+    gaps = rng.integers(1, 64, size=n)
+    start = rng.integers(id_range[0], id_range[1] - 64 * max(n, 1))
+    return start + np.cumsum(gaps)
+
+
+def _spanningTreeMask(edges, num_nodes):
+    """
+    Marks the edges of a spanning forest (Kruskal in the given edge order).
+    """
+    parent = list(range(num_nodes))
+
+    def find(node):
+        while parent[node] != node:
+            parent[node] = parent[parent[node]]
+            node = parent[node]
+        return node
+
+    mask = np.zeros(len(edges), dtype=bool)
+    for i, (a, b) in enumerate(edges.tolist()):
+        root_a, root_b = find(a), find(b)
+        if root_a != root_b:
+            parent[root_a] = root_b
+            mask[i] = True
+    return mask
@@ -0,0 +1,60 @@
+"""
+Incremental updates of graph_update against a full regeneration of the updated
+network: every output file but the run report must be the same.
+
+Run from DataGenerationPython with `python -m pytest test_graph_update.py`.
+"""
+
+import filecmp
+import os
+
+import mapGeoToCells as gen
+import graph_update as gu
+import synthetic_demand as sd
+import synthetic_network as sn
+from stage_cache import StageCache
+
+NETWORK = ('organic', 80, 1)
+
+
+def _generate(tmp_path, name, od_path, graph=None):
+    params = dict(CACHE_DIRECTORY=str(tmp_path / (name + 'Cache')), odMatrixFileNamePath=od_path)
+    if graph is None:
+        params['SYNTHETIC_NETWORK'] = NETWORK
+    ctx = gen.GenerationContext(**params).setOutputDirectory(str(tmp_path / name))
+    gen.generate(graph=graph, context=ctx)
+    return str(tmp_path / name)
+
+
+def _assertSameOutputs(updated, full):
+    names = sorted(name for name in os.listdir(full) if os.path.isfile(os.path.join(full, name)))
+    assert names == sorted(name for name in os.listdir(updated) if os.path.isfile(os.path.join(updated, name)))
+    for name in names:
+        if name.endswith('run_report.json'):
+            continue
+        assert filecmp.cmp(os.path.join(updated, name), os.path.join(full, name), shallow=False), name
+
+
+def test_moved_nodes_match_full_regeneration(tmp_path):
+    g = sn.generateNetwork(*NETWORK[:2], seed=NETWORK[2])
+    _, lat, lon = sd.graphNodeCoordinates(g)
+    od_path = str(tmp_path / 'od.txt')
+    sd.writeODMatrix(od_path, sd.genODMatrix(lat, lon, 6, seed=3))
+    output = _generate(tmp_path, 'update', od_path)
+
+    cache = StageCache(str(tmp_path / 'updateCache'))
+    state, g_old, _ = gen.loadCachedRun(gen.GenerationContext().setOutputDirectory(output), cache)
+    snapped = cache.load('snapping', gen.snappingCacheKey(cache, state['graphKey']), {})
+    cord, origin = sorted(snapped.items())[0]
+    point = [float(value) for value in cord.split('|')]
+    other = next(node for node in g_old.nodes() if node not in snapped.values())
+    change = gu.GraphChange()
+    #a snapped node moved away from its OD point, and another node moved onto an OD point
+    change.addedNodes[origin] = (g_old.nodes[origin]['y'] + 0.0008, g_old.nodes[origin]['x'] - 0.0005)
+    change.addedNodes[other] = (point[0], point[1])
+
+    gu.updateRun(change, str(tmp_path / 'updateCache'), output)
+    g_new, changed_pairs = gu.applyChange(g_old, change)
+    assert all(frozenset((u, v)) in changed_pairs for u, v in g_old.edges(origin))
+    full = _generate(tmp_path, 'full', od_path, graph=g_new)
+    _assertSameOutputs(output, full)
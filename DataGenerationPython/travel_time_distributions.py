@@ -0,0 +1,309 @@
+"""
+module: travel_time_distributions
+-------------------------
+
+Scores the travel time distributions of many simulation runs against observed travel
+times at once. The travel times of every run (travelTimeDist.txt) are stacked into
+flat arrays with a run index, and the observations (the disaggregate demand table of
+the calibration: route, departure time and travel time of every person) into
+arrays too, so that the histograms of all the runs are built by a few bincounts and
+the scores come out as matrices instead of line by line loops.
+
+The people are compared by class, a route and an aggregation period of the departure
+time (`aggregation period (sec)` of the scenario), and the travel times are binned by
+time intervals of the simulation, as Group.getTravTimeProb does. The scores are
+
+ - the log-likelihood of every observed travel time under the simulated distribution
+   of its class in every run, the share of the people of the class arriving in the
+   same bin, as the "traveltimedistribution" calibration mode (runs x observations);
+ - the Kolmogorov-Smirnov and first Wasserstein distances (seconds) between the
+   simulated distribution of every class, conditional on arrival, and the observed
+   one (runs x classes).
+
+e.g. `python travel_time_distributions.py observed.txt sweep/*/travelTimeDist.txt --matrices scores.npz`.
+"""
+
+import argparse
+import os
+import sys
+import time
+import warnings
+
+import numpy as np
+
+from network_loading import NetworkLoading, readScenario
+
+#Probability of a travel time in a bin no simulated person arrives in (Double.MIN_VALUE in Group.getTravTimeProb)
+MIN_PROBABILITY = 5e-324
+
+#Relative tolerance when departure times in seconds are cut into aggregation periods
+TIME_TOLERANCE = 1e-9
+
+#Largest number of histogram bins held at once when computing the distances
+MAX_HISTOGRAM_SIZE = 1 << 24
+
+
+def _readRows(file_path):
+    """ The header names and the rows of a comma separated file, as a string array."""
+    with open(file_path, encoding="utf8") as textFile:
+        lines = [line.replace(" ", "").strip() for line in textFile]
+    header = lines[0].lstrip("#").split(",") if lines else []
+    rows = [line.split(",") for line in lines[1:] if line and not line.startswith("#")]
+    if not rows:
+        return header, np.zeros((0, len(header)), dtype=str)
+    return header, np.array(rows, dtype=str)
+
+
+def readTravelTimeDistribution(file_path):
+    """ Reads a travelTimeDist.txt file of the simulator.
+
+        Returns
+        -------
+        distribution : dictionary
+            arrays of the 'group', 'route', 'groupSize', 'depTime' (interval),
+            'travelTime' (seconds) and 'fragSize' of every fragment.
+    """
+    _, rows = _readRows(file_path)
+    return {'group': rows[:, 0].astype(np.int64), 'route': rows[:, 1], 'groupSize': rows[:, 2].astype(float),
+            'depTime': rows[:, 3].astype(np.int64), 'travelTime': rows[:, 4].astype(float),
+            'fragSize': rows[:, 5].astype(float)}
+
+
+def readObservations(file_path):
+    """ Reads observed travel times from a disaggregate demand table (routeName,
+        depTime, travelTime, ... in seconds, one person per line).
+
+        Returns
+        -------
+        observations : dictionary
+            arrays of the 'route', 'depTime' (seconds) and 'travelTime' (seconds) of
+            every person.
+    """
+    header, rows = _readRows(file_path)
+    column = lambda name, default: header.index(name) if name in header else default
+    return {'route': rows[:, column('routeName', 0)], 'depTime': rows[:, column('depTime', 1)].astype(float),
+            'travelTime': rows[:, column('travelTime', 2)].astype(float)}
+
+
+class RunDistributions(object):
+    """
+    The travel time distributions of many runs stacked into flat arrays, every
+    fragment carrying the index of its run.
+    """
+    def __init__(self, distributions, delta_t, names=None):
+        """
+        Constructor
+
+                @param distributions   Dictionaries of arrays as returned by
+                                       readTravelTimeDistribution, one per run.
+                @param delta_t         Length of a time interval (seconds), of all the
+                                       runs or of every run.
+                @param names           Names of the runs, their indices by default.
+        """
+        self.names = list(names) if names is not None else [str(i) for i in range(len(distributions))]
+        self.deltaT = np.broadcast_to(np.asarray(delta_t, dtype=float), (len(distributions),)).copy()
+        sizes = [len(distribution['group']) for distribution in distributions]
+        self.run = np.repeat(np.arange(len(distributions)), sizes)
+        for name in ('group', 'route', 'groupSize', 'depTime', 'travelTime', 'fragSize'):
+            values = [distribution[name] for distribution in distributions]
+            setattr(self, name, np.concatenate(values) if values else np.zeros(0))
+
+    @classmethod
+    def fromFiles(cls, file_paths, delta_t):
+        """ Reads the travelTimeDist.txt files of the runs, named by their paths."""
+        return cls([readTravelTimeDistribution(path) for path in file_paths], delta_t, file_paths)
+
+    def __len__(self):
+        return len(self.names)
+
+
+def _classes(observations, runs, aggregation_period):
+    """ Class (route and aggregation period) of every observation and fragment, -1 for
+        the fragments of classes without observation, and the (route, period) classes.
+    """
+    obsPeriod = np.floor(observations['depTime'] / aggregation_period * (1 + TIME_TOLERANCE)).astype(np.int64)
+    runPeriod = runs.depTime * runs.deltaT[runs.run] / aggregation_period
+    runPeriod = np.floor(runPeriod * (1 + TIME_TOLERANCE)).astype(np.int64)
+    routeNames, routeCodes = np.unique(np.concatenate([observations['route'], runs.route]), return_inverse=True)
+    numPeriods = int(max(obsPeriod.max(initial=0), runPeriod.max(initial=0))) + 1
+    codes = routeCodes * numPeriods + np.concatenate([obsPeriod, runPeriod])
+    obsCodes, runCodes = codes[:len(obsPeriod)], codes[len(obsPeriod):]
+    classCodes, obsClass = np.unique(obsCodes, return_inverse=True)
+    runClass = np.searchsorted(classCodes, runCodes)
+    runClass[(runClass == len(classCodes)) | (classCodes[np.minimum(runClass, len(classCodes) - 1)] != runCodes)] = -1
+    classes = [(str(routeNames[code // numPeriods]), int(code % numPeriods)) for code in classCodes]
+    return obsClass, runClass, classes
+
+
+def _lookup(keys, values, queries):
+    """ The values of the sorted keys at the queries, 0 for the queries not among the keys."""
+    if len(keys) == 0:
+        return np.zeros(queries.shape)
+    found = np.minimum(np.searchsorted(keys, queries), len(keys) - 1)
+    return np.where(keys[found] == queries, values[found], 0.0)
+
+
+def scoreRuns(runs, observations, aggregation_period=None, bin_intervals=1, bin_width=None):
+    """ Log-likelihood and distance matrices of the runs against the observations.
+
+        Parameters
+        ----------
+        runs : RunDistributions
+            the travel times of the runs.
+        observations : dictionary
+            the observed travel times, see readObservations().
+        aggregation_period : float
+            (optional) length of the departure time periods of the classes (seconds),
+            by default one time interval, i.e. one class per simulated group, when all
+            the runs have the same time interval.
+        bin_intervals : integer
+            (optional) time intervals per travel time bin of the likelihood.
+        bin_width : float
+            (optional) width of the travel time bins of the distances (seconds), the
+            shortest likelihood bin of the runs by default.
+
+        Returns
+        -------
+        scores : dictionary
+            'classes' (route, period) of the observed classes, 'observationClass'
+            their index for every observation, 'logLikelihood' (runs x observations),
+            'totalLogLikelihood' (runs), 'kolmogorovSmirnov' and 'wasserstein'
+            (runs x classes, NaN where no one of the class arrives), and the mean
+            travel times 'simulatedMean' (runs x classes) and 'observedMean' (classes).
+    """
+    numRuns = len(runs)
+    if aggregation_period is None:
+        if numRuns and np.any(runs.deltaT != runs.deltaT[0]):
+            raise ValueError("The runs have different time intervals, give an aggregation period")
+        aggregation_period = runs.deltaT[0] if numRuns else 1.0
+    obsClass, runClass, classes = _classes(observations, runs, aggregation_period)
+    numClasses = len(classes)
+    numObs = len(obsClass)
+    obsTime = observations['travelTime']
+    keep = runClass >= 0
+    run, cls, fragSize, travelTime = runs.run[keep], runClass[keep], runs.fragSize[keep], runs.travelTime[keep]
+    runCls = run * numClasses + cls
+
+    # people of every run and class: the sizes of their groups, counted once per group
+    _, first = np.unique(np.stack([run, runs.group[keep]]), axis=1, return_index=True)
+    people = np.bincount(runCls[first], weights=runs.groupSize[keep][first], minlength=numRuns * numClasses)
+
+    # people arriving in the time interval bin of every fragment, looked up for every
+    # observation of every run in the bins of its time interval
+    runBin = np.rint(travelTime / runs.deltaT[run]).astype(np.int64) // bin_intervals
+    obsBin = np.floor(obsTime[None, :] / runs.deltaT[:, None] * (1 + TIME_TOLERANCE)).astype(np.int64)
+    obsBin //= bin_intervals
+    numBins = int(max(runBin.max(initial=0), obsBin.max(initial=0))) + 1
+    cellKeys, inverse = np.unique(runCls * numBins + runBin, return_inverse=True)
+    arrived = np.bincount(inverse, weights=fragSize, minlength=len(cellKeys))
+    queries = (np.arange(numRuns)[:, None] * numClasses + obsClass[None, :]) * numBins + obsBin
+    total = people.reshape(numRuns, numClasses)[:, obsClass]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        probability = np.where(total > 0, _lookup(cellKeys, arrived, queries) / total, 0.0)
+    logLikelihood = np.log(np.maximum(probability, MIN_PROBABILITY)).reshape(numRuns, numObs)
+
+    mass = np.bincount(runCls, weights=fragSize, minlength=numRuns * numClasses).reshape(numRuns, numClasses)
+    weighted = np.bincount(runCls, weights=fragSize * travelTime, minlength=numRuns * numClasses)
+    observedCount = np.bincount(obsClass, minlength=numClasses)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        simulatedMean = weighted.reshape(numRuns, numClasses) / mass
+        observedMean = np.bincount(obsClass, weights=obsTime, minlength=numClasses) / observedCount
+
+    # distances between the distributions, on dense histograms of a few runs at a time
+    width = bin_width or (runs.deltaT.min() * bin_intervals if numRuns else 1.0)
+    gridBin = np.floor(travelTime / width * (1 + TIME_TOLERANCE)).astype(np.int64)
+    obsGrid = np.floor(obsTime / width * (1 + TIME_TOLERANCE)).astype(np.int64)
+    numGrid = int(max(gridBin.max(initial=0), obsGrid.max(initial=0))) + 1
+    observed = np.bincount(obsClass * numGrid + obsGrid, minlength=numClasses * numGrid).reshape(numClasses, numGrid)
+    observedCdf = np.cumsum(observed, axis=1) / np.maximum(observedCount, 1)[:, None]
+    ks = np.full((numRuns, numClasses), np.nan)
+    wasserstein = np.full((numRuns, numClasses), np.nan)
+    chunk = max(1, MAX_HISTOGRAM_SIZE // max(numClasses * numGrid, 1))
+    order = np.argsort(run, kind='stable')
+    bounds = np.searchsorted(run[order], np.arange(0, numRuns + chunk, chunk))
+    for start, low, high in zip(range(0, numRuns, chunk), bounds[:-1], bounds[1:]):
+        rows = order[low:high]
+        count = min(chunk, numRuns - start)
+        histogram = np.bincount((runCls[rows] - start * numClasses) * numGrid + gridBin[rows],
+                                weights=fragSize[rows], minlength=count * numClasses * numGrid)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            gap = np.abs(np.cumsum(histogram.reshape(count, numClasses, numGrid), axis=2) /
+                         mass[start:start + count, :, None] - observedCdf[None, :, :])
+        ks[start:start + count] = gap.max(axis=2)
+        wasserstein[start:start + count] = gap.sum(axis=2) * width
+    return {'classes': classes, 'observationClass': obsClass, 'logLikelihood': logLikelihood,
+            'totalLogLikelihood': logLikelihood.sum(axis=1), 'kolmogorovSmirnov': ks, 'wasserstein': wasserstein,
+            'simulatedMean': simulatedMean, 'observedMean': observedMean}
+
+
+def writeScores(runs, scores, file_path):
+    """ Writes one line per run: its total log-likelihood and its distances averaged
+        over the classes it has arrivals in.
+    """
+    with open(file_path, 'w', encoding="utf8") as scoreFile:
+        scoreFile.write("# run, logLikelihood, meanKolmogorovSmirnov, meanWasserstein \n")
+        with warnings.catch_warnings():
+            # classes no one of a run arrives in have no distance
+            warnings.simplefilter('ignore', RuntimeWarning)
+            ks = np.nanmean(scores['kolmogorovSmirnov'], axis=1)
+            wasserstein = np.nanmean(scores['wasserstein'], axis=1)
+        for name, value, distance, shift in zip(runs.names, scores['totalLogLikelihood'], ks, wasserstein):
+            scoreFile.write("{}, {!r}, {!r}, {!r}\n".format(name, float(value), float(distance), float(shift)))
+
+
+def runTimeIntervals(file_paths, root=None):
+    """ Length of the time interval of every run, from the scenario.txt file next to its
+        travel times as scenario_sweep and calibration write them.
+    """
+    deltaT = {}
+    for path in file_paths:
+        scenarioPath = os.path.join(os.path.dirname(path), 'scenario.txt')
+        if scenarioPath not in deltaT:
+            deltaT[scenarioPath] = NetworkLoading.fromScenario(scenarioPath, root).deltaT
+    return [deltaT[os.path.join(os.path.dirname(path), 'scenario.txt')] for path in file_paths]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Score the travel time distributions of many runs against observations.")
+    parser.add_argument('observed', help="disaggregate demand table of the observed travel times")
+    parser.add_argument('runs', nargs='+', help="travelTimeDist.txt files of the runs")
+    parser.add_argument('--scenario', default=None,
+                        help="scenario file of all the runs, by default the scenario.txt file next to every run")
+    parser.add_argument('--root', default=None, help="directory the input directory of the scenarios is relative to")
+    parser.add_argument('--delta-t', type=float, default=None,
+                        help="length of a time interval of all the runs (seconds), instead of their scenarios")
+    parser.add_argument('--aggregation-period', type=float, default=None,
+                        help="departure time period of the classes (seconds), the one of the scenario by default")
+    parser.add_argument('--bin-intervals', type=int, default=1, help="time intervals per likelihood bin")
+    parser.add_argument('--bin-width', type=float, default=None, help="travel time bin of the distances (seconds)")
+    parser.add_argument('--output', default='travelTimeScores.txt', help="file receiving the score of every run")
+    parser.add_argument('--matrices', default=None, help=".npz file receiving the score matrices")
+    args = parser.parse_args(argv)
+
+    deltaT, period = args.delta_t, args.aggregation_period
+    scenarioPath = args.scenario or os.path.join(os.path.dirname(args.runs[0]), 'scenario.txt')
+    if deltaT is None:
+        if args.scenario is not None:
+            deltaT = NetworkLoading.fromScenario(args.scenario, args.root).deltaT
+        else:
+            deltaT = runTimeIntervals(args.runs, args.root)
+    if period is None and os.path.exists(scenarioPath):
+        period = readScenario(scenarioPath, args.root)['aggregationPeriod']
+    startTime = time.time()
+    runs = RunDistributions.fromFiles(args.runs, deltaT)
+    observations = readObservations(args.observed)
+    loaded = time.time()
+    scores = scoreRuns(runs, observations, period, args.bin_intervals, args.bin_width)
+    writeScores(runs, scores, args.output)
+    if args.matrices is not None:
+        np.savez(args.matrices, **dict((name, np.asarray(value)) for name, value in scores.items()))
+    best = int(np.argmax(scores['totalLogLikelihood']))
+    print("{} run(s), {} observations in {} classes, read in {:.2f} s and scored in {:.2f} s; best run {} "
+          "with log-likelihood {:.2f}".format(len(runs), len(observations['travelTime']), len(scores['classes']),
+                                              loaded - startTime, time.time() - loaded, runs.names[best],
+                                              scores['totalLogLikelihood'][best]))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
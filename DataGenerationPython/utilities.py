@@ -7,6 +7,8 @@ from math import sqrt
 from YenKShortestPaths import YenKShortestPaths
 import random
 import networkx as nx
+import numpy as np
+from synthetic_demand import sampleODPairs
 
 
 def link_in_path(link, node_list):
@@ -191,19 +193,7 @@ def gen_rand_demands(node_list, n_pair, low, high):
             A dictionary whose keys are the demand (node) pairs and whose values
             are the demand volumes.
     """
-    n = len(node_list)
-    max_pair = n*(n - 1)/2  # max pairs that can be produced
-    #print max_pair
-    demands = {}
-    while len(demands) < min(n_pair, max_pair):
-        nodeA = random.choice(node_list)
-        nodeB = random.choice(node_list)
-        while nodeB == nodeA:
-            nodeB = random.choice(node_list)
-        if not demands.has_key((nodeA, nodeB)):
-            if not demands.has_key((nodeB, nodeA)):
-                demands[(nodeA, nodeB)] = random.uniform(low, high)
-    return demands
+    return _rand_demands(node_list, n_pair, low, high, directed=False)
     
 def gen_rand_demands_dir(node_list, n_pair, low, high):
     """ Used to generate pairs of directed demands between nodes in graph g.
@@ -224,18 +214,17 @@ def gen_rand_demands_dir(node_list, n_pair, low, high):
             A dictionary whose keys are the demand (node) pairs and whose values
             are the demand volumes.
     """
-    n = len(node_list)
-    max_pair = n*(n - 1)  # max pairs that can be produced
-    #print max_pair
-    demands = {}
-    while len(demands) < min(n_pair, max_pair):
-        nodeA = random.choice(node_list)
-        nodeB = random.choice(node_list)
-        while nodeB == nodeA:
-            nodeB = random.choice(node_list)
-        if not demands.has_key((nodeA, nodeB)):
-            demands[(nodeA, nodeB)] = random.uniform(low, high)
-    return demands
+    return _rand_demands(node_list, n_pair, low, high, directed=True)
+
+
+def _rand_demands(node_list, n_pair, low, high, directed):
+    """ Samples distinct demand pairs without replacement over the pair indices.
+        Seeded from the `random` module so that `random.seed` keeps the demands reproducible.
+    """
+    rng = np.random.default_rng(random.getrandbits(64))
+    orig, dest = sampleODPairs(node_list, n_pair, directed=directed, rng=rng)
+    volumes = rng.uniform(low, high, size=len(orig))
+    return dict(zip(zip(orig.tolist(), dest.tolist()), volumes.tolist()))
 
 # [ "nodeList", "cost", "capacity"],
 # ["nodeList" "cost", "ratio", "load"],
@@ -311,7 +300,7 @@ def print_link_costs(g, wt='weight'):
             Used to indicate the link attribute of interest.
     """
     for e in sorted(g.edges()):
-        print "({},{}): {}". format(e[0],e[1], "%5.2f" % g[e[0]][e[1]][wt])
+        print("({},{}): {}". format(e[0],e[1], "%5.2f" % g[e[0]][e[1]][wt]))
 
 
 def sol_net(g, link_cap, link_mod, cap="capacity"):
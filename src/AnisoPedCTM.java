@@ -6,6 +6,7 @@
 package anisopedctm;
 
 import java.util.ArrayList;
+import java.util.Arrays;
 
 import anisopedctm.Board;
 
@@ -27,9 +28,14 @@ public class AnisoPedCTM {
 		 */
 		ArrayList<String> expList = new ArrayList<String>();
 		
-                expList.add("examples/scenarios/SYD350-01-SbFD_scenario.txt");
-                expList.add("examples/scenarios/SYD350-02-SbFD_scenario.txt");
-                expList.add("examples/scenarios/SYD350-01-weidmann_scenario.txt");
+                if (args.length > 0) {
+                        //scenario files given on the command line (e.g. by scenario_sweep.py)
+                        expList.addAll(Arrays.asList(args));
+                } else {
+                        expList.add("examples/scenarios/SYD350-01-SbFD_scenario.txt");
+                        expList.add("examples/scenarios/SYD350-02-SbFD_scenario.txt");
+                        expList.add("examples/scenarios/SYD350-01-weidmann_scenario.txt");
+                }
                 
 		expList.parallelStream().forEach((exp) -> {
 			